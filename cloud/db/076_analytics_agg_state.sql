@@ -0,0 +1,125 @@
+-- 076_analytics_agg_state.sql
+-- mergeable state ของ analytics_agg: (n, sum, M2) + DDSketch (JSONB)
+-- ให้ upsert ของ analytics-worker รวม stddev/p95 ข้าม batch ได้ถูกต้องโดยไม่ต้อง re-aggregate raw
+
+CREATE SCHEMA IF NOT EXISTS analytics;
+
+-----------------------------
+-- 1) STATE COLUMNS
+-----------------------------
+ALTER TABLE analytics.analytics_agg
+  ADD COLUMN IF NOT EXISTS m2_val DOUBLE PRECISION,   -- sum of squared deviations (Welford/Chan)
+  ADD COLUMN IF NOT EXISTS sketch JSONB;              -- {"a":alpha,"z":zero,"p":{idx:cnt},"n":{idx:cnt}}
+
+-- แถวเดิม (m2_val/sketch = NULL) ใช้ stddev_pop^2 * n แทน M2 ตอน merge — ดู _AGG_CONFLICT ใน repository.py
+
+-----------------------------
+-- 2) MERGE FUNCTIONS
+-----------------------------
+-- Chan et al.: M2 รวมของสองกลุ่ม จาก (n, sum, M2)
+CREATE OR REPLACE FUNCTION analytics.agg_m2_merge(
+  n_a BIGINT, sum_a DOUBLE PRECISION, m2_a DOUBLE PRECISION,
+  n_b BIGINT, sum_b DOUBLE PRECISION, m2_b DOUBLE PRECISION
+) RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE AS $$
+  SELECT CASE
+    WHEN COALESCE(n_a, 0) = 0 THEN m2_b
+    WHEN COALESCE(n_b, 0) = 0 THEN m2_a
+    ELSE COALESCE(m2_a, 0) + COALESCE(m2_b, 0)
+         + (COALESCE(sum_b, 0) / n_b - COALESCE(sum_a, 0) / n_a) ^ 2 * n_a * n_b / (n_a + n_b)
+  END
+$$;
+
+-- จำกัดจำนวน bin ต่อฝั่ง (= MAX_BINS / DDSketch._collapse ใน app/utils/sketch.py):
+-- เกิน max_bins → ยุบ bin index ต่ำสุดรวมเข้ากับ bin ถัดไปจนเหลือ max_bins (กระทบแค่ quantile ต่ำ ๆ)
+CREATE OR REPLACE FUNCTION analytics.ddsketch_collapse(bins JSONB, max_bins INT DEFAULT 1024)
+RETURNS JSONB
+LANGUAGE sql IMMUTABLE AS $$
+  SELECT CASE
+    WHEN (SELECT COUNT(*) FROM jsonb_object_keys(bins)) <= max_bins THEN bins
+    ELSE (SELECT jsonb_object_agg(idx, cnt)
+            FROM (SELECT MAX(idx) AS idx, SUM(cnt) AS cnt
+                    FROM (SELECT key::int AS idx, value::bigint AS cnt,
+                                 ROW_NUMBER() OVER (ORDER BY key::int) AS rn,
+                                 COUNT(*) OVER () AS total
+                            FROM jsonb_each_text(bins)) b
+                   GROUP BY GREATEST(rn, total - max_bins + 1)) g)
+  END
+$$;
+
+-- DDSketch merge: บวก count ราย bin (alpha ต้องเท่ากัน) แล้วจำกัดจำนวน bin ด้วย ddsketch_collapse
+CREATE OR REPLACE FUNCTION analytics.ddsketch_merge(a JSONB, b JSONB)
+RETURNS JSONB
+LANGUAGE sql IMMUTABLE AS $$
+  SELECT CASE
+    WHEN a IS NULL THEN b
+    WHEN b IS NULL THEN a
+    ELSE jsonb_build_object(
+      'a', a->'a',
+      'z', COALESCE((a->>'z')::bigint, 0) + COALESCE((b->>'z')::bigint, 0),
+      'p', analytics.ddsketch_collapse(
+             (SELECT COALESCE(jsonb_object_agg(key, cnt), '{}'::jsonb)
+                FROM (SELECT key, SUM(value::bigint) AS cnt
+                        FROM (SELECT * FROM jsonb_each_text(COALESCE(a->'p', '{}'::jsonb))
+                              UNION ALL
+                              SELECT * FROM jsonb_each_text(COALESCE(b->'p', '{}'::jsonb))) u
+                       GROUP BY key) g)),
+      'n', analytics.ddsketch_collapse(
+             (SELECT COALESCE(jsonb_object_agg(key, cnt), '{}'::jsonb)
+                FROM (SELECT key, SUM(value::bigint) AS cnt
+                        FROM (SELECT * FROM jsonb_each_text(COALESCE(a->'n', '{}'::jsonb))
+                              UNION ALL
+                              SELECT * FROM jsonb_each_text(COALESCE(b->'n', '{}'::jsonb))) u
+                       GROUP BY key) g))
+    )
+  END
+$$;
+
+-- DDSketch quantile: rank = q*(n-1) (ตรงกับ DDSketch.quantile ใน app/utils/sketch.py)
+CREATE OR REPLACE FUNCTION analytics.ddsketch_quantile(s JSONB, q DOUBLE PRECISION)
+RETURNS DOUBLE PRECISION
+LANGUAGE plpgsql IMMUTABLE AS $$
+DECLARE
+  gamma DOUBLE PRECISION;
+  total DOUBLE PRECISION;
+  rnk   DOUBLE PRECISION;
+  acc   DOUBLE PRECISION := 0;
+  r     RECORD;
+BEGIN
+  IF s IS NULL THEN
+    RETURN NULL;
+  END IF;
+  gamma := (1 + (s->>'a')::float8) / (1 - (s->>'a')::float8);
+
+  SELECT COALESCE((s->>'z')::float8, 0)
+       + COALESCE((SELECT SUM(value::float8) FROM jsonb_each_text(COALESCE(s->'n', '{}'::jsonb))), 0)
+       + COALESCE((SELECT SUM(value::float8) FROM jsonb_each_text(COALESCE(s->'p', '{}'::jsonb))), 0)
+    INTO total;
+  IF total = 0 THEN
+    RETURN NULL;
+  END IF;
+  rnk := q * (total - 1);
+
+  FOR r IN
+    SELECT sgn, idx, cnt FROM (
+      SELECT -1 AS sgn, key::int AS idx, value::float8 AS cnt
+        FROM jsonb_each_text(COALESCE(s->'n', '{}'::jsonb))
+      UNION ALL
+      SELECT 0, 0, COALESCE((s->>'z')::float8, 0)
+      UNION ALL
+      SELECT 1, key::int, value::float8
+        FROM jsonb_each_text(COALESCE(s->'p', '{}'::jsonb))
+    ) bins
+    ORDER BY sgn, CASE WHEN sgn < 0 THEN -idx ELSE idx END
+  LOOP
+    acc := acc + r.cnt;
+    IF acc > rnk THEN
+      IF r.sgn = 0 THEN
+        RETURN 0;
+      END IF;
+      RETURN r.sgn * 2 * power(gamma, r.idx) / (gamma + 1);
+    END IF;
+  END LOOP;
+  RETURN NULL;
+END
+$$;
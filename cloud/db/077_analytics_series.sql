@@ -0,0 +1,72 @@
+-- 077_analytics_series.sql
+-- series dictionary: (tenant, factory, machine, sensor, metric) → series_id (BIGINT)
+-- worker สร้าง id แบบ bulk ตอนเห็น series ครั้งแรก (SERIES_IDS_ENABLED=1) แล้ว cache ไว้ใน process
+--
+-- ระยะนี้: เพิ่ม series_id ให้ agg/anomaly/kpi + index แคบ ๆ บน series_id
+-- คอลัมน์ TEXT เดิมและ PK ยังอยู่ (API/KPI เดิมยังอ่านชื่อ) — ตัดทิ้งได้เมื่อ reader ทั้งหมดย้ายมาใช้ series_id
+
+CREATE SCHEMA IF NOT EXISTS analytics;
+
+-----------------------------
+-- 1) SERIES REGISTRY
+-----------------------------
+CREATE TABLE IF NOT EXISTS analytics.analytics_series (
+  series_id   BIGSERIAL PRIMARY KEY,
+  tenant_id   TEXT NOT NULL,
+  factory_id  TEXT NOT NULL,
+  machine_id  TEXT NOT NULL,
+  sensor_id   TEXT,
+  metric      TEXT NOT NULL,
+  created_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- sensor_id เป็น NULL ได้ → unique บน COALESCE (ON CONFLICT ของ worker อ้าง expression เดียวกัน)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_series_key
+  ON analytics.analytics_series (tenant_id, factory_id, machine_id, (COALESCE(sensor_id, '')), metric);
+
+GRANT USAGE, SELECT ON SEQUENCE analytics.analytics_series_series_id_seq TO analytics_app;
+
+-----------------------------
+-- 2) SERIES_ID COLUMNS
+-----------------------------
+ALTER TABLE analytics.analytics_agg     ADD COLUMN IF NOT EXISTS series_id BIGINT;
+ALTER TABLE analytics.analytics_anomaly ADD COLUMN IF NOT EXISTS series_id BIGINT;
+ALTER TABLE analytics.analytics_kpi     ADD COLUMN IF NOT EXISTS series_id BIGINT;
+
+-- index 8 byte + window + time แทน 4 TEXT (idx_agg_lookup)
+CREATE INDEX IF NOT EXISTS idx_agg_series
+  ON analytics.analytics_agg (series_id, window_s, bucket_start DESC);
+CREATE INDEX IF NOT EXISTS idx_anomaly_series
+  ON analytics.analytics_anomaly (series_id, time DESC);
+CREATE INDEX IF NOT EXISTS idx_kpi_series
+  ON analytics.analytics_kpi (series_id, period, period_start DESC);
+
+-----------------------------
+-- 3) BACKFILL (idempotent)
+-----------------------------
+INSERT INTO analytics.analytics_series (tenant_id, factory_id, machine_id, sensor_id, metric)
+SELECT DISTINCT tenant_id, factory_id, machine_id, sensor_id, metric FROM analytics.analytics_agg
+UNION
+SELECT DISTINCT tenant_id, factory_id, machine_id, sensor_id, metric FROM analytics.analytics_anomaly
+UNION
+SELECT DISTINCT tenant_id, factory_id, machine_id, sensor_id, metric FROM analytics.analytics_kpi
+ON CONFLICT DO NOTHING;
+
+-- UPDATE บน chunk ที่ compress แล้วต้องใช้ TimescaleDB >= 2.11 (รุ่นเก่า: decompress_chunk ก่อน)
+UPDATE analytics.analytics_agg a SET series_id = s.series_id
+  FROM analytics.analytics_series s
+ WHERE a.series_id IS NULL
+   AND s.tenant_id = a.tenant_id AND s.factory_id = a.factory_id AND s.machine_id = a.machine_id
+   AND COALESCE(s.sensor_id, '') = COALESCE(a.sensor_id, '') AND s.metric = a.metric;
+
+UPDATE analytics.analytics_anomaly a SET series_id = s.series_id
+  FROM analytics.analytics_series s
+ WHERE a.series_id IS NULL
+   AND s.tenant_id = a.tenant_id AND s.factory_id = a.factory_id AND s.machine_id = a.machine_id
+   AND COALESCE(s.sensor_id, '') = COALESCE(a.sensor_id, '') AND s.metric = a.metric;
+
+UPDATE analytics.analytics_kpi a SET series_id = s.series_id
+  FROM analytics.analytics_series s
+ WHERE a.series_id IS NULL
+   AND s.tenant_id = a.tenant_id AND s.factory_id = a.factory_id AND s.machine_id = a.machine_id
+   AND COALESCE(s.sensor_id, '') = COALESCE(a.sensor_id, '') AND s.metric = a.metric;
@@ -0,0 +1,12 @@
+-- 078_analytics_agg_cascade.sql
+-- aggregate สำหรับ cascading rollup ใน backfill_aggregates (analytics-worker app/services/backfill.py):
+-- window หยาบ (300s/3600s) สร้างจากแถว window ละเอียดใน analytics_agg แทนการสแกน raw ซ้ำทุก window
+-- ต้องมี analytics.ddsketch_merge จาก 076_analytics_agg_state.sql
+
+CREATE SCHEMA IF NOT EXISTS analytics;
+
+-- รวม sketch หลายแถว: ddsketch_merge ไม่ strict (state เริ่ม NULL → คืนอีกฝั่ง) → ข้ามแถวที่ sketch เป็น NULL เอง
+CREATE OR REPLACE AGGREGATE analytics.ddsketch_merge_agg(JSONB) (
+  SFUNC = analytics.ddsketch_merge,
+  STYPE = JSONB
+);
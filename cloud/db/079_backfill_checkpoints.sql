@@ -0,0 +1,17 @@
+-- 079_backfill_checkpoints.sql
+-- checkpoint ราย chunk ของ backfill runner (analytics-worker app/workers/backfill.py)
+-- รันซ้ำด้วย job_id เดิม → ข้าม chunk ที่ status = 'done' (resume), chunk ที่ 'failed' ถูกทำใหม่
+
+CREATE SCHEMA IF NOT EXISTS analytics;
+
+CREATE TABLE IF NOT EXISTS analytics.backfill_checkpoints (
+  job_id       TEXT        NOT NULL,          -- hash ของ (range, windows, filters, cascade) หรือชื่อที่ตั้งเอง
+  chunk_start  TIMESTAMPTZ NOT NULL,
+  chunk_end    TIMESTAMPTZ NOT NULL,
+  status       TEXT        NOT NULL,          -- done | failed
+  rows_written BIGINT,
+  duration_s   DOUBLE PRECISION,
+  error        TEXT,
+  updated_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  CONSTRAINT backfill_checkpoints_pk PRIMARY KEY (job_id, chunk_start)
+);
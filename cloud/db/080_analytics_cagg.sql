@@ -0,0 +1,105 @@
+-- 080_analytics_cagg.sql
+-- โหมด continuous aggregate (AGG_ENGINE=cagg ที่ analytics-worker, AGG_SOURCE=cagg ที่ analytics-api)
+-- worker เขียน measurement ดิบลง sensors.device_readings (075_raw_example.sql) อย่างเดียว
+-- rollup 60s/300s/3600s ทำโดย TimescaleDB (refresh policy + real-time aggregation สำหรับช่วงที่ยังไม่ materialize)
+--
+-- ต้องใช้ TimescaleDB >= 2.7 (finalized cagg รองรับ ordered-set aggregate → p95 ผ่าน percentile_disc)
+-- แต่ละ window สร้างจาก raw ตรง ๆ (ไม่ซ้อน cagg) เพราะ p95 รวมต่อจาก bucket ย่อยไม่ได้
+-- WINDOWS ของ worker ไม่มีผลในโหมดนี้ — เพิ่ม/ลด window ที่ไฟล์นี้ + v_agg_cagg
+
+CREATE SCHEMA IF NOT EXISTS analytics;
+
+-----------------------------
+-- 1) CONTINUOUS AGGREGATES
+-----------------------------
+CREATE MATERIALIZED VIEW IF NOT EXISTS analytics.agg_cagg_60s
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+  time_bucket(INTERVAL '60 seconds', time) AS bucket_start,
+  tenant_id, factory_id, machine_id, sensor_id, metric,
+  COUNT(*)::bigint                              AS count_n,
+  SUM(value)                                    AS sum_val,
+  AVG(value)                                    AS avg_val,
+  MIN(value)                                    AS min_val,
+  MAX(value)                                    AS max_val,
+  STDDEV_POP(value)                             AS stddev_val,
+  PERCENTILE_DISC(0.95) WITHIN GROUP (ORDER BY value) AS p95_val
+FROM sensors.device_readings
+GROUP BY 1, tenant_id, factory_id, machine_id, sensor_id, metric
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS analytics.agg_cagg_300s
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+  time_bucket(INTERVAL '300 seconds', time) AS bucket_start,
+  tenant_id, factory_id, machine_id, sensor_id, metric,
+  COUNT(*)::bigint                              AS count_n,
+  SUM(value)                                    AS sum_val,
+  AVG(value)                                    AS avg_val,
+  MIN(value)                                    AS min_val,
+  MAX(value)                                    AS max_val,
+  STDDEV_POP(value)                             AS stddev_val,
+  PERCENTILE_DISC(0.95) WITHIN GROUP (ORDER BY value) AS p95_val
+FROM sensors.device_readings
+GROUP BY 1, tenant_id, factory_id, machine_id, sensor_id, metric
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS analytics.agg_cagg_3600s
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+  time_bucket(INTERVAL '3600 seconds', time) AS bucket_start,
+  tenant_id, factory_id, machine_id, sensor_id, metric,
+  COUNT(*)::bigint                              AS count_n,
+  SUM(value)                                    AS sum_val,
+  AVG(value)                                    AS avg_val,
+  MIN(value)                                    AS min_val,
+  MAX(value)                                    AS max_val,
+  STDDEV_POP(value)                             AS stddev_val,
+  PERCENTILE_DISC(0.95) WITHIN GROUP (ORDER BY value) AS p95_val
+FROM sensors.device_readings
+GROUP BY 1, tenant_id, factory_id, machine_id, sensor_id, metric
+WITH NO DATA;
+
+-- lookup แบบเดียวกับ idx_agg_lookup (/v1/agg)
+CREATE INDEX IF NOT EXISTS idx_agg_cagg_60s_lookup   ON analytics.agg_cagg_60s   (factory_id, machine_id, metric, bucket_start DESC);
+CREATE INDEX IF NOT EXISTS idx_agg_cagg_300s_lookup  ON analytics.agg_cagg_300s  (factory_id, machine_id, metric, bucket_start DESC);
+CREATE INDEX IF NOT EXISTS idx_agg_cagg_3600s_lookup ON analytics.agg_cagg_3600s (factory_id, machine_id, metric, bucket_start DESC);
+
+-----------------------------
+-- 2) REFRESH POLICIES
+-----------------------------
+-- end_offset = 1 bucket: bucket ปัจจุบันมาจาก real-time aggregation (raw ล่าสุด) จน bucket ปิด
+-- ข้อมูลที่มาช้ากว่า start_offset ไม่ถูก refresh อัตโนมัติ → CALL refresh_continuous_aggregate(...) เอง
+SELECT add_continuous_aggregate_policy('analytics.agg_cagg_60s',
+  start_offset => INTERVAL '2 hours', end_offset => INTERVAL '1 minute',
+  schedule_interval => INTERVAL '1 minute', if_not_exists => TRUE);
+
+SELECT add_continuous_aggregate_policy('analytics.agg_cagg_300s',
+  start_offset => INTERVAL '6 hours', end_offset => INTERVAL '5 minutes',
+  schedule_interval => INTERVAL '5 minutes', if_not_exists => TRUE);
+
+SELECT add_continuous_aggregate_policy('analytics.agg_cagg_3600s',
+  start_offset => INTERVAL '3 days', end_offset => INTERVAL '1 hour',
+  schedule_interval => INTERVAL '30 minutes', if_not_exists => TRUE);
+
+-----------------------------
+-- 3) VIEW รูปแบบเดียวกับ analytics_agg
+-----------------------------
+-- window_s เป็นค่าคงที่ต่อ branch → WHERE window_s = :w ตัด branch อื่นทิ้งตั้งแต่ plan
+CREATE OR REPLACE VIEW analytics.v_agg_cagg AS
+SELECT bucket_start, 60 AS window_s, tenant_id, factory_id, machine_id, sensor_id, metric,
+       count_n, sum_val, avg_val, min_val, max_val, stddev_val, p95_val
+FROM analytics.agg_cagg_60s
+UNION ALL
+SELECT bucket_start, 300 AS window_s, tenant_id, factory_id, machine_id, sensor_id, metric,
+       count_n, sum_val, avg_val, min_val, max_val, stddev_val, p95_val
+FROM analytics.agg_cagg_300s
+UNION ALL
+SELECT bucket_start, 3600 AS window_s, tenant_id, factory_id, machine_id, sensor_id, metric,
+       count_n, sum_val, avg_val, min_val, max_val, stddev_val, p95_val
+FROM analytics.agg_cagg_3600s;
+
+GRANT SELECT ON analytics.agg_cagg_60s, analytics.agg_cagg_300s, analytics.agg_cagg_3600s,
+                analytics.v_agg_cagg TO analytics_app;
+GRANT USAGE ON SCHEMA sensors TO analytics_app;
+GRANT SELECT, INSERT ON sensors.device_readings TO analytics_app;
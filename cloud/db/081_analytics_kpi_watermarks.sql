@@ -0,0 +1,16 @@
+-- 081_analytics_kpi_watermarks.sql
+-- high-water mark ของ KPI job แบบ incremental (analytics-worker app/services/kpi.py: compute_kpi_incremental)
+-- รอบถัดไปคำนวณใหม่เฉพาะ (series, period) ที่แถว analytics_agg มี updated_at >= mark (ย้อนซ้อน KPI_WATERMARK_LAG_S)
+
+CREATE SCHEMA IF NOT EXISTS analytics;
+
+CREATE TABLE IF NOT EXISTS analytics.kpi_watermarks (
+  job         TEXT        NOT NULL,          -- kpi:<period>:<window_s>:<metric|*>
+  high_water  TIMESTAMPTZ NOT NULL,
+  updated_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  CONSTRAINT kpi_watermarks_pk PRIMARY KEY (job)
+);
+
+-- หาแถวที่เปลี่ยนตั้งแต่ mark (ต่อ chunk; chunk เก่าถูกตัดด้วย bucket_start >= now - KPI_LOOKBACK_DAYS)
+CREATE INDEX IF NOT EXISTS idx_agg_updated
+  ON analytics.analytics_agg (window_s, updated_at);
@@ -0,0 +1,8 @@
+-- 082_analytics_kpi_sigma.sql
+-- KPI จาก moment ของ analytics_agg (analytics-worker app/services/kpi.py):
+--   stddev_val    = sigma overall (sample sd ทั้ง period: รวม M2 ภายใน + ระหว่าง bucket) → Pp/Ppk
+--   stddev_within = sigma within (pooled sd ภายใน bucket)                                 → Cp/Cpk
+-- แถวเดิม stddev_val = STDDEV_POP(avg_val) ราย bucket — คำนวณใหม่ด้วย compute_kpi (หรือลบ kpi_watermarks ให้ job รันเต็มรอบ)
+
+ALTER TABLE analytics.analytics_kpi
+  ADD COLUMN IF NOT EXISTS stddev_within DOUBLE PRECISION;
@@ -0,0 +1,8 @@
+-- 083_analytics_spec_usl_lsl.sql
+-- spec limits (USL/LSL) คู่กับ control limits (CL/UCL/LCL) ใน analytics_spec_limits
+-- analytics-worker โหลดทั้งตารางเป็น interval index (app/services/spec_resolver.py):
+--   usl/lsl → Cp/Cpk/Pp/Ppk ของ compute_kpi, cl/ucl/lcl → limit คงที่ของ stream anomaly (แทน CL/σ แบบ rolling)
+
+ALTER TABLE analytics.analytics_spec_limits
+  ADD COLUMN IF NOT EXISTS usl DOUBLE PRECISION,
+  ADD COLUMN IF NOT EXISTS lsl DOUBLE PRECISION;
@@ -0,0 +1,18 @@
+-- 084_scheduler_runs.sql
+-- รอบของ scheduled job ข้าม replica (analytics-worker app/workers/coordinator.py)
+-- replica ที่ได้ advisory lock แล้ว INSERT (job, slot_start) สำเร็จเป็นผู้รันรอบนั้น — PK กันรันซ้ำในรอบเดียวกัน
+-- แถวเก่ากว่า 7 วันถูกลบตอน claim รอบใหม่
+
+CREATE SCHEMA IF NOT EXISTS analytics;
+
+CREATE TABLE IF NOT EXISTS analytics.scheduler_runs (
+  job          TEXT        NOT NULL,
+  slot_start   TIMESTAMPTZ NOT NULL,          -- เวลา fire ปัดลงตามรอบของ job
+  holder       TEXT        NOT NULL,          -- hostname:pid ของ replica ที่รัน
+  status       TEXT        NOT NULL,          -- running | ok | error
+  started_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  finished_at  TIMESTAMPTZ,
+  duration_s   DOUBLE PRECISION,
+  error        TEXT,
+  CONSTRAINT scheduler_runs_pk PRIMARY KEY (job, slot_start)
+);
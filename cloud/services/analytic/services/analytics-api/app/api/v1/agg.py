@@ -3,15 +3,20 @@
 from __future__ import annotations
 from typing import List, Optional
 from datetime import datetime
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
+from app.config import Config
 from app.database import get_db
 from app.domain.models import Aggregate
+from app.services.series import names_for
 
 router = APIRouter(prefix="/v1")
 
+# AGG_SOURCE=cagg: view รูปแบบเดียวกับ analytics_agg บน continuous aggregate (รวม bucket ที่ยังไม่ materialize)
+_AGG_FROM = "analytics.v_agg_cagg" if Config.AGG_SOURCE == "cagg" else "analytics.analytics_agg"
+
 @router.get("/agg", response_model=List[Aggregate])
 def get_agg(
     tenant_id: str = Query(...),
@@ -35,7 +40,7 @@ def get_agg(
         COALESCE(max_val,0)    AS max_val,
         COALESCE(stddev_val,0) AS stddev_val,
         COALESCE(p95_val,0)    AS p95_val
-      FROM analytics.analytics_agg
+      FROM {_AGG_FROM}
       WHERE tenant_id = :tenant_id
         AND factory_id = :factory_id
         AND machine_id = :machine_id
@@ -54,3 +59,50 @@ def get_agg(
         "limit": limit,
     }).mappings().all()
     return [Aggregate(**r) for r in rows]
+
+
+@router.get("/agg/series/{series_id}", response_model=List[Aggregate])
+def get_agg_by_series(
+    series_id: int,
+    window_s: int = Query(...),
+    start: datetime = Query(..., description="ISO8601 start"),
+    end: datetime = Query(..., description="ISO8601 end (exclusive)"),
+    limit: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(get_db),
+):
+    """
+    อ่านตาม series_id (idx_agg_series) — ไม่ต้องเทียบ TEXT 4-5 คอลัมน์ต่อแถว
+    ชื่อ tenant/factory/machine/sensor/metric มาจาก cache ของ series registry
+    """
+    key = names_for(db, [series_id]).get(series_id)
+    if key is None:
+        raise HTTPException(status_code=404, detail="unknown series_id")
+    tenant_id, factory_id, machine_id, sensor_id, metric = key
+    # continuous aggregate ไม่มี series_id → กรองด้วยชื่อจาก registry แทน
+    where = ("""tenant_id = :tenant_id AND factory_id = :factory_id AND machine_id = :machine_id
+        AND sensor_id IS NOT DISTINCT FROM :sensor_id AND metric = :metric""" if Config.AGG_SOURCE == "cagg"
+             else "series_id = :series_id")
+    rows = db.execute(text(f"""
+      SELECT
+        bucket_start, window_s,
+        count_n,
+        COALESCE(sum_val,0)    AS sum_val,
+        COALESCE(avg_val,0)    AS avg_val,
+        COALESCE(min_val,0)    AS min_val,
+        COALESCE(max_val,0)    AS max_val,
+        COALESCE(stddev_val,0) AS stddev_val,
+        COALESCE(p95_val,0)    AS p95_val
+      FROM {_AGG_FROM}
+      WHERE {where}
+        AND window_s = :window_s
+        AND bucket_start >= :start
+        AND bucket_start < :end
+      ORDER BY bucket_start ASC
+      LIMIT :limit
+    """), {
+        "series_id": series_id, "tenant_id": tenant_id, "factory_id": factory_id, "machine_id": machine_id,
+        "sensor_id": sensor_id, "metric": metric,
+        "window_s": window_s, "start": start, "end": end, "limit": limit,
+    }).mappings().all()
+    return [Aggregate(**r, tenant_id=tenant_id, factory_id=factory_id, machine_id=machine_id,
+                      sensor_id=sensor_id, metric=metric) for r in rows]
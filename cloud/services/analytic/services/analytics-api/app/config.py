@@ -79,6 +79,9 @@ class Config:
     # Aggregation windows (seconds)
     WINDOWS: List[int] = _get_list("WINDOWS", [60, 300, 3600])
 
+    # แหล่งข้อมูลของ /v1/agg: table (analytics_agg ที่ worker upsert) | cagg (continuous aggregate — 080_analytics_cagg.sql)
+    AGG_SOURCE: str = _env("AGG_SOURCE", "table").strip().lower()
+
     # API
     API_HOST: str = _env("API_HOST", "0.0.0.0")
     API_PORT: int = int(_env("ANALYTICS_API_PORT", "7304"))
@@ -0,0 +1,47 @@
+# app/services/series.py
+"""
+series_id → (tenant, factory, machine, sensor, metric) จาก analytics.analytics_series
+(registry ที่ analytics-worker สร้าง — ดู cloud/db/077_analytics_series.sql)
+
+series ไม่เคยถูกแก้ชื่อ → cache ใน process ได้ถาวร (LRU จำกัดขนาด)
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+SeriesKey = Tuple[str, str, str, Optional[str], str]
+
+_MAX = 100_000
+_names: "OrderedDict[int, SeriesKey]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def names_for(db: Session, ids: Sequence[int]) -> Dict[int, SeriesKey]:
+    out: Dict[int, SeriesKey] = {}
+    missing = []
+    with _lock:
+        for sid in set(ids):
+            key = _names.get(sid)
+            if key is None:
+                missing.append(sid)
+            else:
+                _names.move_to_end(sid)
+                out[sid] = key
+    if missing:
+        rows = db.execute(text("""
+          SELECT series_id, tenant_id, factory_id, machine_id, sensor_id, metric
+          FROM analytics.analytics_series
+          WHERE series_id = ANY(:ids)
+        """), {"ids": missing}).all()
+        with _lock:
+            for sid, *key in rows:
+                out[sid] = _names[sid] = tuple(key)
+            while len(_names) > _MAX:
+                _names.popitem(last=False)
+    return out
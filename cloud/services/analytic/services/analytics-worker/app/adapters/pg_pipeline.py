@@ -0,0 +1,112 @@
+# app/adapters/pg_pipeline.py
+"""
+Write adapter แบบ psycopg3 pipeline mode + server-side prepared statement (WRITE_ADAPTER=pipeline)
+
+- ใช้ connection psycopg ตัวเดียวกับ Session (transaction/savepoint เดียวกับ batch) ไม่ผ่าน text()/compile ของ SQLAlchemy
+- 1 statement ต่อแถว, prepare=True → server parse/plan ครั้งเดียวต่อ connection แล้วส่งแค่ Bind/Execute
+- ทั้ง batch ส่งต่อกันใน pipeline (SAVEPOINT ... RELEASE) แล้วรอผลครั้งเดียว → 1 round trip ต่อ batch
+- error ราย statement: batch ที่ล้ม rollback กลับ savepoint แล้วแบ่งครึ่งส่งใหม่จนเหลือแถวที่ผิดจริง
+  → แถวดีถูกเขียนครบ, แถวที่ผิดเก็บใน PipelineRepo.errors (table, key ของแถว, error) + นับ aw_write_errors
+  (key = PK ของ agg/rollup หรือ key ธรรมชาติของ event/anomaly — แถวถูกรวม PK ซ้ำก่อนส่ง index จึงไม่มีความหมายกับผู้เรียก)
+conflict semantics เหมือน upsert ทีละแถวของ AnalyticsRepo (agg/rollup ยังรวม PK ซ้ำในฝั่ง Python ก่อน → statement น้อยลง)
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+import psycopg
+
+from app.adapters.repository import (
+    AGG_COLS, AGG_PK, ANOMALY_COLS, EVENT_COLS, ROLLUP_COLS, ROLLUP_PK, AnalyticsRepo,
+    _AGG_CONFLICT, _AGG_CONFLICT_SERIES, _ROLLUP_CONFLICT, _agg_params, _dedupe, _jsonb,
+    _merge_rollup_row, _with_series,
+)
+from app.instrumentation.metrics import write_errors
+from app.utils.stats import merge_agg_row
+
+
+class StatementError(NamedTuple):
+    table: str
+    key: tuple
+    error: str
+    sqlstate: Optional[str] = None
+
+    @property
+    def permanent(self) -> bool:
+        # class 22 (data exception) / 23 (integrity constraint) — เขียนซ้ำกี่ครั้งก็ไม่ผ่าน
+        return (self.sqlstate or "")[:2] in ("22", "23")
+
+
+EVENT_KEY = ("time", "tenant_id", "domain", "entity_type", "entity_id", "event_type")
+ANOMALY_KEY = ("time", "tenant_id", "factory_id", "machine_id", "sensor_id", "metric", "rule_code")
+
+
+def _insert_sql(table: str, cols: Sequence[str], casts: Dict[str, str], tail: str) -> str:
+    ph = ", ".join(f"%({c})s::{casts[c]}" if c in casts else f"%({c})s" for c in cols)
+    return f"INSERT INTO {table} ({', '.join(cols)})\n        VALUES ({ph})" + tail
+
+
+_DO_NOTHING = "\n        ON CONFLICT DO NOTHING;\n"
+
+
+class PipelineRepo(AnalyticsRepo):
+    def __init__(self, db):
+        super().__init__(db)
+        self.errors: List[StatementError] = []
+
+    def _pg(self) -> psycopg.Connection:
+        # connection ที่ Session ใช้อยู่ (เริ่ม transaction ของ Session ถ้ายังไม่เริ่ม)
+        return self.db.connection().connection.driver_connection
+
+    def _send(self, conn: psycopg.Connection, sql: str, params: List[dict]) -> None:
+        with conn.pipeline():
+            with conn.cursor() as cur:
+                cur.execute("SAVEPOINT aw_pipeline")
+                for p in params:
+                    cur.execute(sql, p, prepare=True)
+                cur.execute("RELEASE SAVEPOINT aw_pipeline")
+
+    def _run(self, table: str, sql: str, params: List[dict], key: Sequence[str],
+             lo: int = 0, hi: int = None) -> int:
+        """params[lo:hi] → จำนวนแถวที่เขียนสำเร็จ (แถวที่ผิดไปอยู่ใน self.errors)"""
+        hi = len(params) if hi is None else hi
+        if lo >= hi:
+            return 0
+        conn = self._pg()
+        try:
+            self._send(conn, sql, params[lo:hi])
+            return hi - lo
+        except psycopg.Error as e:
+            conn.execute("ROLLBACK TO SAVEPOINT aw_pipeline")
+            conn.execute("RELEASE SAVEPOINT aw_pipeline")
+            if hi - lo == 1:
+                self.errors.append(StatementError(table, tuple(params[lo].get(c) for c in key),
+                                                  str(e).strip()[:500], e.sqlstate))
+                write_errors.labels(table=table).inc()
+                return 0
+        mid = (lo + hi) // 2
+        return self._run(table, sql, params, key, lo, mid) + self._run(table, sql, params, key, mid, hi)
+
+    def upsert_agg_many(self, rows: Iterable[dict]) -> int:
+        rows = _dedupe(rows, AGG_PK, merge_agg_row)
+        cols = _with_series(AGG_COLS, rows)
+        conflict = _AGG_CONFLICT_SERIES if "series_id" in cols else _AGG_CONFLICT
+        sql = _insert_sql("analytics.analytics_agg", cols, {"sketch": "jsonb"}, conflict)
+        return self._run("analytics_agg", sql, [_agg_params(r) for r in rows], AGG_PK)
+
+    def insert_events_many(self, rows: Iterable[dict]) -> int:
+        params = [{**{c: r.get(c) for c in EVENT_COLS}, "payload": _jsonb(r.get("payload"))} for r in rows]
+        sql = _insert_sql("analytics.analytics_event", EVENT_COLS, {"payload": "jsonb"}, _DO_NOTHING)
+        return self._run("analytics_event", sql, params, EVENT_KEY)
+
+    def upsert_event_rollup_many(self, rows: Iterable[dict]) -> int:
+        rows = _dedupe(rows, ROLLUP_PK, _merge_rollup_row)
+        sql = _insert_sql("analytics.analytics_event_rollup", ROLLUP_COLS, {}, _ROLLUP_CONFLICT)
+        return self._run("analytics_event_rollup", sql, [{c: r.get(c) for c in ROLLUP_COLS} for r in rows], ROLLUP_PK)
+
+    def insert_anomalies_many(self, rows: Iterable[dict]) -> int:
+        rows = [{**r, "details": _jsonb(r.get("details"))} for r in rows]
+        cols = _with_series(ANOMALY_COLS, rows)
+        sql = _insert_sql("analytics.analytics_anomaly", cols, {"details": "jsonb"}, _DO_NOTHING)
+        return self._run("analytics_anomaly", sql, [{c: r.get(c) for c in cols} for r in rows], ANOMALY_KEY)
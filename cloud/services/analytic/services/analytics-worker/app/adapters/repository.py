@@ -1,8 +1,171 @@
 ## app/adapters/repository.py
 
+from typing import Dict, Iterable, List, Sequence, Tuple
+
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
+from app.config import Config
+from app.pipelines.batch import MeasurementBatch
+from app.utils.serialization import to_json
+from app.utils.stats import merge_agg_row, least, greatest
+
+# ขนาด multi-VALUES ต่อ 1 statement (กันชน limit 65535 bind params ของ Postgres)
+BULK_CHUNK_ROWS = 500
+
+AGG_COLS = (
+    "bucket_start", "window_s", "tenant_id", "factory_id", "machine_id", "sensor_id", "metric",
+    "count_n", "sum_val", "avg_val", "min_val", "max_val", "stddev_val", "p95_val",
+    "m2_val", "sketch",
+)
+AGG_PK = ("tenant_id", "factory_id", "machine_id", "metric", "window_s", "bucket_start")
+
+EVENT_COLS = (
+    "time", "tenant_id", "domain", "entity_type", "entity_id", "event_type",
+    "value", "unit", "severity", "payload",
+)
+
+ROLLUP_COLS = (
+    "bucket_start", "window_s", "tenant_id", "domain", "entity_type", "entity_id", "event_type",
+    "count_n", "sum_val", "avg_val", "min_val", "max_val",
+)
+ROLLUP_PK = ("tenant_id", "domain", "entity_type", "entity_id", "event_type", "window_s", "bucket_start")
+
+ANOMALY_COLS = (
+    "time", "tenant_id", "factory_id", "machine_id", "sensor_id", "metric",
+    "rule_code", "severity", "value", "cl", "ucl", "lcl", "zscore", "details",
+)
+
+KPI_COLS = (
+    "period", "period_start", "tenant_id", "factory_id", "machine_id", "sensor_id", "metric",
+    "n", "mean_val", "stddev_val", "stddev_within", "cp", "cpk", "pp", "ppk",
+)
+KPI_PK = ("tenant_id", "factory_id", "machine_id", "metric", "period", "period_start")
+
+SERIES_COLS = ("tenant_id", "factory_id", "machine_id", "sensor_id", "metric")
+
+# merge state แบบ O(1) ต่อแถว: count/sum บวก, M2 รวมแบบ Chan, sketch บวก bin แล้วอ่าน p95
+# (แถวเก่าที่ยังไม่มี m2_val ประมาณจาก stddev_pop^2 * n)
+_AGG_CONFLICT_SET = """
+        ON CONFLICT (tenant_id, factory_id, machine_id, metric, window_s, bucket_start)
+        DO UPDATE SET
+          count_n    = analytics.analytics_agg.count_n + EXCLUDED.count_n,
+          sum_val    = COALESCE(analytics.analytics_agg.sum_val,0) + COALESCE(EXCLUDED.sum_val,0),
+          avg_val    = (COALESCE(analytics.analytics_agg.sum_val,0) + COALESCE(EXCLUDED.sum_val,0))
+                       / NULLIF(analytics.analytics_agg.count_n + EXCLUDED.count_n, 0),
+          min_val    = LEAST(analytics.analytics_agg.min_val, EXCLUDED.min_val),
+          max_val    = GREATEST(analytics.analytics_agg.max_val, EXCLUDED.max_val),
+          m2_val     = analytics.agg_m2_merge(
+                         analytics.analytics_agg.count_n, analytics.analytics_agg.sum_val,
+                         COALESCE(analytics.analytics_agg.m2_val,
+                                  analytics.analytics_agg.stddev_val ^ 2 * analytics.analytics_agg.count_n),
+                         EXCLUDED.count_n, EXCLUDED.sum_val, EXCLUDED.m2_val),
+          stddev_val = sqrt(analytics.agg_m2_merge(
+                         analytics.analytics_agg.count_n, analytics.analytics_agg.sum_val,
+                         COALESCE(analytics.analytics_agg.m2_val,
+                                  analytics.analytics_agg.stddev_val ^ 2 * analytics.analytics_agg.count_n),
+                         EXCLUDED.count_n, EXCLUDED.sum_val, EXCLUDED.m2_val)
+                       / NULLIF(analytics.analytics_agg.count_n + EXCLUDED.count_n, 0)),
+          sketch     = analytics.ddsketch_merge(analytics.analytics_agg.sketch, EXCLUDED.sketch),
+          p95_val    = CASE WHEN analytics.analytics_agg.sketch IS NOT NULL AND EXCLUDED.sketch IS NOT NULL
+                            THEN analytics.ddsketch_quantile(
+                                   analytics.ddsketch_merge(analytics.analytics_agg.sketch, EXCLUDED.sketch), 0.95)
+                            ELSE EXCLUDED.p95_val END,
+"""
+_AGG_CONFLICT = _AGG_CONFLICT_SET + """          updated_at = NOW();
+"""
+# แถวเก่า (ก่อน SERIES_IDS_ENABLED) ได้ series_id จาก upsert ครั้งถัดไป
+_AGG_CONFLICT_SERIES = _AGG_CONFLICT_SET + """          series_id  = COALESCE(analytics.analytics_agg.series_id, EXCLUDED.series_id),
+          updated_at = NOW();
+"""
+
+_ROLLUP_CONFLICT = """
+        ON CONFLICT (tenant_id, domain, entity_type, entity_id, event_type, window_s, bucket_start)
+        DO UPDATE SET
+          count_n    = analytics.analytics_event_rollup.count_n + EXCLUDED.count_n,
+          sum_val    = CASE WHEN analytics.analytics_event_rollup.sum_val IS NULL AND EXCLUDED.sum_val IS NULL
+                            THEN NULL
+                            ELSE COALESCE(analytics.analytics_event_rollup.sum_val,0) + COALESCE(EXCLUDED.sum_val,0) END,
+          avg_val    = CASE WHEN analytics.analytics_event_rollup.sum_val IS NULL AND EXCLUDED.sum_val IS NULL
+                            THEN NULL
+                            ELSE (COALESCE(analytics.analytics_event_rollup.sum_val,0) + COALESCE(EXCLUDED.sum_val,0))
+                                 / NULLIF(analytics.analytics_event_rollup.count_n + EXCLUDED.count_n, 0) END,
+          min_val    = LEAST(analytics.analytics_event_rollup.min_val, EXCLUDED.min_val),
+          max_val    = GREATEST(analytics.analytics_event_rollup.max_val, EXCLUDED.max_val),
+          updated_at = NOW();
+"""
+
+
+def _values_sql(cols: Sequence[str], n: int, casts: Dict[str, str] = None) -> str:
+    """สร้าง (:c_0,...),(:c_1,...) สำหรับ multi-VALUES INSERT"""
+    casts = casts or {}
+    out = []
+    for i in range(n):
+        ph = []
+        for c in cols:
+            p = f":{c}_{i}"
+            ph.append(f"CAST({p} AS {casts[c]})" if c in casts else p)
+        out.append("(" + ", ".join(ph) + ")")
+    return ",\n          ".join(out)
+
+
+def _bind(cols: Sequence[str], rows: Sequence[dict]) -> dict:
+    params = {}
+    for i, r in enumerate(rows):
+        for c in cols:
+            params[f"{c}_{i}"] = r.get(c)
+    return params
+
+
+def _chunks(rows: List[dict], size: int) -> Iterable[List[dict]]:
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _jsonb(v):
+    if v is None or isinstance(v, str):
+        return v
+    if hasattr(v, "to_dict"):  # DDSketch
+        v = v.to_dict()
+    return to_json(v)
+
+
+def _agg_params(row: dict) -> dict:
+    return {**{c: row.get(c) for c in AGG_COLS}, "sketch": _jsonb(row.get("sketch")),
+            "series_id": row.get("series_id")}
+
+
+def _with_series(cols: Tuple[str, ...], rows: List[dict]) -> Tuple[str, ...]:
+    # เขียน series_id เฉพาะเมื่อ worker แนบมา (SERIES_IDS_ENABLED → ต้องรัน 077_analytics_series.sql แล้ว)
+    return cols + ("series_id",) if rows and "series_id" in rows[0] else cols
+
+
+def _merge_rollup_row(cur: dict, new: dict) -> dict:
+    out = dict(cur)
+    out["count_n"] = cur["count_n"] + new["count_n"]
+    if cur.get("sum_val") is None and new.get("sum_val") is None:
+        out["sum_val"] = out["avg_val"] = None
+    else:
+        out["sum_val"] = (cur.get("sum_val") or 0) + (new.get("sum_val") or 0)
+        out["avg_val"] = out["sum_val"] / out["count_n"] if out["count_n"] else None
+    out["min_val"] = least(cur.get("min_val"), new.get("min_val"))
+    out["max_val"] = greatest(cur.get("max_val"), new.get("max_val"))
+    return out
+
+
+def _dedupe(rows: Iterable[dict], pk: Tuple[str, ...], merge) -> List[dict]:
+    """
+    ON CONFLICT DO UPDATE แตะแถวเดียวกันซ้ำใน statement เดียวไม่ได้
+    → รวมแถวที่ PK ชนกันในฝั่ง Python ก่อน (ลำดับเหมือนเขียนทีละแถว)
+    """
+    merged: Dict[tuple, dict] = {}
+    for r in rows:
+        k = tuple(r.get(c) for c in pk)
+        cur = merged.get(k)
+        merged[k] = r if cur is None else merge(cur, r)
+    return list(merged.values())
+
+
 class AnalyticsRepo:
     def __init__(self, db: Session): self.db = db
 
@@ -10,24 +173,73 @@ class AnalyticsRepo:
         sql = text("""
         INSERT INTO analytics.analytics_agg (
           bucket_start, window_s, tenant_id, factory_id, machine_id, sensor_id, metric,
-          count_n, sum_val, avg_val, min_val, max_val, stddev_val, p95_val
+          count_n, sum_val, avg_val, min_val, max_val, stddev_val, p95_val, m2_val, sketch
         ) VALUES (
           :bucket_start, :window_s, :tenant_id, :factory_id, :machine_id, :sensor_id, :metric,
-          :count_n, :sum_val, :avg_val, :min_val, :max_val, :stddev_val, :p95_val
-        )
-        ON CONFLICT (tenant_id, factory_id, machine_id, metric, window_s, bucket_start)
-        DO UPDATE SET
-          count_n    = analytics.analytics_agg.count_n + EXCLUDED.count_n,
-          sum_val    = COALESCE(analytics.analytics_agg.sum_val,0) + COALESCE(EXCLUDED.sum_val,0),
-          avg_val    = EXCLUDED.avg_val,
-          min_val    = LEAST(analytics.analytics_agg.min_val, EXCLUDED.min_val),
-          max_val    = GREATEST(analytics.analytics_agg.max_val, EXCLUDED.max_val),
-          stddev_val = EXCLUDED.stddev_val,
-          p95_val    = EXCLUDED.p95_val,
-          updated_at = NOW();
+          :count_n, :sum_val, :avg_val, :min_val, :max_val, :stddev_val, :p95_val,
+          :m2_val, CAST(:sketch AS JSONB)
+        )""" + _AGG_CONFLICT)
+        self.db.execute(sql, _agg_params(row))
+
+    def upsert_agg_many(self, rows: Iterable[dict]) -> int:
+        """
+        bulk upsert: 1 multi-VALUES statement ต่อ BULK_CHUNK_ROWS แถว
+        conflict semantics เหมือนเรียก upsert_agg ทีละแถวตามลำดับ
+        """
+        rows = _dedupe(rows, AGG_PK, merge_agg_row)
+        cols = _with_series(AGG_COLS, rows)
+        conflict = _AGG_CONFLICT_SERIES if "series_id" in cols else _AGG_CONFLICT
+        for chunk in _chunks(rows, BULK_CHUNK_ROWS):
+            sql = text(f"""
+        INSERT INTO analytics.analytics_agg ({", ".join(cols)})
+        VALUES
+          {_values_sql(cols, len(chunk), {"sketch": "JSONB"})}""" + conflict)
+            self.db.execute(sql, _bind(cols, [_agg_params(r) for r in chunk]))
+        return len(rows)
+
+    def insert_event(self, row: dict):
+        sql = text("""
+        INSERT INTO analytics.analytics_event
+        (time, tenant_id, domain, entity_type, entity_id, event_type, value, unit, severity, payload)
+        VALUES (:time,:tenant_id,:domain,:entity_type,:entity_id,:event_type,
+                :value,:unit,:severity,CAST(:payload AS JSONB))
+        ON CONFLICT DO NOTHING;
         """)
+        self.db.execute(sql, {**row, "payload": _jsonb(row.get("payload"))})
+
+    def insert_events_many(self, rows: Iterable[dict]) -> int:
+        rows = [{**r, "payload": _jsonb(r.get("payload"))} for r in rows]
+        for chunk in _chunks(rows, BULK_CHUNK_ROWS):
+            sql = text(f"""
+        INSERT INTO analytics.analytics_event ({", ".join(EVENT_COLS)})
+        VALUES
+          {_values_sql(EVENT_COLS, len(chunk), {"payload": "JSONB"})}
+        ON CONFLICT DO NOTHING;
+        """)
+            self.db.execute(sql, _bind(EVENT_COLS, chunk))
+        return len(rows)
+
+    def upsert_event_rollup(self, row: dict):
+        sql = text("""
+        INSERT INTO analytics.analytics_event_rollup (
+          bucket_start, window_s, tenant_id, domain, entity_type, entity_id, event_type,
+          count_n, sum_val, avg_val, min_val, max_val
+        ) VALUES (
+          :bucket_start, :window_s, :tenant_id, :domain, :entity_type, :entity_id, :event_type,
+          :count_n, :sum_val, :avg_val, :min_val, :max_val
+        )""" + _ROLLUP_CONFLICT)
         self.db.execute(sql, row)
 
+    def upsert_event_rollup_many(self, rows: Iterable[dict]) -> int:
+        rows = _dedupe(rows, ROLLUP_PK, _merge_rollup_row)
+        for chunk in _chunks(rows, BULK_CHUNK_ROWS):
+            sql = text(f"""
+        INSERT INTO analytics.analytics_event_rollup ({", ".join(ROLLUP_COLS)})
+        VALUES
+          {_values_sql(ROLLUP_COLS, len(chunk))}""" + _ROLLUP_CONFLICT)
+            self.db.execute(sql, _bind(ROLLUP_COLS, chunk))
+        return len(rows)
+
     def insert_anomaly(self, row: dict):
         sql = text("""
         INSERT INTO analytics.analytics_anomaly
@@ -38,3 +250,105 @@ class AnalyticsRepo:
         ON CONFLICT DO NOTHING;
         """)
         self.db.execute(sql, row)
+
+    def insert_anomalies_many(self, rows: Iterable[dict]) -> int:
+        # DO NOTHING → PK ซ้ำภายใน statement เดียวกันได้ ไม่ต้อง dedupe
+        rows = [{**r, "details": _jsonb(r.get("details"))} for r in rows]
+        cols = _with_series(ANOMALY_COLS, rows)
+        for chunk in _chunks(rows, BULK_CHUNK_ROWS):
+            sql = text(f"""
+        INSERT INTO analytics.analytics_anomaly ({", ".join(cols)})
+        VALUES
+          {_values_sql(cols, len(chunk), {"details": "JSONB"})}
+        ON CONFLICT DO NOTHING;
+        """)
+            self.db.execute(sql, _bind(cols, chunk))
+        return len(rows)
+
+    def upsert_kpi_many(self, rows: Iterable[dict]) -> int:
+        """
+        bulk upsert analytics_kpi (แทน INSERT ทีละแถวของ compute_kpi)
+        sensor_id ไม่อยู่ใน PK → แถวที่ชนกันเหลือตัวสุดท้าย เหมือนเขียนทีละแถวตามลำดับ
+        """
+        rows = _dedupe(rows, KPI_PK, lambda cur, new: new)
+        cols = _with_series(KPI_COLS, rows)
+        series = "series_id = COALESCE(EXCLUDED.series_id, analytics.analytics_kpi.series_id)," \
+            if "series_id" in cols else ""
+        for chunk in _chunks(rows, BULK_CHUNK_ROWS):
+            sql = text(f"""
+        INSERT INTO analytics.analytics_kpi ({", ".join(cols)})
+        VALUES
+          {_values_sql(cols, len(chunk))}
+        ON CONFLICT (tenant_id, factory_id, machine_id, metric, period, period_start)
+        DO UPDATE SET
+          n = EXCLUDED.n, mean_val = EXCLUDED.mean_val,
+          stddev_val = EXCLUDED.stddev_val, stddev_within = EXCLUDED.stddev_within,
+          cp = EXCLUDED.cp, cpk = EXCLUDED.cpk, pp = EXCLUDED.pp, ppk = EXCLUDED.ppk,
+          {series}
+          updated_at = NOW();
+        """)
+            self.db.execute(sql, _bind(cols, chunk))
+        return len(rows)
+
+    def ensure_series_many(self, keys: Iterable[tuple]) -> Dict[tuple, int]:
+        """
+        series key (tenant, factory, machine, sensor, metric) → series_id
+        สร้างแถวที่ยังไม่มีใน statement เดียวกัน (DO UPDATE แบบ no-op เพื่อให้ RETURNING คืนแถวเดิมด้วย)
+        """
+        keys = list(dict.fromkeys(keys))  # DO UPDATE แตะแถวเดียวกันซ้ำใน statement เดียวไม่ได้
+        out: Dict[tuple, int] = {}
+        for chunk in _chunks(keys, BULK_CHUNK_ROWS):
+            sql = text(f"""
+        INSERT INTO analytics.analytics_series ({", ".join(SERIES_COLS)})
+        VALUES
+          {_values_sql(SERIES_COLS, len(chunk))}
+        ON CONFLICT (tenant_id, factory_id, machine_id, (COALESCE(sensor_id, '')), metric)
+        DO UPDATE SET metric = EXCLUDED.metric
+        RETURNING series_id, {", ".join(SERIES_COLS)};
+        """)
+            params = _bind(SERIES_COLS, [dict(zip(SERIES_COLS, k)) for k in chunk])
+            for r in self.db.execute(sql, params).mappings():
+                out[tuple(r[c] for c in SERIES_COLS)] = r["series_id"]
+        return out
+
+    def series_by_id(self, ids: Sequence[int]) -> Dict[int, tuple]:
+        if not ids:
+            return {}
+        sql = text(f"""
+        SELECT series_id, {", ".join(SERIES_COLS)} FROM analytics.analytics_series
+        WHERE series_id = ANY(:ids)
+        """)
+        rows = self.db.execute(sql, {"ids": list(ids)}).mappings()
+        return {r["series_id"]: tuple(r[c] for c in SERIES_COLS) for r in rows}
+
+    def insert_raw_many(self, batch: MeasurementBatch) -> int:
+        """
+        measurement ดิบ (AGG_ENGINE=cagg) → RAW_TABLE
+        bind เป็น array ต่อคอลัมน์ + unnest: MeasurementBatch เป็น columnar อยู่แล้ว, เวลาส่งเป็น epoch ms
+        """
+        n = len(batch)
+        if not n:
+            return 0
+        keys = batch.keys
+        self.db.execute(text(f"""
+        INSERT INTO {Config.RAW_TABLE} (time, tenant_id, factory_id, machine_id, sensor_id, metric, value)
+        SELECT to_timestamp(u.t / 1000.0), u.tenant_id, u.factory_id, u.machine_id, u.sensor_id, u.metric, u.value
+        FROM unnest(CAST(:t AS BIGINT[]), CAST(:tenant_id AS TEXT[]), CAST(:factory_id AS TEXT[]),
+                    CAST(:machine_id AS TEXT[]), CAST(:sensor_id AS TEXT[]), CAST(:metric AS TEXT[]),
+                    CAST(:value AS DOUBLE PRECISION[]))
+             AS u(t, tenant_id, factory_id, machine_id, sensor_id, metric, value);
+        """), {
+            "t": batch.times,
+            "tenant_id": [k[0] for k in keys], "factory_id": [k[1] for k in keys],
+            "machine_id": [k[2] for k in keys], "sensor_id": [k[3] for k in keys],
+            "metric": [k[4] for k in keys], "value": batch.values,
+        })
+        return n
+
+
+def make_repo(db: Session) -> AnalyticsRepo:
+    """repo ของ worker ตาม WRITE_ADAPTER: session (multi-VALUES ผ่าน Session) | pipeline (psycopg3 pipeline mode)"""
+    if Config.WRITE_ADAPTER == "pipeline":
+        from app.adapters.pg_pipeline import PipelineRepo
+        return PipelineRepo(db)
+    return AnalyticsRepo(db)
@@ -1,6 +1,13 @@
 # app/v1/endpoint.py
-from fastapi import APIRouter, Response
+from datetime import datetime, timezone
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from app.config import Config
 from app.instrumentation.metrics import metrics_response
+from app.pipelines.registry import dispatch
+from app.workers.pool import get_pool, reload_registry
 
 router = APIRouter(prefix="/v1")
 
@@ -13,4 +20,124 @@ def metrics():
     body, code, headers = metrics_response()
     return Response(content=body, status_code=code, media_type=headers["Content-Type"])
 
+@router.get("/workers")
+def workers():
+    """สถานะ worker pool ราย child (ว่างถ้ารันแบบ thread เดียว)"""
+    pool = get_pool()
+    return {"mode": "pool" if pool else "thread", "children": pool.status() if pool else []}
 
+@router.get("/admin/registry")
+def registry_status():
+    """dispatch table ที่ active อยู่ (domain/topic/handler แบบ batch native)"""
+    return dispatch().describe()
+
+# ---- registry reload + backfill (ADMIN_API_ENABLED=1 เท่านั้น — ปิดอยู่ route ไม่ถูกลงทะเบียนเลย) ----
+if Config.ADMIN_API_ENABLED:
+    @router.post("/admin/registry/reload")
+    def registry_reload():
+        """อ่าน DOMAINS_ENABLED (.env) ใหม่แล้ว compile dispatch table; worker subscribe ใหม่ถ้า topic เปลี่ยน"""
+        return reload_registry().describe()
+
+    # backfill ใช้ connection จาก pool เดียวกับ API/worker
+    from app.workers.backfill import BackfillJob, get_job, list_jobs, start_job
+
+    class BackfillRequest(BaseModel):
+        start: datetime
+        end: datetime
+        windows: Optional[List[int]] = None
+        tenant_id: Optional[str] = None
+        factory_id: Optional[str] = None
+        machine_id: Optional[str] = None
+        metric: Optional[str] = None
+        cascade: bool = True
+        parallel: Optional[int] = None
+        chunk_s: Optional[int] = None
+        job_id: Optional[str] = None
+
+    @router.post("/admin/backfill", status_code=202)
+    def backfill_start(req: BackfillRequest):
+        """เริ่ม backfill analytics_agg แบบ chunk/ขนาน/resume ได้ (รันพื้นหลัง) — job_id เดิม = ต่อจาก checkpoint"""
+        if req.end <= req.start:
+            raise HTTPException(status_code=400, detail="end must be after start")
+        if req.parallel is not None and not 1 <= req.parallel <= Config.BACKFILL_PARALLEL:
+            raise HTTPException(status_code=400, detail=f"parallel must be in [1, {Config.BACKFILL_PARALLEL}] "
+                                                        "(BACKFILL_PARALLEL)")
+        return start_job(BackfillJob(**req.model_dump())).status()
+
+    @router.get("/admin/backfill")
+    def backfill_jobs():
+        return list_jobs()
+
+    @router.get("/admin/backfill/{job_id}")
+    def backfill_status(job_id: str):
+        job = get_job(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="unknown job")
+        return job.status()
+
+# ---- profiling (PROFILING_ENABLED=1 เท่านั้น — ปิดอยู่ route ไม่ถูกลงทะเบียนเลย) ----
+if Config.PROFILING_ENABLED:
+    from app.instrumentation import profiling
+
+    def _in_process_worker():
+        if get_pool() is not None:
+            raise HTTPException(status_code=409, detail="WORKER_PROCESSES>1: worker runs in child processes "
+                                                        "(profile a child with py-spy)")
+
+    def _attachment(body, media_type: str, ext: str) -> Response:
+        name = f"analytics-worker-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.{ext}"
+        return Response(content=body, media_type=media_type,
+                        headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+    @router.get("/admin/profile")
+    def profile(seconds: float = 10.0, mode: str = "sample", fmt: Optional[str] = Query(None, alias="format"),
+                hz: Optional[float] = None, sort: str = "cumulative"):
+        """
+        profile stream worker thread นาน seconds วินาที
+        mode=sample (ค่าเริ่มต้น): format=collapsed → stack สำหรับ speedscope/flamegraph.pl, format=text → self/total ต่อ frame
+        mode=cprofile: format=pstats → ไฟล์ pstats (snakeviz / pstats.Stats), format=text → print_stats ตาม sort
+        """
+        _in_process_worker()
+        if not 0 < seconds <= Config.PROFILE_MAX_S:
+            raise HTTPException(status_code=400, detail=f"seconds must be in (0, {Config.PROFILE_MAX_S}]")
+        try:
+            if mode == "sample":
+                stacks, _ = profiling.sample_threads(seconds, hz)
+                if not stacks:
+                    raise HTTPException(status_code=409, detail="no analytics-stream-* thread is running")
+                if fmt == "text":
+                    return PlainTextResponse(profiling.top_frames(stacks))
+                if fmt not in (None, "collapsed"):
+                    raise HTTPException(status_code=400, detail="format must be collapsed or text")
+                return _attachment(profiling.collapsed(stacks), "text/plain", "collapsed")
+            if mode == "cprofile":
+                st, thread = profiling.profile_worker(seconds)
+                if fmt == "text":
+                    return PlainTextResponse(f"thread {thread}\n" + profiling.pstats_text(st, sort))
+                if fmt not in (None, "pstats"):
+                    raise HTTPException(status_code=400, detail="format must be pstats or text")
+                return _attachment(profiling.pstats_bytes(st), "application/octet-stream", "pstats")
+        except profiling.ProfileBusy as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except profiling.ProfileTimeout as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        raise HTTPException(status_code=400, detail="mode must be sample or cprofile")
+
+    @router.post("/admin/tracemalloc/start")
+    def tracemalloc_start(frames: int = 1):
+        """เริ่ม trace allocation (ถ้ายังไม่เริ่ม) และตั้ง baseline ของ diff เป็นตอนนี้"""
+        return profiling.tracemalloc_start(max(1, frames))
+
+    @router.get("/admin/tracemalloc")
+    def tracemalloc_diff(limit: int = 30, key_type: str = "lineno", reset: bool = False):
+        """allocation ที่โตขึ้นเทียบ baseline (key_type: lineno | filename | traceback), reset=true → ตั้ง baseline ใหม่"""
+        if key_type not in ("lineno", "filename", "traceback"):
+            raise HTTPException(status_code=400, detail="key_type must be lineno, filename or traceback")
+        try:
+            return profiling.tracemalloc_diff(limit, key_type, reset)
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+    @router.post("/admin/tracemalloc/stop")
+    def tracemalloc_stop():
+        return profiling.tracemalloc_stop()
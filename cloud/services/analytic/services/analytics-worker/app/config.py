@@ -18,6 +18,10 @@ def _find_dotenv() -> Path:
 
 load_dotenv(_find_dotenv())
 
+def reload_dotenv() -> None:
+    """อ่าน .env ซ้ำ (override) — ใช้ตอน reload ค่าที่อ่านแบบ runtime เช่น DOMAINS_ENABLED"""
+    load_dotenv(_find_dotenv(), override=True)
+
 def _get_list(key: str, default: List[str] | List[int]):
     """
     รองรับทั้ง JSON list และ comma-separated
@@ -42,6 +46,9 @@ def _get_list(key: str, default: List[str] | List[int]):
 def _env(key: str, default: str) -> str:
     return os.getenv(key, default)
 
+def _flag(key: str, default: str = "0") -> bool:
+    return os.getenv(key, default).strip().lower() in ("1", "true", "yes", "on")
+
 # ---------- config ----------
 class Config:
     # Identity
@@ -79,6 +86,78 @@ class Config:
     # Aggregation windows (seconds)
     WINDOWS: List[int] = _get_list("WINDOWS", [60, 300, 3600])
 
+    # JSON decoder: auto (msgspec schema → orjson → json) | stdlib
+    DECODER: str = _env("DECODER", "auto")
+
+    # Aggregation engine: python | numpy | cascade (raw ลง window ละเอียดสุด แล้วรวมขึ้น window หยาบ)
+    #   | cagg (worker เขียน raw อย่างเดียว → rollup โดย continuous aggregate: cloud/db/080_analytics_cagg.sql)
+    AGG_ENGINE: str = _env("AGG_ENGINE", "python")
+    # ตาราง raw measurement (backfill อ่าน, AGG_ENGINE=cagg เขียน)
+    RAW_TABLE: str = _env("RAW_TABLE", "sensors.device_readings")
+
+    # Pre-aggregation buffer (สะสม partial aggregate ข้าม batch ก่อน upsert)
+    AGG_BUFFER_ENABLED: bool = _flag("AGG_BUFFER_ENABLED", "0")
+    AGG_BUFFER_MAX_KEYS: int = int(_env("AGG_BUFFER_MAX_KEYS", "50000"))
+    AGG_BUFFER_MAX_AGE_S: float = float(_env("AGG_BUFFER_MAX_AGE_S", "60"))
+    AGG_BUFFER_GRACE_S: float = float(_env("AGG_BUFFER_GRACE_S", "5"))
+
+    # Streaming anomaly detection (WE-1..4 ราย series ระหว่าง consume)
+    ANOMALY_STREAM_ENABLED: bool = _flag("ANOMALY_STREAM_ENABLED", "0")
+    ANOMALY_MAX_SERIES: int = int(_env("ANOMALY_MAX_SERIES", "100000"))
+    ANOMALY_IDLE_TTL_S: float = float(_env("ANOMALY_IDLE_TTL_S", "3600"))
+    ANOMALY_WARMUP_N: int = int(_env("ANOMALY_WARMUP_N", "30"))       # จุดขั้นต่ำก่อนเริ่มตรวจ
+    ANOMALY_BASELINE_N: int = int(_env("ANOMALY_BASELINE_N", "500"))  # ความยาว rolling ของ CL/σ โดยประมาณ
+
+    # Staged pipeline: decode/map → aggregate → write คนละ thread (queue จำกัดขนาด)
+    WORKER_PIPELINE: bool = _flag("WORKER_PIPELINE", "0")
+    PIPELINE_MAX_INFLIGHT: int = int(_env("PIPELINE_MAX_INFLIGHT", "4"))  # batch ที่ยังไม่ commit ก่อน pause
+
+    # batch ที่เขียน DB ไม่สำเร็จ: เขียนซ้ำแบบ backoff 1, 2, 4, ... วินาที สูงสุดเท่านี้ (offset ยังไม่ถูก commit ระหว่างนั้น)
+    WRITE_RETRY_MAX_S: float = float(_env("WRITE_RETRY_MAX_S", "30"))
+    # แถว agg ที่ PipelineRepo แยกได้ว่าผิดเอง (data/constraint error) เขียนไม่ผ่านครบกี่ flush → dead-letter (log + metric)
+    AGG_DEAD_LETTER_ATTEMPTS: int = int(_env("AGG_DEAD_LETTER_ATTEMPTS", "5"))
+
+    # Write adapter ของ worker: session = multi-VALUES ผ่าน SQLAlchemy Session | pipeline = psycopg3 pipeline mode
+    # + prepared statement ราย statement (app/adapters/pg_pipeline.py, error แยกราย statement)
+    WRITE_ADAPTER: str = _env("WRITE_ADAPTER", "session").strip().lower()
+
+    # Series dictionary: เขียน series_id ลง agg/anomaly (ต้องรัน cloud/db/077_analytics_series.sql ก่อน)
+    SERIES_IDS_ENABLED: bool = _flag("SERIES_IDS_ENABLED", "0")
+    SERIES_CACHE_SIZE: int = int(_env("SERIES_CACHE_SIZE", "200000"))
+
+    # Backfill runner (app/workers/backfill.py): chunk ขนานกันกี่ตัว (= เพดานของ parallel ที่ขอได้, 1 connection ต่อ chunk
+    # จาก pool เดียวกับ API/worker ขนาด 10+20 → ตั้งให้ต่ำกว่านั้นมาก) + ขนาด chunk ถ้า raw ไม่ใช่ hypertable
+    BACKFILL_PARALLEL: int = int(_env("BACKFILL_PARALLEL", "2"))
+    BACKFILL_CHUNK_S: int = int(_env("BACKFILL_CHUNK_S", "86400"))
+
+    # KPI job (compute_kpi_incremental, ต้องรัน cloud/db/081_analytics_kpi_watermarks.sql):
+    # ย้อนอ่านซ้อน high-water mark กี่วินาที (tx ที่ค้างนาน), สแกน agg ย้อนหลังสุดกี่วัน, ช่วงที่ cagg ยัง refresh
+    KPI_WATERMARK_LAG_S: int = int(_env("KPI_WATERMARK_LAG_S", "300"))
+    KPI_LOOKBACK_DAYS: int = int(_env("KPI_LOOKBACK_DAYS", "35"))
+    KPI_CAGG_REFRESH_S: int = int(_env("KPI_CAGG_REFRESH_S", str(3 * 86400)))
+
+    # Spec/control limits (analytics_spec_limits): resolver กลางของ KPI + stream anomaly, โหลดใหม่ทุก TTL
+    SPEC_LIMITS_ENABLED: bool = _flag("SPEC_LIMITS_ENABLED", "1")
+    SPEC_CACHE_TTL_S: float = float(_env("SPEC_CACHE_TTL_S", "300"))
+
+    # Scheduler: job รันที่ replica เดียวต่อรอบ (advisory lock + cloud/db/084_scheduler_runs.sql), 0 = รันทุก replica แบบเดิม
+    SCHEDULER_COORDINATION: bool = _flag("SCHEDULER_COORDINATION", "1")
+
+    # Admin API ที่เริ่มงานหนัก/เปลี่ยนสถานะ worker (/v1/admin/registry/reload, /v1/admin/backfill*): 0 = ไม่มี route
+    # (reload ยังทำได้ด้วย SIGHUP)
+    ADMIN_API_ENABLED: bool = _flag("ADMIN_API_ENABLED", "0")
+
+    # Profiling (/v1/admin/profile, /v1/admin/tracemalloc/*): 0 = ไม่มี route และ worker ไม่มี hook
+    PROFILING_ENABLED: bool = _flag("PROFILING_ENABLED", "0")
+    PROFILE_MAX_S: float = float(_env("PROFILE_MAX_S", "60"))
+    PROFILE_SAMPLE_HZ: float = float(_env("PROFILE_SAMPLE_HZ", "100"))
+
+    # Metrics: รอบการคำนวณ consumer lag ราย partition (ถาม broker → ไม่ทำทุก batch)
+    LAG_INTERVAL_S: float = float(_env("LAG_INTERVAL_S", "15"))
+
+    # จำนวน consumer process (1 = thread เดียวใน process API แบบเดิม, >1 = worker pool)
+    WORKER_PROCESSES: int = int(_env("WORKER_PROCESSES", "1"))
+
     # API
     API_HOST: str = _env("API_HOST", "0.0.0.0")
     API_PORT: int = int(_env("ANALYTICS_WORKER_PORT", "7304"))
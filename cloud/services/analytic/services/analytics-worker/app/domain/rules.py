@@ -1,8 +1,29 @@
 # app\domain\rules.py
+"""
+Western Electric / Nelson rules บน NumPy
+
+ทุกกติกาเป็น "นับจำนวนจุดที่เข้าเงื่อนไขในหน้าต่าง w จุดล่าสุด" → ทำด้วย cumsum ของ mask
+(side / sigma-zone) ครั้งเดียวต่อ series: O(n) ไม่ต้อง slice หน้าต่างทีละ index
+
+  WE-1  1 จุดเลย 3σ
+  WE-2  2 จาก 3 จุดเลย 2σ ฝั่งเดียวกัน
+  WE-3  4 จาก 5 จุดเลย 1σ ฝั่งเดียวกัน
+  WE-4  8 จุดติดกันอยู่ฝั่งเดียวของ CL
+  N-3   6 จุดเพิ่มขึ้น/ลดลงต่อเนื่อง (trend — Nelson #3)
+  N-4   14 จุดขึ้น-ลงสลับกัน (alternation — Nelson #4)
+  N-7   15 จุดติดกันอยู่ภายใน 1σ (stratification — Nelson #7)
+  N-8   8 จุดติดกันไม่มีจุดใดอยู่ภายใน 1σ และมีทั้งสองฝั่ง (mixture — Nelson #8)
+
+index ของ hit = จุดสุดท้ายของหน้าต่าง
+รหัส N-x ตามเลข Nelson (Nelson #1, #2, #5, #6 ซ้ำกับ WE-1, WE-4, WE-2, WE-3 จึงไม่มีแยก)
+evaluate() ค่าเริ่มต้นยังเป็น WE-1..4 เหมือนเดิม — Nelson ต้องเลือกเองด้วย rules=ALL_RULES / NELSON_RULES
+"""
 
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import List, Sequence, Optional
+from typing import Callable, Dict, List, Sequence, Optional, Tuple
+
+import numpy as np
 
 @dataclass
 class RuleHit:
@@ -10,64 +31,103 @@ class RuleHit:
     code: str
     detail: Optional[dict] = None
 
-def _side(v: float, cl: float) -> int:
-    if v > cl: return 1
-    if v < cl: return -1
-    return 0
+def _arr(values: Sequence[float]) -> np.ndarray:
+    return np.asarray(values, dtype=np.float64)
+
+def _count(mask: np.ndarray, w: int) -> np.ndarray:
+    """จำนวน True ในหน้าต่าง w จุดที่จบที่ index i (i = w-1 .. n-1)"""
+    c = np.concatenate(([0], np.cumsum(mask, dtype=np.int64)))
+    return c[w:] - c[:-w]
+
+def _hits(v: np.ndarray, cond: np.ndarray, w: int, code: str) -> List[RuleHit]:
+    # cond จัดตำแหน่งตาม _count (ตัวแรกคือ index w-1)
+    idx = (np.flatnonzero(cond) + (w - 1)).tolist()
+    if not idx:
+        return []
+    vl = v.tolist()  # slice list เร็วกว่า slice ndarray แล้ว tolist ทีละ hit
+    return [RuleHit(i, code, {"window": vl[i-w+1:i+1]}) for i in idx]
+
+def _same_side(v: np.ndarray, cl: float, thr: float, w: int, k: int) -> np.ndarray:
+    """k จาก w จุดเลย ±thr และทุกจุดที่เลยอยู่ฝั่งเดียวกัน"""
+    hi = _count(v > cl + thr, w)
+    lo = _count(v < cl - thr, w)
+    return ((hi >= k) & (lo == 0)) | ((lo >= k) & (hi == 0))
 
 def we1(values: Sequence[float], cl: float, std: float) -> List[RuleHit]:
     """Western Electric #1: ค่าเกิน 3σ"""
     if std <= 0:
         return []
+    v = _arr(values)
     ucl, lcl = cl + 3*std, cl - 3*std
-    return [RuleHit(i, "WE-1", {"ucl": ucl, "lcl": lcl, "v": v})
-            for i, v in enumerate(values) if (v > ucl or v < lcl)]
+    out = (v > ucl) | (v < lcl)
+    return [RuleHit(i, "WE-1", {"ucl": ucl, "lcl": lcl, "v": x})
+            for i, x in zip(np.flatnonzero(out).tolist(), v[out].tolist())]
 
 def we2(values: Sequence[float], cl: float, std: float) -> List[RuleHit]:
     """WE-2: 2 จาก 3 จุดอยู่เลย 2σ ฝั่งเดียวกัน"""
     if std <= 0 or len(values) < 3: return []
-    thr_hi, thr_lo = cl + 2*std, cl - 2*std
-    hits: List[RuleHit] = []
-    for i in range(2, len(values)):
-        window = values[i-2:i+1]
-        s = [_side(v, cl) for v in window]
-        over2 = [v for v in window if (v > thr_hi or v < thr_lo)]
-        same_side = len(set([_side(v, cl) for v in over2])) <= 1 if over2 else False
-        if len(over2) >= 2 and same_side:
-            hits.append(RuleHit(i, "WE-2", {"window": window}))
-    return hits
+    v = _arr(values)
+    return _hits(v, _same_side(v, cl, 2*std, 3, 2), 3, "WE-2")
 
 def we3(values: Sequence[float], cl: float, std: float) -> List[RuleHit]:
     """WE-3: 4 จาก 5 จุดเลย 1σ ฝั่งเดียวกัน"""
     if std <= 0 or len(values) < 5: return []
-    thr_hi, thr_lo = cl + 1*std, cl - 1*std
-    out: List[RuleHit] = []
-    for i in range(4, len(values)):
-        window = values[i-4:i+1]
-        over1 = [v for v in window if (v > thr_hi or v < thr_lo)]
-        if len(over1) >= 4:
-            if len(set([_side(v, cl) for v in over1])) == 1:
-                out.append(RuleHit(i, "WE-3", {"window": window}))
-    return out
+    v = _arr(values)
+    return _hits(v, _same_side(v, cl, 1*std, 5, 4), 5, "WE-3")
 
 def we4(values: Sequence[float], cl: float, std: float) -> List[RuleHit]:
-    """WE-4: 8 จุดติดกันอยู่ฝั่งเดียวของ CL"""
+    """WE-4: 8 จุดติดกันอยู่ฝั่งเดียวของ CL (จุดที่เท่ากับ CL ไม่ทำให้หลุด แต่ต้องมีอย่างน้อย 1 จุดไม่เท่ากับ CL)"""
     if len(values) < 8: return []
-    out: List[RuleHit] = []
-    for i in range(7, len(values)):
-        window = values[i-7:i+1]
-        s = [_side(v, cl) for v in window]
-        if all(x >= 0 for x in s) or all(x <= 0 for x in s):
-            if any(x != 0 for x in s):  # มีอย่างน้อย 1 จุดไม่เท่ากับ CL
-                out.append(RuleHit(i, "WE-4", {"window": window}))
-    return out
-
-def evaluate(values: Sequence[float], cl: float, std: float) -> List[RuleHit]:
-    """รวมกติกาหลัก ๆ; สามารถเพิ่ม Nelson rules ได้ในอนาคต"""
+    v = _arr(values)
+    above, below = _count(v > cl, 8), _count(v < cl, 8)
+    return _hits(v, ((below == 0) & (above > 0)) | ((above == 0) & (below > 0)), 8, "WE-4")
+
+def n3(values: Sequence[float], cl: float, std: float) -> List[RuleHit]:
+    """N-3: 6 จุดเพิ่มขึ้นหรือลดลงต่อเนื่อง (5 ช่วงต่างติดกันเป็นบวกทั้งหมด/ลบทั้งหมด)"""
+    if len(values) < 6: return []
+    v = _arr(values)
+    d = np.diff(v)
+    cond = (_count(d > 0, 5) == 5) | (_count(d < 0, 5) == 5)
+    # หน้าต่าง diff 5 ตัวที่จบที่ d[j] ↔ จุดสุดท้าย v[j+1] → ตำแหน่งเดียวกับหน้าต่าง 6 จุด
+    return _hits(v, cond, 6, "N-3")
+
+def n4(values: Sequence[float], cl: float, std: float) -> List[RuleHit]:
+    """N-4: 14 จุดขึ้น-ลงสลับกัน (13 ช่วงต่างที่เครื่องหมายสลับทุกคู่)"""
+    if len(values) < 14: return []
+    v = _arr(values)
+    s = np.sign(np.diff(v))
+    alt = (s[1:] * s[:-1]) < 0
+    return _hits(v, _count(alt, 12) == 12, 14, "N-4")
+
+def n7(values: Sequence[float], cl: float, std: float) -> List[RuleHit]:
+    """N-7: 15 จุดติดกันอยู่ภายใน 1σ (ทั้งสองฝั่งของ CL)"""
+    if std <= 0 or len(values) < 15: return []
+    v = _arr(values)
+    return _hits(v, _count(np.abs(v - cl) < std, 15) == 15, 15, "N-7")
+
+def n8(values: Sequence[float], cl: float, std: float) -> List[RuleHit]:
+    """N-8: 8 จุดติดกันอยู่นอก 1σ ทั้งหมด และมีทั้งฝั่งบนและล่าง"""
+    if std <= 0 or len(values) < 8: return []
+    v = _arr(values)
+    hi, lo = _count(v > cl + std, 8), _count(v < cl - std, 8)
+    return _hits(v, (hi + lo == 8) & (hi > 0) & (lo > 0), 8, "N-8")
+
+Rule = Callable[[Sequence[float], float, float], List[RuleHit]]
+
+WE_RULES: Tuple[Rule, ...] = (we1, we2, we3, we4)
+NELSON_RULES: Tuple[Rule, ...] = (n3, n4, n7, n8)
+ALL_RULES: Tuple[Rule, ...] = WE_RULES + NELSON_RULES
+RULES: Dict[str, Rule] = {
+    "WE-1": we1, "WE-2": we2, "WE-3": we3, "WE-4": we4,
+    "N-3": n3, "N-4": n4, "N-7": n7, "N-8": n8,
+}
+
+def evaluate(values: Sequence[float], cl: float, std: float,
+             rules: Sequence[Rule] = WE_RULES) -> List[RuleHit]:
+    """รวมกติกา WE-1..4 (ค่าเริ่มต้น เหมือนเดิม); เพิ่ม Nelson N-3/N-4/N-7/N-8 ได้ด้วย rules=ALL_RULES"""
+    v = _arr(values)  # แปลงครั้งเดียว ส่งต่อให้ทุกกติกา
     hits = []
-    hits += we1(values, cl, std)
-    hits += we2(values, cl, std)
-    hits += we3(values, cl, std)
-    hits += we4(values, cl, std)
-    # เรียงตาม index เพื่อ deterministic
+    for rule in rules:
+        hits += rule(v, cl, std)
+    # เรียงตาม index เพื่อ deterministic (stable → ลำดับกติกาใน index เดียวกันคงเดิม)
     return sorted(hits, key=lambda h: h.index)
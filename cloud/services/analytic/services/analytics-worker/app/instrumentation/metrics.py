@@ -1,10 +1,95 @@
 # app/instrumentation/metrics.py
+"""
+Prometheus metrics ของ API + worker
 
-from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+WORKER_PROCESSES>1: metric ของ hot path อยู่ใน child process → ใช้ multiprocess mode ของ prometheus_client
+  - ตั้ง PROMETHEUS_MULTIPROC_DIR (temp dir ใหม่ต่อการรัน) ก่อน import prometheus_client ครั้งแรก
+    → ทุก process (parent + child ที่ spawn ทีหลังและได้ env นี้ไป) เขียนค่าลงไฟล์ mmap ราย pid
+  - /v1/metrics รวมไฟล์ทุก pid ด้วย MultiProcessCollector (counter/histogram ของ child ที่ตายแล้วยังนับอยู่)
+  - supervisor เรียก mark_process_dead() เมื่อ child ตาย → gauge แบบ live* ของ pid นั้นหายไป
+  - Gauge ต้องเลือก multiprocess_mode (ดูแต่ละตัว); metric process_* / python_* ของ default collector ไม่มีในโหมดนี้
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+
+from app.config import Config
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR is None and Config.WORKER_PROCESSES > 1:
+    MULTIPROC_DIR = os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="aw-prometheus-")
+    atexit.register(shutil.rmtree, MULTIPROC_DIR, ignore_errors=True)
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST, \
+    multiprocess  # noqa: E402 — ต้อง import หลังตั้ง PROMETHEUS_MULTIPROC_DIR
+
+ingested = Counter("aw_ingested_msgs", "Messages ingested", ["topic"])
+# multiprocess: partition ย้าย child ได้ (rebalance) → ค่าที่เขียนล่าสุดจาก process ที่ยังอยู่ชนะ
+lag = Gauge("aw_consumer_lag", "Consumer lag: high watermark - committed offset", ["topic", "partition"],
+            multiprocess_mode="livemostrecent")
+proc_time = Histogram("aw_proc_time_seconds", "Batch processing time (consume → commit)")
+
+# hot path ของ stream worker (นับราย batch ไม่ใช่ราย record → overhead ต่ำ)
+decode_errors = Counter("aw_decode_errors", "Messages that failed to decode", ["topic"])
+mapper_errors = Counter("aw_mapper_errors", "Records skipped by mapper", ["topic"])
+mapped_records = Counter("aw_mapped_records", "Records produced by mapper", ["topic", "kind"])
+rows_written = Counter("aw_rows_written", "Rows written to DB", ["table"])
+write_errors = Counter("aw_write_errors", "Failed bulk writes (batch continues)", ["table"])
+write_retries = Counter("aw_write_retries", "Batch writes retried after a DB error (offsets stay uncommitted)")
+dead_letter_rows = Counter("aw_dead_letter_rows", "Rows dropped after failing AGG_DEAD_LETTER_ATTEMPTS writes", ["table"])
+stage_time = Histogram("aw_stage_seconds", "Per-batch latency of each worker stage", ["stage"],
+                       buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+batch_size = Gauge("aw_batch_size", "Messages in the last consumed batch", multiprocess_mode="liveall")
+
+# backfill runner (chunk ละ transaction)
+backfill_chunks = Counter("aw_backfill_chunks", "Backfill chunks finished", ["status"])
+backfill_rows = Counter("aw_backfill_rows", "analytics_agg rows written by backfill")
+backfill_chunk_time = Histogram("aw_backfill_chunk_seconds", "Backfill time per chunk",
+                                buckets=(.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800))
+
+# KPI job (scheduler): full = ยังไม่มี high-water mark, incremental = เฉพาะ period ที่ agg เปลี่ยน
+kpi_runs = Counter("aw_kpi_runs", "KPI job runs", ["mode"])
+kpi_rows = Counter("aw_kpi_rows", "analytics_kpi rows upserted by the KPI job")
+kpi_run_time = Histogram("aw_kpi_run_seconds", "KPI job duration", ["mode"],
+                         buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+
+# spec/control limits resolver (interval index ใน memory, โหลดใหม่ทุก SPEC_CACHE_TTL_S)
+spec_lookups = Counter("aw_spec_lookups", "Spec-limit lookups", ["result"])
+spec_refresh = Counter("aw_spec_refresh", "Spec-limit table reloads", ["status"])
+spec_entries = Gauge("aw_spec_entries", "Spec-limit intervals held in memory", multiprocess_mode="livemax")
+
+# scheduler: job รันที่ replica เดียวต่อรอบ (advisory lock + scheduler_runs)
+sched_runs = Counter("aw_sched_runs", "Scheduled job fires by outcome (ok/error/locked/done_elsewhere)",
+                     ["job", "status"])
+sched_run_time = Histogram("aw_sched_run_seconds", "Scheduled job run duration (runs on this replica)", ["job"],
+                           buckets=(.1, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+sched_running = Gauge("aw_sched_running", "Scheduled job runs in progress on this replica", ["job"],
+                      multiprocess_mode="livesum")
+sched_last_success = Gauge("aw_sched_last_success_ts", "Unix time of last successful run on this replica", ["job"],
+                           multiprocess_mode="livemax")
+
+# worker pool (WORKER_PROCESSES > 1): สถิติราย child process (supervisor ใน parent เป็นผู้ set)
+pool_child_up = Gauge("aw_pool_child_up", "Worker child process alive (1/0)", ["child"], multiprocess_mode="livemax")
+pool_child_restarts = Counter("aw_pool_child_restarts", "Worker child restarts", ["child"])
+pool_child_msgs = Gauge("aw_pool_child_msgs", "Messages processed by worker child", ["child"],
+                        multiprocess_mode="livemax")
+pool_child_batches = Gauge("aw_pool_child_batches", "Batches processed by worker child", ["child"],
+                           multiprocess_mode="livemax")
+pool_child_last_batch = Gauge("aw_pool_child_last_batch_ts", "Unix time of last batch in worker child", ["child"],
+                              multiprocess_mode="livemax")
+
+
+def mark_process_dead(pid: int) -> None:
+    """child ของ pool ตาย → ลบไฟล์ gauge แบบ live* ของ pid นั้น (counter/histogram ยังถูกรวมต่อ)"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid, MULTIPROC_DIR)
 
-ingested = Counter("aw_ingested_msgs", "Messages ingested")
-lag = Gauge("aw_consumer_lag", "Consumer lag (approx)")
-proc_time = Histogram("aw_proc_time_seconds", "Batch processing time")
 
 def metrics_response():
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, MULTIPROC_DIR)
+        return generate_latest(registry), 200, {"Content-Type": CONTENT_TYPE_LATEST}
     return generate_latest(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
@@ -0,0 +1,237 @@
+# app/instrumentation/profiling.py
+"""
+Profile worker ที่รันอยู่โดยไม่ต้อง attach py-spy (PROFILING_ENABLED=1 เท่านั้น)
+
+- sample_threads(): sampling profiler — thread แยกอ่าน sys._current_frames() ของ thread เป้าหมาย
+  (ค่าเริ่มต้น analytics-stream-* = stream worker + stage ของ WORKER_PIPELINE) ที่ PROFILE_SAMPLE_HZ
+  → stack แบบ collapsed ("thread;f1;f2 count") เปิดด้วย speedscope / flamegraph.pl ได้ตรง ๆ
+  ไม่ต้องให้ worker ร่วมมือ และไม่มี overhead ใน thread ของ worker (นอกจาก GIL ตอน sample)
+- profile_worker(): cProfile (deterministic) ของ thread ที่วน consume — cProfile ของ 3.11 ผูกกับ thread
+  ที่เรียก enable() → worker เรียก checkpoint() ทุกรอบ loop แล้วเปิด/ปิด profiler ในตัวเอง
+  (WORKER_PIPELINE=1: ได้เฉพาะ thread ของ consumer — ดู stage อื่นด้วย sample)
+- tracemalloc: start → snapshot diff เทียบ baseline (หา memory ที่โตขึ้น) → stop
+  trace เฉพาะช่วงที่ start ไว้ (มี overhead ทุก allocation ระหว่างนั้น)
+
+ครอบเฉพาะ process นี้: WORKER_PROCESSES>1 worker อยู่ใน child process → endpoint ตอบ 409
+"""
+
+from __future__ import annotations
+
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.config import Config
+
+WORKER_THREADS = ("analytics-stream",)
+
+# กัน profile ซ้อนกัน (sample / cProfile ทีละงาน)
+_busy = threading.Lock()
+
+
+class ProfileBusy(Exception):
+    pass
+
+
+class ProfileTimeout(Exception):
+    pass
+
+
+def _label(code) -> str:
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _targets(prefixes: Sequence[str]) -> Dict[int, str]:
+    me = threading.get_ident()
+    return {t.ident: t.name for t in threading.enumerate()
+            if t.ident != me and t.name.startswith(tuple(prefixes))}
+
+
+def sample_threads(seconds: float, hz: float = None, prefixes: Sequence[str] = WORKER_THREADS) -> Tuple[Counter, int]:
+    """(stack ของแต่ละ sample → จำนวน, จำนวนรอบที่ sample) — stack = (thread, frame นอกสุด, ..., frame ในสุด)"""
+    if not _busy.acquire(blocking=False):
+        raise ProfileBusy("another profile is running")
+    try:
+        interval = 1.0 / (hz or Config.PROFILE_SAMPLE_HZ)
+        stacks: Counter = Counter()
+        labels: Dict[object, str] = {}  # code object → label (ไม่สร้าง string ซ้ำทุก sample)
+        ticks = 0
+        end = time.monotonic() + seconds
+        targets = _targets(prefixes)
+        while time.monotonic() < end:
+            frames = sys._current_frames()
+            for ident, name in targets.items():
+                f = frames.get(ident)
+                stack: List[str] = []
+                while f is not None:
+                    code = f.f_code
+                    lab = labels.get(code)
+                    if lab is None:
+                        lab = labels[code] = _label(code)
+                    stack.append(lab)
+                    f = f.f_back
+                if stack:
+                    stack.append(name)
+                    stacks[tuple(reversed(stack))] += 1
+            ticks += 1
+            if ticks % 100 == 0:
+                targets = _targets(prefixes)  # thread ใหม่ (เช่น worker restart)
+            time.sleep(interval)
+        return stacks, ticks
+    finally:
+        _busy.release()
+
+
+def collapsed(stacks: Counter) -> str:
+    return "".join(f"{';'.join(s)} {n}\n" for s, n in sorted(stacks.items()))
+
+
+def top_frames(stacks: Counter, limit: int = 40) -> str:
+    """ตาราง self/total ต่อ frame จาก sample (คล้าย py-spy top)"""
+    own: Counter = Counter()
+    total: Counter = Counter()
+    n = sum(stacks.values()) or 1
+    for s, c in stacks.items():
+        own[s[-1]] += c
+        for lab in set(s[1:]):
+            total[lab] += c
+    out = io.StringIO()
+    out.write(f"{n} samples\n{'self%':>7}{'total%':>8}  frame\n")
+    for lab, c in sorted(total.items(), key=lambda x: (-own[x[0]], -x[1]))[:limit]:
+        out.write(f"{own[lab] / n:>7.1%}{c / n:>8.1%}  {lab}\n")
+    return out.getvalue()
+
+
+class _Request:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.profiler: Optional[cProfile.Profile] = None
+        self.thread: Optional[str] = None
+        self.ends = 0.0
+        self.cancelled = False
+        self.done = threading.Event()
+
+
+_pending: Optional[_Request] = None
+_req_lock = threading.Lock()  # เริ่ม profiler (worker) กับยกเลิก (endpoint) ไม่ให้ชนกัน
+
+
+def checkpoint() -> None:
+    """worker เรียกทุกรอบ loop (thread ของ consumer) — มีคำขอ cProfile ค้างอยู่ → เปิด/ปิดใน thread นี้"""
+    global _pending
+    req = _pending
+    if req is None:
+        return
+    with _req_lock:
+        if req.profiler is None:
+            if req.cancelled:
+                _pending = None
+                return
+            req.thread = threading.current_thread().name
+            req.ends = time.monotonic() + req.seconds
+            req.profiler = cProfile.Profile()
+            req.profiler.enable()
+        elif req.cancelled or time.monotonic() >= req.ends:
+            req.profiler.disable()
+            _pending = None
+            req.done.set()
+
+
+def profile_worker(seconds: float, grace_s: float = 10.0) -> Tuple[pstats.Stats, str]:
+    """cProfile ของ thread worker seconds วินาที → (Stats, ชื่อ thread)"""
+    global _pending
+    if not _busy.acquire(blocking=False):
+        raise ProfileBusy("another profile is running")
+    try:
+        with _req_lock:
+            if _pending is not None:
+                # คำขอก่อนหน้าหมดเวลาแต่ worker ยังไม่ผ่าน checkpoint มาปิด profiler
+                raise ProfileBusy("previous profile has not been released by the worker yet")
+            req = _pending = _Request(seconds)
+        # worker ต้องผ่าน checkpoint เพื่อเริ่ม และอีกครั้งหลังครบเวลาเพื่อปิด (รอ consume/batch ที่ค้างได้ grace_s)
+        if not req.done.wait(seconds + grace_s):
+            with _req_lock:
+                req.cancelled = True
+                if req.profiler is None:
+                    _pending = None
+            raise ProfileTimeout("worker thread did not reach a checkpoint "
+                                 "(not running, WORKER_PROCESSES>1, or stuck in a long batch)")
+        return pstats.Stats(req.profiler), req.thread
+    finally:
+        _busy.release()
+
+
+def pstats_bytes(st: pstats.Stats) -> bytes:
+    """รูปแบบเดียวกับ Stats.dump_stats → เปิดด้วย pstats.Stats(path) / snakeviz"""
+    return marshal.dumps(st.stats)
+
+
+def pstats_text(st: pstats.Stats, sort: str = "cumulative", limit: int = 60) -> str:
+    out = io.StringIO()
+    st.stream = out
+    st.sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+# ---- tracemalloc ----
+_baseline: Optional[tracemalloc.Snapshot] = None
+_trace_lock = threading.Lock()
+
+
+def tracemalloc_start(frames: int = 1) -> dict:
+    global _baseline
+    with _trace_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        _baseline = tracemalloc.take_snapshot()
+        return tracemalloc_status()
+
+
+def tracemalloc_status() -> dict:
+    if not tracemalloc.is_tracing():
+        return {"tracing": False}
+    cur, peak = tracemalloc.get_traced_memory()
+    return {"tracing": True, "frames": tracemalloc.get_traceback_limit(),
+            "traced_kib": round(cur / 1024, 1), "peak_kib": round(peak / 1024, 1),
+            "overhead_kib": round(tracemalloc.get_tracemalloc_memory() / 1024, 1)}
+
+
+def tracemalloc_diff(limit: int = 30, key_type: str = "lineno", reset: bool = False) -> dict:
+    """snapshot ปัจจุบันเทียบ baseline (ตอน start หรือ reset ครั้งก่อน) เรียงตามขนาดที่โตขึ้น"""
+    global _baseline
+    with _trace_lock:
+        if not tracemalloc.is_tracing() or _baseline is None:
+            raise RuntimeError("tracemalloc is not running (POST /v1/admin/tracemalloc/start)")
+        snap = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        diff = snap.compare_to(_baseline, key_type)
+        if reset:
+            _baseline = snap
+    grew = sum(d.size_diff for d in diff)
+    return {
+        **tracemalloc_status(),
+        "size_diff_kib": round(grew / 1024, 1),
+        "top": [{
+            "where": [f"{fr.filename}:{fr.lineno}" for fr in d.traceback],
+            "size_kib": round(d.size / 1024, 1), "size_diff_kib": round(d.size_diff / 1024, 1),
+            "count": d.count, "count_diff": d.count_diff,
+        } for d in diff[:limit]],
+    }
+
+
+def tracemalloc_stop() -> dict:
+    global _baseline
+    with _trace_lock:
+        tracemalloc.stop()
+        _baseline = None
+    return {"tracing": False}
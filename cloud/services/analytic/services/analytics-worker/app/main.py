@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import os
+import signal
 import threading
 from typing import Optional
 from contextlib import asynccontextmanager
@@ -10,6 +11,8 @@ from fastapi import FastAPI
 from app.config import Config
 from app.api.v1.endpoint import router
 from app.workers.scheduler import start_scheduler, shutdown_scheduler
+from app.pipelines import init_registry
+from app.workers.pool import start_pool, shutdown_pool, reload_registry
 
 try:
     from app.workers.stream_worker import run_worker
@@ -22,12 +25,28 @@ _worker_thread: Optional[threading.Thread] = None
 def _enabled(key: str, default: str = "1") -> bool:
     return os.getenv(key, default).strip().lower() in ("1", "true", "yes", "on")
 
+def _handle_hup(*_):
+    d = reload_registry()
+    print(f"[registry] reloaded v{d.version}: {d.topics}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # registry ของ process API (GET /v1/admin/registry) — worker thread ใช้ตัวเดียวกัน
+    init_registry()
+    try:
+        # SIGHUP → reload registry (ค่า default ของ SIGHUP คือปิด process)
+        signal.signal(signal.SIGHUP, _handle_hup)
+    except Exception:
+        pass
+
     if _enabled("ENABLE_SCHEDULER", "1"):
         start_scheduler()
 
-    if _enabled("ENABLE_WORKER", "1") and run_worker is not None:
+    if _enabled("ENABLE_WORKER", "1") and Config.WORKER_PROCESSES > 1:
+        # หลาย process ใน consumer group เดียวกัน (แบ่ง partition กันเอง)
+        start_pool(Config.WORKER_PROCESSES)
+        print(f"[boot] worker pool started ({Config.WORKER_PROCESSES} processes)")
+    elif _enabled("ENABLE_WORKER", "1") and run_worker is not None:
         global _worker_thread
         _worker_thread = threading.Thread(
             target=run_worker, name="analytics-stream-worker", daemon=True
@@ -36,6 +55,7 @@ async def lifespan(app: FastAPI):
         print("[boot] stream worker started")
 
     yield
+    shutdown_pool()
     shutdown_scheduler()
 
 app = FastAPI(title=Config.APP_NAME, lifespan=lifespan)
@@ -1,13 +1,19 @@
 # app/pipelines/__init__.py
-from app.pipelines.registry import register
-from app.pipelines.map.sensor import handle_sensor_reading
+from app.pipelines.registry import register, register_batch
+from app.pipelines.map.sensor import handle_sensor_reading, handle_sensor_batch
 from app.pipelines.map.device_health import handle_device_health
 from app.pipelines.map.sweep import handle_sweep_reading
-from app.pipelines.map.lab import handle_lab_record
+from app.pipelines.map.lab import handle_lab_record, handle_lab_batch
+from app.pipelines.map.weather import handle_weather_record, handle_weather_batch
 
 def init_registry():
     register("sensors.device.readings",  handle_sensor_reading,  domain="sensor")  # numeric → agg
     register("device.health",            handle_device_health,   domain="device")  # event/measurement
     register("sensors.sweep.readings",   handle_sweep_reading,   domain="sweep")   # event (summary)
     register("lab.results",              handle_lab_record,      domain="lab")     # measurement → agg
+    register("weather.readings",         handle_weather_record,  domain="weather") # measurement → agg / event
 
+    # batch handler แบบ native (topic อื่นใช้ handler ราย record ที่ถูก adapt อัตโนมัติ)
+    register_batch("sensors.device.readings", handle_sensor_batch)
+    register_batch("lab.results",             handle_lab_batch)
+    register_batch("weather.readings",        handle_weather_batch)
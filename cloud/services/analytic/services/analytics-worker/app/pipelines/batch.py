@@ -0,0 +1,99 @@
+# app/pipelines/batch.py
+"""
+Columnar batch สำหรับ mapper แบบ batch (ดู registry.register_batch)
+
+handler ราย record คืน (kind, dict) ต่อข้อความ → ต้องสร้าง dict + tuple ทุกแถว
+batch handler รับ list ของ payload ที่ decode แล้วของ topic เดียว แล้วคืน MappedBatch:
+  - measurements: column ของ key / time / value / payload (ส่งเข้า aggregator ได้ตรง ๆ)
+    time เป็น int epoch ms (app.utils.time.parse_ts_ms) — datetime ถูกสร้างเฉพาะตอนลง DB
+  - events: list ของ dict (event มีน้อยและรูปแบบหลากหลาย — ไม่ทำ columnar)
+
+handler ราย record เดิมใช้ได้ต่อ: adapt() ห่อให้เป็น batch handler อัตโนมัติ
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from app.utils.time import ms_to_dt, parse_ts_ms
+
+# (tenant_id, factory_id, machine_id, sensor_id, metric)
+MeasurementKey = Tuple[str, str, str, Optional[str], str]
+
+
+@dataclass
+class MeasurementBatch:
+    keys: List[MeasurementKey] = field(default_factory=list)
+    times: List[int] = field(default_factory=list)  # epoch ms UTC
+    values: List[float] = field(default_factory=list)
+    payloads: List[Optional[dict]] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def add(self, key: MeasurementKey, t: int, value: float, payload: Optional[dict] = None):
+        self.keys.append(key)
+        self.times.append(t)
+        self.values.append(value)
+        self.payloads.append(payload)
+
+    def append(self, m: dict):
+        """เพิ่มจาก dict measurement (รูปแบบเดียวกับที่ handler ราย record คืน)"""
+        self.add((m["tenant_id"], m["factory_id"], m["machine_id"], m.get("sensor_id"), m["metric"]),
+                 parse_ts_ms(m["time"]), m["value"], m.get("payload"))
+
+    def extend(self, other: "MeasurementBatch"):
+        self.keys.extend(other.keys)
+        self.times.extend(other.times)
+        self.values.extend(other.values)
+        self.payloads.extend(other.payloads)
+
+    def watermark(self) -> Optional[datetime]:
+        return ms_to_dt(max(self.times)) if self.times else None
+
+    def rows(self) -> List[dict]:
+        """แปลงกลับเป็น dict ราย record (สำหรับโค้ดที่ยังรับ measurement แบบ dict)"""
+        return [{
+            "tenant_id": k[0], "factory_id": k[1], "machine_id": k[2],
+            "sensor_id": k[3], "metric": k[4],
+            "value": v, "time": ms_to_dt(t), "payload": p,
+        } for k, t, v, p in zip(self.keys, self.times, self.values, self.payloads)]
+
+
+@dataclass
+class MappedBatch:
+    measurements: MeasurementBatch = field(default_factory=MeasurementBatch)
+    events: List[dict] = field(default_factory=list)
+    errors: int = 0  # record ที่ map ไม่ได้ (ถูกข้าม)
+
+    def extend(self, other: "MappedBatch"):
+        self.measurements.extend(other.measurements)
+        self.events.extend(other.events)
+        self.errors += other.errors
+
+
+# batch handler: payload ที่ decode แล้วของ topic เดียว → MappedBatch
+BatchHandler = Callable[[List[dict]], MappedBatch]
+
+
+def adapt(handler: Callable[[dict], Tuple[str, dict]]) -> BatchHandler:
+    """ห่อ handler ราย record ให้เป็น batch handler (record ที่ error ถูกข้ามเหมือนเดิม)"""
+    def run(objs: List[dict]) -> MappedBatch:
+        out = MappedBatch()
+        ms, events = out.measurements, out.events
+        for o in objs:
+            try:
+                kind, payload = handler(o)
+            except Exception:
+                out.errors += 1
+                continue
+            if kind == "measurement":
+                ms.append(payload)
+            elif kind == "event":
+                events.append(payload)
+        return out
+
+    run.__wrapped__ = handler
+    return run
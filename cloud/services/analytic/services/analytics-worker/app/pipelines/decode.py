@@ -0,0 +1,76 @@
+# app/pipelines/decode.py
+"""
+Decode ข้อความ Kafka → dict สำหรับ mapper
+
+ลำดับความเร็ว (เลือกอัตโนมัติตาม lib ที่ติดตั้ง; DECODER=stdlib บังคับใช้ json.loads):
+  1) msgspec + schema ต่อ topic (app/pipelines/schemas.py) → time เป็น datetime มาเลย
+  2) orjson.loads / msgspec generic decode
+  3) json.loads (stdlib)
+ถ้า payload ไม่ตรง schema (เช่น value เป็น string หรือมี key ที่ schema แบบ Exact ไม่รู้จัก)
+→ ถอยไป generic decode ของข้อความนั้น ให้ mapper ตัดสินเหมือนเดิม (ไม่มี key ไหนหายระหว่าง decode)
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Dict, Optional
+
+from app.config import Config
+
+try:
+    import msgspec
+    from msgspec import UNSET
+    from app.pipelines.schemas import TOPIC_SCHEMAS
+    MSGSPEC_AVAILABLE = True
+except Exception:  # pragma: no cover
+    MSGSPEC_AVAILABLE = False
+
+try:
+    import orjson
+    _generic_loads: Callable[[bytes], Any] = orjson.loads
+except Exception:  # pragma: no cover
+    _generic_loads = msgspec.json.decode if MSGSPEC_AVAILABLE else json.loads
+
+Decoder = Callable[[bytes], Any]
+
+_DECODERS: Dict[str, Decoder] = {}
+
+
+def _typed(schema: type) -> Decoder:
+    dec = msgspec.json.Decoder(schema)
+    fields = schema.__struct_fields__
+
+    def decode(raw: bytes) -> Any:
+        try:
+            obj = dec.decode(raw)
+        except msgspec.ValidationError:
+            return _generic_loads(raw)
+        # Struct → dict โดยตัด field ที่ไม่มีใน payload (UNSET) ทิ้ง
+        out = {}
+        for f in fields:
+            v = getattr(obj, f)
+            if v is not UNSET:
+                out[f] = v
+        return out
+
+    return decode
+
+
+def _stdlib(raw: bytes) -> Any:
+    return json.loads(raw)
+
+
+def decoder_for(topic: str, mode: Optional[str] = None) -> Decoder:
+    """decoder ของ topic (cache ไว้ — สร้าง msgspec.Decoder ครั้งเดียวต่อ topic)"""
+    mode = (mode or Config.DECODER).strip().lower()
+    if mode == "stdlib":
+        return _stdlib
+    d = _DECODERS.get(topic)
+    if d is None:
+        schema = TOPIC_SCHEMAS.get(topic) if MSGSPEC_AVAILABLE else None
+        d = _DECODERS[topic] = _typed(schema) if schema is not None else _generic_loads
+    return d
+
+
+def decode(topic: str, raw: bytes) -> Any:
+    return decoder_for(topic)(raw)
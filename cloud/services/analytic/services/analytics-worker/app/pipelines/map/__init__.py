@@ -1,11 +1,11 @@
 # app/pipelines/__init__.py
-from app.pipelines.registry import register
+from app.pipelines.registry import register, register_batch
 from app.pipelines.map.device_health import handle_device_health
 from app.pipelines.map.econ import handle_econ_event
-from app.pipelines.map.lab import handle_lab_record
+from app.pipelines.map.lab import handle_lab_record, handle_lab_batch
 from app.pipelines.map.ops import handle_ops_event
 from app.pipelines.map.sweep import handle_sweep_reading
-from app.pipelines.map.weather import handle_weather_record
+from app.pipelines.map.weather import handle_weather_record, handle_weather_batch
 
 def init_registry():
     register("device.health", handle_device_health)
@@ -15,3 +15,5 @@ def init_registry():
     register("sensors.sweep.readings", handle_sweep_reading)
     register("weather.readings", handle_weather_record)
 
+    register_batch("lab.results", handle_lab_batch)
+    register_batch("weather.readings", handle_weather_batch)
@@ -1,10 +1,10 @@
 # app/pipelines/map/feed.py
-from datetime import datetime, timezone
+from app.utils.time import parse_ts
 
 def handle_feed_event(o: dict):
     # two shapes: delivery event / silo level metric
     etype = o.get("event_type")
-    t = datetime.fromisoformat(o["time"].replace("Z","+00:00")).astimezone(timezone.utc)
+    t = parse_ts(o["time"])
     if etype == "delivery_received":
         return "event", {
             "time": t, "tenant_id": o["tenant_id"], "domain": "feed",
@@ -1,11 +1,15 @@
 # app\pipelines\map\lab.py
 
 from __future__ import annotations
-from datetime import datetime, timezone
-from typing import Tuple, Dict, Any
+from datetime import datetime
+from app.utils.time import parse_ts, parse_ts_ms
+from typing import Tuple, Dict, Any, List
 
-def _ts(s: str) -> datetime:
-    return datetime.fromisoformat(s.replace("Z", "+00:00")).astimezone(timezone.utc)
+from app.pipelines.batch import MappedBatch
+
+def _ts(s) -> datetime:
+    # s อาจเป็น string หรือ datetime (ถ้า decode ผ่าน msgspec schema)
+    return parse_ts(s)
 
 def _slug(s: str) -> str:
     return (s or "").strip().lower().replace(" ", "_")
@@ -40,3 +44,27 @@ def handle_lab_record(o: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
         "time": t,
         "payload": {k:v for k,v in o.items() if k not in ("tenant_id","factory_id","time")}
     }
+
+
+def handle_lab_batch(objs: List[Dict[str, Any]]) -> MappedBatch:
+    """batch version ของ handle_lab_record (ผลลัพธ์เท่ากันราย record)"""
+    out = MappedBatch()
+    ms = out.measurements
+    keys, times, values, payloads = ms.keys, ms.times, ms.values, ms.payloads
+    slugs: Dict[str, str] = {}  # analyte ใน batch มักซ้ำกัน
+    for o in objs:
+        try:
+            t = parse_ts_ms(o["time"])
+            raw = o.get("analyte") or "value"
+            metric = slugs.get(raw)
+            if metric is None:
+                metric = slugs[raw] = f"lab.{_slug(raw)}"
+            key = (o["tenant_id"], o["factory_id"],
+                   o.get("station_id") or o.get("lab_id") or "lab", o.get("sample_id"), metric)
+            value = float(o["value"])
+        except Exception:
+            out.errors += 1
+            continue
+        keys.append(key); times.append(t); values.append(value)
+        payloads.append({k:v for k,v in o.items() if k not in ("tenant_id","factory_id","time")})
+    return out
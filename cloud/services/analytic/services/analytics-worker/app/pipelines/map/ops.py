@@ -1,11 +1,13 @@
 # app\pipelines\map\ops.py
 
 from __future__ import annotations
-from datetime import datetime, timezone
+from datetime import datetime
+from app.utils.time import parse_ts
 from typing import Tuple, Dict, Any
 
-def _ts(s: str) -> datetime:
-    return datetime.fromisoformat(s.replace("Z", "+00:00")).astimezone(timezone.utc)
+def _ts(s) -> datetime:
+    # s อาจเป็น string หรือ datetime (ถ้า decode ผ่าน msgspec schema)
+    return parse_ts(s)
 
 def _sev(evt: str) -> int:
     evt = (evt or "").lower()
@@ -1,5 +1,8 @@
 # app/pipelines/map/sensor.py
-from datetime import datetime, timezone
+from typing import List
+
+from app.pipelines.batch import MappedBatch
+from app.utils.time import parse_ts, parse_ts_ms
 
 def handle_sensor_reading(o: dict):
     # normalize → measurement
@@ -10,6 +13,24 @@ def handle_sensor_reading(o: dict):
         "sensor_id": o.get("sensor_id"),
         "metric": o["metric"],
         "value": float(o["value"]),
-        "time": datetime.fromisoformat(o["time"].replace("Z","+00:00")).astimezone(timezone.utc),
+        "time": parse_ts(o["time"]),
         "payload": o.get("payload")
-    }
\ No newline at end of file
+    }
+
+
+def handle_sensor_batch(objs: List[dict]) -> MappedBatch:
+    # batch version: เขียนลง column ตรง ๆ ไม่สร้าง dict/tuple ราย record
+    out = MappedBatch()
+    ms = out.measurements
+    keys, times, values, payloads = ms.keys, ms.times, ms.values, ms.payloads
+    for o in objs:
+        try:
+            key = (o["tenant_id"], o["factory_id"], o["machine_id"], o.get("sensor_id"), o["metric"])
+            v = float(o["value"])
+            t = parse_ts_ms(o["time"])
+        except Exception:
+            out.errors += 1
+            continue
+        keys.append(key); times.append(t); values.append(v)
+        payloads.append(o.get("payload"))
+    return out
@@ -1,11 +1,15 @@
 # app\pipelines\map\weather.py
 
 from __future__ import annotations
-from datetime import datetime, timezone
-from typing import Tuple, Dict, Any, Optional
+from datetime import datetime
+from app.utils.time import parse_ts, parse_ts_ms
+from typing import Tuple, Dict, Any, Optional, List
 
-def _ts(s: str) -> datetime:
-    return datetime.fromisoformat(s.replace("Z", "+00:00")).astimezone(timezone.utc)
+from app.pipelines.batch import MappedBatch
+
+def _ts(s) -> datetime:
+    # s อาจเป็น string หรือ datetime (ถ้า decode ผ่าน msgspec schema)
+    return parse_ts(s)
 
 def _pick_metric(o: Dict[str, Any]) -> Tuple[str, Optional[float], Optional[str]]:
     """
@@ -45,7 +49,10 @@ def handle_weather_record(o: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
         }
 
     # ถ้าไม่มี numeric เลย -> เก็บเป็น event summary
-    return "event", {
+    return "event", _event(o, t)
+
+def _event(o: Dict[str, Any], t: datetime) -> Dict[str, Any]:
+    return {
         "time": t,
         "tenant_id": o["tenant_id"],
         "domain": "weather",
@@ -57,3 +64,26 @@ def handle_weather_record(o: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
         "severity": 1,
         "payload": {k:v for k,v in o.items() if k not in ("tenant_id","factory_id","time")}
     }
+
+
+def handle_weather_batch(objs: List[Dict[str, Any]]) -> MappedBatch:
+    """batch version ของ handle_weather_record: measurement ลง column, record ที่ไม่มี numeric → event"""
+    out = MappedBatch()
+    ms, events = out.measurements, out.events
+    keys, times, values, payloads = ms.keys, ms.times, ms.values, ms.payloads
+    for o in objs:
+        try:
+            metric, value, unit = _pick_metric(o)
+            if value is None:
+                # event ลง DB ตรง ๆ → datetime
+                events.append(_event(o, parse_ts(o["time"])))
+                continue
+            t = parse_ts_ms(o["time"])
+            key = (o["tenant_id"], o["factory_id"], o.get("station_id") or "weather",
+                   o.get("sensor_id"), metric)
+        except Exception:
+            out.errors += 1
+            continue
+        keys.append(key); times.append(t); values.append(value)
+        payloads.append({ "unit": unit, **(o.get("payload") or {}) })
+    return out
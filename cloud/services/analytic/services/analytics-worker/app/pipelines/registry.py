@@ -1,16 +1,62 @@
 # app/pipelines/registry.py
+"""
+Registry ของ handler ต่อ topic
+
+register()/register_batch() เก็บ handler ทั้งหมด ส่วนการเลือกว่า topic ไหน "active"
+(กรองด้วย DOMAINS_ENABLED) ถูก compile เป็น dispatch table แบบ immutable ครั้งเดียว
+→ hot loop ของ worker เป็นแค่ dict lookup ไม่อ่าน env/แยก string ราย record
+
+เปลี่ยน DOMAINS_ENABLED แล้วต้อง reload() อย่างตั้งใจ (POST /v1/admin/registry/reload หรือ SIGHUP)
+"""
+
 from __future__ import annotations
 
 import os
-from typing import Callable, Dict, List, Tuple, Optional
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, Dict, FrozenSet, List, Mapping, Set, Tuple, Optional
+
+from app.pipelines.batch import BatchHandler, adapt
 
 # handler จะคืน ("measurement" | "event", payload_dict)
 Handler = Callable[[dict], Tuple[str, dict]]
 
 _REGISTRY: Dict[str, Handler] = {}        # topic -> handler
+_BATCH: Dict[str, BatchHandler] = {}      # topic -> batch handler (native หรือ adapt จาก handler ราย record)
+_NATIVE_BATCH: Set[str] = set()           # topic ที่มี batch handler แบบ native
 _TOPIC_DOMAIN: Dict[str, str] = {}        # topic -> domain (sensor/feed/lab/...)
 
 
+@dataclass(frozen=True)
+class Dispatch:
+    """dispatch table ที่ compile แล้ว (อ่านอย่างเดียว — reload = สร้างใหม่แล้วสลับทั้งก้อน)"""
+    version: int
+    compiled_at: float
+    domains: FrozenSet[str]
+    handlers: Mapping[str, Handler]
+    batch: Mapping[str, BatchHandler]
+
+    @property
+    def topics(self) -> List[str]:
+        return list(self.batch)
+
+    def describe(self) -> dict:
+        return {
+            "version": self.version,
+            "compiled_at": self.compiled_at,
+            "domains": sorted(self.domains),
+            "topics": {t: _TOPIC_DOMAIN.get(t) for t in self.batch},
+            "native_batch": sorted(t for t in self.batch if t in _NATIVE_BATCH),
+        }
+
+
+_DISPATCH: Optional[Dispatch] = None
+_VERSION = 0
+_LOCK = threading.Lock()
+
+
 def _enabled_domains() -> List[str]:
     raw = os.getenv("DOMAINS_ENABLED", "sensor")
     return [x.strip() for x in raw.split(",") if x.strip()]
@@ -19,19 +65,62 @@ def _enabled_domains() -> List[str]:
 def register(topic: str, handler: Handler, *, domain: str = "sensor") -> None:
     _REGISTRY[topic] = handler
     _TOPIC_DOMAIN[topic] = domain
+    # batch handler ที่ลงทะเบียนไว้แบบ native ไม่ถูกทับ
+    if topic not in _NATIVE_BATCH:
+        _BATCH[topic] = adapt(handler)
+    _invalidate()
+
+
+def register_batch(topic: str, handler: BatchHandler, *, domain: Optional[str] = None) -> None:
+    """ลงทะเบียน batch handler แบบ native (ใช้แทน adapt(handler ราย record) ของ topic นี้)"""
+    _BATCH[topic] = handler
+    _NATIVE_BATCH.add(topic)
+    if domain is not None or topic not in _TOPIC_DOMAIN:
+        _TOPIC_DOMAIN[topic] = domain or "sensor"
+    _invalidate()
+
+
+def _invalidate() -> None:
+    # handler เปลี่ยน (ปกติเกิดตอน init_registry() เท่านั้น) → compile ใหม่ตอนเรียกครั้งถัดไป
+    global _DISPATCH
+    _DISPATCH = None
+
+
+def reload() -> Dispatch:
+    """อ่าน DOMAINS_ENABLED ใหม่แล้ว compile dispatch table (สลับแบบ atomic)"""
+    global _DISPATCH, _VERSION
+    with _LOCK:
+        enabled = frozenset(_enabled_domains())
+        active = [t for t, d in _TOPIC_DOMAIN.items() if d in enabled]
+        _VERSION += 1
+        _DISPATCH = Dispatch(
+            version=_VERSION,
+            compiled_at=time.time(),
+            domains=enabled,
+            handlers=MappingProxyType({t: _REGISTRY[t] for t in active if t in _REGISTRY}),
+            batch=MappingProxyType({t: _BATCH[t] for t in active if t in _BATCH}),
+        )
+        return _DISPATCH
+
+
+def dispatch() -> Dispatch:
+    d = _DISPATCH
+    return d if d is not None else reload()
 
 
 def topics() -> List[str]:
-    enabled = set(_enabled_domains())
     # คืนเฉพาะ topic ที่ domain ถูกเปิดไว้
-    return [t for t, d in _TOPIC_DOMAIN.items() if d in enabled]
+    return dispatch().topics
+
+
+def registered() -> Dict[str, str]:
+    # topic -> domain ของทุก handler ที่ลงทะเบียน (ไม่กรอง DOMAINS_ENABLED — ใช้กับ bench/เครื่องมือ)
+    return dict(_TOPIC_DOMAIN)
 
 
 def handler_for(topic: str) -> Optional[Handler]:
-    h = _REGISTRY.get(topic)
-    d = _TOPIC_DOMAIN.get(topic)
-    if h is None:
-        return None
-    if d and d not in _enabled_domains():
-        return None
-    return h
+    return dispatch().handlers.get(topic)
+
+
+def batch_handler_for(topic: str) -> Optional[BatchHandler]:
+    return dispatch().batch.get(topic)
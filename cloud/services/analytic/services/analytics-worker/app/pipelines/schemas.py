@@ -0,0 +1,127 @@
+# app/pipelines/schemas.py
+"""
+msgspec Struct ต่อ topic (ตามรูปแบบใน docstring ของ mapper แต่ละตัว)
+decode JSON → object ชนิดชัดเจนในขั้นตอนเดียว: parse datetime (RFC3339) และแปลง int→float ในระดับ C
+
+field ที่ไม่มีใน payload = UNSET (จะถูกตัดทิ้งตอนแปลงเป็น dict → mapper ใช้ o.get()/"in" ได้เหมือนเดิม)
+field ที่ไม่ได้ประกาศไว้:
+  - Struct ปกติ: ถูกข้าม — ใช้ได้เฉพาะ topic ที่ mapper อ่านแค่ field ที่ประกาศไว้ (sensor, sweep)
+  - Exact (forbid_unknown_fields): mapper copy "ทุก key ที่เหลือ" ลง payload → ข้อความที่มี key แปลก
+    ไม่ผ่าน schema แล้วถอยไป generic decode ทั้งข้อความ (key ไม่หาย) — field ที่พบบ่อยจึงควรประกาศไว้
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Union
+
+import msgspec
+from msgspec import UNSET, UnsetType
+
+# field ที่อาจไม่มี / เป็น null ได้
+OptStr = Union[str, None, UnsetType]
+OptFloat = Union[float, None, UnsetType]
+OptDict = Union[Dict[str, Any], None, UnsetType]
+
+
+class Exact(msgspec.Struct, forbid_unknown_fields=True):
+    """schema ของ topic ที่ mapper ส่ง key ที่เหลือทั้งหมดต่อไปใน payload"""
+
+
+class SensorReading(msgspec.Struct):
+    time: datetime
+    tenant_id: str
+    factory_id: str
+    machine_id: str
+    metric: str
+    value: float
+    sensor_id: OptStr = UNSET
+    payload: OptDict = UNSET
+
+
+class DeviceHealth(Exact):
+    time: datetime
+    tenant_id: str
+    factory_id: str
+    machine_id: str
+    sensor_id: OptStr = UNSET
+    status: OptStr = UNSET
+    level: OptStr = UNSET
+    health_score: OptFloat = UNSET
+    battery_pct: OptFloat = UNSET
+    cpu_pct: OptFloat = UNSET
+    payload: OptDict = UNSET
+
+
+class SweepReading(msgspec.Struct):
+    time: datetime
+    tenant_id: str
+    factory_id: OptStr = UNSET
+    machine_id: OptStr = UNSET
+    metric: OptStr = UNSET
+    unit: OptStr = UNSET
+    readings: Union[List[Dict[str, Any]], None, UnsetType] = UNSET
+    payload: OptDict = UNSET
+
+
+class LabRecord(Exact):
+    time: datetime
+    tenant_id: str
+    factory_id: str
+    value: float
+    station_id: OptStr = UNSET
+    lab_id: OptStr = UNSET
+    sample_id: OptStr = UNSET
+    analyte: OptStr = UNSET
+    unit: OptStr = UNSET
+    lot: OptStr = UNSET
+    operator: OptStr = UNSET
+    method: OptStr = UNSET
+
+
+class WeatherRecord(Exact):
+    time: datetime
+    tenant_id: str
+    factory_id: str
+    station_id: OptStr = UNSET
+    sensor_id: OptStr = UNSET
+    temp_c: OptFloat = UNSET
+    humidity: OptFloat = UNSET
+    rain_mm: OptFloat = UNSET
+    wind_kph: OptFloat = UNSET
+    payload: OptDict = UNSET
+
+
+class OpsEvent(Exact):
+    time: datetime
+    tenant_id: str
+    entity_type: OptStr = UNSET
+    entity_id: OptStr = UNSET
+    event_type: OptStr = UNSET
+    value: Any = UNSET
+    unit: OptStr = UNSET
+    payload: OptDict = UNSET
+
+
+class EconEvent(Exact):
+    time: datetime
+    tenant_id: str
+    commodity: OptStr = UNSET
+    symbol: OptStr = UNSET
+    price: OptFloat = UNSET
+    currency: OptStr = UNSET
+    unit: OptStr = UNSET
+    source: OptStr = UNSET
+    market: OptStr = UNSET
+
+
+# topic -> schema (topic ที่ไม่มีในนี้ใช้ generic decode)
+TOPIC_SCHEMAS: Dict[str, type] = {
+    "sensors.device.readings": SensorReading,
+    "device.health": DeviceHealth,
+    "sensors.sweep.readings": SweepReading,
+    "lab.results": LabRecord,
+    "weather.readings": WeatherRecord,
+    "ops.events": OpsEvent,
+    "econ.events": EconEvent,
+}
@@ -0,0 +1,146 @@
+# app/services/agg_buffer.py
+"""
+Pre-aggregation buffer: สะสม partial aggregate ราย (series, window, bucket) ข้ามหลาย Kafka batch
+แล้วค่อย flush ลง analytics_agg เมื่อ
+  - bucket ปิดแล้ว (bucket_start + window_s + grace <= watermark ของเวลา event)
+  - entry ค้างนานเกิน max_age_s
+  - จำนวน key เกิน max_keys
+  - shutdown / partition ถูก revoke (flush ทั้งหมด)
+
+at-least-once: แต่ละ entry จำ offset ต่ำสุดต่อ (topic, partition) ที่ยังไม่ได้ลง DB
+→ committable() คืน offset ที่ commit ได้อย่างปลอดภัย (ข้อมูลก่อนหน้านั้นลง DB หมดแล้ว)
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.utils.stats import merge_agg_row
+
+TopicPartition = Tuple[str, int]
+
+
+@dataclass
+class BufferEntry:
+    row: dict
+    born: float
+    offsets: Dict[TopicPartition, int] = field(default_factory=dict)  # tp -> offset ต่ำสุดที่ยังค้าง
+    attempts: int = 0  # จำนวนครั้งที่เขียนแล้วพังด้วย error ถาวร (ครบ AGG_DEAD_LETTER_ATTEMPTS → dead-letter)
+
+
+def _key(row: dict) -> tuple:
+    # PK ของ analytics_agg (sensor_id ไม่อยู่ใน PK → รวมกันแบบเดียวกับ upsert)
+    return (row["tenant_id"], row["factory_id"], row["machine_id"], row["metric"],
+            row["window_s"], row["bucket_start"])
+
+
+class AggBuffer:
+    def __init__(self, max_keys: int = 50_000, max_age_s: float = 60.0, grace_s: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self.max_age_s = max_age_s
+        self.grace = timedelta(seconds=grace_s)
+        self.clock = clock
+        self._entries: Dict[tuple, BufferEntry] = {}
+        self._seen: Dict[TopicPartition, int] = {}   # tp -> offset สูงสุดที่ผ่านเข้ามาแล้ว
+        self._watermark = None                        # เวลา event ล่าสุดที่เห็น (datetime UTC)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, rows: Iterable[dict], offsets: Dict[TopicPartition, Tuple[int, int]], watermark=None):
+        """
+        rows: ผลจาก aggregate() ของ batch นี้
+        offsets: tp -> (min_offset, max_offset) ของข้อความใน batch
+        watermark: เวลา event สูงสุดของ batch (ใช้ตัดสินว่า bucket ปิดแล้ว)
+        """
+        now = self.clock()
+        first = {tp: lo for tp, (lo, _) in offsets.items()}
+        for row in rows:
+            k = _key(row)
+            e = self._entries.get(k)
+            if e is None:
+                self._entries[k] = BufferEntry(row=row, born=now, offsets=dict(first))
+            else:
+                e.row = merge_agg_row(e.row, row)
+                for tp, lo in first.items():
+                    if tp not in e.offsets or lo < e.offsets[tp]:
+                        e.offsets[tp] = lo
+        for tp, (_, hi) in offsets.items():
+            if hi > self._seen.get(tp, -1):
+                self._seen[tp] = hi
+        if watermark is not None and (self._watermark is None or watermark > self._watermark):
+            self._watermark = watermark
+
+    def pop_due(self, force: bool = False) -> List[BufferEntry]:
+        """ดึง entry ที่ถึงเวลา flush ออกจาก buffer (force=True → ทั้งหมด)"""
+        if force or len(self._entries) > self.max_keys:
+            out = list(self._entries.values())
+            self._entries.clear()
+            return out
+
+        now = self.clock()
+        wm = self._watermark
+        due = []
+        for k, e in self._entries.items():
+            closed = wm is not None and \
+                e.row["bucket_start"] + timedelta(seconds=e.row["window_s"]) + self.grace <= wm
+            if closed or now - e.born >= self.max_age_s:
+                due.append(k)
+        return [self._entries.pop(k) for k in due]
+
+    def restore(self, entries: List[BufferEntry]):
+        """เขียน DB ไม่สำเร็จ → คืน entry เข้า buffer (รวมกับของใหม่ที่อาจเข้ามาแล้ว)"""
+        for e in entries:
+            k = _key(e.row)
+            cur = self._entries.get(k)
+            if cur is None:
+                self._entries[k] = e
+                continue
+            # entry ที่คืนมาเป็นข้อมูลเก่ากว่า → merge ให้ของเก่าอยู่ก่อน
+            cur.row = merge_agg_row(e.row, cur.row)
+            cur.born = min(cur.born, e.born)
+            cur.attempts = max(cur.attempts, e.attempts)
+            for tp, lo in e.offsets.items():
+                if tp not in cur.offsets or lo < cur.offsets[tp]:
+                    cur.offsets[tp] = lo
+
+    def committable(self) -> Dict[TopicPartition, int]:
+        """tp -> offset ถัดไปที่ commit ได้ (Kafka commit = offset ของข้อความถัดไป)"""
+        pending: Dict[TopicPartition, int] = {}
+        for e in self._entries.values():
+            for tp, lo in e.offsets.items():
+                if tp not in pending or lo < pending[tp]:
+                    pending[tp] = lo
+        return {tp: pending.get(tp, hi + 1) for tp, hi in self._seen.items()}
+
+    def forget(self, tps: Iterable[TopicPartition]):
+        """partition ถูก revoke (หลัง flush + commit แล้ว) → เลิกติดตาม offset"""
+        for tp in tps:
+            self._seen.pop(tp, None)
+
+    def drop(self, tps: Iterable[TopicPartition]):
+        """
+        ทิ้ง entry ที่มีข้อมูลจาก partition เหล่านี้ (flush ก่อน revoke ไม่สำเร็จ → เจ้าของใหม่อ่านซ้ำจาก offset ที่ commit แล้ว)
+        consumer ใช้ eager rebalance (revoke ทุก partition พร้อมกัน) → entry ไม่ปนกับ partition ที่ยังถืออยู่
+        """
+        tps = set(tps)
+        for k in [k for k, e in self._entries.items() if tps.intersection(e.offsets)]:
+            del self._entries[k]
+
+    def oldest_age(self) -> Optional[float]:
+        if not self._entries:
+            return None
+        return self.clock() - min(e.born for e in self._entries.values())
+
+    @staticmethod
+    def key(row: dict) -> tuple:
+        """PK ของ analytics_agg ลำดับเดียวกับ AGG_PK (= StatementError.key ของ PipelineRepo)"""
+        return _key(row)
+
+    @staticmethod
+    def rows(entries: List[BufferEntry]) -> List[dict]:
+        return [e.row for e in entries]
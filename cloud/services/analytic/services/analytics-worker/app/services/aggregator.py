@@ -2,32 +2,185 @@
 
 from collections import defaultdict
 from statistics import mean, pstdev
-from typing import Iterable, Dict, Tuple, List
-from datetime import datetime, timezone
-from app.utils.time import floor_to_bucket
+from typing import Callable, Iterable, Dict, Tuple, List, Optional
+from datetime import datetime
+from app.config import Config
+from app.pipelines.batch import MeasurementBatch
+from app.utils.sketch import DDSketch
+from app.utils.time import ms_to_dt, parse_ts_ms
+
+Aggregator = Callable[[Iterable[dict], List[int]], Iterable[dict]]
+BatchAggregator = Callable[[MeasurementBatch, List[int]], Iterable[dict]]
 
 def aggregate(measurements: Iterable[dict], windows: List[int]) -> Iterable[dict]:
     # group by (key, window, bucket_start)
     buckets: Dict[Tuple, list] = defaultdict(list)
+    wms = [(w, w * 1000) for w in windows]
+    for m in measurements:
+        key = (m["tenant_id"], m["factory_id"], m["machine_id"], m.get("sensor_id"), m["metric"])
+        t = parse_ts_ms(m["time"])
+        for w, span in wms:
+            buckets[(key, w, t - t % span)].append(m["value"])
+
+    yield from _reduce(buckets)
+
+def aggregate_batch(batch: MeasurementBatch, windows: List[int]) -> Iterable[dict]:
+    # เหมือน aggregate แต่อ่านจาก column ของ MeasurementBatch (ไม่ต้องมี dict ราย record)
+    buckets: Dict[Tuple, list] = defaultdict(list)
+    wms = [(w, w * 1000) for w in windows]
+    for key, t, v in zip(batch.keys, batch.times, batch.values):
+        for w, span in wms:
+            buckets[(key, w, t - t % span)].append(v)
+
+    yield from _reduce(buckets)
+
+def _reduce(buckets: Dict[Tuple, list]) -> Iterable[dict]:
+    # bucket เป็น epoch ms → datetime ครั้งเดียวต่อ bucket (ตอนออกไป DB)
+    dt_cache: Dict[int, datetime] = {}
+    for (key, w, b), vals in buckets.items():
+        bs = dt_cache.get(b)
+        if bs is None:
+            bs = dt_cache[b] = ms_to_dt(b)
+        yield _stats_row(key, w, bs, vals)
+
+def _stats_row(key: tuple, w: int, bs: datetime, vals: list) -> dict:
+    n = len(vals)
+    avg = mean(vals)
+    mn, mx = min(vals), max(vals)
+    sd = pstdev(vals) if n > 1 else 0.0
+    m2 = sum((v - avg) ** 2 for v in vals)
+    p95 = sorted(vals)[int(0.95*(n-1))]  # rank q*(n-1) เหมือน DDSketch.quantile
+    (tenant, factory, machine, sensor, metric) = key
+    return {
+        "bucket_start": bs,
+        "window_s": w,
+        "tenant_id": tenant, "factory_id": factory, "machine_id": machine,
+        "sensor_id": sensor, "metric": metric,
+        "count_n": n, "sum_val": sum(vals), "avg_val": avg,
+        "min_val": mn, "max_val": mx, "stddev_val": sd, "p95_val": p95,
+        # mergeable state: รวมข้าม batch ได้ใน upsert (ดู merge_agg_row)
+        "m2_val": m2, "sketch": DDSketch.from_values(vals),
+    }
+
+
+# ---- cascading engine (AGG_ENGINE=cascade) ----
+# raw ลงเฉพาะ window ที่ไม่มี window ละเอียดกว่าหารลงตัว (ปกติคือ 60s)
+# window หยาบกว่ารวมจาก partial state ของ window ลูก: n/sum/min/max บวก, M2 แบบ Chan, sketch merge
+# p95 ของ window หยาบมาจาก sketch ที่ merge แล้ว (เหมือน conflict path ของ upsert และ backfill cascade)
+# → ค่าดิบใช้แค่ที่ window ละเอียดสุด ไม่ต้องพกขึ้นไปเรียงใหม่ทุกระดับ
+
+def cascade_plan(windows: List[int]) -> List[Tuple[int, Optional[int]]]:
+    """[(window, parent)] เรียงละเอียด → หยาบ; parent = window ที่ใหญ่สุดที่หาร window ลงตัว (None = จาก raw)"""
+    plan: List[Tuple[int, Optional[int]]] = []
+    done: List[int] = []
+    for w in sorted(set(windows)):
+        parent = max((p for p in done if w % p == 0), default=None)
+        plan.append((w, parent))
+        done.append(w)
+    return plan
+
+def aggregate_cascade(measurements: Iterable[dict], windows: List[int]) -> Iterable[dict]:
+    plan = cascade_plan(windows)
+    wms = [(w, w * 1000) for w, parent in plan if parent is None]
+    buckets: Dict[Tuple, list] = defaultdict(list)
     for m in measurements:
         key = (m["tenant_id"], m["factory_id"], m["machine_id"], m.get("sensor_id"), m["metric"])
-        t: datetime = m["time"]
-        for w in windows:
-            b = floor_to_bucket(t, w)
-            buckets[(key, w, b)].append(m["value"])
+        t = parse_ts_ms(m["time"])
+        for w, span in wms:
+            buckets[(key, w, t - t % span)].append(m["value"])
+
+    return _cascade(buckets, plan)
+
+def aggregate_cascade_batch(batch: MeasurementBatch, windows: List[int]) -> Iterable[dict]:
+    plan = cascade_plan(windows)
+    wms = [(w, w * 1000) for w, parent in plan if parent is None]
+    buckets: Dict[Tuple, list] = defaultdict(list)
+    if len(wms) == 1:
+        # กรณีปกติ: raw ลง window เดียว
+        (w, span), = wms
+        for key, t, v in zip(batch.keys, batch.times, batch.values):
+            buckets[(key, w, t - t % span)].append(v)
+    else:
+        for key, t, v in zip(batch.keys, batch.times, batch.values):
+            for w, span in wms:
+                buckets[(key, w, t - t % span)].append(v)
+
+    return _cascade(buckets, plan)
+
+def _cascade(buckets: Dict[Tuple, list], plan: List[Tuple[int, Optional[int]]]) -> List[dict]:
+    dt_cache: Dict[int, datetime] = {}
 
+    def _dt(b: int) -> datetime:
+        bs = dt_cache.get(b)
+        if bs is None:
+            bs = dt_cache[b] = ms_to_dt(b)
+        return bs
+
+    # level[w]: (key, bucket ms) → row
+    level: Dict[int, Dict[Tuple, dict]] = defaultdict(dict)
     for (key, w, b), vals in buckets.items():
-        n = len(vals)
-        avg = mean(vals)
-        mn, mx = min(vals), max(vals)
-        sd = pstdev(vals) if n > 1 else 0.0
-        p95 = sorted(vals)[max(0, int(0.95*n)-1)]
-        (tenant, factory, machine, sensor, metric) = key
-        yield {
-            "bucket_start": b.replace(tzinfo=timezone.utc),
-            "window_s": w,
-            "tenant_id": tenant, "factory_id": factory, "machine_id": machine,
-            "sensor_id": sensor, "metric": metric,
-            "count_n": n, "sum_val": sum(vals), "avg_val": avg,
-            "min_val": mn, "max_val": mx, "stddev_val": sd, "p95_val": p95
-        }
+        level[w][(key, b)] = _stats_row(key, w, _dt(b), vals)
+
+    for w, parent in plan:
+        if parent is None:
+            continue
+        span = w * 1000
+        children: Dict[Tuple, list] = defaultdict(list)
+        for (key, b), row in level[parent].items():
+            children[(key, b - b % span)].append(row)
+        out = level[w]
+        for (key, b), group in children.items():
+            out[(key, b)] = _merge_rows(group, key, w, _dt(b))
+
+    return [row for w, _ in plan for row in level[w].values()]
+
+def _merge_rows(rows: List[dict], key: tuple, w: int, bs: datetime) -> dict:
+    n = sum(r["count_n"] for r in rows)
+    total = sum(r["sum_val"] for r in rows)
+    avg = total / n
+    # Chan: M2 = ΣM2_i + Σn_i(mean_i - mean)^2
+    m2 = sum(r["m2_val"] + r["count_n"] * (r["avg_val"] - avg) ** 2 for r in rows)
+    sk = DDSketch(alpha=rows[0]["sketch"].alpha)
+    for r in rows:
+        sk.merge(r["sketch"])
+    (tenant, factory, machine, sensor, metric) = key
+    return {
+        "bucket_start": bs,
+        "window_s": w,
+        "tenant_id": tenant, "factory_id": factory, "machine_id": machine,
+        "sensor_id": sensor, "metric": metric,
+        "count_n": n, "sum_val": total, "avg_val": avg,
+        "min_val": min(r["min_val"] for r in rows), "max_val": max(r["max_val"] for r in rows),
+        "stddev_val": (m2 / n) ** 0.5 if n > 1 else 0.0,
+        "p95_val": sk.quantile(0.95),
+        "m2_val": m2, "sketch": sk,
+    }
+
+def get_aggregator(engine: Optional[str] = None) -> Aggregator:
+    """
+    เลือก engine ตาม AGG_ENGINE: "python" (ค่าเริ่มต้น) | "numpy" | "cascade"
+    ถ้า numpy ไม่ได้ติดตั้ง → fallback เป็น python
+    """
+    engine = (engine or Config.AGG_ENGINE).strip().lower()
+    if engine == "cascade":
+        return aggregate_cascade
+    if engine == "numpy":
+        try:
+            from app.services.aggregator_np import aggregate_np
+            return aggregate_np
+        except ImportError as e:  # pragma: no cover
+            print(f"[agg] numpy engine not available: {e} → fallback to python")
+    return aggregate
+
+def get_batch_aggregator(engine: Optional[str] = None) -> BatchAggregator:
+    """เหมือน get_aggregator แต่รับ MeasurementBatch (columnar) จาก batch handler"""
+    engine = (engine or Config.AGG_ENGINE).strip().lower()
+    if engine == "cascade":
+        return aggregate_cascade_batch
+    if engine == "numpy":
+        try:
+            from app.services.aggregator_np import aggregate_np_batch
+            return aggregate_np_batch
+        except ImportError as e:  # pragma: no cover
+            print(f"[agg] numpy engine not available: {e} → fallback to python")
+    return aggregate_batch
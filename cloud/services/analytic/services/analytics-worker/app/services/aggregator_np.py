@@ -0,0 +1,166 @@
+# app/services/aggregator_np.py
+"""
+Vectorized aggregation engine (NumPy) — ผลลัพธ์แถวเหมือน app.services.aggregator.aggregate
+(ต่างกันได้แค่ระดับ floating-point rounding ของ sum/avg/std)
+
+ขั้นตอน:
+  1) แปลง batch เป็น columnar: epoch ms (int64), key index (intern), value (float64)
+     (MeasurementBatch จาก batch handler เป็น columnar อยู่แล้ว → aggregate_np_batch)
+  2) bucket floor ของทุก window พร้อมกันด้วย integer arithmetic: ms - ms % (w*1000)  → shape (W, N)
+  3) lexsort ตาม (key, window, bucket, value) แล้ว reduceat ต่อกลุ่ม
+     count/sum/min/max/std/p95 (+ M2, DDSketch) ไม่ต้อง sort ซ้ำราย group
+"""
+
+from __future__ import annotations
+
+import math
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from app.pipelines.batch import MeasurementBatch
+from app.utils.sketch import DDSketch, DEFAULT_ALPHA, MIN_INDEXABLE
+from app.utils.time import ms_to_dt, parse_ts_ms
+
+
+def _columns(measurements: Iterable[dict]) -> Tuple[List[tuple], np.ndarray, np.ndarray, np.ndarray]:
+    keys: Dict[tuple, int] = {}
+    key_list: List[tuple] = []
+    kidx: List[int] = []
+    times: List[int] = []
+    vals: List[float] = []
+    for m in measurements:
+        key = (m["tenant_id"], m["factory_id"], m["machine_id"], m.get("sensor_id"), m["metric"])
+        i = keys.get(key)
+        if i is None:
+            i = keys[key] = len(key_list)
+            key_list.append(key)
+        kidx.append(i)
+        times.append(parse_ts_ms(m["time"]))
+        vals.append(m["value"])
+    return (key_list,
+            np.asarray(kidx, dtype=np.int64),
+            np.asarray(times, dtype=np.int64),
+            np.asarray(vals, dtype=np.float64))
+
+
+def _batch_columns(batch: MeasurementBatch) -> Tuple[List[tuple], np.ndarray, np.ndarray, np.ndarray]:
+    # batch เป็น columnar อยู่แล้ว → intern key อย่างเดียว
+    keys: Dict[tuple, int] = {}
+    key_list: List[tuple] = []
+    kidx: List[int] = []
+    for key in batch.keys:
+        i = keys.get(key)
+        if i is None:
+            i = keys[key] = len(key_list)
+            key_list.append(key)
+        kidx.append(i)
+    return (key_list,
+            np.asarray(kidx, dtype=np.int64),
+            np.asarray(batch.times, dtype=np.int64),
+            np.asarray(batch.values, dtype=np.float64))
+
+
+def aggregate_np(measurements: Iterable[dict], windows: List[int]) -> Iterable[dict]:
+    return _aggregate_columns(*_columns(measurements), windows)
+
+
+def aggregate_np_batch(batch: MeasurementBatch, windows: List[int]) -> Iterable[dict]:
+    """เหมือน aggregate_np แต่รับ MeasurementBatch (จาก batch handler) ตรง ๆ"""
+    return _aggregate_columns(*_batch_columns(batch), windows)
+
+
+def _aggregate_columns(key_list: List[tuple], kidx: np.ndarray, ms: np.ndarray, vals: np.ndarray,
+                       windows: List[int]) -> List[dict]:
+    n = vals.size
+    if n == 0 or not windows:
+        return []
+
+    w_arr = np.asarray(windows, dtype=np.int64)
+    nw = w_arr.size
+
+    # (W, N): bucket floor ของทุก window ในครั้งเดียว
+    buckets = (ms[None, :] - ms[None, :] % (w_arr * 1000)[:, None]).ravel()
+    widx = np.repeat(np.arange(nw, dtype=np.int64), n)
+    keys = np.tile(kidx, nw)
+    v = np.tile(vals, nw)
+
+    order = np.lexsort((v, buckets, widx, keys))
+    keys, widx, buckets, v = keys[order], widx[order], buckets[order], v[order]
+
+    change = np.empty(keys.size, dtype=bool)
+    change[0] = True
+    change[1:] = (keys[1:] != keys[:-1]) | (widx[1:] != widx[:-1]) | (buckets[1:] != buckets[:-1])
+    starts = np.flatnonzero(change)
+    ends = np.append(starts[1:], keys.size)
+
+    cnt = ends - starts
+    sums = np.add.reduceat(v, starts)
+    avg = sums / cnt
+    dev = v - np.repeat(avg, cnt)
+    m2 = np.add.reduceat(dev * dev, starts)
+    std = np.sqrt(m2 / cnt)
+    std[cnt <= 1] = 0.0
+    # ค่าใน group เรียงจากน้อยไปมากแล้ว → min/max/p95 คือ index ตรง ๆ
+    mn = v[starts]
+    mx = v[ends - 1]
+    p95 = v[starts + (0.95 * (cnt - 1)).astype(np.int64)]  # rank q*(n-1) เหมือน DDSketch.quantile
+
+    sketches = _sketches(v, change, cnt)
+
+    g_key = keys[starts].tolist()
+    g_w = w_arr[widx[starts]].tolist()
+    g_b = buckets[starts].tolist()
+    cols = zip(g_key, g_w, g_b, cnt.tolist(), sums.tolist(), avg.tolist(),
+               mn.tolist(), mx.tolist(), std.tolist(), p95.tolist(), m2.tolist(), sketches)
+
+    dt_cache: Dict[int, datetime] = {}
+    out: List[dict] = []
+    for k, w, b, c, s, a, lo, hi, sd, p, q, sk in cols:
+        bs = dt_cache.get(b)
+        if bs is None:
+            bs = dt_cache[b] = ms_to_dt(b)
+        tenant, factory, machine, sensor, metric = key_list[k]
+        out.append({
+            "bucket_start": bs,
+            "window_s": w,
+            "tenant_id": tenant, "factory_id": factory, "machine_id": machine,
+            "sensor_id": sensor, "metric": metric,
+            "count_n": c, "sum_val": s, "avg_val": a,
+            "min_val": lo, "max_val": hi, "stddev_val": sd, "p95_val": p,
+            "m2_val": q, "sketch": sk,
+        })
+    return out
+
+
+def _sketches(v: np.ndarray, change: np.ndarray, cnt: np.ndarray) -> List[DDSketch]:
+    """
+    สร้าง DDSketch ต่อ group จาก v ที่เรียงแล้วภายใน group:
+    bin index คำนวณทั้ง array ครั้งเดียว แล้วนับแบบ run-length (bin เดียวกันอยู่ติดกัน)
+    """
+    gamma = (1 + DEFAULT_ALPHA) / (1 - DEFAULT_ALPHA)
+    sign = np.where(v > MIN_INDEXABLE, 1, np.where(v < -MIN_INDEXABLE, -1, 0))
+    idx = np.zeros(v.size, dtype=np.int64)
+    nz = sign != 0
+    idx[nz] = np.ceil(np.log(np.abs(v[nz])) / math.log(gamma)).astype(np.int64)
+
+    run = change.copy()
+    run[1:] |= (sign[1:] != sign[:-1]) | (idx[1:] != idx[:-1])
+    r_starts = np.flatnonzero(run)
+    r_counts = np.diff(np.append(r_starts, v.size))
+    r_group = np.cumsum(change)[r_starts] - 1
+
+    out = [DDSketch() for _ in range(cnt.size)]
+    for g, sg, i, c in zip(r_group.tolist(), sign[r_starts].tolist(),
+                           idx[r_starts].tolist(), r_counts.tolist()):
+        sk = out[g]
+        if sg > 0:
+            sk.pos[i] = c
+        elif sg < 0:
+            sk.neg[i] = c
+        else:
+            sk.zero = c
+    for sk in out:
+        sk._collapse()
+    return out
@@ -1,59 +1,37 @@
 # app\services\backfill.py
 
 from __future__ import annotations
+import math
 from datetime import datetime
 from typing import Iterable, List, Optional
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 from app.config import Config
+from app.services.aggregator import cascade_plan
+from app.utils.sketch import DEFAULT_ALPHA, MIN_INDEXABLE
 
 """
 Backfill aggregates โดยใช้ time_bucket() ฝั่ง DB (เร็วกว่าโหลดมาทำใน Python มาก)
-สมมติ raw อยู่ในตาราง sensors.device_readings โครง: 
+สมมติ raw อยู่ในตาราง sensors.device_readings โครง:
 (time timestamptz, tenant_id text, factory_id text, machine_id text, sensor_id text, metric text, value double precision)
 ปรับชื่อ schema/table ถ้าของจริงต่างไป
+
+cascade=True (ค่าเริ่มต้น): สแกน raw เฉพาะ window ละเอียดสุด (เหมือน AGG_ENGINE=cascade)
+แล้วสร้าง window หยาบจากแถวใน analytics_agg: n/sum/min/max รวม, M2 แบบ Chan, sketch merge
+(ต้องมี 076_analytics_agg_state.sql + 078_analytics_agg_cascade.sql)
+p95 มาจาก DDSketch (relative error 1%) ทั้ง window ละเอียดและหยาบ และเก็บ sketch ไว้ให้ upsert สดรวมต่อได้
+cascade=False: สแกน raw ทุก window (ไม่ rollup จาก analytics_agg) — sketch/p95 แบบเดียวกัน
 """
 
-RAW_TABLE = "sensors.device_readings"
+RAW_TABLE = Config.RAW_TABLE
 
-def backfill_aggregates(db: Session, start: datetime, end: datetime,
-                        windows: Optional[List[int]] = None,
-                        tenant_id: Optional[str] = None,
-                        factory_id: Optional[str] = None,
-                        machine_id: Optional[str] = None,
-                        metric: Optional[str] = None):
-    windows = windows or Config.WINDOWS
+_KEY = "tenant_id, factory_id, machine_id, sensor_id, metric"
 
-    where = ["time >= :start", "time < :end"]
-    params = {"start": start, "end": end}
-    if tenant_id:  where.append("tenant_id = :tenant_id");  params["tenant_id"]  = tenant_id
-    if factory_id: where.append("factory_id = :factory_id");params["factory_id"] = factory_id
-    if machine_id: where.append("machine_id = :machine_id");params["machine_id"] = machine_id
-    if metric:     where.append("metric = :metric");        params["metric"]     = metric
-    where_sql = " AND ".join(where)
-
-    for w in windows:
-        # ใช้ approx_percentile ถ้ามี; ที่นี่ใช้ p95 ง่าย ๆ ผ่าน percentile_disc
-        sql = text(f"""
-        WITH agg AS (
-          SELECT
-            time_bucket(make_interval(secs => :w), time) AS bucket_start,
-            :w AS window_s,
-            tenant_id, factory_id, machine_id, sensor_id, metric,
-            COUNT(*)::bigint AS count_n,
-            SUM(value)::double precision AS sum_val,
-            AVG(value)::double precision AS avg_val,
-            MIN(value)::double precision AS min_val,
-            MAX(value)::double precision AS max_val,
-            STDDEV_POP(value)::double precision AS stddev_val,
-            PERCENTILE_DISC(0.95) WITHIN GROUP (ORDER BY value) AS p95_val
-          FROM {RAW_TABLE}
-          WHERE {where_sql}
-          GROUP BY bucket_start, tenant_id, factory_id, machine_id, sensor_id, metric
-        )
-        INSERT INTO {Config.DB_SCHEMA}.analytics_agg
+# เขียนทับ bucket ทั้งแถว (ไม่ merge กับค่าเดิม) — backfill คำนวณ bucket ใหม่ทั้งก้อน
+_UPSERT = """
+        INSERT INTO {schema}.analytics_agg
         (bucket_start, window_s, tenant_id, factory_id, machine_id, sensor_id, metric,
-         count_n, sum_val, avg_val, min_val, max_val, stddev_val, p95_val)
+         count_n, sum_val, avg_val, min_val, max_val, stddev_val, p95_val, m2_val, sketch)
         SELECT * FROM agg
         ON CONFLICT (tenant_id, factory_id, machine_id, metric, window_s, bucket_start)
         DO UPDATE SET
@@ -64,7 +42,136 @@ def backfill_aggregates(db: Session, start: datetime, end: datetime,
           max_val    = EXCLUDED.max_val,
           stddev_val = EXCLUDED.stddev_val,
           p95_val    = EXCLUDED.p95_val,
+          m2_val     = EXCLUDED.m2_val,
+          sketch     = EXCLUDED.sketch,
           updated_at = NOW();
-        """)
-        db.execute(sql, {**params, "w": w})
+"""
+
+# partial state (n, s, lo, hi, m2) ต่อกลุ่มย่อยใน src → แถว bucket
+# M2 แบบ Chan: ΣM2_i + Σn_i(mean_i - mean)^2 (mean ของ bucket จาก window function)
+_MERGE = """
+        mu AS (
+          SELECT *, SUM(s) OVER k / SUM(n) OVER k AS mean_k
+          FROM src
+          WINDOW k AS (PARTITION BY bucket_start, {key})
+        ),
+        merged AS (
+          SELECT bucket_start, {key},
+                 SUM(n)::bigint AS n, SUM(s) AS s, MIN(lo) AS lo, MAX(hi) AS hi,
+                 SUM(m2 + n * (s / n - mean_k) ^ 2) AS m2,
+                 {sketch} AS sketch,
+                 {p95_fallback} AS p95_fallback
+          FROM mu
+          GROUP BY bucket_start, {key}
+        ),
+        agg AS (
+          SELECT bucket_start, CAST(:w AS int) AS window_s, {key},
+                 n, s, s / n AS avg_val, lo, hi, SQRT(m2 / n) AS stddev_val,
+                 COALESCE(analytics.ddsketch_quantile(sketch, 0.95), p95_fallback) AS p95_val,
+                 m2, sketch
+          FROM merged
+        )
+"""
+
+# raw → window ละเอียดสุด: group ย่อยถึงระดับ bin ของ DDSketch → สแกน raw รอบเดียวได้ทั้ง stats และ sketch
+_RAW_SRC = """
+        WITH src AS (
+          SELECT
+            time_bucket(make_interval(secs => :w), time) AS bucket_start,
+            {key},
+            CASE WHEN value > CAST(:eps AS float8) THEN 1
+                 WHEN value < -CAST(:eps AS float8) THEN -1 ELSE 0 END AS side,
+            CASE WHEN ABS(value) > CAST(:eps AS float8)
+                 THEN CEIL(LN(ABS(value)) / CAST(:ln_gamma AS float8))::int ELSE 0 END AS idx,
+            COUNT(*) AS n,
+            SUM(value)::double precision AS s,
+            MIN(value)::double precision AS lo,
+            MAX(value)::double precision AS hi,
+            (VAR_POP(value) * COUNT(*))::double precision AS m2
+          FROM {raw}
+          WHERE {where}
+          GROUP BY 1, {key}, side, idx
+        ),
+"""
+_RAW_SKETCH = """jsonb_build_object(
+                   'a', CAST(:alpha AS float8),
+                   'z', COALESCE(SUM(n) FILTER (WHERE side = 0), 0),
+                   'p', COALESCE(jsonb_object_agg(idx, n) FILTER (WHERE side = 1), '{}'::jsonb),
+                   'n', COALESCE(jsonb_object_agg(idx, n) FILTER (WHERE side = -1), '{}'::jsonb))"""
+
+# window ละเอียด (analytics_agg) → window หยาบ; ช่วงเวลาขยายให้ครอบ bucket หยาบเต็มใบ
+_ROLLUP_SRC = """
+        WITH src AS (
+          SELECT
+            time_bucket(make_interval(secs => :w), bucket_start) AS bucket_start,
+            {key},
+            count_n AS n, sum_val AS s, min_val AS lo, max_val AS hi,
+            COALESCE(m2_val, stddev_val ^ 2 * count_n, 0) AS m2,  -- แถวเก่าก่อนมี m2_val
+            sketch, p95_val
+          FROM {schema}.analytics_agg
+          WHERE window_s = :parent AND count_n > 0
+            AND bucket_start >= time_bucket(make_interval(secs => :w), CAST(:start AS timestamptz))
+            AND bucket_start <  time_bucket(make_interval(secs => :w), CAST(:end AS timestamptz) - INTERVAL '1 microsecond')
+                                + make_interval(secs => :w)
+            {filters}
+        ),
+"""
+
+
+def backfill_aggregates(db: Session, start: datetime, end: datetime,
+                        windows: Optional[List[int]] = None,
+                        tenant_id: Optional[str] = None,
+                        factory_id: Optional[str] = None,
+                        machine_id: Optional[str] = None,
+                        metric: Optional[str] = None,
+                        cascade: bool = True) -> int:
+    """คืนจำนวนแถว analytics_agg ที่ insert/update (ทุก window) — commit ครั้งเดียวตอนจบ"""
+    windows = windows or Config.WINDOWS
+
+    filters = []
+    params = {"start": start, "end": end}
+    if tenant_id:  filters.append("tenant_id = :tenant_id");  params["tenant_id"]  = tenant_id
+    if factory_id: filters.append("factory_id = :factory_id");params["factory_id"] = factory_id
+    if machine_id: filters.append("machine_id = :machine_id");params["machine_id"] = machine_id
+    if metric:     filters.append("metric = :metric");        params["metric"]     = metric
+
+    rows = 0
+    sketch_params = {
+        "alpha": DEFAULT_ALPHA, "eps": MIN_INDEXABLE,
+        "ln_gamma": math.log((1 + DEFAULT_ALPHA) / (1 - DEFAULT_ALPHA)),
+    }
+    if not cascade:
+        # สแกน raw ทีละ window (ก่อนมี cascade) — ยังสร้าง sketch แบบเดียวกับ window ละเอียดสุด
+        where_sql = " AND ".join(["time >= :start", "time < :end"] + filters)
+        for w in windows:
+            rows += db.execute(_raw_sql(where_sql), {**params, **sketch_params, "w": w}).rowcount
+        db.commit()
+        return rows
+
+    for w, parent in cascade_plan(windows):
+        if parent is None:
+            # ขยายช่วงให้ครอบ bucket ของ window นี้เต็มใบ (ไม่เขียนทับ bucket ขอบด้วยข้อมูลครึ่งเดียว)
+            where_sql = " AND ".join([
+                "time >= time_bucket(make_interval(secs => :w), CAST(:start AS timestamptz))",
+                "time <  time_bucket(make_interval(secs => :w), CAST(:end AS timestamptz) - INTERVAL '1 microsecond')"
+                " + make_interval(secs => :w)",
+            ] + filters)
+            rows += db.execute(_raw_sql(where_sql), {**params, **sketch_params, "w": w}).rowcount
+        else:
+            sql = (_ROLLUP_SRC.format(key=_KEY, schema=Config.DB_SCHEMA,
+                                      filters="".join(f"AND {f} " for f in filters))
+                   # แถวเก่าที่ไม่มี sketch เลยทั้ง bucket → p95 ประมาณด้วย max ของ p95 ราย bucket ลูก
+                   + _MERGE.format(key=_KEY, sketch="analytics.ddsketch_merge_agg(sketch)",
+                                   p95_fallback="MAX(p95_val)"))
+            rows += db.execute(text(sql + _UPSERT.format(schema=Config.DB_SCHEMA)),
+                               {**params, "w": w, "parent": parent}).rowcount
     db.commit()
+    return rows
+
+
+
+def _raw_sql(where_sql: str):
+    # raw → bucket ของ :w พร้อม sketch (p95 จาก sketch ตรงกับที่ upsert สดและ rollup ใช้)
+    sql = (_RAW_SRC.format(key=_KEY, raw=RAW_TABLE, where=where_sql)
+           + _MERGE.format(key=_KEY, sketch=_RAW_SKETCH, p95_fallback="NULL::double precision"))
+    return text(sql + _UPSERT.format(schema=Config.DB_SCHEMA))
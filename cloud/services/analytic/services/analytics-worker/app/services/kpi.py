@@ -1,15 +1,21 @@
 # app\services\kpi.py
 
 from __future__ import annotations
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Tuple
 from sqlalchemy import text
 from sqlalchemy.orm import Session
+from app.adapters.repository import AnalyticsRepo
 from app.config import Config
+from app.instrumentation.metrics import kpi_rows, kpi_run_time, kpi_runs
+from app.services.spec_resolver import default_resolver
 
 """
 คำนวณ KPI (Cp/Cpk/Pp/Ppk) ราย period (day|week|month)
-ต้องมีสเปก (USL/LSL) สำหรับ metric นั้น ๆ — รับผ่าน spec_lookup() ด้านล่าง
+ต้องมีสเปก (USL/LSL) สำหรับ metric นั้น ๆ — ค่าเริ่มต้นอ่าน analytics_spec_limits ผ่าน SpecResolver หรือส่ง spec_lookup() เอง
+sigma มาจาก moment (n, mean, M2) ราย bucket ของ analytics_agg — ไม่ต้องอ่าน raw:
+  Cp/Cpk ใช้ sigma within (pooled ภายใน bucket), Pp/Ppk ใช้ sigma overall (ทั้ง period)
 """
 
 def _period_floor(ts: datetime, period: str) -> datetime:
@@ -33,59 +39,192 @@ def _compute_cp_cpk(mean: float, std: float, lsl: Optional[float], usl: Optional
     cpk = min(cpu, cpl) if cpu is not None and cpl is not None else None
     return cp, cpk
 
-def compute_kpi(
-    db: Session,
-    period: str = "day",
-    metric: Optional[str] = None,
-    spec_lookup: Optional[callable] = None,
-    use_window_s: int = 60
-):
+def _source() -> Tuple[str, bool]:
+    """(ตาราง/view ที่อ่าน, cagg?) — AGG_ENGINE=cagg อ่าน v_agg_cagg (ไม่มี series_id/updated_at)"""
+    cagg = Config.AGG_ENGINE.strip().lower() == "cagg"
+    return f"{Config.DB_SCHEMA}.{'v_agg_cagg' if cagg else 'analytics_agg'}", cagg
+
+
+def _sigmas(n, k, m2_within, m2_total) -> Tuple[Optional[float], Optional[float]]:
     """
-    ดึงจาก analytics_agg (window=use_window_s) มาเฉลี่ยทั้ง period แล้ว upsert ลง analytics_kpi
-    spec_lookup: fn(key)->(lsl,usl)  | key: (tenant_id,factory_id,machine_id,sensor_id,metric,period_start)
+    (sigma_within, sigma_overall) จาก moment ที่รวมแล้ว
+    within  = pooled sd ภายใน bucket: sqrt(ΣM2_i / (n - k))      → Cp/Cpk
+    overall = sample sd ทั้ง period:  sqrt(M2_total / (n - 1))   → Pp/Ppk
+    """
+    n, k = int(n or 0), int(k or 0)
+    within = (max(m2_within, 0.0) / (n - k)) ** 0.5 if m2_within is not None and n > k else None
+    overall = (max(m2_total, 0.0) / (n - 1)) ** 0.5 if m2_total is not None and n > 1 else None
+    return within, overall
+
+
+def _base_sql(period: str, src: str, cagg: bool, series: bool, metric: Optional[str],
+              touched: Optional[str]) -> str:
+    """
+    moment ราย (period, series) ใน 1 pass บน agg: n, mean, k (จำนวน bucket),
+    m2_within = ΣM2_i, m2_total = ΣM2_i + Σn_i(mean_i - mean)^2 (Chan แบบหลายกลุ่ม, mean รวมจาก window function)
+    touched = predicate ของแถว agg ที่เปลี่ยน (None = ทุก period, มีค่า = คำนวณใหม่เฉพาะ (key, period) ที่มีแถวตรง predicate)
     """
-    sql = text(f"""
-      WITH base AS (
-        SELECT
-          time_bucket(INTERVAL '1 {period}', bucket_start) AS period_start,
-          tenant_id, factory_id, machine_id, sensor_id, metric,
-          SUM(count_n) AS n,
-          SUM(sum_val) / NULLIF(SUM(count_n),0) AS mean_val,
-          -- stddev ของ aggregate ต้องระวัง; เอาง่าย ๆ ใช้ stddev_pop ของ avg ราย bucket
-          STDDEV_POP(avg_val) AS stddev_val
-        FROM {Config.DB_SCHEMA}.analytics_agg
-        WHERE window_s = :w
+    # แถวเก่า (ก่อน 076) / cagg ไม่มี m2_val → stddev_pop^2 * n (เหมือน _m2_of)
+    m2 = "POWER(a.stddev_val, 2) * a.count_n" if cagg else \
+        "COALESCE(a.m2_val, POWER(a.stddev_val, 2) * a.count_n)"
+    cols = f"""a.tenant_id, a.factory_id, a.machine_id, a.sensor_id, a.metric,
+               a.count_n, a.sum_val, a.avg_val, {m2} AS m2{", a.series_id" if series else ""}"""
+    if touched is None:
+        head = f"""
+      WITH b AS (
+        SELECT time_bucket(INTERVAL '1 {period}', a.bucket_start) AS period_start, {cols}
+        FROM {src} a
+        WHERE a.window_s = :w AND a.count_n > 0
+        { "AND a.metric = :metric" if metric else "" }
+      ),"""
+    else:
+        # touched อยู่ระดับ PK ของ analytics_kpi (ไม่มี sensor_id) → คำนวณทุก sensor ของ key นั้นใหม่
+        # แล้ว join กลับด้วยช่วง bucket_start ของ period → อ่านเฉพาะ chunk ที่เกี่ยว
+        head = f"""
+      WITH touched AS (
+        SELECT DISTINCT time_bucket(INTERVAL '1 {period}', bucket_start) AS period_start,
+               tenant_id, factory_id, machine_id, metric
+        FROM {src}
+        WHERE window_s = :w AND {touched}
         { "AND metric = :metric" if metric else "" }
-        GROUP BY period_start, tenant_id, factory_id, machine_id, sensor_id, metric
+      ),
+      b AS (
+        SELECT t.period_start, {cols}
+        FROM touched t
+        JOIN {src} a
+          ON a.tenant_id = t.tenant_id AND a.factory_id = t.factory_id
+         AND a.machine_id = t.machine_id AND a.metric = t.metric
+         AND a.bucket_start >= t.period_start AND a.bucket_start < t.period_start + INTERVAL '1 {period}'
+        WHERE a.window_s = :w AND a.count_n > 0
+      ),"""
+    return head + f"""
+      mu AS (
+        SELECT b.*, SUM(sum_val) OVER s / SUM(count_n) OVER s AS mean_all
+        FROM b
+        WINDOW s AS (PARTITION BY period_start, tenant_id, factory_id, machine_id, sensor_id, metric)
       )
-      SELECT * FROM base
-    """)
-    rows = db.execute(sql, {"w": use_window_s, **({"metric": metric} if metric else {})}).mappings().all()
+      SELECT
+        period_start, tenant_id, factory_id, machine_id, sensor_id, metric,
+        SUM(count_n) AS n,
+        SUM(sum_val) / SUM(count_n) AS mean_val,
+        COUNT(*) AS k,
+        SUM(m2) AS m2_within,
+        SUM(m2) + SUM(count_n * POWER(avg_val - mean_all, 2)) AS m2_total
+        { ", MAX(series_id) AS series_id" if series else "" }
+      FROM mu
+      GROUP BY period_start, tenant_id, factory_id, machine_id, sensor_id, metric
+    """
+
 
+def _upsert_kpi(db: Session, rows, period: str, spec_lookup: Optional[callable], series: bool) -> int:
+    resolver = default_resolver() if spec_lookup is None else None
+    if resolver is not None:
+        resolver.refresh_if_stale(db)
+        spec_lookup = resolver.kpi_limits
+    out = []
     for r in rows:
         key = (r["tenant_id"], r["factory_id"], r["machine_id"], r["sensor_id"], r["metric"], r["period_start"])
         lsl = usl = None
         if spec_lookup:
-            lsl, usl = spec_lookup(*key)  # ผู้ใช้ส่งฟังก์ชันมาเอง (อ่านจาก config/table อื่น ๆ )
-
-        cp, cpk = _compute_cp_cpk(r["mean_val"], r["stddev_val"], lsl, usl)
-        sql_upsert = text(f"""
-          INSERT INTO {Config.DB_SCHEMA}.analytics_kpi
-          (period, period_start, tenant_id, factory_id, machine_id, sensor_id, metric,
-           n, mean_val, stddev_val, cp, cpk, pp, ppk)
-          VALUES (:period, :period_start, :tenant_id, :factory_id, :machine_id, :sensor_id, :metric,
-                  :n, :mean_val, :stddev_val, :cp, :cpk, :pp, :ppk)
-          ON CONFLICT (tenant_id, factory_id, machine_id, metric, period, period_start)
-          DO UPDATE SET
-            n = EXCLUDED.n, mean_val = EXCLUDED.mean_val, stddev_val = EXCLUDED.stddev_val,
-            cp = EXCLUDED.cp, cpk = EXCLUDED.cpk, pp = EXCLUDED.pp, ppk = EXCLUDED.ppk,
-            updated_at = NOW();
-        """)
-        db.execute(sql_upsert, {
+            lsl, usl = spec_lookup(*key)  # ค่าเริ่มต้น: SpecResolver (analytics_spec_limits) / ส่งฟังก์ชันมาเองได้
+
+        within, overall = _sigmas(r["n"], r["k"], r["m2_within"], r["m2_total"])
+        cp, cpk = _compute_cp_cpk(r["mean_val"], within, lsl, usl)
+        pp, ppk = _compute_cp_cpk(r["mean_val"], overall, lsl, usl)
+        out.append({
             "period": period, "period_start": r["period_start"],
             "tenant_id": r["tenant_id"], "factory_id": r["factory_id"], "machine_id": r["machine_id"],
             "sensor_id": r["sensor_id"], "metric": r["metric"],
-            "n": int(r["n"] or 0), "mean_val": r["mean_val"], "stddev_val": r["stddev_val"],
-            "cp": cp, "cpk": cpk, "pp": None, "ppk": None  # pp/ppk ไว้เพิ่มภายหลัง
+            "n": int(r["n"] or 0), "mean_val": r["mean_val"],
+            "stddev_val": overall, "stddev_within": within,
+            "cp": cp, "cpk": cpk, "pp": pp, "ppk": ppk,
+            # series_id (077_analytics_series.sql) มาจากแถว agg ของ series เดียวกัน
+            **({"series_id": r["series_id"]} if series else {}),
         })
+    if resolver is not None:
+        resolver.flush_metrics()
+    return AnalyticsRepo(db).upsert_kpi_many(out)
+
+
+def compute_kpi(
+    db: Session,
+    period: str = "day",
+    metric: Optional[str] = None,
+    spec_lookup: Optional[callable] = None,
+    use_window_s: int = 60
+) -> int:
+    """
+    ดึงจาก analytics_agg (window=use_window_s) มาเฉลี่ยทั้ง period แล้ว upsert ลง analytics_kpi
+    (AGG_ENGINE=cagg: อ่าน v_agg_cagg แทน — continuous aggregate ไม่มี series_id)
+    spec_lookup: fn(key)->(lsl,usl)  | key: (tenant_id,factory_id,machine_id,sensor_id,metric,period_start)
+                 None = default_resolver().kpi_limits (usl/lsl ที่มีผล ณ ต้น period)
+    คำนวณใหม่ทุก period — งานประจำใช้ compute_kpi_incremental; คืนจำนวนแถว kpi ที่เขียน
+    """
+    _period_floor(datetime.now(timezone.utc), period)  # validate period ก่อนประกอบ SQL
+    src, cagg = _source()
+    series = Config.SERIES_IDS_ENABLED and not cagg
+    sql = text(_base_sql(period, src, cagg, series, metric, None))
+    rows = db.execute(sql, {"w": use_window_s, **({"metric": metric} if metric else {})}).mappings().all()
+    n = _upsert_kpi(db, rows, period, spec_lookup, series)
     db.commit()
+    return n
+
+
+def kpi_job_name(period: str, use_window_s: int, metric: Optional[str]) -> str:
+    return f"kpi:{period}:{use_window_s}:{metric or '*'}"
+
+
+def compute_kpi_incremental(
+    db: Session,
+    period: str = "day",
+    metric: Optional[str] = None,
+    spec_lookup: Optional[callable] = None,
+    use_window_s: int = 60
+) -> Dict[str, object]:
+    """
+    คำนวณใหม่เฉพาะ (series, period) ที่แถว agg ถูกเขียนตั้งแต่รอบก่อน (high-water mark บน updated_at)
+    เก็บ mark ใน analytics.kpi_watermarks (cloud/db/081_analytics_kpi_watermarks.sql) — ยังไม่มี mark = คำนวณทั้งหมด
+
+    - updated_at = NOW() ของ transaction ผู้เขียน (เวลาเริ่ม tx) → tx ที่ commit หลังเรารันอาจมีค่าน้อยกว่า mark
+      จึงย้อนอ่านซ้อนรอบก่อน KPI_WATERMARK_LAG_S (upsert ซ้ำได้ผลเท่าเดิม)
+    - สแกนเฉพาะ bucket_start ภายใน KPI_LOOKBACK_DAYS (ตัด chunk เก่า/บีบอัด) — backfill ที่เก่ากว่านี้ให้รัน compute_kpi
+    - AGG_ENGINE=cagg: view ไม่มี updated_at → ถือว่า bucket ที่ refresh policy ยังแก้ได้ (ย้อน KPI_CAGG_REFRESH_S) เปลี่ยน
+    คืน {"mode", "rows", "duration_s", "since", "high_water"}
+    """
+    _period_floor(datetime.now(timezone.utc), period)
+    t0 = time.perf_counter()
+    src, cagg = _source()
+    series = Config.SERIES_IDS_ENABLED and not cagg
+    job = kpi_job_name(period, use_window_s, metric)
+
+    mark, now = db.execute(text(f"""
+      SELECT (SELECT high_water FROM {Config.DB_SCHEMA}.kpi_watermarks WHERE job = :job), NOW()
+    """), {"job": job}).one()
+    params = {"w": use_window_s, **({"metric": metric} if metric else {})}
+    if mark is None:
+        mode, since = "full", None
+        sql = _base_sql(period, src, cagg, series, metric, None)
+    elif cagg:
+        mode, since = "incremental", mark - timedelta(seconds=Config.KPI_CAGG_REFRESH_S)
+        sql = _base_sql(period, src, cagg, series, metric, "bucket_start >= :since")
+        params["since"] = since
+    else:
+        mode, since = "incremental", mark - timedelta(seconds=Config.KPI_WATERMARK_LAG_S)
+        sql = _base_sql(period, src, cagg, series, metric, "updated_at >= :since AND bucket_start >= :floor")
+        params.update(since=since, floor=now - timedelta(days=Config.KPI_LOOKBACK_DAYS))
+
+    rows = db.execute(text(sql), params).mappings().all()
+    n = _upsert_kpi(db, rows, period, spec_lookup, series)
+    # mark = NOW() ของ tx นี้ (เวลาเริ่ม) → ไม่ข้ามแถวที่เขียนระหว่างสแกน; commit พร้อม kpi
+    db.execute(text(f"""
+      INSERT INTO {Config.DB_SCHEMA}.kpi_watermarks (job, high_water) VALUES (:job, :hw)
+      ON CONFLICT (job) DO UPDATE SET high_water = EXCLUDED.high_water, updated_at = NOW();
+    """), {"job": job, "hw": now})
+    db.commit()
+
+    dt = time.perf_counter() - t0
+    kpi_runs.labels(mode=mode).inc()
+    kpi_rows.inc(n)
+    kpi_run_time.labels(mode=mode).observe(dt)
+    return {"mode": mode, "rows": n, "duration_s": round(dt, 3),
+            "since": since.isoformat() if since else None, "high_water": now.isoformat()}
@@ -0,0 +1,79 @@
+# app/services/series.py
+"""
+Series dictionary: (tenant, factory, machine, sensor, metric) → series_id (analytics.analytics_series)
+
+- cache แบบ LRU ใน process: hot path เป็นแค่ dict lookup
+- key ที่ยังไม่เคยเห็น → สร้าง/อ่าน id แบบ bulk 1 statement ต่อ batch
+  ใน session ของตัวเอง (commit ทันที) → id ใน cache มีอยู่จริงใน DB เสมอ
+  แม้ transaction ของ batch จะ rollback ภายหลัง
+- thread-safe (staged pipeline เรียกจาก writer thread)
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List
+
+from app.adapters.repository import AnalyticsRepo
+from app.pipelines.batch import MeasurementKey
+
+
+def key_of_row(r: dict) -> MeasurementKey:
+    return (r["tenant_id"], r["factory_id"], r["machine_id"], r.get("sensor_id"), r["metric"])
+
+
+class SeriesCache:
+    def __init__(self, session_factory: Callable, max_size: int = 200_000):
+        self.session_factory = session_factory
+        self.max_size = max_size
+        self._ids: "OrderedDict[MeasurementKey, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _put(self, key: MeasurementKey, sid: int) -> None:
+        self._ids[key] = sid
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def resolve(self, keys: Iterable[MeasurementKey]) -> Dict[MeasurementKey, int]:
+        """key → series_id (สร้างใน DB ให้ถ้ายังไม่มี)"""
+        out: Dict[MeasurementKey, int] = {}
+        missing: List[MeasurementKey] = []
+        with self._lock:
+            for k in dict.fromkeys(keys):
+                sid = self._ids.get(k)
+                if sid is None:
+                    missing.append(k)
+                    continue
+                self._ids.move_to_end(k)
+                out[k] = sid
+            self.hits += len(out)
+            self.misses += len(missing)
+        if missing:
+            db = self.session_factory()
+            try:
+                got = AnalyticsRepo(db).ensure_series_many(missing)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+            with self._lock:
+                for k, sid in got.items():
+                    self._put(k, sid)
+            out.update(got)
+        return out
+
+    def attach(self, rows: List[dict]) -> List[dict]:
+        """เติม series_id ให้แถว agg/anomaly (in-place)"""
+        if rows:
+            ids = self.resolve(key_of_row(r) for r in rows)
+            for r in rows:
+                r["series_id"] = ids[key_of_row(r)]
+        return rows
@@ -0,0 +1,165 @@
+# app/services/spec_resolver.py
+"""
+Spec/control limits ที่มีผล ณ เวลาใด ๆ ต่อ series (analytics.analytics_spec_limits)
+
+- โหลดทั้งตารางครั้งเดียว (1 query) เป็น interval index ใน memory:
+  (tenant, factory, machine, metric) → ช่วง [lower, upper) เรียงตาม lower → bisect
+  (spec_no_overlap รับประกันว่าช่วงของ key เดียวกันไม่ซ้อนกัน)
+- โหลดใหม่เมื่อครบ ttl_s (สร้าง index ใหม่แล้วสลับทั้งก้อน → reader ไม่ต้องล็อก)
+  โหลดไม่สำเร็จ (เช่นยังไม่รัน migration) → ใช้ index เดิมต่อ แล้วลองใหม่รอบถัดไป
+- sensor_id ของแถว spec: NULL = ทุก sensor ของ machine/metric นั้น, มีค่า = เฉพาะ sensor นั้น
+- hit/miss นับเป็น int แล้ว flush_metrics() ทีละรอบ (ไม่ inc Prometheus ราย lookup)
+
+default_resolver() เป็น resolver กลางของ process ที่ KPI / stream anomaly ใช้เป็นค่าเริ่มต้น
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.config import Config
+from app.instrumentation.metrics import spec_entries, spec_lookups, spec_refresh
+from app.pipelines.batch import MeasurementKey
+from app.utils.time import dt_to_ms
+
+_INF = float("inf")
+
+
+class SpecLimits(NamedTuple):
+    cl: Optional[float]
+    ucl: Optional[float]
+    lcl: Optional[float]
+    usl: Optional[float]
+    lsl: Optional[float]
+    sensor_id: Optional[str] = None
+
+
+# key → (lower ms ที่เรียงแล้ว, upper ms, limits)
+_Index = Dict[Tuple[str, str, str, str], Tuple[List[float], List[float], List[SpecLimits]]]
+
+_hits = spec_lookups.labels(result="hit")
+_misses = spec_lookups.labels(result="miss")
+
+
+def build_index(rows) -> _Index:
+    """แถว (tenant, factory, machine, sensor, metric, lower, upper, cl, ucl, lcl, usl, lsl) → index"""
+    tmp: Dict[tuple, list] = {}
+    for r in rows:
+        tenant, factory, machine, sensor, metric, lo, hi, cl, ucl, lcl, usl, lsl = r
+        tmp.setdefault((tenant, factory, machine, metric), []).append((
+            dt_to_ms(lo) if lo is not None else -_INF,
+            dt_to_ms(hi) if hi is not None else _INF,
+            SpecLimits(cl, ucl, lcl, usl, lsl, sensor),
+        ))
+    out: _Index = {}
+    for k, iv in tmp.items():
+        iv.sort(key=lambda x: x[0])
+        out[k] = ([x[0] for x in iv], [x[1] for x in iv], [x[2] for x in iv])
+    return out
+
+
+class SpecResolver:
+    def __init__(self, session_factory: Callable, ttl_s: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.session_factory = session_factory
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self._index: _Index = {}
+        self._expires = -_INF
+        self._load_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._flushed = (0, 0)
+
+    def __len__(self) -> int:
+        return sum(len(v[0]) for v in self._index.values())
+
+    def load(self, db=None) -> int:
+        """โหลดทั้งตารางใหม่ (db = session ที่มีอยู่แล้ว หรือเปิดเองจาก session_factory)"""
+        own = db is None
+        if own:
+            db = self.session_factory()
+        try:
+            rows = db.execute(text(f"""
+              SELECT tenant_id, factory_id, machine_id, sensor_id, metric,
+                     lower(period), upper(period), cl, ucl, lcl, usl, lsl
+              FROM {Config.DB_SCHEMA}.analytics_spec_limits
+            """)).all()
+        finally:
+            if own:
+                db.close()
+        self._index = build_index(rows)
+        self._expires = self.clock() + self.ttl_s
+        spec_entries.set(len(rows))
+        return len(rows)
+
+    def refresh_if_stale(self, db=None) -> None:
+        if self.clock() < self._expires or not self._load_lock.acquire(blocking=False):
+            return  # ยังไม่หมดอายุ หรือ thread อื่นกำลังโหลด (ใช้ index เดิมไปก่อน)
+        try:
+            if self.clock() < self._expires:
+                return
+            if db is not None:
+                with db.begin_nested():
+                    self.load(db)
+            else:
+                self.load()
+            spec_refresh.labels(status="ok").inc()
+        except Exception as e:
+            self._expires = self.clock() + self.ttl_s
+            spec_refresh.labels(status="error").inc()
+            print(f"[spec] reload failed (using {len(self)} cached limits): {e}")
+        finally:
+            self._load_lock.release()
+
+    def get(self, key: MeasurementKey, t_ms: float) -> Optional[SpecLimits]:
+        """limits ของ series (tenant, factory, machine, sensor, metric) ณ เวลา t_ms (epoch ms)"""
+        if self.clock() >= self._expires:
+            self.refresh_if_stale()
+        iv = self._index.get((key[0], key[1], key[2], key[4]))
+        if iv is not None:
+            i = bisect_right(iv[0], t_ms) - 1
+            if i >= 0 and t_ms < iv[1][i]:
+                lim = iv[2][i]
+                if lim.sensor_id is None or lim.sensor_id == key[3]:
+                    self.hits += 1
+                    return lim
+        self.misses += 1
+        return None
+
+    def kpi_limits(self, tenant_id: str, factory_id: str, machine_id: str, sensor_id: Optional[str],
+                   metric: str, period_start: datetime) -> Tuple[Optional[float], Optional[float]]:
+        """รูปแบบ spec_lookup ของ compute_kpi: (lsl, usl) ที่มีผล ณ ต้น period"""
+        lim = self.get((tenant_id, factory_id, machine_id, sensor_id, metric), dt_to_ms(period_start))
+        return (lim.lsl, lim.usl) if lim is not None else (None, None)
+
+    def flush_metrics(self) -> None:
+        h, m = self.hits, self.misses
+        fh, fm = self._flushed
+        if h > fh:
+            _hits.inc(h - fh)
+        if m > fm:
+            _misses.inc(m - fm)
+        self._flushed = (h, m)
+
+
+_default: Optional[SpecResolver] = None
+_default_lock = threading.Lock()
+
+
+def default_resolver() -> Optional[SpecResolver]:
+    """resolver กลางของ process (SPEC_LIMITS_ENABLED=0 → None = ไม่ใช้ spec limits)"""
+    global _default
+    if not Config.SPEC_LIMITS_ENABLED:
+        return None
+    with _default_lock:
+        if _default is None:
+            from app.database import SessionLocal
+            _default = SpecResolver(SessionLocal, ttl_s=Config.SPEC_CACHE_TTL_S)
+        return _default
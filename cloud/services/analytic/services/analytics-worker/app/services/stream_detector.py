@@ -0,0 +1,162 @@
+# app/services/stream_detector.py
+"""
+Streaming anomaly detection (WE-1..4) ราย series — อัปเดตทีละ measurement ระหว่างที่ batch ไหลผ่าน worker
+ต่างจาก detect_anomalies() ที่ต้องมี point ครบทั้ง series แล้วคำนวณ CL/σ ใหม่ทุกครั้ง
+
+state ต่อ series (memory คงที่):
+  - OnlineStats (Welford) สำหรับ CL/σ แบบ rolling: เมื่อ n เกิน baseline_n จะตรึง n ไว้
+    → ค่าใหม่มีน้ำหนัก ~1/baseline_n (ลืมข้อมูลเก่าแบบ exponential)
+  - ring buffer 8 จุดล่าสุด (พอสำหรับ WE-4 ซึ่งยาวสุด)
+ตรวจจุดใหม่กับ limit "ก่อน" รวมจุดนั้นเข้า stats (outlier ไม่ดึง limit ของตัวเอง)
+series ที่มี control limits (cl/ucl/lcl) ใน analytics_spec_limits ณ เวลาของจุด → ใช้ limit นั้นแทน CL/σ แบบ rolling
+(σ = (ucl - lcl) / 6, ไม่ต้องรอ warmup) — ส่ง limits=SpecResolver เข้ามา
+
+series ที่ไม่มีข้อมูลเกิน idle_ttl_s ถูก evict; จำนวน series เกิน max_series → ตัดตัวที่ใช้ล่าสุดนานที่สุด (LRU)
+ลำดับจุดในแต่ละ series = ลำดับที่มาถึง (ภายใน partition ของ Kafka ปกติเรียงตามเวลาอยู่แล้ว)
+"""
+
+from __future__ import annotations
+
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, List, Optional
+
+from app.pipelines.batch import MeasurementBatch, MeasurementKey
+from app.services.spec_resolver import SpecResolver
+from app.utils.stats import OnlineStats
+from app.utils.time import ms_to_dt
+
+
+class SeriesState:
+    __slots__ = ("stats", "ring", "last_seen")
+
+    def __init__(self, now: float):
+        self.stats = OnlineStats()
+        self.ring: Deque[float] = deque(maxlen=8)
+        self.last_seen = now
+
+
+def _same_side(win: List[float], cl: float, thr: float, k: int) -> bool:
+    hi = sum(1 for x in win if x > cl + thr)
+    lo = sum(1 for x in win if x < cl - thr)
+    return (hi >= k and lo == 0) or (lo >= k and hi == 0)
+
+
+def check_rules(ring: Deque[float], cl: float, std: float) -> List[tuple]:
+    """
+    WE-1..4 ที่จุดล่าสุดของ ring (เงื่อนไขเดียวกับ app.domain.rules) → [(code, detail)]
+    """
+    v = ring[-1]
+    win = list(ring)
+    n = len(win)
+    out = []
+    if std > 0:
+        ucl, lcl = cl + 3*std, cl - 3*std
+        if v > ucl or v < lcl:
+            out.append(("WE-1", {"ucl": ucl, "lcl": lcl, "v": v}))
+        if n >= 3 and _same_side(win[-3:], cl, 2*std, 2):
+            out.append(("WE-2", {"window": win[-3:]}))
+        if n >= 5 and _same_side(win[-5:], cl, std, 4):
+            out.append(("WE-3", {"window": win[-5:]}))
+    if n >= 8:
+        above = sum(1 for x in win if x > cl)
+        below = sum(1 for x in win if x < cl)
+        if (below == 0 and above > 0) or (above == 0 and below > 0):
+            out.append(("WE-4", {"window": win}))
+    return out
+
+
+class StreamDetector:
+    def __init__(self, max_series: int = 100_000, idle_ttl_s: float = 3600.0,
+                 warmup_n: int = 30, baseline_n: int = 500,
+                 clock: Callable[[], float] = time.monotonic,
+                 limits: Optional[SpecResolver] = None):
+        self.max_series = max_series
+        self.idle_ttl_s = idle_ttl_s
+        self.warmup_n = warmup_n
+        self.baseline_n = baseline_n
+        self.clock = clock
+        self.limits = limits
+        self._series: "OrderedDict[MeasurementKey, SeriesState]" = OrderedDict()  # LRU: เก่าสุดอยู่หน้า
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    def _state(self, key: MeasurementKey, now: float) -> SeriesState:
+        st = self._series.get(key)
+        if st is None:
+            st = self._series[key] = SeriesState(now)
+            if len(self._series) > self.max_series:
+                self._series.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._series.move_to_end(key)
+            st.last_seen = now
+        return st
+
+    def update(self, key: MeasurementKey, t: int, value: float, now: Optional[float] = None) -> List[dict]:
+        """รับ 1 จุด (t = epoch ms) → anomaly row (รูปแบบเดียวกับ detect_anomalies / analytics_anomaly)"""
+        st = self._state(key, self.clock() if now is None else now)
+        s = st.stats
+        st.ring.append(value)
+
+        out: List[dict] = []
+        spec = self.limits.get(key, t) if self.limits is not None else None
+        if spec is not None and spec.cl is not None and spec.ucl is not None and spec.lcl is not None:
+            cl, std, ucl, lcl, source = spec.cl, (spec.ucl - spec.lcl) / 6.0, spec.ucl, spec.lcl, "spec"
+        elif s.n >= self.warmup_n:
+            cl, std, source = s.mean, s.std, "rolling"
+            ucl, lcl = cl + 3*std, cl - 3*std
+        else:
+            source = None
+        if source is not None:
+            hits = check_rules(st.ring, cl, std)
+            if hits:
+                tenant, factory, machine, sensor, metric = key
+                z = (value - cl) / std if std > 0 else None
+                ts = ms_to_dt(t)
+                for code, detail in hits:
+                    out.append({
+                        "time": ts,
+                        "tenant_id": tenant, "factory_id": factory, "machine_id": machine,
+                        "sensor_id": sensor, "metric": metric,
+                        "rule_code": code,
+                        "severity": 3 if code == "WE-1" else 2,
+                        "value": float(value),
+                        "cl": cl, "ucl": ucl, "lcl": lcl,
+                        "zscore": z,
+                        "details": {"reason": "stream", "limits": source, "n": s.n, **detail},
+                    })
+
+        s.push(value)
+        if s.n > self.baseline_n:
+            # rolling: ตรึง n → M2 ลดตามสัดส่วน (variance คงเดิม) และจุดถัดไปมีน้ำหนัก 1/baseline_n
+            s.M2 *= self.baseline_n / s.n
+            s.n = self.baseline_n
+        return out
+
+    def process(self, batch: MeasurementBatch) -> List[dict]:
+        """ทั้ง batch (columnar) → anomaly rows"""
+        now = self.clock()
+        out: List[dict] = []
+        for key, t, v in zip(batch.keys, batch.times, batch.values):
+            hits = self.update(key, t, v, now)
+            if hits:
+                out.extend(hits)
+        if self.limits is not None:
+            self.limits.flush_metrics()
+        return out
+
+    def evict_idle(self) -> int:
+        """ลบ series ที่ไม่มีข้อมูลเกิน idle_ttl_s (OrderedDict เรียงตามการใช้ล่าสุด → หยุดที่ตัวแรกที่ยังไม่หมดอายุ)"""
+        cutoff = self.clock() - self.idle_ttl_s
+        n = 0
+        while self._series:
+            key, st = next(iter(self._series.items()))
+            if st.last_seen > cutoff:
+                break
+            self._series.popitem(last=False)
+            n += 1
+        self.evicted += n
+        return n
@@ -0,0 +1,118 @@
+# app\utils\sketch.py
+
+from __future__ import annotations
+import math
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional
+
+# relative accuracy ของ quantile (1%) — ต้องตรงกันทุก sketch ที่จะ merge กัน
+DEFAULT_ALPHA = 0.01
+# จำกัดจำนวน bin ต่อฝั่ง; เกินแล้วยุบ bin ค่าน้อยสุดรวมกัน (กระทบแค่ quantile ต่ำ ๆ)
+# ต้องตรงกับ max_bins ของ analytics.ddsketch_collapse ใน cloud/db/076_analytics_agg_state.sql
+MAX_BINS = 1024
+# |x| ต่ำกว่านี้นับเป็นศูนย์
+MIN_INDEXABLE = 1e-9
+
+
+@dataclass
+class DDSketch:
+    """
+    DDSketch แบบย่อ: นับจำนวนค่าใน bin log-scale (gamma = (1+a)/(1-a))
+    merge = บวก count ราย bin → รวมข้าม batch ได้โดยไม่ต้องเก็บ raw
+    รูปแบบ JSON (ใช้ร่วมกับ analytics.ddsketch_merge / ddsketch_quantile ใน DB):
+      {"a": alpha, "z": zero_count, "p": {"idx": count}, "n": {"idx": count}}
+    """
+    alpha: float = DEFAULT_ALPHA
+    zero: int = 0
+    pos: Dict[int, int] = field(default_factory=dict)
+    neg: Dict[int, int] = field(default_factory=dict)
+
+    @property
+    def gamma(self) -> float:
+        return (1 + self.alpha) / (1 - self.alpha)
+
+    @property
+    def count(self) -> int:
+        return self.zero + sum(self.pos.values()) + sum(self.neg.values())
+
+    def index(self, x: float) -> int:
+        return int(math.ceil(math.log(x) / math.log(self.gamma)))
+
+    def add(self, x: float, n: int = 1):
+        if x > MIN_INDEXABLE:
+            i = self.index(x)
+            self.pos[i] = self.pos.get(i, 0) + n
+        elif x < -MIN_INDEXABLE:
+            i = self.index(-x)
+            self.neg[i] = self.neg.get(i, 0) + n
+        else:
+            self.zero += n
+
+    def merge(self, other: "DDSketch") -> "DDSketch":
+        if other.alpha != self.alpha:
+            raise ValueError("cannot merge sketches with different alpha")
+        self.zero += other.zero
+        for i, c in other.pos.items():
+            self.pos[i] = self.pos.get(i, 0) + c
+        for i, c in other.neg.items():
+            self.neg[i] = self.neg.get(i, 0) + c
+        self._collapse()
+        return self
+
+    def _collapse(self):
+        for bins in (self.pos, self.neg):
+            if len(bins) <= MAX_BINS:
+                continue
+            keys = sorted(bins)
+            extra = len(keys) - MAX_BINS
+            moved = sum(bins.pop(k) for k in keys[:extra])
+            bins[keys[extra]] += moved
+
+    def _value(self, i: int) -> float:
+        g = self.gamma
+        return 2.0 * g ** i / (g + 1.0)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """q: 0..1 (rank = q*(n-1) เหมือน ddsketch_quantile ใน DB)"""
+        total = self.count
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        acc = 0
+        for i in sorted(self.neg, reverse=True):
+            acc += self.neg[i]
+            if acc > rank:
+                return -self._value(i)
+        acc += self.zero
+        if acc > rank:
+            return 0.0
+        for i in sorted(self.pos):
+            acc += self.pos[i]
+            if acc > rank:
+                return self._value(i)
+        return self._value(max(self.pos)) if self.pos else 0.0
+
+    @classmethod
+    def from_values(cls, values: Iterable[float], alpha: float = DEFAULT_ALPHA) -> "DDSketch":
+        s = cls(alpha=alpha)
+        for v in values:
+            s.add(v)
+        s._collapse()
+        return s
+
+    def to_dict(self) -> dict:
+        return {
+            "a": self.alpha, "z": self.zero,
+            "p": {str(i): c for i, c in self.pos.items()},
+            "n": {str(i): c for i, c in self.neg.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, d: Optional[dict]) -> Optional["DDSketch"]:
+        if not d:
+            return None
+        return cls(
+            alpha=float(d.get("a", DEFAULT_ALPHA)), zero=int(d.get("z", 0)),
+            pos={int(i): int(c) for i, c in (d.get("p") or {}).items()},
+            neg={int(i): int(c) for i, c in (d.get("n") or {}).items()},
+        )
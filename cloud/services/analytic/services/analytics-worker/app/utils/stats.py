@@ -3,6 +3,7 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from typing import Iterable, List, Optional
+from app.utils.sketch import DDSketch
 
 @dataclass
 class OnlineStats:
@@ -17,6 +18,27 @@ class OnlineStats:
         delta2 = x - self.mean
         self.M2 += delta * delta2
 
+    def merge(self, other: "OnlineStats") -> "OnlineStats":
+        """รวม state สองก้อน (Chan et al.) — ผลเท่ากับ push ทุกค่าต่อกัน"""
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n, self.mean, self.M2 = other.n, other.mean, other.M2
+            return self
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.M2 += other.M2 + delta * delta * self.n * other.n / n
+        self.n = n
+        return self
+
+    @classmethod
+    def from_values(cls, values: Iterable[float]) -> "OnlineStats":
+        s = cls()
+        for x in values:
+            s.push(x)
+        return s
+
     @property
     def variance(self) -> float:
         return (self.M2 / self.n) if self.n > 0 else 0.0
@@ -25,6 +47,54 @@ class OnlineStats:
     def std(self) -> float:
         return self.variance ** 0.5
 
+def least(a, b):
+    # เหมือน LEAST/GREATEST ของ Postgres (ข้าม NULL)
+    if a is None: return b
+    if b is None: return a
+    return min(a, b)
+
+def greatest(a, b):
+    if a is None: return b
+    if b is None: return a
+    return max(a, b)
+
+def merge_agg_row(cur: dict, new: dict) -> dict:
+    """
+    รวมแถว analytics_agg สองแถวของ bucket เดียวกัน (ตรงกับ ON CONFLICT ของ upsert_agg):
+    count/sum บวกกัน, mean/M2 รวมแบบ Chan, min/max, sketch merge แล้วอ่าน p95 จาก sketch
+    """
+    a = OnlineStats(cur["count_n"], (cur.get("sum_val") or 0) / cur["count_n"] if cur["count_n"] else 0.0,
+                    _m2_of(cur))
+    b = OnlineStats(new["count_n"], (new.get("sum_val") or 0) / new["count_n"] if new["count_n"] else 0.0,
+                    _m2_of(new))
+    a.merge(b)
+
+    out = dict(cur)
+    out["count_n"] = a.n
+    out["sum_val"] = (cur.get("sum_val") or 0) + (new.get("sum_val") or 0)
+    out["avg_val"] = out["sum_val"] / a.n if a.n else None
+    out["m2_val"] = a.M2
+    out["stddev_val"] = a.std
+    out["min_val"] = least(cur.get("min_val"), new.get("min_val"))
+    out["max_val"] = greatest(cur.get("max_val"), new.get("max_val"))
+
+    sk_a, sk_b = cur.get("sketch"), new.get("sketch")
+    if sk_a is not None and sk_b is not None:
+        merged = DDSketch(alpha=sk_a.alpha).merge(sk_a).merge(sk_b)
+        out["sketch"] = merged
+        out["p95_val"] = merged.quantile(0.95)
+    else:
+        out["sketch"] = sk_b if sk_b is not None else sk_a
+        out["p95_val"] = new.get("p95_val")
+    return out
+
+def _m2_of(row: dict) -> float:
+    # แถวเก่า (ก่อนมี m2_val) ประมาณจาก stddev_pop: M2 = sd^2 * n
+    if row.get("m2_val") is not None:
+        return row["m2_val"]
+    sd = row.get("stddev_val") or 0.0
+    return sd * sd * row["count_n"]
+
 def percentile(values: List[float], q: float) -> Optional[float]:
     """
     q: 0..1
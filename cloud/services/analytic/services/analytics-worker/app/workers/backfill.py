@@ -0,0 +1,261 @@
+# app/workers/backfill.py
+"""
+Backfill runner: แบ่ง [start, end) เป็น chunk ตาม chunk ของ hypertable raw แล้วรัน backfill_aggregates
+ทีละ chunk (transaction สั้น) แบบขนานจำกัดจำนวน — แต่ละ chunk ใช้ connection ของตัวเอง
+
+- ขอบ chunk ลงตัวทั้ง chunk_time_interval ของ hypertable และทุก window → bucket หยาบ (cascade) ไม่คร่อม chunk
+- chunk ที่เสร็จบันทึกใน analytics.backfill_checkpoints (cloud/db/079_backfill_checkpoints.sql)
+  รันซ้ำด้วย job_id เดิม → ข้าม chunk ที่ done, ทำ chunk ที่ failed ใหม่
+- chunk ที่ล้มไม่หยุดทั้ง job; สถานะ/rows ต่อวินาทีดูได้จาก BackfillJob.status()
+
+    python -m app.workers.backfill --start 2025-07-01T00:00:00Z --end 2025-08-01T00:00:00Z --parallel 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import reduce
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.config import Config
+from app.database import SessionLocal
+from app.instrumentation.metrics import backfill_chunks, backfill_rows, backfill_chunk_time
+from app.services.backfill import RAW_TABLE, backfill_aggregates
+from app.utils.time import dt_to_ms, ms_to_dt, parse_ts
+
+Chunk = Tuple[datetime, datetime]
+
+_jobs: Dict[str, "BackfillJob"] = {}
+_jobs_lock = threading.Lock()
+
+
+def raw_chunk_interval_s(db) -> Optional[int]:
+    """chunk_time_interval ของ hypertable raw (None ถ้าไม่ใช่ hypertable / ไม่มี TimescaleDB)"""
+    schema, _, table = RAW_TABLE.rpartition(".")
+    try:
+        with db.begin_nested():
+            iv = db.execute(text("""
+              SELECT EXTRACT(EPOCH FROM time_interval)::bigint
+              FROM timescaledb_information.dimensions
+              WHERE hypertable_schema = :s AND hypertable_name = :t AND time_interval IS NOT NULL
+              LIMIT 1
+            """), {"s": schema or "public", "t": table}).scalar()
+    except Exception:
+        return None
+    return int(iv) if iv else None
+
+
+def plan_chunks(start: datetime, end: datetime, step_s: int, windows: List[int]) -> List[Chunk]:
+    """
+    [start, end) → chunk ที่ขอบลงตัว step_s และทุก window (นับจาก epoch เหมือน time_bucket/TimescaleDB)
+    chunk แรก/สุดท้ายถูกตัดที่ start/end
+    """
+    step = reduce(lambda a, b: a * b // math.gcd(a, b), [int(step_s), *windows]) * 1000
+    lo, hi = dt_to_ms(start), dt_to_ms(end)
+    out: List[Chunk] = []
+    t = lo - lo % step
+    while t < hi:
+        out.append((ms_to_dt(max(t, lo)), ms_to_dt(min(t + step, hi))))
+        t += step
+    return out
+
+
+def job_id_for(start: datetime, end: datetime, windows: List[int], filters: Dict[str, Optional[str]],
+               cascade: bool) -> str:
+    raw = repr((start.isoformat(), end.isoformat(), sorted(windows),
+                sorted((k, v) for k, v in filters.items() if v), cascade))
+    return "agg-" + hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+
+class BackfillJob:
+    def __init__(self, start: datetime, end: datetime,
+                 windows: Optional[List[int]] = None,
+                 tenant_id: Optional[str] = None, factory_id: Optional[str] = None,
+                 machine_id: Optional[str] = None, metric: Optional[str] = None,
+                 cascade: bool = True, parallel: Optional[int] = None,
+                 chunk_s: Optional[int] = None, job_id: Optional[str] = None,
+                 session_factory: Callable = SessionLocal):
+        self.start, self.end = start, end
+        self.windows = list(windows or Config.WINDOWS)
+        self.filters = {"tenant_id": tenant_id, "factory_id": factory_id,
+                        "machine_id": machine_id, "metric": metric}
+        self.cascade = cascade
+        # เพดาน BACKFILL_PARALLEL: แต่ละ chunk ถือ 1 connection จาก pool ที่ใช้ร่วมกับ API/worker
+        self.parallel = min(max(1, parallel or Config.BACKFILL_PARALLEL), max(1, Config.BACKFILL_PARALLEL))
+        self.chunk_s = chunk_s
+        self.job_id = job_id or job_id_for(start, end, self.windows, self.filters, cascade)
+        self.session_factory = session_factory
+
+        self._lock = threading.Lock()
+        self.state = "pending"
+        self.chunks_total = 0
+        self.chunks_done = 0
+        self.chunks_skipped = 0
+        self.failed: List[dict] = []
+        self.rows = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    # ---- checkpoints ----
+    def _done_chunks(self, db) -> set:
+        rows = db.execute(text(f"""
+          SELECT chunk_start FROM {Config.DB_SCHEMA}.backfill_checkpoints
+          WHERE job_id = :job AND status = 'done'
+        """), {"job": self.job_id}).scalars()
+        return {dt_to_ms(t) for t in rows}
+
+    def _checkpoint(self, db, chunk: Chunk, status: str, rows: Optional[int], dt: float,
+                    error: Optional[str] = None) -> None:
+        db.execute(text(f"""
+          INSERT INTO {Config.DB_SCHEMA}.backfill_checkpoints
+            (job_id, chunk_start, chunk_end, status, rows_written, duration_s, error)
+          VALUES (:job, :cs, :ce, :status, :rows, :dt, :error)
+          ON CONFLICT (job_id, chunk_start) DO UPDATE SET
+            chunk_end = EXCLUDED.chunk_end, status = EXCLUDED.status, rows_written = EXCLUDED.rows_written,
+            duration_s = EXCLUDED.duration_s, error = EXCLUDED.error, updated_at = NOW();
+        """), {"job": self.job_id, "cs": chunk[0], "ce": chunk[1], "status": status,
+               "rows": rows, "dt": dt, "error": error})
+        db.commit()
+
+    # ---- run ----
+    def plan(self) -> List[Chunk]:
+        db = self.session_factory()
+        try:
+            step = self.chunk_s or raw_chunk_interval_s(db) or Config.BACKFILL_CHUNK_S
+            chunks = plan_chunks(self.start, self.end, step, self.windows)
+            done = self._done_chunks(db)
+        finally:
+            db.close()
+        todo = [c for c in chunks if dt_to_ms(c[0]) not in done]
+        with self._lock:
+            self.chunks_total = len(chunks)
+            self.chunks_skipped = len(chunks) - len(todo)
+        return todo
+
+    def _run_chunk(self, chunk: Chunk) -> None:
+        db = self.session_factory()
+        t = time.perf_counter()
+        try:
+            n = backfill_aggregates(db, chunk[0], chunk[1], windows=self.windows,
+                                    cascade=self.cascade, **self.filters)
+            dt = time.perf_counter() - t
+            self._checkpoint(db, chunk, "done", n, dt)
+        except Exception as e:
+            db.rollback()
+            dt = time.perf_counter() - t
+            backfill_chunks.labels(status="failed").inc()
+            with self._lock:
+                self.failed.append({"chunk_start": chunk[0].isoformat(), "error": str(e)[:500]})
+            print(f"[backfill] {self.job_id} chunk {chunk[0].isoformat()} failed: {e}")
+            try:
+                self._checkpoint(db, chunk, "failed", None, dt, str(e)[:2000])
+            except Exception:
+                db.rollback()
+            return
+        finally:
+            db.close()
+
+        backfill_chunks.labels(status="done").inc()
+        backfill_rows.inc(n)
+        backfill_chunk_time.observe(dt)
+        with self._lock:
+            self.chunks_done += 1
+            self.rows += n
+            done, total = self.chunks_done + self.chunks_skipped, self.chunks_total
+        print(f"[backfill] {self.job_id} {done}/{total} {chunk[0].isoformat()} "
+              f"rows={n} ({n / dt if dt else 0:,.0f} rows/s)")
+
+    def run(self) -> dict:
+        with self._lock:
+            self.state = "running"
+            self.started_at = time.time()
+        try:
+            todo = self.plan()
+            with ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix="backfill") as ex:
+                list(ex.map(self._run_chunk, todo))
+        except Exception as e:
+            with self._lock:
+                self.failed.append({"chunk_start": None, "error": str(e)[:500]})
+        with self._lock:
+            self.finished_at = time.time()
+            self.state = "failed" if self.failed else "done"
+        return self.status()
+
+    def status(self) -> dict:
+        with self._lock:
+            elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+            return {
+                "job_id": self.job_id, "state": self.state,
+                "start": self.start.isoformat(), "end": self.end.isoformat(),
+                "windows": self.windows, "filters": {k: v for k, v in self.filters.items() if v},
+                "cascade": self.cascade, "parallel": self.parallel,
+                "chunks_total": self.chunks_total, "chunks_done": self.chunks_done,
+                "chunks_skipped": self.chunks_skipped, "chunks_failed": len(self.failed),
+                "rows": self.rows, "elapsed_s": round(elapsed, 3),
+                "rows_per_s": round(self.rows / elapsed, 1) if elapsed else 0.0,
+                "errors": self.failed[-10:],
+            }
+
+
+def start_job(job: BackfillJob) -> BackfillJob:
+    """รัน job ใน thread พื้นหลัง (admin endpoint); job_id เดิมที่ยังรันอยู่ → คืนตัวเดิม"""
+    with _jobs_lock:
+        cur = _jobs.get(job.job_id)
+        if cur is not None and cur.state in ("pending", "running"):
+            return cur
+        _jobs[job.job_id] = job
+    job.state = "running"
+    threading.Thread(target=job.run, name=f"backfill-{job.job_id}", daemon=True).start()
+    return job
+
+
+def get_job(job_id: str) -> Optional[BackfillJob]:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def list_jobs() -> List[dict]:
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    return [j.status() for j in jobs]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="chunked/resumable backfill ของ analytics_agg")
+    ap.add_argument("--start", required=True, help="ISO8601 (รวม)")
+    ap.add_argument("--end", required=True, help="ISO8601 (ไม่รวม)")
+    ap.add_argument("--windows", default=None, help="เช่น 60,300,3600 (ค่าเริ่มต้น WINDOWS)")
+    ap.add_argument("--tenant-id")
+    ap.add_argument("--factory-id")
+    ap.add_argument("--machine-id")
+    ap.add_argument("--metric")
+    ap.add_argument("--parallel", type=int, default=None, help="จำนวน chunk ที่รันพร้อมกัน (ไม่เกิน BACKFILL_PARALLEL)")
+    ap.add_argument("--chunk-s", type=int, default=None, help="ขนาด chunk (ค่าเริ่มต้น: ตาม hypertable raw)")
+    ap.add_argument("--job-id", default=None, help="ตั้งชื่อเอง (ค่าเริ่มต้น: hash ของพารามิเตอร์)")
+    ap.add_argument("--no-cascade", action="store_true", help="สแกน raw ทุก window (ไม่ rollup จาก analytics_agg)")
+    args = ap.parse_args()
+    if args.parallel is not None and not 1 <= args.parallel <= Config.BACKFILL_PARALLEL:
+        ap.error(f"--parallel must be in [1, {Config.BACKFILL_PARALLEL}] (raise BACKFILL_PARALLEL to allow more)")
+
+    job = BackfillJob(
+        parse_ts(args.start), parse_ts(args.end),
+        windows=[int(w) for w in args.windows.split(",")] if args.windows else None,
+        tenant_id=args.tenant_id, factory_id=args.factory_id, machine_id=args.machine_id, metric=args.metric,
+        cascade=not args.no_cascade, parallel=args.parallel, chunk_s=args.chunk_s, job_id=args.job_id,
+    )
+    st = job.run()
+    print(f"[backfill] {st['job_id']} {st['state']}: {st['chunks_done']} done, {st['chunks_skipped']} skipped, "
+          f"{st['chunks_failed']} failed, rows={st['rows']} in {st['elapsed_s']}s ({st['rows_per_s']:,.0f} rows/s)")
+    raise SystemExit(1 if st["chunks_failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
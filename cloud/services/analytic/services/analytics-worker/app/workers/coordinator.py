@@ -0,0 +1,134 @@
+# app/workers/coordinator.py
+"""
+ประสาน job ตามเวลาข้ามหลาย replica: ทุก replica มี APScheduler ของตัวเอง แต่ job รันจริงที่เดียวต่อรอบ
+
+ต่อการ fire หนึ่งครั้ง:
+  1) จองที่ด้วย session advisory lock บน connection แยก (aw-sched:<job>:<i>, i < max_concurrency)
+     ไม่ว่างทุกช่อง = มี run ของ job นี้ค้างอยู่ครบจำนวนแล้ว → ข้าม (locked)
+  2) claim slot ของรอบนี้ใน analytics.scheduler_runs (PK job + slot_start, cloud/db/084_scheduler_runs.sql)
+     replica อื่นรันรอบนี้ไปแล้ว (นาฬิกาคลาดกัน/fire ช้า) → ข้าม (done_elsewhere)
+  3) รัน job แล้วบันทึก status/duration ลงแถวเดิม
+
+replica ที่ถือ lock ตาย → connection หลุด → Postgres ปล่อย lock เอง → รอบถัดไป replica อื่นรับต่อ
+(แถวของรอบที่ตายค้าง status = running ไว้ดูย้อนหลัง)
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import text
+
+from app.config import Config
+from app.instrumentation.metrics import sched_last_success, sched_run_time, sched_runs, sched_running
+
+# ประวัติใน scheduler_runs เก็บไว้กี่วัน (ลบตอน claim รอบใหม่ของ job เดียวกัน)
+RUN_HISTORY_DAYS = 7
+
+
+@dataclass
+class JobSpec:
+    name: str
+    fn: Callable[[], object]
+    crontab: str
+    every_s: int                # ความยาวรอบของ crontab → slot_start = เวลา fire ปัดลงทีละ every_s
+    max_concurrency: int = 1    # run พร้อมกันได้กี่ตัวทั้ง cluster (job ยาวกว่ารอบ)
+
+
+def default_holder() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobCoordinator:
+    def __init__(self, engine, holder: Optional[str] = None, clock: Callable[[], float] = time.time):
+        self.engine = engine
+        self.holder = holder or default_holder()
+        self.clock = clock
+
+    def _try_lock(self, conn, job: JobSpec) -> Optional[str]:
+        for i in range(max(1, job.max_concurrency)):
+            key = f"aw-sched:{job.name}:{i}"
+            if conn.execute(text("SELECT pg_try_advisory_lock(hashtext(:k))"), {"k": key}).scalar():
+                return key
+        return None
+
+    def _claim(self, conn, job: JobSpec, slot: datetime) -> bool:
+        conn.execute(text(f"""
+          DELETE FROM {Config.DB_SCHEMA}.scheduler_runs
+          WHERE job = :job AND slot_start < NOW() - make_interval(days => :days)
+        """), {"job": job.name, "days": RUN_HISTORY_DAYS})
+        return conn.execute(text(f"""
+          INSERT INTO {Config.DB_SCHEMA}.scheduler_runs (job, slot_start, holder, status)
+          VALUES (:job, :slot, :holder, 'running')
+          ON CONFLICT (job, slot_start) DO NOTHING
+          RETURNING job
+        """), {"job": job.name, "slot": slot, "holder": self.holder}).scalar() is not None
+
+    def _finish(self, conn, job: JobSpec, slot: datetime, status: str, dt: float,
+                error: Optional[str] = None) -> None:
+        conn.execute(text(f"""
+          UPDATE {Config.DB_SCHEMA}.scheduler_runs
+          SET status = :status, finished_at = NOW(), duration_s = :dt, error = :error
+          WHERE job = :job AND slot_start = :slot
+        """), {"job": job.name, "slot": slot, "status": status, "dt": dt, "error": error})
+
+    def run(self, job: JobSpec) -> str:
+        """fire หนึ่งครั้งของ job → ok | error | locked | done_elsewhere"""
+        now = self.clock()
+        slot = datetime.fromtimestamp(now - now % job.every_s, tz=timezone.utc)
+        # AUTOCOMMIT: lock เป็นของ session, claim เห็นทันทีทุก replica; job ใช้ session ของตัวเอง
+        try:
+            conn = self.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        except Exception as e:
+            print(f"[sched] {job.name}: no DB connection: {e}")
+            sched_runs.labels(job=job.name, status="error").inc()
+            return "error"
+        key = None
+        try:
+            key = self._try_lock(conn, job)
+            if key is None:
+                status = "locked"
+            elif not self._claim(conn, job, slot):
+                status = "done_elsewhere"
+            else:
+                return self._run_claimed(conn, job, slot)
+        except Exception as e:
+            # lock/claim ล้ม (DB หลุด, ยังไม่รัน 084) → ไม่รัน job รอบนี้
+            print(f"[sched] {job.name} {slot.isoformat()} coordination failed: {e}")
+            status = "error"
+        finally:
+            if key is not None:
+                try:
+                    conn.execute(text("SELECT pg_advisory_unlock(hashtext(:k))"), {"k": key})
+                except Exception:
+                    conn.invalidate()  # ปลดไม่ได้ → ทิ้ง connection (lock หลุดตาม) ไม่คืนเข้า pool
+            conn.close()
+        sched_runs.labels(job=job.name, status=status).inc()
+        return status
+
+    def _run_claimed(self, conn, job: JobSpec, slot: datetime) -> str:
+        sched_running.labels(job=job.name).inc()
+        t = time.perf_counter()
+        try:
+            job.fn()
+            status, error = "ok", None
+        except Exception as e:
+            status, error = "error", str(e)[:2000]
+            print(f"[sched] {job.name} {slot.isoformat()} failed: {e}")
+        finally:
+            sched_running.labels(job=job.name).dec()
+        dt = time.perf_counter() - t
+        sched_runs.labels(job=job.name, status=status).inc()
+        sched_run_time.labels(job=job.name).observe(dt)
+        if status == "ok":
+            sched_last_success.labels(job=job.name).set(self.clock())
+        try:
+            self._finish(conn, job, slot, status, dt, error)
+        except Exception as e:
+            print(f"[sched] {job.name} {slot.isoformat()} could not record status: {e}")
+        return status
@@ -0,0 +1,297 @@
+# app/workers/pipeline.py
+"""
+Staged pipeline ของ stream worker (WORKER_PIPELINE=1)
+
+  fetch (thread ของ run_worker) ──q──► decode/map (+ streaming anomaly) ──q──► aggregate ──q──► write ──done──► commit
+                                                                                                               (fetch thread)
+
+- ทุก stage เป็น thread เดียว + queue FIFO → batch ผ่านทุก stage ตามลำดับเดิม → commit ตามลำดับเสมอ
+- batch N+1 decode/aggregate ระหว่างที่ batch N กำลังเขียน DB (psycopg/librdkafka ปล่อย GIL ระหว่างรอ I/O)
+- consumer ใช้จาก fetch thread เท่านั้น: consume / pause / resume / commit / rebalance callback
+- backpressure: batch ที่ยังไม่ commit (in-flight) ถึง max_inflight → pause ทุก partition
+  (ยัง consume ต่อเพื่อให้ callback/heartbeat ทำงาน) แล้ว resume เมื่อเหลือครึ่งหนึ่ง
+- partition ถูก revoke → ส่ง flush ผ่านทุก stage แล้วรอจน batch ที่ค้างลง DB + commit ก่อนคืน partition
+- เขียน DB ไม่สำเร็จ → stage write เขียนซ้ำ batch เดิมแบบ backoff เหมือน run_worker (queue เต็ม → fetch pause เอง)
+  ระหว่าง revoke/หยุด เลิกเขียนซ้ำ: ทิ้ง batch นั้นและ batch ที่ตามมา (ไม่ commit → เจ้าของใหม่อ่านซ้ำ)
+  และทิ้งแถวใน buffer ของ partition ที่ถูก revoke เหมือน _on_revoke ของ run_worker
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from confluent_kafka import KafkaException, TopicPartition
+
+from app.instrumentation.metrics import batch_size, proc_time, write_retries
+from app.services.agg_buffer import AggBuffer
+from app.services.stream_detector import StreamDetector
+from app.workers.stream_worker import T_AGG, T_COMMIT, T_DECODE, T_DETECT, RAW_ONLY, _Work, \
+    _decode_batch, _flush_buffer, _offsets_of, _retry_delay, _rollup, _store
+
+TopicPart = Tuple[str, int]
+
+
+@dataclass
+class _Batch(_Work):
+    msgs: list = field(default_factory=list)
+
+
+@dataclass
+class _Flush:
+    """control message: flush buffer (force) และ/หรือเลิกติดตาม partition แล้วแจ้งกลับ"""
+    force: bool = False
+    forget: List[TopicPart] = field(default_factory=list)
+    done: threading.Event = field(default_factory=threading.Event)
+
+
+_STOP = object()
+
+
+class StagedPipeline:
+    def __init__(self, consumer, buffer: Optional[AggBuffer] = None,
+                 detector: Optional[StreamDetector] = None,
+                 on_batch: Optional[Callable[[int], None]] = None,
+                 max_inflight: int = 4):
+        self.c = consumer
+        self.buffer = buffer
+        self.detector = detector
+        self.on_batch = on_batch
+        self.max_inflight = max(1, max_inflight)
+        size = self.max_inflight + 1  # +1 ให้ control message แทรกได้เสมอ
+        self._q_map: "queue.Queue" = queue.Queue(size)
+        self._q_agg: "queue.Queue" = queue.Queue(size)
+        self._q_write: "queue.Queue" = queue.Queue(size)
+        self._done: "queue.Queue" = queue.Queue()   # writer → fetch (ไม่จำกัด: writer ต้องไม่ block)
+        self._inflight = 0
+        self._idle_flush: Optional[_Flush] = None
+        self._paused = False
+        self._reassigned = False
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._wake = threading.Event()      # ปลุก writer ที่รอ backoff (revoke / หยุด)
+        self._giving_up = False             # revoke / หยุด: เขียนไม่สำเร็จ → เลิก ไม่เขียนซ้ำ
+        self._discard = False               # เลิกเขียน batch ไปแล้ว → ทิ้ง batch ที่ตามมาจนถึง revoke flush
+        self._threads: List[threading.Thread] = []
+
+    # ---------- stages (worker threads) ----------
+    def _map(self, b: _Batch) -> _Batch:
+        with T_DECODE.time():
+            b.measurements, b.events = _decode_batch(b.msgs)
+        b.msgs = []  # ไม่ต้องถือ raw message ต่อ
+        if self.detector is not None:
+            with T_DETECT.time():
+                b.anomalies = self.detector.process(b.measurements)
+                self.detector.evict_idle()
+        return b
+
+    def _agg(self, b: _Batch) -> _Batch:
+        if b.measurements and not RAW_ONLY:
+            with T_AGG.time():
+                b.rows = _rollup(b.measurements)
+        return b
+
+    def _write(self, b: _Batch) -> Dict[TopicPart, int]:
+        """เขียน batch ลง DB → offset ที่ commit ได้หลังจากนี้"""
+        return _store(b, self.buffer)
+
+    def _flush(self, f: _Flush) -> Dict[TopicPart, int]:
+        if self.buffer is None:
+            return {}
+        _flush_buffer(self.buffer, force=f.force)
+        offs = self.buffer.committable()
+        self.buffer.forget(f.forget)
+        return offs
+
+    def _retry(self, fn: Callable, item):
+        """เรียก fn(item) ซ้ำแบบ backoff จนสำเร็จ — revoke / หยุดระหว่างนั้น → raise error ล่าสุด"""
+        failures = 0
+        while True:
+            try:
+                return fn(item)
+            except Exception as e:
+                if self._giving_up:
+                    raise
+                failures += 1
+                write_retries.inc()
+                delay = _retry_delay(failures)
+                print(f"[worker] batch write failed ({failures}x), retry in {delay:.0f}s: {e}")
+                self._wake.wait(delay)
+
+    def _write_stage(self, item) -> None:
+        if isinstance(item, _Flush):
+            try:
+                offs = self._retry(self._flush, item)
+            except Exception as e:
+                if item.forget:
+                    # เหมือน _on_revoke ของ run_worker: offset ของ entry ที่ค้างยังไม่ถูก commit → เจ้าของใหม่อ่านซ้ำ
+                    print(f"[worker] flush on revoke failed, dropping buffered rows of revoked partitions: {e}")
+                    self.buffer.drop(item.forget)
+                    self.buffer.forget(item.forget)
+                else:
+                    print(f"[worker] flush failed, entries stay buffered: {e}")
+                offs = {}
+            if item.forget:
+                self._discard = False
+            self._done.put((offs, None))
+            return
+        if self._discard:
+            self._done.put(({}, item))  # ไม่ commit: batch ก่อนหน้ายังไม่ลง DB
+            return
+        try:
+            self._done.put((self._retry(self._write, item), item))
+        except Exception as e:
+            print(f"[worker] giving up batch write, offsets stay uncommitted: {e}")
+            self._discard = True
+            self._done.put(({}, item))
+
+    def _run_stage(self, fn: Callable, inq: "queue.Queue", outq: Optional["queue.Queue"]):
+        while True:
+            item = inq.get()
+            if item is _STOP:
+                if outq is not None:
+                    outq.put(_STOP)
+                else:
+                    self._final()
+                return
+            if self._error is not None:
+                # พังแล้ว: ทิ้งงานที่เหลือ (ไม่ commit) แต่ยังรับของต่อไม่ให้ต้นทาง block
+                if isinstance(item, _Flush):
+                    item.done.set()
+                continue
+            try:
+                if outq is not None:
+                    outq.put(item if isinstance(item, _Flush) else fn(item))
+                else:
+                    fn(item)
+                    if isinstance(item, _Flush):
+                        item.done.set()
+            except BaseException as e:
+                self._error = e
+                if isinstance(item, _Flush):
+                    item.done.set()
+
+    def _final(self):
+        # writer: ปิดงาน → flush buffer ทั้งหมดก่อนจบ (ครั้งเดียว ไม่เขียนซ้ำ)
+        if self.buffer is not None and self._error is None and not self._discard:
+            try:
+                self._done.put((self._flush(_Flush(force=True)), None))
+            except Exception as e:
+                print(f"[worker] final flush failed: {e}")
+
+    # ---------- fetch thread ----------
+    def _commit_done(self) -> None:
+        """รวม offset ของงานที่เขียนเสร็จแล้ว → commit ครั้งเดียว (ตามลำดับ, sync)"""
+        offs: Dict[TopicPart, int] = {}
+        batches: List[_Batch] = []
+        while True:
+            try:
+                o, b = self._done.get_nowait()
+            except queue.Empty:
+                break
+            if b is not None:
+                batches.append(b)
+            for tp, off in o.items():
+                if off > offs.get(tp, -1):
+                    offs[tp] = off
+        if offs:
+            try:
+                with T_COMMIT.time():
+                    self.c.commit(offsets=[TopicPartition(t, p, o) for (t, p), o in offs.items()],
+                                  asynchronous=False)
+            except KafkaException as e:
+                # ข้อมูลลง DB แล้ว: commit รอบถัดไปครอบ offset นี้ / เสีย partition ไปแล้ว → เจ้าของใหม่อ่านซ้ำ
+                print(f"[worker] commit failed: {e}")
+        self._inflight -= len(batches)
+        now = time.perf_counter()
+        for b in batches:
+            proc_time.observe(now - b.t0)
+            if self.on_batch:
+                self.on_batch(b.count)
+        if self._paused and self._inflight <= self.max_inflight // 2:
+            self.c.resume(self.c.assignment())
+            self._paused = False
+
+    def _drain(self, flush: _Flush) -> None:
+        """ส่ง control ผ่านทุก stage แล้วรอจนถึง writer (batch ก่อนหน้าลง DB + commit หมด)"""
+        self._q_map.put(flush)
+        while not flush.done.wait(0.05):
+            self._commit_done()
+        self._commit_done()
+        if self._error is not None:
+            raise self._error
+
+    def on_assign(self, consumer, partitions):
+        self._reassigned = True
+
+    def on_revoke(self, consumer, partitions):
+        if self._closed:
+            return  # c.close() หลัง pipeline หยุด — stage ปิดไปแล้วและ flush ครบแล้ว
+        # writer ที่กำลังเขียนซ้ำต้องเลิก ไม่งั้น callback ค้างจนเกิน max.poll.interval.ms
+        self._giving_up = True
+        self._wake.set()
+        try:
+            self._drain(_Flush(force=True, forget=[(tp.topic, tp.partition) for tp in partitions]))
+        finally:
+            self._giving_up = False
+            self._wake.clear()
+
+    def start(self):
+        for name, fn, inq, outq in (("map", self._map, self._q_map, self._q_agg),
+                                    ("agg", self._agg, self._q_agg, self._q_write),
+                                    ("write", self._write_stage, self._q_write, None)):
+            t = threading.Thread(target=self._run_stage, args=(fn, inq, outq),
+                                 name=f"analytics-stream-{name}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def run(self, stop: threading.Event, before_poll: Optional[Callable[[], None]] = None):
+        """loop ของ fetch thread จน stop ถูก set หรือ stage ใด stage หนึ่งพัง"""
+        self.start()
+        try:
+            while not stop.is_set() and self._error is None:
+                self._commit_done()
+                if before_poll:
+                    before_poll()
+
+                if not self._paused and self._inflight >= self.max_inflight:
+                    # writer ตามไม่ทัน → หยุด fetch (consume ต่อเพื่อ serve callback)
+                    self.c.pause(self.c.assignment())
+                    self._paused = True
+                elif self._paused and self._reassigned:
+                    self.c.pause(self.c.assignment())
+                self._reassigned = False
+
+                try:
+                    msgs = self.c.consume(num_messages=500, timeout=0.1 if self._paused else 1.0)
+                except KafkaException:
+                    continue
+
+                if not msgs:
+                    if self.buffer is not None and self._inflight == 0 and \
+                            (self._idle_flush is None or self._idle_flush.done.is_set()):
+                        # idle → flush bucket ที่ถึงเวลา (ทีละครั้ง ไม่ให้ control ค้างเต็ม queue)
+                        self._idle_flush = _Flush()
+                        self._q_map.put(self._idle_flush)
+                    continue
+
+                self._inflight += 1
+                batch_size.set(len(msgs))
+                self._q_map.put(_Batch(msgs=msgs, offsets=_offsets_of(msgs), count=len(msgs),
+                                       t0=time.perf_counter()))
+        finally:
+            self._giving_up = True
+            self._wake.set()
+            self._q_map.put(_STOP)
+            for t in self._threads:
+                while t.is_alive():
+                    t.join(0.1)
+                    self._commit_done()
+            self._commit_done()
+            self._closed = True
+
+        if self._error is not None:
+            raise self._error
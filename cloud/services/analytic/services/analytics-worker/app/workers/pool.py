@@ -0,0 +1,183 @@
+# app/workers/pool.py
+"""
+Worker pool: รัน stream worker N process ใน consumer group เดียวกัน
+Kafka แบ่ง partition ให้แต่ละ process เอง (group rebalance) → 1 pod ใช้ได้หลาย core โดยไม่ติด GIL
+
+supervisor (thread ใน process หลัก):
+  - restart child ที่ตาย (exponential backoff; child ที่อยู่ได้นานกว่า max_backoff_s ก่อนตาย → เริ่ม backoff ใหม่)
+  - อ่านสถิติจาก shared memory ของแต่ละ child → Prometheus gauges (label child=<idx>)
+  - child ตาย → mark_process_dead(pid) ให้ /v1/metrics (multiprocess mode) ไม่รายงาน gauge ของ pid เก่า
+"""
+
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from app.config import reload_dotenv
+from app.pipelines.registry import Dispatch, reload as _reload_dispatch
+from app.instrumentation.metrics import pool_child_up, pool_child_restarts, pool_child_msgs, \
+    pool_child_batches, pool_child_last_batch, mark_process_dead
+
+# index ใน shared array ของแต่ละ child
+_MSGS, _BATCHES, _LAST_BATCH = 0, 1, 2
+
+_pool: Optional["WorkerPool"] = None
+
+
+def _child_main(idx: int, stats) -> None:
+    """entrypoint ของ child process (spawn → import ใหม่ทั้งหมด)"""
+    from app.config import Config
+    from app.workers.stream_worker import run_worker
+
+    # client.id แยกราย child ให้ดูใน broker ได้ว่าใครถือ partition ไหน
+    Config.KAFKA_CLIENT_ID = f"{Config.KAFKA_CLIENT_ID}-{idx}"
+
+    def on_batch(n: int):
+        with stats.get_lock():
+            stats[_MSGS] += n
+            stats[_BATCHES] += 1
+            stats[_LAST_BATCH] = time.time()
+
+    run_worker(on_batch=on_batch)
+
+
+@dataclass
+class _Child:
+    idx: int
+    stats: object
+    proc: Optional[mp.Process] = None
+    restarts: int = 0     # ทั้งหมดตั้งแต่เริ่ม pool (status / aw_pool_child_restarts)
+    streak: int = 0       # ตายติดกันโดยไม่ได้อยู่นานเกิน max_backoff_s → ใช้คำนวณ backoff
+    started: float = 0.0
+    next_start: float = 0.0
+
+
+class WorkerPool:
+    def __init__(self, processes: int, max_backoff_s: float = 30.0):
+        self._ctx = mp.get_context("spawn")  # ไม่ fork state ของ librdkafka/SQLAlchemy จาก parent
+        self._children = [_Child(i, self._ctx.Array("d", 3)) for i in range(processes)]
+        self._max_backoff = max_backoff_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _spawn(self, ch: _Child):
+        p = self._ctx.Process(target=_child_main, args=(ch.idx, ch.stats),
+                              name=f"analytics-stream-worker-{ch.idx}", daemon=True)
+        p.start()
+        ch.proc = p
+        ch.started = time.time()
+        print(f"[pool] child {ch.idx} started pid={p.pid}")
+
+    def start(self):
+        for ch in self._children:
+            self._spawn(ch)
+        self._thread = threading.Thread(target=self._supervise, name="analytics-worker-pool", daemon=True)
+        self._thread.start()
+
+    def _supervise(self):
+        while not self._stop.wait(1.0):
+            self._tick(time.time())
+
+    def _tick(self, now: float):
+        for ch in self._children:
+            label = str(ch.idx)
+            alive = ch.proc is not None and ch.proc.is_alive()
+            if not alive and ch.proc is not None:
+                # child ตาย → ตั้งเวลา restart แบบ backoff
+                code = ch.proc.exitcode
+                mark_process_dead(ch.proc.pid)
+                ch.proc = None
+                if now - ch.started > self._max_backoff:
+                    ch.streak = 0  # อยู่ได้นานแล้วค่อยตาย = ไม่ใช่ crash loop → ไม่ต้องรอ backoff สูงสุด
+                ch.restarts += 1
+                ch.streak += 1
+                ch.next_start = now + min(self._max_backoff, 2 ** min(ch.streak, 10))
+                pool_child_restarts.labels(child=label).inc()
+                print(f"[pool] child {ch.idx} exited code={code}; restart in {ch.next_start - now:.0f}s")
+            if ch.proc is None and now >= ch.next_start and not self._stop.is_set():
+                self._spawn(ch)
+                alive = True
+
+            pool_child_up.labels(child=label).set(1 if alive else 0)
+            with ch.stats.get_lock():
+                msgs, batches, last = ch.stats[_MSGS], ch.stats[_BATCHES], ch.stats[_LAST_BATCH]
+            pool_child_msgs.labels(child=label).set(msgs)
+            pool_child_batches.labels(child=label).set(batches)
+            pool_child_last_batch.labels(child=label).set(last)
+
+    def signal(self, sig: int):
+        """ส่ง signal ให้ child ที่ยังรันอยู่ทุกตัว (เช่น SIGHUP → reload registry)"""
+        for ch in self._children:
+            if ch.proc is not None and ch.proc.is_alive():
+                try:
+                    os.kill(ch.proc.pid, sig)
+                except OSError:
+                    pass
+
+    def stop(self, timeout: float = 15.0):
+        self._stop.set()
+        for ch in self._children:
+            if ch.proc is not None and ch.proc.is_alive():
+                ch.proc.terminate()  # SIGTERM → run_worker flush + ปิด consumer
+        deadline = time.time() + timeout
+        for ch in self._children:
+            if ch.proc is not None:
+                ch.proc.join(max(0.0, deadline - time.time()))
+                if ch.proc.is_alive():
+                    ch.proc.kill()
+                    ch.proc.join(1.0)
+                mark_process_dead(ch.proc.pid)
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+    def status(self) -> List[dict]:
+        out = []
+        for ch in self._children:
+            with ch.stats.get_lock():
+                msgs, batches, last = ch.stats[_MSGS], ch.stats[_BATCHES], ch.stats[_LAST_BATCH]
+            out.append({
+                "child": ch.idx,
+                "pid": ch.proc.pid if ch.proc is not None else None,
+                "alive": ch.proc is not None and ch.proc.is_alive(),
+                "restarts": ch.restarts,
+                "messages": int(msgs), "batches": int(batches),
+                "last_batch_at": last or None,
+            })
+        return out
+
+
+def start_pool(processes: int) -> WorkerPool:
+    global _pool
+    if _pool is None:
+        _pool = WorkerPool(processes)
+        _pool.start()
+    return _pool
+
+
+def get_pool() -> Optional[WorkerPool]:
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.stop()
+        _pool = None
+
+
+def reload_registry() -> Dispatch:
+    """
+    อ่าน .env ใหม่ + compile dispatch table ของ process นี้
+    แล้วส่ง SIGHUP ให้ child ของ pool ให้ reload ตาม (child อ่าน .env เองเหมือนกัน)
+    """
+    reload_dotenv()
+    d = _reload_dispatch()
+    if _pool is not None:
+        _pool.signal(signal.SIGHUP)
+    return d
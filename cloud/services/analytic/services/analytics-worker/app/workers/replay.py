@@ -0,0 +1,364 @@
+# app/workers/replay.py
+"""
+Replay ข้อความ Kafka ที่เก็บไว้ในไฟล์ผ่านเส้นทางเดียวกับ run_worker (ไม่ต้องมี broker)
+  decode → batch handler ของ dispatch table → StreamDetector → aggregate → AggBuffer → repository
+
+input: ไฟล์หรือ directory ของ
+  - JSON Lines (.jsonl / .ndjson / .json, บีบ .gz ได้) — 1 ข้อความต่อบรรทัด:
+      {"topic": "...", "key": "...", "value": {...} | "<json string>", "timestamp": 1724123520000 | "ISO8601",
+       "partition": 0, "offset": 42}
+    value เป็น object/string ก็ได้ (binary ใช้ "value_b64"); partition/offset ไม่ใส่ได้ (นับให้ต่อ topic)
+    รับ output ของ `kcat -C -J` ตรง ๆ ด้วย ("payload" / "ts")
+  - Parquet (.parquet, ต้องมี pyarrow) — คอลัมน์ชื่อเดียวกัน
+batch ละ --batch ข้อความ (เท่า consume ของ worker); --rate จำกัด msg/s (0 = เร็วที่สุด)
+→ batch = ข้อความที่ "มาถึง" ภายใน --poll-s วินาที เหมือน consume(timeout) ของ worker
+--dry-run: ไม่แตะ DB (repo นับแถวแทน, ไม่ใช้ series_id/spec limits) → วัด CPU ของ decode → aggregate ล้วน
+
+    python -m app.workers.replay samples/ --rate 5000
+    python -m app.workers.replay capture.jsonl.gz --dry-run --repeat 10 --json report.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import time
+from array import array
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from confluent_kafka import TIMESTAMP_CREATE_TIME
+
+from app.instrumentation.metrics import rows_written, write_errors
+from app.pipelines import init_registry
+from app.pipelines.registry import reload as reload_registry
+from app.utils.time import parse_ts_ms
+from app.workers.stream_worker import (
+    _build_buffer, _build_detector, _compute, _flush_buffer, _repo_scope, _series, _store,
+)
+
+_JSONL = (".jsonl", ".ndjson", ".json")
+_PARQUET = (".parquet",)
+
+
+class ReplayMessage:
+    """ข้อความจากไฟล์ที่หน้าตาเหมือน confluent_kafka.Message (เท่าที่ worker เรียกใช้)"""
+    __slots__ = ("_topic", "_partition", "_offset", "_key", "_value", "_ts")
+
+    def __init__(self, topic: str, value: Optional[bytes], key: Optional[bytes] = None,
+                 timestamp: Optional[int] = None, partition: int = 0, offset: int = 0):
+        self._topic = topic
+        self._value = value
+        self._key = key
+        self._ts = timestamp
+        self._partition = partition
+        self._offset = offset
+
+    def topic(self) -> str:
+        return self._topic
+
+    def partition(self) -> int:
+        return self._partition
+
+    def offset(self) -> int:
+        return self._offset
+
+    def key(self) -> Optional[bytes]:
+        return self._key
+
+    def value(self) -> Optional[bytes]:
+        return self._value
+
+    def timestamp(self):
+        return (TIMESTAMP_CREATE_TIME, self._ts if self._ts is not None else -1)
+
+    def error(self):
+        return None
+
+
+def _bytes(v) -> Optional[bytes]:
+    if v is None or isinstance(v, bytes):
+        return v
+    if isinstance(v, str):
+        return v.encode("utf-8")
+    return json.dumps(v, separators=(",", ":")).encode("utf-8")
+
+
+class ReplaySource:
+    """
+    อ่านข้อความจากไฟล์/directory ตามลำดับชื่อไฟล์ (ลำดับภายในไฟล์คงเดิม)
+    บรรทัด/แถวที่อ่านไม่ได้ถูกข้ามและนับใน skipped
+    """
+
+    def __init__(self, paths: Sequence[str], topics: Optional[Sequence[str]] = None, repeat: int = 1):
+        self.files = self._expand(paths)
+        self.topics = set(topics) if topics else None
+        self.repeat = max(1, repeat)
+        self.skipped = 0
+        self._next_offset: Dict[tuple, int] = {}
+
+    @staticmethod
+    def _expand(paths: Sequence[str]) -> List[str]:
+        out = []
+        for p in paths:
+            if os.path.isdir(p):
+                out += sorted(os.path.join(p, f) for f in os.listdir(p)
+                              if f.removesuffix(".gz").endswith(_JSONL + _PARQUET))
+            else:
+                out.append(p)
+        if not out:
+            raise SystemExit(f"no replay files in {', '.join(paths)}")
+        return out
+
+    def __iter__(self) -> Iterator[ReplayMessage]:
+        for _ in range(self.repeat):
+            for path in self.files:
+                rows = self._parquet(path) if path.endswith(_PARQUET) else self._jsonl(path)
+                for r in rows:
+                    m = self._message(r)
+                    if m is not None:
+                        yield m
+
+    def _jsonl(self, path: str) -> Iterator[dict]:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    self.skipped += 1
+
+    @staticmethod
+    def _parquet(path: str) -> Iterator[dict]:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit(f"{path}: reading Parquet needs pyarrow (pip install pyarrow)")
+        for rb in pq.ParquetFile(path).iter_batches(batch_size=10_000):
+            yield from rb.to_pylist()
+
+    def _message(self, r: dict) -> Optional[ReplayMessage]:
+        try:
+            topic = r["topic"]
+            if self.topics is not None and topic not in self.topics:
+                return None
+            if r.get("value_b64") is not None:
+                value = base64.b64decode(r["value_b64"])
+            else:
+                value = _bytes(r["value"] if "value" in r else r.get("payload"))
+            ts = r.get("timestamp", r.get("ts"))
+            if ts is not None and not isinstance(ts, int):
+                ts = parse_ts_ms(ts)
+            part = int(r.get("partition") or 0)
+            off = r.get("offset")
+            tp = (topic, part)
+            off = int(off) if off is not None else self._next_offset.get(tp, 0)
+            self._next_offset[tp] = off + 1
+        except Exception:
+            self.skipped += 1
+            return None
+        return ReplayMessage(topic, value, _bytes(r.get("key")), ts, part, off)
+
+
+class DryRunRepo:
+    """repo ที่ไม่แตะ DB: คืนจำนวนแถวที่จะถูกส่ง (rows_written นับเหมือนเขียนจริง)"""
+
+    class _NoDB:
+        def begin_nested(self):
+            return nullcontext()
+
+    def __init__(self):
+        self.db = self._NoDB()
+
+    def insert_events_many(self, rows) -> int:
+        return len(rows)
+
+    def upsert_event_rollup_many(self, rows) -> int:
+        return len(rows)
+
+    def upsert_agg_many(self, rows) -> int:
+        return len(rows)
+
+    def insert_anomalies_many(self, rows) -> int:
+        return len(rows)
+
+    def insert_raw_many(self, batch) -> int:
+        return len(batch)
+
+
+def _pct(vals: Sequence[float], q: float) -> float:
+    if not vals:
+        return 0.0
+    return vals[min(len(vals) - 1, int(q * len(vals)))]
+
+
+def _latency_ms(vals) -> dict:
+    s = sorted(vals)
+    return {"p50": round(_pct(s, 0.50) * 1e3, 2), "p95": round(_pct(s, 0.95) * 1e3, 2),
+            "p99": round(_pct(s, 0.99) * 1e3, 2), "max": round((s[-1] if s else 0.0) * 1e3, 2)}
+
+
+def _by_table(counter) -> Dict[str, float]:
+    return {s.labels["table"]: s.value for m in counter.collect() for s in m.samples if s.name.endswith("_total")}
+
+
+@dataclass
+class ReplayReport:
+    dry_run: bool
+    rate: float
+    messages: int = 0
+    batches: int = 0
+    measurements: int = 0
+    events: int = 0
+    anomalies: int = 0
+    skipped_input: int = 0
+    elapsed_s: float = 0.0
+    stages_s: Dict[str, float] = field(default_factory=lambda: dict.fromkeys(("decode_map", "detect", "aggregate", "write"), 0.0))
+    rows_written: Dict[str, int] = field(default_factory=dict)
+    write_errors: Dict[str, int] = field(default_factory=dict)
+    batch_latency: List[float] = field(default_factory=list)
+    msg_latency: array = field(default_factory=lambda: array("d"))  # --rate เท่านั้น: เสร็จ − เวลาที่ข้อความ "มาถึง"
+
+    def summary(self) -> dict:
+        el = self.elapsed_s or 1e-9
+        out = {
+            "dry_run": self.dry_run, "rate_target": self.rate or None,
+            "messages": self.messages, "batches": self.batches, "elapsed_s": round(self.elapsed_s, 3),
+            "msgs_per_s": round(self.messages / el, 1), "measurements_per_s": round(self.measurements / el, 1),
+            "measurements": self.measurements, "events": self.events, "anomalies": self.anomalies,
+            "unmapped": self.messages - self.measurements - self.events, "skipped_input": self.skipped_input,
+            "stages_s": {k: round(v, 3) for k, v in self.stages_s.items()},
+            "rows_written": self.rows_written, "write_errors": self.write_errors,
+            "batch_latency_ms": _latency_ms(self.batch_latency),
+        }
+        if self.rate:
+            out["msg_latency_ms"] = _latency_ms(self.msg_latency)
+        return out
+
+    def format(self) -> str:
+        s = self.summary()
+        lines = [
+            f"[replay] {s['messages']:,} msgs in {s['elapsed_s']}s → {s['msgs_per_s']:,.0f} msg/s "
+            f"({s['measurements_per_s']:,.0f} measurements/s){' DRY-RUN' if self.dry_run else ''}"
+            + (f", target {self.rate:,.0f} msg/s" if self.rate else ""),
+            f"  mapped: {s['measurements']:,} measurements, {s['events']:,} events, {s['anomalies']:,} anomalies; "
+            f"unmapped {s['unmapped']:,}, bad input {s['skipped_input']:,}",
+            "  stage seconds: " + ", ".join(f"{k}={v}" for k, v in s["stages_s"].items()),
+            "  rows written: " + (", ".join(f"{k}={v:,}" for k, v in sorted(s["rows_written"].items())) or "-"),
+            "  batch latency ms: " + ", ".join(f"{k}={v}" for k, v in s["batch_latency_ms"].items()),
+        ]
+        if self.rate:
+            lines.append("  msg latency ms: " + ", ".join(f"{k}={v}" for k, v in s["msg_latency_ms"].items()))
+        if s["write_errors"]:
+            lines.append("  write errors: " + ", ".join(f"{k}={v:,}" for k, v in sorted(s["write_errors"].items())))
+        return "\n".join(lines)
+
+
+def replay(messages, rate: float = 0.0, batch: int = 500, poll_s: float = 1.0, dry_run: bool = False,
+           limit: Optional[int] = None) -> ReplayReport:
+    """ส่ง messages ผ่าน decode → map → detect → aggregate → write แบบเดียวกับ run_worker (ไม่มี commit offset)"""
+    init_registry()
+    reg = reload_registry()
+    print(f"[replay] registry v{reg.version} active topics: {reg.topics}")
+
+    buffer = _build_buffer()
+    detector = _build_detector()
+    series = None if dry_run else _series
+    if dry_run and detector is not None:
+        detector.limits = None  # spec limits ต้องโหลดจาก DB
+
+    @contextmanager
+    def dry_writer():
+        yield DryRunRepo()
+
+    writer = dry_writer if dry_run else _repo_scope
+
+    rep = ReplayReport(dry_run=dry_run, rate=rate)
+    before_rows, before_err = _by_table(rows_written), _by_table(write_errors)
+    size = batch if rate <= 0 else max(1, min(batch, int(rate * poll_s)))
+    it = iter(messages) if limit is None else islice(messages, limit)
+    stages = rep.stages_s
+
+    @contextmanager
+    def stage(name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            stages[name] += time.perf_counter() - t
+
+    t0 = time.perf_counter()
+    try:
+        while True:
+            msgs = list(islice(it, size))
+            if not msgs:
+                break
+            if rate > 0:
+                # ข้อความสุดท้ายของ batch มาถึงที่ t0 + n/rate → รอถึงตอนนั้น (ช้ากว่านั้น = ตามไม่ทัน, ไม่รอ)
+                wait = t0 + (rep.messages + len(msgs)) / rate - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            start = time.perf_counter()
+
+            # เส้นทางเดียวกับ run_worker แต่ไม่ commit offset
+            w = _compute(msgs, detector, stage=stage)
+            _store(w, buffer, writer=writer, series=series, stage=stage)
+            end = time.perf_counter()
+
+            if rate > 0:
+                base = t0 + rep.messages / rate
+                rep.msg_latency.extend(end - (base + (i + 1) / rate) for i in range(len(msgs)))
+            rep.batch_latency.append(end - start)
+            rep.batches += 1
+            rep.messages += len(msgs)
+            rep.measurements += len(w.measurements)
+            rep.events += len(w.events)
+            rep.anomalies += len(w.anomalies)
+    except KeyboardInterrupt:
+        print("[replay] interrupted — reporting what was replayed so far")
+    finally:
+        if buffer is not None and len(buffer):
+            try:
+                with stage("write"):
+                    _flush_buffer(buffer, force=True, writer=writer, series=series)
+            except Exception as e:
+                print(f"[replay] final flush failed: {e}")
+        rep.elapsed_s = time.perf_counter() - t0
+
+    after_rows, after_err = _by_table(rows_written), _by_table(write_errors)
+    rep.rows_written = {k: int(v - before_rows.get(k, 0)) for k, v in after_rows.items() if v > before_rows.get(k, 0)}
+    rep.write_errors = {k: int(v - before_err.get(k, 0)) for k, v in after_err.items() if v > before_err.get(k, 0)}
+    rep.skipped_input = getattr(messages, "skipped", 0)
+    return rep
+
+
+def main():
+    ap = argparse.ArgumentParser(description="replay ข้อความ Kafka จากไฟล์ผ่าน pipeline ของ worker")
+    ap.add_argument("paths", nargs="+", help="ไฟล์ .jsonl[.gz]/.parquet หรือ directory")
+    ap.add_argument("--rate", type=float, default=0.0, help="msg/s (0 = เร็วที่สุด)")
+    ap.add_argument("--batch", type=int, default=500, help="ข้อความต่อ batch สูงสุด (เท่า consume ของ worker)")
+    ap.add_argument("--poll-s", type=float, default=1.0, help="--rate: batch = ข้อความที่มาถึงภายในกี่วินาที")
+    ap.add_argument("--limit", type=int, default=None, help="หยุดหลังกี่ข้อความ")
+    ap.add_argument("--repeat", type=int, default=1, help="วนไฟล์ชุดเดิมกี่รอบ")
+    ap.add_argument("--topics", default=None, help="เฉพาะ topic เหล่านี้ (คั่นด้วย ,)")
+    ap.add_argument("--dry-run", action="store_true", help="ไม่เขียน DB (นับแถวแทน)")
+    ap.add_argument("--json", dest="json_out", help="เขียน report เป็น JSON")
+    args = ap.parse_args()
+
+    src = ReplaySource(args.paths, topics=args.topics.split(",") if args.topics else None, repeat=args.repeat)
+    rep = replay(src, rate=args.rate, batch=args.batch, poll_s=args.poll_s, dry_run=args.dry_run, limit=args.limit)
+    print(rep.format())
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(rep.summary(), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
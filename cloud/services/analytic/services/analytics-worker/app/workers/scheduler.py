@@ -1,26 +1,54 @@
 # app/workers/scheduler.py
 from __future__ import annotations
-from typing import Optional
+from typing import Callable, List, Optional
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from app.database import SessionLocal
-from app.services.kpi import compute_kpi
+from app.config import Config
+from app.database import SessionLocal, engine
+from app.services.kpi import compute_kpi_incremental
+from app.workers.coordinator import JobCoordinator, JobSpec
 
 _scheduler: Optional[BackgroundScheduler] = None
 
 def _job_compute_kpi():
+    # incremental: เฉพาะ period ที่ analytics_agg เปลี่ยนตั้งแต่รอบก่อน (รอบแรก = ทั้งหมด)
     db = SessionLocal()
     try:
-        compute_kpi(db, period="day", use_window_s=60)
+        st = compute_kpi_incremental(db, period="day", use_window_s=60)
+        print(f"[kpi] {st['mode']} rows={st['rows']} in {st['duration_s']}s (since {st['since']})")
+    except Exception:
+        db.rollback()
+        raise
     finally:
         db.close()
 
+# job ทั้งหมดของ scheduler — job หนัก (backfill/rescan) เพิ่มผ่าน register_job() ก่อน start_scheduler()
+JOBS: List[JobSpec] = [
+    JobSpec("compute_kpi", _job_compute_kpi, crontab="*/5 * * * *", every_s=300),
+]
+
+def register_job(name: str, fn: Callable[[], object], crontab: str, every_s: int,
+                 max_concurrency: int = 1) -> JobSpec:
+    spec = JobSpec(name, fn, crontab=crontab, every_s=every_s, max_concurrency=max_concurrency)
+    JOBS.append(spec)
+    return spec
+
+def _runner(spec: JobSpec) -> Callable[[], object]:
+    # SCHEDULER_COORDINATION=0 (replica เดียว / dev ที่ยังไม่รัน 084) → รันตรง ๆ แบบเดิม
+    if not Config.SCHEDULER_COORDINATION:
+        return spec.fn
+    coord = JobCoordinator(engine)
+    return lambda: coord.run(spec)
+
 def start_scheduler() -> BackgroundScheduler:
     global _scheduler
     if _scheduler is not None:
         return _scheduler
     s = BackgroundScheduler(timezone="UTC")
-    s.add_job(_job_compute_kpi, CronTrigger.from_crontab("*/5 * * * *"))
+    for spec in JOBS:
+        # max_instances: จำกัดใน process เดียวกันด้วย (ข้าม replica ใช้ advisory lock ของ coordinator)
+        s.add_job(_runner(spec), CronTrigger.from_crontab(spec.crontab), id=spec.name,
+                  max_instances=max(1, spec.max_concurrency), coalesce=True, misfire_grace_time=60)
     s.start()
     _scheduler = s
     return s
@@ -1,22 +1,60 @@
 # app/workers/stream_worker.py
 from __future__ import annotations
 
-import json
 import os
 import signal
 import threading
+import time
 from contextlib import contextmanager
-from datetime import timezone
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, ContextManager, Dict, Iterator, List, Optional, Set, Tuple
 
-from confluent_kafka import KafkaException
+from confluent_kafka import KafkaException, TopicPartition
 
-from app.pipelines.registry import handler_for, topics as reg_topics
+from app.pipelines.decode import decode
+from app.pipelines.batch import MappedBatch, MeasurementBatch
+from app.pipelines import init_registry
+from app.pipelines.registry import dispatch, reload as reload_registry
 from app.adapters.kafka_consumer import build_consumer
-from app.adapters.repository import AnalyticsRepo
+from app.adapters.repository import AnalyticsRepo, make_repo
 from app.database import SessionLocal
-from app.services.aggregator import aggregate
-from app.utils.time import floor_to_bucket
-from app.config import Config
+from app.services.aggregator import get_batch_aggregator
+from app.services.agg_buffer import AggBuffer
+from app.services.series import SeriesCache
+from app.services.spec_resolver import default_resolver
+from app.services.stream_detector import StreamDetector
+from app.utils.time import ms_to_dt, parse_ts_ms
+from app.instrumentation.metrics import MULTIPROC_DIR, ingested, lag, proc_time, decode_errors, mapper_errors, \
+    mapped_records, rows_written, write_errors, write_retries, dead_letter_rows, stage_time, batch_size
+from app.config import Config, reload_dotenv
+
+# engine ตาม AGG_ENGINE (python | numpy | cascade) — รับ MeasurementBatch แบบ columnar
+_aggregate = get_batch_aggregator()
+
+# AGG_ENGINE=cagg: worker ไม่ aggregate — เขียน raw แล้ว continuous aggregate ทำ rollup (cloud/db/080_analytics_cagg.sql)
+RAW_ONLY = Config.AGG_ENGINE.strip().lower() == "cagg"
+
+# series dictionary (SERIES_IDS_ENABLED): เติม series_id ก่อนเขียน agg/anomaly
+_series: Optional[SeriesCache] = \
+    SeriesCache(SessionLocal, max_size=Config.SERIES_CACHE_SIZE) if Config.SERIES_IDS_ENABLED else None
+
+# histogram ราย stage (bind label ครั้งเดียว)
+T_DECODE = stage_time.labels(stage="decode_map")
+T_DETECT = stage_time.labels(stage="detect")
+T_AGG = stage_time.labels(stage="aggregate")
+T_WRITE = stage_time.labels(stage="write")
+T_COMMIT = stage_time.labels(stage="commit")
+_STAGES = {"decode_map": T_DECODE, "detect": T_DETECT, "aggregate": T_AGG, "write": T_WRITE, "commit": T_COMMIT}
+
+
+def _observe_stage(stage: str) -> ContextManager:
+    return _STAGES[stage].time()
+
+# PROFILING_ENABLED: จุดเปิด/ปิด cProfile ใน thread ของ consumer (ปิด = ไม่มี hook ใน loop)
+_profile_checkpoint: Optional[Callable[[], None]] = None
+if Config.PROFILING_ENABLED:
+    from app.instrumentation.profiling import checkpoint as _profile_checkpoint
 
 # --- graceful shutdown flag ---
 _stop = threading.Event()
@@ -24,6 +62,12 @@ _stop = threading.Event()
 def _handle_sig(*_):
     _stop.set()
 
+def _handle_hup(*_):
+    # SIGHUP → อ่าน .env ใหม่แล้ว compile dispatch table (loop จะ subscribe ใหม่ถ้า topic เปลี่ยน)
+    reload_dotenv()
+    d = reload_registry()
+    print(f"[worker] registry reloaded v{d.version}: {d.topics}")
+
 # --- DB session scope (auto commit/rollback) ---
 @contextmanager
 def session_scope():
@@ -38,122 +82,520 @@ def session_scope():
         db.close()
 
 
-def run_worker():
+@contextmanager
+def _repo_scope() -> Iterator[AnalyticsRepo]:
+    with session_scope() as db:
+        yield make_repo(db)
+
+
+def _event_rollups(events: List[dict], windows: List[int]) -> List[dict]:
+    """สรุป event ราย (key, window, bucket) → แถวสำหรับ analytics_event_rollup"""
+    rows: List[dict] = []
+    wms = [(w, w * 1000) for w in windows]
+    grouped: Dict[tuple, list] = {}
+    for e in events:
+        # แปลงเวลาเป็น epoch ms ครั้งเดียวต่อ event แล้ว bucket ด้วย integer ทุก window
+        t = parse_ts_ms(e["time"])
+        ident = (e["tenant_id"], e["domain"], e["entity_type"], e["entity_id"], e["event_type"])
+        v = e.get("value")  # บาง event อาจไม่มี value (นับเป็น count อย่างเดียว)
+        for w, span in wms:
+            k = (ident, w, t - t % span)
+            arr = grouped.get(k)
+            if arr is None:
+                arr = grouped[k] = []
+            arr.append(v)
+
+    dt_cache: Dict[int, datetime] = {}
+    for ((tenant, domain, etype, eid, ev), window, b), vals in grouped.items():
+        bucket = dt_cache.get(b)
+        if bucket is None:
+            bucket = dt_cache[b] = ms_to_dt(b)
+        numeric_vals = [v for v in vals if isinstance(v, (int, float))]
+        n = len(numeric_vals) if numeric_vals else len(vals)  # ถ้าไม่มี value นับจากจำนวน event
+        s = sum(numeric_vals) if numeric_vals else None
+        avg = (s / n) if (s is not None and n > 0) else None
+        mn = min(numeric_vals) if numeric_vals else None
+        mx = max(numeric_vals) if numeric_vals else None
+
+        rows.append({
+            "bucket_start": bucket, "window_s": window,
+            "tenant_id": tenant, "domain": domain,
+            "entity_type": etype, "entity_id": eid,
+            "event_type": ev,
+            "count_n": n, "sum_val": s, "avg_val": avg,
+            "min_val": mn, "max_val": mx,
+        })
+    return rows
+
+
+def _write_events(repo: AnalyticsRepo, events: List[dict]) -> None:
+    """events → raw + rollup (bulk)"""
+    if not events:
+        return
+    try:
+        # savepoint: ถ้า raw insert พัง transaction หลักยังใช้ต่อได้
+        with repo.db.begin_nested():
+            rows_written.labels(table="analytics_event").inc(repo.insert_events_many(events))
+    except Exception:
+        # เขียน raw event พลาด -> ไม่ล้มทั้ง batch
+        write_errors.labels(table="analytics_event").inc()
+
+    n = repo.upsert_event_rollup_many(_event_rollups(events, Config.WINDOWS))
+    rows_written.labels(table="analytics_event_rollup").inc(n)
+
+
+def _rollup(measurements: MeasurementBatch) -> List[dict]:
+    if RAW_ONLY or not measurements:
+        return []
+    return list(_aggregate(measurements, Config.WINDOWS))
+
+
+def _write_raw(repo: AnalyticsRepo, measurements: Optional[MeasurementBatch]) -> None:
+    if not RAW_ONLY or not measurements:
+        return
+    try:
+        with repo.db.begin_nested():
+            rows_written.labels(table=Config.RAW_TABLE).inc(repo.insert_raw_many(measurements))
+    except Exception:
+        write_errors.labels(table=Config.RAW_TABLE).inc()
+
+
+class AggWriteError(Exception):
+    """เขียน analytics_agg ไม่ครบ (PipelineRepo เก็บแถวที่ผิดไว้ใน errors แทนการ raise)"""
+
+    def __init__(self, msg: str, errors=()):
+        super().__init__(msg)
+        self.errors = list(errors)  # StatementError ของแถวที่ผิด (key = PK ของ analytics_agg)
+
+
+def _write_aggs(repo: AnalyticsRepo, rows: List[dict], series: Optional[SeriesCache] = _series,
+                raise_errors: bool = False) -> None:
+    """
+    raise_errors=True (path ที่มี AggBuffer): เขียนไม่ครบ → rollback savepoint ทั้งชุดแล้ว raise
+    ให้ผู้เรียกคืน entry เข้า buffer และไม่ commit offset ที่ entry เหล่านั้นครอบอยู่
+    """
+    if not rows:
+        return
+    try:
+        with repo.db.begin_nested():
+            if series is not None:
+                series.attach(rows)
+            failed = len(getattr(repo, "errors", ()))
+            n = repo.upsert_agg_many(rows)
+            if raise_errors and len(getattr(repo, "errors", ())) > failed:
+                # แถวที่เขียนสำเร็จถูก rollback ไปด้วย → restore แล้วเขียนซ้ำทั้งชุดได้โดยไม่นับซ้ำ
+                raise AggWriteError(f"{len(repo.errors) - failed} agg row(s) failed", repo.errors[failed:])
+            rows_written.labels(table="analytics_agg").inc(n)
+    except AggWriteError:
+        raise  # PipelineRepo นับ aw_write_errors ราย statement แล้ว
+    except Exception:
+        write_errors.labels(table="analytics_agg").inc()
+        if raise_errors:
+            raise
+        # path ที่ไม่มี buffer: อย่าให้ล้มทั้ง batch
+
+
+def _write_anomalies(repo: AnalyticsRepo, rows: List[dict], series: Optional[SeriesCache] = _series) -> None:
+    if not rows:
+        return
+    try:
+        with repo.db.begin_nested():
+            if series is not None:
+                series.attach(rows)
+            rows_written.labels(table="analytics_anomaly").inc(repo.insert_anomalies_many(rows))
+    except Exception:
+        # anomaly เขียนไม่ได้ไม่ควรทำให้ agg ของ batch หาย
+        write_errors.labels(table="analytics_anomaly").inc()
+
+
+def _write_rows(repo: AnalyticsRepo, rows: List[dict], events: List[dict],
+                anomalies: List[dict] = (), measurements: Optional[MeasurementBatch] = None,
+                series: Optional[SeriesCache] = _series) -> None:
+    """เขียนทั้ง batch แบบ bulk: 1 multi-VALUES upsert ต่อ table (ต่อ BULK_CHUNK_ROWS แถว)"""
+    _write_events(repo, events)
+    _write_raw(repo, measurements)
+    _write_aggs(repo, rows, series)
+    _write_anomalies(repo, anomalies, series)
+
+
+def _decode_batch(msgs) -> Tuple[MeasurementBatch, List[dict]]:
+    """decode + map ทั้ง batch → (measurements แบบ columnar, events)"""
+    # จัดกลุ่มตาม topic (คงลำดับภายใน topic) แล้วเรียก batch handler ครั้งเดียวต่อ topic
+    handlers = dispatch().batch  # อ่าน dispatch table ครั้งเดียวต่อ batch
+    by_topic: Dict[str, List[dict]] = {}
+    seen: Dict[str, int] = {}    # นับราย topic แล้วค่อย inc metric ครั้งเดียวต่อ batch
+    bad: Dict[str, int] = {}
+    for m in msgs:
+        if m.error():
+            continue
+        topic = m.topic()
+        seen[topic] = seen.get(topic, 0) + 1
+        if topic not in handlers:
+            # ไม่มี handler ของ topic นี้ (หรือ domain ปิดอยู่) — ไม่ต้อง decode
+            continue
+        objs = by_topic.get(topic)
+        if objs is None:
+            objs = by_topic[topic] = []
+        try:
+            objs.append(decode(topic, m.value()))
+        except Exception:
+            # payload พัง ข้าม
+            bad[topic] = bad.get(topic, 0) + 1
+            continue
+
+    out = MappedBatch()
+    for topic, objs in by_topic.items():
+        if objs:
+            # record ที่ map ไม่ได้ถูกข้ามภายใน handler
+            mb = handlers[topic](objs)
+            out.extend(mb)
+            if mb.errors:
+                mapper_errors.labels(topic=topic).inc(mb.errors)
+            if len(mb.measurements):
+                mapped_records.labels(topic=topic, kind="measurement").inc(len(mb.measurements))
+            if mb.events:
+                mapped_records.labels(topic=topic, kind="event").inc(len(mb.events))
+
+    for topic, n in seen.items():
+        ingested.labels(topic=topic).inc(n)
+    for topic, n in bad.items():
+        decode_errors.labels(topic=topic).inc(n)
+
+    return out.measurements, out.events
+
+
+def _offsets_of(msgs) -> Dict[Tuple[str, int], Tuple[int, int]]:
+    """(topic, partition) -> (min_offset, max_offset) ของข้อความที่อ่านได้ใน batch"""
+    out: Dict[Tuple[str, int], Tuple[int, int]] = {}
+    for m in msgs:
+        if m.error():
+            continue
+        tp, off = (m.topic(), m.partition()), m.offset()
+        lo, hi = out.get(tp, (off, off))
+        out[tp] = (min(lo, off), max(hi, off))
+    return out
+
+
+def _report_lag(c, reported: Set[Tuple[str, int]]) -> Set[Tuple[str, int]]:
+    """
+    lag ราย partition = high watermark - position ของ consumer (offset ถัดไปที่จะอ่าน; ยังไม่ได้อ่าน → low watermark)
+    อ่านจาก state ใน librdkafka อย่างเดียว (position + watermark ที่ cache จาก fetch) → ไม่มี round trip
+    ไปหา broker บน thread ที่ poll อยู่ (ไม่งั้น committed()/watermark ราย partition บล็อกได้หลายวินาที)
+    ลบ gauge ของ partition ที่ไม่ได้ถืออยู่แล้ว (หลัง rebalance) → คืนชุด partition ที่รายงานรอบนี้
+    """
+    now: Set[Tuple[str, int]] = set()
+    try:
+        parts = c.assignment()
+        positions = c.position(parts) if parts else []
+    except KafkaException:
+        return reported
+    for tp in positions:
+        try:
+            lo, hi = c.get_watermark_offsets(tp, cached=True)
+        except KafkaException:
+            continue
+        pos = tp.offset if tp.offset >= 0 else lo
+        if hi < 0 or pos < 0:
+            continue  # ยังไม่มี fetch response ของ partition นี้
+        lag.labels(topic=tp.topic, partition=str(tp.partition)).set(max(hi - pos, 0))
+        now.add((tp.topic, tp.partition))
+    for topic, part in reported - now:
+        try:
+            if MULTIPROC_DIR:
+                # multiprocess: remove() ไม่ลบค่าในไฟล์ mmap → ตั้ง 0 ไว้ (เจ้าของใหม่ที่รายงานทีหลังชนะ)
+                lag.labels(topic=topic, partition=str(part)).set(0)
+            lag.remove(topic, str(part))
+        except KeyError:
+            pass
+    return now
+
+
+def _flush_buffer(buffer: AggBuffer, force: bool = False,
+                  writer: Callable[[], ContextManager[AnalyticsRepo]] = None,
+                  series: Optional[SeriesCache] = _series) -> None:
+    """
+    เขียน entry ที่ถึงเวลาลง DB — ไม่สำเร็จ → คืน entry เข้า buffer แล้ว raise
+    แถวที่ repo ระบุได้ว่าผิดเอง (PipelineRepo, error class 22/23) ครบ AGG_DEAD_LETTER_ATTEMPTS ครั้ง
+    → dead-letter แล้วเขียนที่เหลือต่อ
+    (ไม่งั้นแถวเดียวที่ผิดถาวรจะถูกคืนเข้า buffer และทำให้ flush ล้มทุกรอบ)
+    """
+    due = buffer.pop_due(force=force)
+    writer = writer or _repo_scope
+    while due:
+        try:
+            with writer() as repo:
+                _write_aggs(repo, AggBuffer.rows(due), series, raise_errors=True)
+            return
+        except AggWriteError as e:
+            bad = {err.key: err for err in e.errors}
+            dead = []
+            for entry in due:
+                err = bad.get(AggBuffer.key(entry.row))
+                if err is not None and err.permanent:
+                    entry.attempts += 1
+                    if entry.attempts >= Config.AGG_DEAD_LETTER_ATTEMPTS:
+                        dead.append((entry, err))
+            if not dead:
+                buffer.restore(due)
+                raise
+            for entry, err in dead:
+                _dead_letter(entry.row, err.error)
+            gone = {id(entry) for entry, _ in dead}
+            due = [entry for entry in due if id(entry) not in gone]
+        except Exception:
+            buffer.restore(due)
+            raise
+
+
+def _dead_letter(row: dict, error: str) -> None:
+    # ทิ้งแถว agg ที่เขียนไม่ได้ถาวร: log พอให้ตามแก้/backfill ได้ + นับ aw_dead_letter_rows
+    dead_letter_rows.labels(table="analytics_agg").inc()
+    print(f"[worker] dead-letter analytics_agg key={AggBuffer.key(row)} count_n={row.get('count_n')} "
+          f"sum_val={row.get('sum_val')}: {error}")
+
+
+@dataclass
+class _Work:
+    """batch ที่ decode/detect/aggregate แล้ว — เขียนซ้ำได้จนสำเร็จโดยไม่ต้อง decode/ตรวจ anomaly ซ้ำ"""
+    offsets: Dict[Tuple[str, int], Tuple[int, int]]
+    count: int = 0     # จำนวนข้อความ (สำหรับ on_batch)
+    t0: float = 0.0    # perf_counter ตอน consume (สำหรับ aw_proc_time_seconds)
+    measurements: Optional[MeasurementBatch] = None
+    events: List[dict] = field(default_factory=list)
+    anomalies: List[dict] = field(default_factory=list)
+    rows: List[dict] = field(default_factory=list)
+    stored: bool = False  # ข้อมูลของ batch ลง DB (หรือเข้า buffer) แล้ว — เหลือ flush buffer / commit
+
+    def empty(self) -> bool:
+        return not (self.rows or self.events or self.anomalies or (RAW_ONLY and self.measurements))
+
+
+def _compute(msgs, detector: Optional[StreamDetector],
+             stage: Callable[[str], ContextManager] = _observe_stage) -> _Work:
+    """decode/map → detect → aggregate (ไม่แตะ DB)"""
+    w = _Work(offsets=_offsets_of(msgs), count=len(msgs), t0=time.perf_counter())
+    with stage("decode_map"):
+        w.measurements, w.events = _decode_batch(msgs)
+
+    if detector is not None:
+        # ตรวจราย measurement ตามลำดับที่มาถึง แล้วเขียนพร้อม batch นี้
+        with stage("detect"):
+            w.anomalies = detector.process(w.measurements)
+            detector.evict_idle()
+
+    with stage("aggregate"):
+        w.rows = _rollup(w.measurements)
+    return w
+
+
+def _store(w: _Work, buffer: Optional[AggBuffer],
+           writer: Callable[[], ContextManager[AnalyticsRepo]] = None,
+           series: Optional[SeriesCache] = _series,
+           stage: Callable[[str], ContextManager] = _observe_stage) -> Dict[Tuple[str, int], int]:
+    """
+    เขียน batch ลง DB → offset ที่ commit ได้ (tp -> offset ถัดไป)
+    raise เมื่อเขียนไม่สำเร็จ → เรียกซ้ำด้วย w เดิมได้: ส่วนที่ลง DB แล้ว (w.stored) ไม่ถูกเขียนซ้ำ
+    มี buffer: events/anomalies commit ใน transaction ของตัวเองก่อนรวม rows เข้า buffer แล้วค่อย flush agg
+    → flush พังไม่พา events ของ batch หายไปกับ rollback (entry กลับเข้า buffer พร้อม offset ที่ยังไม่ commit)
+    """
+    writer = writer or _repo_scope
+    with stage("write"):
+        if buffer is None:
+            if not w.stored and not w.empty():
+                with writer() as repo:
+                    _write_rows(repo, w.rows, w.events, w.anomalies, w.measurements, series)
+            w.stored = True
+            return {tp: hi + 1 for tp, (_, hi) in w.offsets.items()}
+
+        if not w.stored:
+            if w.events or w.anomalies:
+                with writer() as repo:
+                    _write_events(repo, w.events)
+                    _write_anomalies(repo, w.anomalies, series)
+            buffer.add(w.rows, w.offsets, watermark=w.measurements.watermark() if w.measurements else None)
+            w.stored = True
+        _flush_buffer(buffer, writer=writer, series=series)
+        return buffer.committable()
+
+
+def _retry_delay(failures: int) -> float:
+    # 1, 2, 4, ... วินาที สูงสุด WRITE_RETRY_MAX_S (ต่ำกว่า max.poll.interval.ms ของ consumer มาก)
+    return min(Config.WRITE_RETRY_MAX_S, 2.0 ** (failures - 1))
+
+
+def _build_detector() -> Optional[StreamDetector]:
+    if not Config.ANOMALY_STREAM_ENABLED:
+        return None
+    return StreamDetector(max_series=Config.ANOMALY_MAX_SERIES,
+                          idle_ttl_s=Config.ANOMALY_IDLE_TTL_S,
+                          warmup_n=Config.ANOMALY_WARMUP_N,
+                          baseline_n=Config.ANOMALY_BASELINE_N,
+                          limits=default_resolver())
+
+
+def _build_buffer() -> Optional[AggBuffer]:
+    if not Config.AGG_BUFFER_ENABLED:
+        return None
+    if RAW_ONLY:
+        print("[worker] AGG_BUFFER_ENABLED ignored: AGG_ENGINE=cagg writes raw measurements only")
+        return None
+    return AggBuffer(max_keys=Config.AGG_BUFFER_MAX_KEYS,
+                     max_age_s=Config.AGG_BUFFER_MAX_AGE_S,
+                     grace_s=Config.AGG_BUFFER_GRACE_S)
+
+
+def run_worker(on_batch: Optional[Callable[[int], None]] = None):
+    """
+    on_batch: callback หลังจบแต่ละ batch (จำนวนข้อความ) — worker pool ใช้เก็บสถิติราย child
+    """
     # ติดตั้ง signal handler
     try:
         signal.signal(signal.SIGINT, _handle_sig)
         signal.signal(signal.SIGTERM, _handle_sig)
+        signal.signal(signal.SIGHUP, _handle_hup)
     except Exception:
         # บาง runtime (เช่น Windows thread) อาจ set signal ไม่ได้ — ข้ามไป
         pass
 
+    # compile dispatch table ครั้งเดียวตอนเริ่ม (เปลี่ยน domain ต้อง reload อย่างตั้งใจ)
+    init_registry()
+    reg = reload_registry()
+    print(f"[worker] registry v{reg.version} active topics: {reg.topics}")
+
     c = build_consumer()
+    buffer = _build_buffer()
+    detector = _build_detector()
 
-    # ถ้าไม่ได้กำหนด KAFKA_TOPICS ใน .env ให้ subscribe ตาม registry
-    if not os.getenv("KAFKA_TOPICS"):
-        c.subscribe(reg_topics())
+    def _commit(offs: Dict[Tuple[str, int], int], sync: bool = True):
+        if offs:
+            with T_COMMIT.time():
+                c.commit(offsets=[TopicPartition(t, p, o) for (t, p), o in offs.items()],
+                         asynchronous=not sync)
 
-    while not _stop.is_set():
+    def _flush(force: bool = False):
+        """เขียน entry ที่ถึงเวลาลง DB แล้ว commit offset ที่ครอบคลุมแล้ว"""
+        _flush_buffer(buffer, force=force)
+        _commit(buffer.committable())
+
+    def _on_revoke(consumer, partitions):
+        # ต้อง flush ก่อนเสีย partition ไม่งั้นเจ้าของใหม่จะอ่านซ้ำ/ข้อมูลใน buffer ค้าง
+        if buffer is None:
+            return
+        tps = [(tp.topic, tp.partition) for tp in partitions]
         try:
-            msgs = c.consume(num_messages=500, timeout=1.0)
-        except KafkaException:
-            continue
+            _flush(force=True)
+        except Exception as e:
+            # offset ของ entry ที่ค้างยังไม่ถูก commit → เจ้าของใหม่อ่านซ้ำเอง (เก็บไว้ = เขียนซ้ำสองที่)
+            print(f"[worker] flush on revoke failed, dropping buffered rows of revoked partitions: {e}")
+            buffer.drop(tps)
+        buffer.forget(tps)
 
-        if not msgs:
-            continue
+    pipe = None
+    if Config.WORKER_PIPELINE:
+        # import ตรงนี้: pipeline ใช้ helper จาก module นี้
+        from app.workers.pipeline import StagedPipeline
+        pipe = StagedPipeline(c, buffer=buffer, detector=detector, on_batch=on_batch,
+                              max_inflight=Config.PIPELINE_MAX_INFLIGHT)
+        callbacks = {"on_assign": pipe.on_assign, "on_revoke": pipe.on_revoke}
+    else:
+        callbacks = {"on_revoke": _on_revoke}
 
-        measurements, events = [], []
+    # ถ้าไม่ได้กำหนด KAFKA_TOPICS ใน .env ให้ subscribe ตาม registry
+    fixed_topics = bool(os.getenv("KAFKA_TOPICS"))
+    sub_topics = Config.KAFKA_TOPICS if fixed_topics else reg.topics
+    c.subscribe(sub_topics, **callbacks)
 
-        for m in msgs:
-            if m.error():
-                continue
-            try:
-                o = json.loads(m.value())
-            except Exception:
-                # payload พัง ข้าม
-                continue
+    lag_parts: Set[Tuple[str, int]] = set()
+    lag_at = 0.0
 
-            h = handler_for(m.topic())
-            if not h:
-                # ไม่มี handler ของ topic นี้
-                continue
+    def _check_registry():
+        nonlocal reg, sub_topics
+        if not fixed_topics and dispatch().version != reg.version:
+            # registry ถูก reload → subscribe ตาม topic ชุดใหม่ (rebalance จะเรียก on_revoke ให้ flush)
+            reg = dispatch()
+            if reg.topics != sub_topics:
+                sub_topics = reg.topics
+                if sub_topics:
+                    c.subscribe(sub_topics, **callbacks)
+                else:
+                    c.unsubscribe()
+                print(f"[worker] resubscribed: {sub_topics}")
 
+    def _housekeeping():
+        # เรียกก่อน consume ทุกรอบ (thread เดียวกับ consumer)
+        nonlocal lag_parts, lag_at
+        _check_registry()
+        if _profile_checkpoint is not None:
+            _profile_checkpoint()
+        if Config.LAG_INTERVAL_S > 0 and time.monotonic() - lag_at >= Config.LAG_INTERVAL_S:
+            lag_at = time.monotonic()
+            lag_parts = _report_lag(c, lag_parts)
+
+    if pipe is not None:
+        try:
+            pipe.run(_stop, before_poll=_housekeeping)
+        finally:
             try:
-                kind, payload = h(o)
+                c.close()
             except Exception:
-                # mapper error ข้าม record นี้ไป
+                pass
+        return
+
+    work: Optional[_Work] = None  # batch ที่เขียนไม่สำเร็จ → เขียนซ้ำก่อน consume ต่อ (offset ยังไม่ถูก commit)
+    failures = 0
+    while not _stop.is_set():
+        _housekeeping()
+        if work is None:
+            try:
+                msgs = c.consume(num_messages=500, timeout=1.0)
+            except KafkaException:
                 continue
 
-            if kind == "measurement":
-                measurements.append(payload)
-            elif kind == "event":
-                events.append(payload)
-            else:
-                # ชนิดไม่รู้จัก
+            if not msgs:
+                if buffer is not None and len(buffer):
+                    try:
+                        _flush()
+                    except Exception as e:
+                        print(f"[worker] idle flush failed, entries stay buffered: {e}")
                 continue
 
-        # เขียนลง DB
-        if not measurements and not events:
-            c.commit(asynchronous=True)
+            batch_size.set(len(msgs))
+            work = _compute(msgs, detector)
+
+        try:
+            offs = _store(work, buffer)
+        except Exception as e:
+            # DB ใช้ไม่ได้ชั่วคราว: ไม่ commit offset ของ batch นี้ รอแล้วเขียนซ้ำ (ไม่ consume ต่อระหว่างนี้
+            # → rebalance callback ไม่ถูกเรียก; backoff สูงสุดต่ำกว่า max.poll.interval.ms จึงยังอยู่ใน group)
+            failures += 1
+            write_retries.inc()
+            delay = _retry_delay(failures)
+            print(f"[worker] batch write failed ({failures}x), retry in {delay:.0f}s: {e}")
+            _stop.wait(delay)
             continue
+        failures = 0
 
-        with session_scope() as db:
-            repo = AnalyticsRepo(db)
+        try:
+            # batch ที่ไม่มีอะไรต้องเขียน (ไม่มี buffer) → commit แบบ async
+            _commit(offs, sync=buffer is not None or not work.empty())
+        except KafkaException as e:
+            # ข้อมูลลง DB แล้ว: commit รอบถัดไปครอบ offset นี้ / เสีย partition ไปแล้ว → เจ้าของใหม่อ่านซ้ำ
+            print(f"[worker] commit failed: {e}")
+        proc_time.observe(time.perf_counter() - work.t0)
 
-            # 1) events → raw + rollup
-            if events:
-                for e in events:
-                    try:
-                        repo.insert_event(e)
-                    except Exception:
-                        # เขียน raw event พลาด -> ไม่ล้มทั้ง batch
-                        pass
-
-                # rollup ทีละ window
-                for w in Config.WINDOWS:
-                    grouped = {}
-                    for e in events:
-                        # บาง event อาจไม่มี value (นับเป็น count อย่างเดียว)
-                        bucket = floor_to_bucket(e["time"], w).astimezone(timezone.utc)
-                        key = (
-                            e["tenant_id"], e["domain"], e["entity_type"],
-                            e["entity_id"], e["event_type"], w, bucket
-                        )
-                        arr = grouped.setdefault(key, [])
-                        arr.append(e.get("value"))
-
-                    for (tenant, domain, etype, eid, ev, window, bucket), vals in grouped.items():
-                        numeric_vals = [v for v in vals if isinstance(v, (int, float))]
-                        n = len(numeric_vals) if numeric_vals else len(vals)  # ถ้าไม่มี value นับจากจำนวน event
-                        s = sum(numeric_vals) if numeric_vals else None
-                        avg = (s / n) if (s is not None and n > 0) else None
-                        mn = min(numeric_vals) if numeric_vals else None
-                        mx = max(numeric_vals) if numeric_vals else None
-
-                        repo.upsert_event_rollup({
-                            "bucket_start": bucket, "window_s": window,
-                            "tenant_id": tenant, "domain": domain,
-                            "entity_type": etype, "entity_id": eid,
-                            "event_type": ev,
-                            "count_n": n, "sum_val": s, "avg_val": avg,
-                            "min_val": mn, "max_val": mx,
-                        })
-
-            # 2) measurements → aggregate เดิม
-            if measurements:
-                try:
-                    aggs = list(aggregate(measurements, Config.WINDOWS))
-                    for row in aggs:
-                        repo.upsert_agg(row)
-                except Exception:
-                    # อย่าให้ล้มทั้ง batch
-                    pass
-
-        # commit offset หลังเขียนสำเร็จ
-        c.commit(asynchronous=False)
+        if on_batch:
+            on_batch(work.count)
+        work = None
+
+    # flush ที่ค้างใน buffer ก่อนปิด
+    if buffer is not None:
+        try:
+            _flush(force=True)
+        except Exception as e:
+            print(f"[worker] final flush failed: {e}")
 
     # ปิด consumer เมื่อได้รับสัญญาณหยุด
     try:
         c.close()
     except Exception:
-        pass
\ No newline at end of file
+        pass
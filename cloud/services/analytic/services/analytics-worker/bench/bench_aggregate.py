@@ -0,0 +1,94 @@
+# bench/bench_aggregate.py
+"""
+เทียบ aggregate() (python) กับ aggregate_np() (numpy) และ aggregate_cascade() (cascade):
+  1) ตรวจว่าแถวผลลัพธ์ตรงกัน (key เดียวกัน, ค่าเท่ากันภายใน rel_tol; p95 ของ window หยาบใน cascade ภายใน alpha ของ sketch)
+  2) จับเวลา rows/sec ของแต่ละ engine
+
+    python -m bench.bench_aggregate --n 50000 --series 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List
+
+from app.config import Config
+from app.services.aggregator import aggregate, aggregate_cascade
+from app.services.aggregator_np import aggregate_np
+
+_FIELDS = ("count_n", "sum_val", "avg_val", "min_val", "max_val", "stddev_val", "p95_val")
+
+
+def synth_measurements(n: int, series: int = 500, seed: int = 7) -> List[dict]:
+    rnd = random.Random(seed)
+    t0 = datetime(2025, 8, 20, tzinfo=timezone.utc)
+    out = []
+    for i in range(n):
+        s = int(rnd.paretovariate(1.2)) % series  # cardinality แบบเบ้ (บาง series ร้อน)
+        out.append({
+            "tenant_id": "t1", "factory_id": "f1", "machine_id": f"mc-{s % 50:02d}",
+            "sensor_id": f"s-{s:04d}", "metric": "temp",
+            "value": rnd.gauss(25.0, 2.0),
+            # out-of-order ในช่วง ±90s
+            "time": t0 + timedelta(seconds=i * 0.05 + rnd.uniform(-90, 90)),
+        })
+    return out
+
+
+def _index(rows: Iterable[dict]) -> Dict[tuple, dict]:
+    return {(r["tenant_id"], r["factory_id"], r["machine_id"], r["sensor_id"], r["metric"],
+             r["window_s"], r["bucket_start"]): r for r in rows}
+
+
+def check_equivalent(ms: List[dict], windows: List[int], rel_tol: float = 1e-9, other=aggregate_np) -> int:
+    a, b = _index(aggregate(ms, windows)), _index(other(ms, windows))
+    assert a.keys() == b.keys(), f"group mismatch: {len(a.keys() ^ b.keys())} keys"
+    finest = min(windows)
+    for k, ra in a.items():
+        rb = b[k]
+        for f in _FIELDS:
+            tol = rel_tol
+            if f == "p95_val" and other is aggregate_cascade and ra["window_s"] != finest:
+                tol = ra["sketch"].alpha  # window หยาบของ cascade: p95 จาก sketch
+            assert math.isclose(ra[f], rb[f], rel_tol=tol, abs_tol=1e-9), (k, f, ra[f], rb[f])
+        assert math.isclose(ra["m2_val"], rb["m2_val"], rel_tol=1e-6, abs_tol=1e-6), (k, "m2_val")
+        assert ra["sketch"].count == rb["sketch"].count, (k, "sketch")
+    return len(a)
+
+
+def _rate(fn, ms, windows, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        list(fn(ms, windows))
+        best = min(best, time.perf_counter() - t)
+    return len(ms) / best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=50_000)
+    ap.add_argument("--series", type=int, default=500)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    ms = synth_measurements(args.n, args.series)
+    windows = list(Config.WINDOWS)
+    groups = check_equivalent(ms, windows)
+    check_equivalent(ms, windows, other=aggregate_cascade)
+    print(f"equivalent: {groups} groups over windows={windows}")
+
+    py = _rate(aggregate, ms, windows, args.repeat)
+    npy = _rate(aggregate_np, ms, windows, args.repeat)
+    cas = _rate(aggregate_cascade, ms, windows, args.repeat)
+    print(f"python  {py:12,.0f} rows/s")
+    print(f"numpy   {npy:12,.0f} rows/s   (x{npy / py:.1f})")
+    print(f"cascade {cas:12,.0f} rows/s   (x{cas / py:.1f})")
+
+
+if __name__ == "__main__":
+    main()
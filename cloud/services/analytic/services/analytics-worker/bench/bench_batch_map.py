@@ -0,0 +1,120 @@
+# bench/bench_batch_map.py
+"""
+เทียบ mapper ราย record (handler → (kind, dict) → aggregate) กับ batch handler แบบ columnar
+(handler_batch → MeasurementBatch → aggregate_batch) ของ topic ที่มี native batch handler
+ตรวจด้วยว่า measurement / event ที่ได้เท่ากันทุกแถว
+
+    python -m bench.bench_batch_map --n 50000
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List
+
+from app.config import Config
+from app.pipelines.batch import MappedBatch, MeasurementBatch, adapt
+from app.pipelines.map.lab import handle_lab_batch, handle_lab_record
+from app.pipelines.map.sensor import handle_sensor_batch, handle_sensor_reading
+from app.pipelines.map.weather import handle_weather_batch, handle_weather_record
+from app.services.aggregator import get_aggregator, get_batch_aggregator
+
+
+def _iso(t: datetime) -> str:
+    return t.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def synth(topic: str, n: int, seed: int = 7) -> List[dict]:
+    rnd = random.Random(seed)
+    t0 = datetime(2025, 8, 20, tzinfo=timezone.utc)
+    out = []
+    for i in range(n):
+        t = _iso(t0 + timedelta(seconds=i * 0.05 + rnd.uniform(-90, 90)))
+        s = rnd.randrange(200)
+        if topic == "sensors.device.readings":
+            o = {"time": t, "tenant_id": "t1", "factory_id": "f1", "machine_id": f"mc-{s % 20:02d}",
+                 "sensor_id": f"s-{s:03d}", "metric": "temp", "value": rnd.gauss(25, 2)}
+        elif topic == "lab.results":
+            o = {"time": t, "tenant_id": "t1", "factory_id": "f1", "station_id": "lab-01",
+                 "sample_id": f"S-{s}", "analyte": rnd.choice(["Moisture", "Crude Protein", "Ash"]),
+                 "value": rnd.uniform(5, 20), "unit": "%", "lot": f"L-{s % 7}"}
+        else:
+            o = {"time": t, "tenant_id": "t1", "factory_id": "farm-a", "station_id": f"wx-{s % 5}",
+                 "payload": {"src": "bench"}}
+            o.update(rnd.choice([{"temp_c": rnd.gauss(30, 3)}, {"humidity": 70.0}, {}]))
+        if i % 997 == 0:
+            o.pop("tenant_id")  # record เสีย → ต้องถูกข้ามทั้งสองทาง
+        out.append(o)
+    return out
+
+
+CASES = {
+    "sensors.device.readings": (handle_sensor_reading, handle_sensor_batch),
+    "lab.results": (handle_lab_record, handle_lab_batch),
+    "weather.readings": (handle_weather_record, handle_weather_batch),
+}
+
+
+def _per_record(handler: Callable, objs: List[dict], agg=None):
+    # เส้นทางเดิมของ worker: handler ราย record → list ของ dict → aggregate
+    ms, events, errors = [], [], 0
+    for o in objs:
+        try:
+            kind, payload = handler(o)
+        except Exception:
+            errors += 1
+            continue
+        (ms if kind == "measurement" else events).append(payload)
+    return (list(agg(ms, Config.WINDOWS)) if agg else []), (ms, events, errors)
+
+
+def _batch(handler: Callable, objs: List[dict], agg=None):
+    b: MappedBatch = handler(objs)
+    return (list(agg(b.measurements, Config.WINDOWS)) if agg else []), b
+
+
+def _best(fn, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=50_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--engine", default="numpy", help="AGG_ENGINE ที่ใช้ในรอบ map+agg")
+    args = ap.parse_args()
+    agg, agg_b = get_aggregator(args.engine), get_batch_aggregator(args.engine)
+
+    print(f"engine={args.engine}  (msg/s: map อย่างเดียว | map+aggregate)")
+    print(f"{'topic':<26}{'record':>12}{'batch':>12}{'speedup':>9}{'record+agg':>14}{'batch+agg':>12}{'speedup':>9}")
+    for topic, (rec, bat) in CASES.items():
+        objs = synth(topic, args.n)
+        rows_a, (ms, events, errors) = _per_record(rec, objs, agg)
+        rows_b, b = _batch(bat, objs, agg_b)
+        # batch เก็บเวลาเป็น epoch ms → เทียบหลังแปลง dict ราย record เข้า column เดียวกัน
+        want = MeasurementBatch()
+        for m in ms:
+            want.append(m)
+        assert want == b.measurements, f"{topic}: measurements differ"
+        assert events == b.events, f"{topic}: events differ"
+        assert errors == b.errors, f"{topic}: error count differs"
+        assert adapt(rec)(objs).measurements == b.measurements, f"{topic}: adapt() differs"
+        assert len(rows_a) == len(rows_b), f"{topic}: agg rows differ"
+        ta = _best(_per_record, rec, objs, repeat=args.repeat)
+        tb = _best(_batch, bat, objs, repeat=args.repeat)
+        ga = _best(_per_record, rec, objs, agg, repeat=args.repeat)
+        gb = _best(_batch, bat, objs, agg_b, repeat=args.repeat)
+        print(f"{topic:<26}{args.n / ta:>12,.0f}{args.n / tb:>12,.0f}{ta / tb:>8.2f}x"
+              f"{args.n / ga:>14,.0f}{args.n / gb:>12,.0f}{ga / gb:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
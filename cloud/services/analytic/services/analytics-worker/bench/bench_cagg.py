@@ -0,0 +1,180 @@
+# bench/bench_cagg.py
+"""
+AGG_ENGINE=cagg (worker เขียน raw, rollup โดย continuous aggregate) เทียบกับเส้นทาง python เดิม
+(aggregate ใน worker แล้ว upsert analytics_agg)
+
+  1) CPU ของ worker ต่อ batch (ไม่ต้องมี DB): aggregate + bind พารามิเตอร์ upsert  vs  แยก column ของ raw
+  2) --db: ingest throughput จริง (measurements/s) ของทั้งสองทาง + latency ของ query แบบ /v1/agg
+     บน analytics_agg vs v_agg_cagg (real-time aggregation จาก raw ที่ยังไม่ materialize)
+     ทำใน transaction เดียวแล้ว rollback — ไม่ทิ้งข้อมูลไว้ (ต้องรัน 075, 076, 080 แล้ว; DB_* env เดียวกับ worker)
+  3) --db --materialize: commit ข้อมูล tenant "bench-cagg", refresh cagg แล้ววัด query บนส่วนที่ materialize แล้ว
+     จากนั้นลบข้อมูล bench ทิ้ง
+
+    python -m bench.bench_cagg --n 200000
+    python -m bench.bench_cagg --n 200000 --db [--materialize]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from sqlalchemy import text
+
+from app.adapters.repository import AGG_COLS, AnalyticsRepo, _agg_params, _bind, _values_sql
+from app.config import Config
+from app.pipelines.batch import MeasurementBatch
+from app.services.aggregator import get_batch_aggregator
+
+T0 = datetime(2025, 8, 20, tzinfo=timezone.utc)
+TENANT = "bench-cagg"
+BATCH = 500
+
+_QUERY = """
+  SELECT bucket_start, window_s, count_n, sum_val, avg_val, min_val, max_val, stddev_val, p95_val
+  FROM {src}
+  WHERE tenant_id = :tenant_id AND factory_id = :factory_id AND machine_id = :machine_id
+    AND metric = :metric AND window_s = :window_s AND bucket_start >= :start AND bucket_start < :end
+  ORDER BY bucket_start LIMIT 1000
+"""
+
+
+def synth_batches(n: int, series: int, seed: int = 11) -> List[MeasurementBatch]:
+    rnd = random.Random(seed)
+    t0 = int(T0.timestamp() * 1000)
+    out: List[MeasurementBatch] = []
+    for i in range(0, n, BATCH):
+        b = MeasurementBatch()
+        for j in range(i, min(i + BATCH, n)):
+            s = int(rnd.paretovariate(1.2)) % series
+            b.add((TENANT, "f1", f"mc-{s % 50:02d}", f"s-{s:04d}", "temp"),
+                  t0 + j * 50 + rnd.randrange(-90_000, 90_000), rnd.gauss(25.0, 2.0))
+        out.append(b)
+    return out
+
+
+def _raw_columns(b: MeasurementBatch) -> dict:
+    keys = b.keys
+    return {"t": b.times, "tenant_id": [k[0] for k in keys], "factory_id": [k[1] for k in keys],
+            "machine_id": [k[2] for k in keys], "sensor_id": [k[3] for k in keys],
+            "metric": [k[4] for k in keys], "value": b.values}
+
+
+def bench_cpu(batches: List[MeasurementBatch], n: int) -> None:
+    agg = get_batch_aggregator()
+
+    def python_path():
+        for b in batches:
+            rows = list(agg(b, Config.WINDOWS))
+            _values_sql(AGG_COLS, len(rows), {"sketch": "JSONB"})
+            _bind(AGG_COLS, [_agg_params(r) for r in rows])
+
+    def raw_path():
+        for b in batches:
+            _raw_columns(b)
+
+    print(f"worker CPU ({n:,} measurements, batch {BATCH}, AGG_ENGINE={Config.AGG_ENGINE}, windows={Config.WINDOWS})")
+    for name, fn in (("python aggregate + upsert params", python_path), ("cagg: raw columns", raw_path)):
+        best = float("inf")
+        for _ in range(3):
+            t = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - t)
+        print(f"  {name:<34} {n / best:12,.0f} measurements/s")
+
+
+def _query_latency(db, src: str, keys: List[tuple], window_s: int, end: datetime, repeat: int) -> float:
+    q = text(_QUERY.format(src=src))
+    times = []
+    for _ in range(repeat):
+        for k in keys:
+            t = time.perf_counter()
+            db.execute(q, {"tenant_id": k[0], "factory_id": k[1], "machine_id": k[2], "metric": k[4],
+                           "window_s": window_s, "start": T0, "end": end}).all()
+            times.append(time.perf_counter() - t)
+    return statistics.median(times) * 1e3
+
+
+def bench_db(batches: List[MeasurementBatch], n: int, materialize: bool) -> None:
+    from app.database import SessionLocal, engine
+
+    agg = get_batch_aggregator()
+    keys = list(dict.fromkeys(k for b in batches[:4] for k in b.keys))[:20]
+    end = T0 + timedelta(days=1)
+    db = SessionLocal()
+    try:
+        repo = AnalyticsRepo(db)
+        t = time.perf_counter()
+        for b in batches:
+            with db.begin_nested():
+                repo.upsert_agg_many(list(agg(b, Config.WINDOWS)))
+        py = time.perf_counter() - t
+
+        t = time.perf_counter()
+        for b in batches:
+            with db.begin_nested():
+                repo.insert_raw_many(b)
+        cg = time.perf_counter() - t
+        print(f"ingest ({n:,} measurements, 1 statement set / batch)")
+        print(f"  python → analytics_agg           {n / py:12,.0f} measurements/s")
+        print(f"  cagg   → {Config.RAW_TABLE:<24} {n / cg:12,.0f} measurements/s  (x{py / cg:.1f})")
+
+        print(f"/v1/agg query latency (median ms, {len(keys)} series)")
+        for w in Config.WINDOWS:
+            a = _query_latency(db, "analytics.analytics_agg", keys, w, end, 3)
+            b = _query_latency(db, "analytics.v_agg_cagg", keys, w, end, 3)
+            print(f"  window {w:>5}s  analytics_agg {a:7.2f}   v_agg_cagg (real-time) {b:7.2f}")
+
+        if materialize:
+            db.commit()
+    finally:
+        if not materialize:
+            db.rollback()
+        db.close()
+
+    if not materialize:
+        return
+    try:
+        # refresh_continuous_aggregate รันใน transaction block ไม่ได้
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as c:
+            for w in (60, 300, 3600):
+                c.execute(text(f"CALL refresh_continuous_aggregate('analytics.agg_cagg_{w}s', :s, :e)"),
+                          {"s": T0 - timedelta(hours=1), "e": end})
+        db = SessionLocal()
+        try:
+            print("/v1/agg query latency หลัง refresh (median ms)")
+            for w in Config.WINDOWS:
+                a = _query_latency(db, "analytics.analytics_agg", keys, w, end, 3)
+                b = _query_latency(db, "analytics.v_agg_cagg", keys, w, end, 3)
+                print(f"  window {w:>5}s  analytics_agg {a:7.2f}   v_agg_cagg (materialized) {b:7.2f}")
+        finally:
+            db.close()
+    finally:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as c:
+            c.execute(text("DELETE FROM analytics.analytics_agg WHERE tenant_id = :t"), {"t": TENANT})
+            c.execute(text(f"DELETE FROM {Config.RAW_TABLE} WHERE tenant_id = :t"), {"t": TENANT})
+            for w in (60, 300, 3600):
+                c.execute(text(f"CALL refresh_continuous_aggregate('analytics.agg_cagg_{w}s', :s, :e)"),
+                          {"s": T0 - timedelta(hours=1), "e": end})
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200_000)
+    ap.add_argument("--series", type=int, default=500)
+    ap.add_argument("--db", action="store_true", help="วัด ingest/query บน DB จริง (DB_* env)")
+    ap.add_argument("--materialize", action="store_true", help="commit + refresh cagg แล้ววัด query (ลบข้อมูล bench ทิ้งตอนจบ)")
+    args = ap.parse_args()
+
+    batches = synth_batches(args.n, args.series)
+    bench_cpu(batches, args.n)
+    if args.db:
+        bench_db(batches, args.n, args.materialize)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# bench/bench_decode.py
+"""
+micro-benchmark decode + map ต่อ topic: stdlib (json.loads) เทียบกับ fast path (msgspec schema / orjson)
+ตรวจด้วยว่า output ของ mapper ทั้งสองทางเท่ากันสำหรับ payload ตัวอย่าง
+
+    python -m bench.bench_decode --n 20000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+
+from app.pipelines.decode import MSGSPEC_AVAILABLE, decoder_for
+from app.pipelines.map.device_health import handle_device_health
+from app.pipelines.map.econ import handle_econ_event
+from app.pipelines.map.lab import handle_lab_record
+from app.pipelines.map.ops import handle_ops_event
+from app.pipelines.map.sensor import handle_sensor_reading
+from app.pipelines.map.sweep import handle_sweep_reading
+from app.pipelines.map.weather import handle_weather_record
+
+# payload ตัวอย่างตาม docstring ของ mapper
+SAMPLES = {
+    "sensors.device.readings": (handle_sensor_reading, {
+        "time": "2025-08-20T03:12:00Z", "tenant_id": "t1", "factory_id": "f1", "machine_id": "mc-01",
+        "sensor_id": "s-001", "metric": "temp", "value": 23.7}),
+    "device.health": (handle_device_health, {
+        "time": "2025-08-20T03:12:00Z", "tenant_id": "t1", "factory_id": "f1", "machine_id": "mc-01",
+        "health_score": 0.96, "battery_pct": 82, "cpu_pct": 36.4}),
+    "sensors.sweep.readings": (handle_sweep_reading, {
+        "time": "2025-08-20T02:20:00Z", "tenant_id": "t1", "factory_id": "f1", "machine_id": "mc-01",
+        "metric": "temp", "readings": [{"value": 23.1}, {"value": 22.9}, {"value": 23.6}]}),
+    "lab.results": (handle_lab_record, {
+        "time": "2025-08-20T01:45:00Z", "tenant_id": "t1", "factory_id": "f1", "station_id": "lab-01",
+        "sample_id": "S-8892", "analyte": "Moisture", "value": 12.4, "unit": "%", "lot": "L-1001"}),
+    "weather.readings": (handle_weather_record, {
+        "time": "2025-08-20T02:05:00Z", "tenant_id": "t1", "factory_id": "farm-a", "station_id": "wx-001",
+        "temp_c": 31.2, "humidity": 78.0, "rain_mm": 0.0, "wind_kph": 5.6, "payload": {"src": "openweather"}}),
+    "ops.events": (handle_ops_event, {
+        "time": "2025-08-20T03:00:00Z", "tenant_id": "t1", "entity_type": "batch",
+        "entity_id": "B-2025-08-01", "event_type": "batch_started", "value": None,
+        "payload": {"species": "broiler", "target_fcr": 1.5}}),
+    "econ.events": (handle_econ_event, {
+        "time": "2025-08-20T02:00:00Z", "tenant_id": "t1", "commodity": "corn", "price": 256.7,
+        "currency": "USD/MT", "source": "bloomberg"}),
+}
+
+
+def _bench(decoder, handler, raw: bytes, n: int) -> float:
+    t = time.perf_counter()
+    for _ in range(n):
+        handler(decoder(raw))
+    return (time.perf_counter() - t) / n * 1e6  # µs/msg
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20_000)
+    args = ap.parse_args()
+
+    print(f"msgspec schemas: {'on' if MSGSPEC_AVAILABLE else 'off (fallback)'}")
+    print(f"{'topic':<26}{'stdlib µs':>12}{'fast µs':>12}{'speedup':>10}")
+    for topic, (handler, sample) in SAMPLES.items():
+        raw = json.dumps(sample).encode()
+        slow, fast = decoder_for(topic, "stdlib"), decoder_for(topic, "auto")
+        assert handler(slow(raw)) == handler(fast(raw)), f"{topic}: mapper output differs"
+        a = _bench(slow, handler, raw, args.n)
+        b = _bench(fast, handler, raw, args.n)
+        print(f"{topic:<26}{a:>12.2f}{b:>12.2f}{a / b:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# bench/bench_kpi.py
+"""
+ตรวจ sigma/Cp/Cpk/Pp/Ppk ของ compute_kpi (moment จาก analytics_agg) เทียบกับ reference จาก raw ตรง ๆ
+บนข้อมูลสังเคราะห์ที่ค่าเฉลี่ยลอยระหว่าง bucket (within < overall ชัด ๆ)
+
+  1) offline: raw → worker aggregator (window 60s, มี m2_val) → รวม moment แบบเดียวกับ _base_sql ใน Python
+     เทียบ raw: overall = statistics.stdev(ทั้ง period), within = pooled sd รอบ mean ราย bucket
+     + แสดงค่าประมาณเดิม STDDEV_POP(avg_val) ว่าคลาดเท่าไร
+  2) --db: upsert agg ลง analytics_agg แล้วรัน SQL จริงของ compute_kpi ใน transaction เดียวแล้ว rollback
+     (ต้องรัน 071, 076 แล้ว; DB_* env เดียวกับ worker)
+
+    python -m bench.bench_kpi
+    python -m bench.bench_kpi --db
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import random
+import statistics
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from sqlalchemy import text
+
+from app.pipelines.batch import MeasurementBatch
+from app.services.aggregator import get_batch_aggregator
+from app.services.kpi import _base_sql, _compute_cp_cpk, _sigmas
+
+T0 = datetime(2025, 8, 20, tzinfo=timezone.utc)
+TENANT = "bench-kpi"
+LSL, USL = 20.0, 30.0
+WINDOW = 60
+
+
+def synth_raw(series: int, per_series: int, seed: int = 5) -> Dict[tuple, List[Tuple[int, float]]]:
+    """ต่อ series: ค่าเฉลี่ยเดินสุ่มราย bucket (ระหว่าง bucket) + noise ภายใน bucket"""
+    rnd = random.Random(seed)
+    t0 = int(T0.timestamp() * 1000)
+    out: Dict[tuple, List[Tuple[int, float]]] = {}
+    for s in range(series):
+        key = (TENANT, "f1", f"mc-{s:02d}", f"s-{s:03d}", "temp")
+        mu, pts = 25.0, []
+        step = 86_400_000 // per_series
+        for j in range(per_series):
+            t = t0 + j * step
+            if j and t // 60_000 != (t - step) // 60_000:
+                mu += rnd.gauss(0.0, 0.15)
+            pts.append((t, rnd.gauss(mu, 0.8 + 0.4 * (s % 3))))
+        out[key] = pts
+    return out
+
+
+def agg_rows(raw: Dict[tuple, List[Tuple[int, float]]]) -> List[dict]:
+    b = MeasurementBatch()
+    for key, pts in raw.items():
+        for t, v in pts:
+            b.add(key, t, v)
+    return list(get_batch_aggregator()(b, [WINDOW]))
+
+
+def reference(pts: List[Tuple[int, float]]) -> Tuple[float, float]:
+    """(within, overall) จาก raw: pooled sd รอบ mean ราย bucket, sample sd ทั้งหมด"""
+    buckets = defaultdict(list)
+    for t, v in pts:
+        buckets[t - t % (WINDOW * 1000)].append(v)
+    n, k = len(pts), len(buckets)
+    ss = sum(sum((x - statistics.fmean(xs)) ** 2 for x in xs) for xs in buckets.values())
+    return math.sqrt(ss / (n - k)), statistics.stdev(v for _, v in pts)
+
+
+def moments_like_sql(rows: List[dict]) -> Dict[tuple, dict]:
+    """Python ของสูตรใน _base_sql (1 period = ทั้งวัน): n, k, ΣM2, ΣM2 + Σn(mean_i - mean)^2"""
+    groups = defaultdict(list)
+    for r in rows:
+        if r["count_n"] > 0:
+            groups[(r["tenant_id"], r["factory_id"], r["machine_id"], r["sensor_id"], r["metric"])].append(r)
+    out = {}
+    for key, rs in groups.items():
+        n = sum(r["count_n"] for r in rs)
+        mean = sum(r["sum_val"] for r in rs) / n
+        m2w = sum(r["m2_val"] for r in rs)
+        out[key] = {"n": n, "k": len(rs), "mean_val": mean, "m2_within": m2w,
+                    "m2_total": m2w + sum(r["count_n"] * (r["avg_val"] - mean) ** 2 for r in rs),
+                    "old_sd": statistics.pstdev(r["avg_val"] for r in rs)}
+    return out
+
+
+def _rel(a: float, b: float) -> float:
+    return abs(a - b) / abs(b) if b else abs(a)
+
+
+def check(name: str, raw: Dict[tuple, List[Tuple[int, float]]], got: Dict[tuple, dict], tol: float) -> bool:
+    worst = {"within": 0.0, "overall": 0.0, "cpk": 0.0, "ppk": 0.0, "old": 0.0}
+    for key, pts in raw.items():
+        r = got[key]
+        ref_w, ref_o = reference(pts)
+        mean = statistics.fmean(v for _, v in pts)
+        w, o = _sigmas(r["n"], r["k"], r["m2_within"], r["m2_total"])
+        worst["within"] = max(worst["within"], _rel(w, ref_w))
+        worst["overall"] = max(worst["overall"], _rel(o, ref_o))
+        worst["cpk"] = max(worst["cpk"], _rel(_compute_cp_cpk(r["mean_val"], w, LSL, USL)[1],
+                                              _compute_cp_cpk(mean, ref_w, LSL, USL)[1]))
+        worst["ppk"] = max(worst["ppk"], _rel(_compute_cp_cpk(r["mean_val"], o, LSL, USL)[1],
+                                              _compute_cp_cpk(mean, ref_o, LSL, USL)[1]))
+        if "old_sd" in r:
+            worst["old"] = max(worst["old"], _rel(r["old_sd"], ref_o))
+    ok = all(worst[k] < tol for k in ("within", "overall", "cpk", "ppk"))
+    print(f"{name}: max rel err  within {worst['within']:.1e}  overall {worst['overall']:.1e}  "
+          f"Cpk {worst['cpk']:.1e}  Ppk {worst['ppk']:.1e}  → {'OK' if ok else 'MISMATCH'}")
+    if worst["old"]:
+        print(f"  (เดิม STDDEV_POP(avg_val) คลาดจาก overall สูงสุด {worst['old']:.0%})")
+    return ok
+
+
+def check_db(raw: Dict[tuple, List[Tuple[int, float]]], rows: List[dict], tol: float) -> bool:
+    from app.adapters.repository import AnalyticsRepo
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        AnalyticsRepo(db).upsert_agg_many(rows)
+        sql = _base_sql("day", "analytics.analytics_agg", False, False, None, None)
+        res = db.execute(text(f"SELECT * FROM ({sql}) q WHERE tenant_id = :t"),
+                         {"w": WINDOW, "t": TENANT}).mappings().all()
+        got = {(r["tenant_id"], r["factory_id"], r["machine_id"], r["sensor_id"], r["metric"]): dict(r)
+               for r in res}
+        return check("db (SQL ของ compute_kpi)", raw, got, tol)
+    finally:
+        db.rollback()
+        db.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--series", type=int, default=12)
+    ap.add_argument("--per-series", type=int, default=20_000, help="จุดต่อ series ต่อวัน")
+    ap.add_argument("--tol", type=float, default=1e-9)
+    ap.add_argument("--db", action="store_true", help="รัน SQL จริงบน DB (rollback)")
+    args = ap.parse_args()
+
+    raw = synth_raw(args.series, args.per_series)
+    rows = agg_rows(raw)
+    print(f"{args.series} series × {args.per_series:,} จุด → {len(rows):,} agg rows (window {WINDOW}s), "
+          f"spec [{LSL}, {USL}]")
+    ok = check("offline (สูตรเดียวกับ SQL)", raw, moments_like_sql(rows), args.tol)
+    if args.db:
+        ok = check_db(raw, rows, args.tol) and ok
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
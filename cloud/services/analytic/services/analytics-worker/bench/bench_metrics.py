@@ -0,0 +1,151 @@
+# bench/bench_metrics.py
+"""
+overhead ของ Prometheus metrics บน hot path ของ stream worker
+(decode/map ราย topic → aggregate → นับ rows) — รอบที่มี metrics จริง เทียบกับรอบที่แทน metric ด้วย no-op
+เป้าหมาย: overhead ไม่เกินไม่กี่ % ของเวลา CPU ต่อ batch (ไม่รวม DB)
+
+    python -m bench.bench_metrics --batches 200 --size 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import time
+from typing import List
+
+from app.config import Config
+from app.pipelines import init_registry
+from app.pipelines.registry import reload as reload_registry
+from app.workers import stream_worker as sw
+from bench.bench_batch_map import synth
+
+TOPICS = ("sensors.device.readings", "lab.results", "weather.readings")
+METRICS = ("ingested", "decode_errors", "mapper_errors", "mapped_records", "rows_written", "batch_size",
+           "proc_time", "T_DECODE", "T_AGG")
+
+
+class _Msg:
+    """แทน confluent_kafka.Message เท่าที่ _decode_batch ใช้"""
+    __slots__ = ("_topic", "_value")
+
+    def __init__(self, topic: str, value: bytes):
+        self._topic, self._value = topic, value
+
+    def error(self):
+        return None
+
+    def topic(self) -> str:
+        return self._topic
+
+    def value(self) -> bytes:
+        return self._value
+
+
+class _Noop:
+    def labels(self, *a, **kw):
+        return self
+
+    def inc(self, *a):
+        pass
+
+    def set(self, *a):
+        pass
+
+    def observe(self, *a):
+        pass
+
+    def time(self):
+        return contextlib.nullcontext()
+
+
+def _batches(n_batches: int, size: int) -> List[List[_Msg]]:
+    # ข้อความจากหลาย topic ปนกันใน batch เดียว (เหมือน consume จริง)
+    per_topic = {t: synth(t, n_batches * size // len(TOPICS) + 1) for t in TOPICS}
+    msgs = [_Msg(t, json.dumps(o).encode()) for objs in zip(*per_topic.values())
+            for t, o in zip(TOPICS, objs)]
+    msgs.append(_Msg(TOPICS[0], b"{not json"))  # decode error path
+    return [msgs[i:i + size] for i in range(0, n_batches * size, size)]
+
+
+def _run(batches: List[List[_Msg]]) -> None:
+    # ส่วน CPU ของ loop ใน run_worker (ตัด DB ออก: นับ rows แทนการเขียน)
+    for msgs in batches:
+        t0 = time.perf_counter()
+        sw.batch_size.set(len(msgs))
+        with sw.T_DECODE.time():
+            measurements, events = sw._decode_batch(msgs)
+        with sw.T_AGG.time():
+            rows = list(sw._aggregate(measurements, Config.WINDOWS)) if measurements else []
+        sw.rows_written.labels(table="analytics_agg").inc(len(rows))
+        sw.rows_written.labels(table="analytics_event").inc(len(events))
+        sw.proc_time.observe(time.perf_counter() - t0)
+
+
+def _metrics_only(batches: List[List[_Msg]]) -> float:
+    """เวลาเฉพาะการเรียก metric ต่อ batch (ชุดเดียวกับที่ _decode_batch + loop ทำจริง)"""
+    t = time.perf_counter()
+    for msgs in batches:
+        sw.batch_size.set(len(msgs))
+        with sw.T_DECODE.time():
+            for topic in TOPICS:
+                sw.ingested.labels(topic=topic).inc(len(msgs) // len(TOPICS))
+                sw.mapped_records.labels(topic=topic, kind="measurement").inc(1)
+            sw.mapper_errors.labels(topic=TOPICS[0]).inc(1)
+            sw.mapped_records.labels(topic=TOPICS[2], kind="event").inc(1)
+        with sw.T_AGG.time():
+            pass
+        sw.rows_written.labels(table="analytics_agg").inc(1)
+        sw.rows_written.labels(table="analytics_event").inc(1)
+        sw.proc_time.observe(0.01)
+    return time.perf_counter() - t
+
+
+def _timed(batches) -> float:
+    t = time.perf_counter()
+    _run(batches)
+    return time.perf_counter() - t
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--batches", type=int, default=200)
+    ap.add_argument("--size", type=int, default=500, help="ข้อความต่อ batch (เท่ากับ consume num_messages)")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    os.environ["DOMAINS_ENABLED"] = "sensor,lab,weather"
+    init_registry()
+    reload_registry()
+    batches = _batches(args.batches, args.size)
+    n = sum(len(b) for b in batches)
+
+    real = {name: getattr(sw, name) for name in METRICS}
+    noop = {name: _Noop() for name in METRICS}
+    _run(batches[:5])  # warm-up (สร้าง label child ครั้งแรก)
+    # สลับสองโหมดทุกรอบแล้วเอาค่าดีที่สุด → ไม่ให้ลำดับ/ความร้อนของ cache เอียงผล
+    with_metrics = without = float("inf")
+    try:
+        for _ in range(args.repeat):
+            with_metrics = min(with_metrics, _timed(batches))
+            for name, m in noop.items():
+                setattr(sw, name, m)
+            without = min(without, _timed(batches))
+            for name, m in real.items():
+                setattr(sw, name, m)
+    finally:
+        for name, m in real.items():
+            setattr(sw, name, m)
+
+    print(f"{n:,} msgs in {len(batches)} batches")
+    print(f"no-op metrics : {without:.3f}s ({n / without:,.0f} msg/s)")
+    print(f"prometheus    : {with_metrics:.3f}s ({n / with_metrics:,.0f} msg/s)")
+    print(f"overhead      : {(with_metrics / without - 1) * 100:+.2f}%  (end-to-end, รวม noise ของเครื่อง)")
+    direct = min(_metrics_only(batches) for _ in range(args.repeat))
+    print(f"metric calls  : {direct * 1e6 / len(batches):.1f}µs/batch = {direct / without * 100:.2f}% ของ CPU ต่อ batch")
+
+
+if __name__ == "__main__":
+    main()
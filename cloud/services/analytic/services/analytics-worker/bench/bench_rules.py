@@ -0,0 +1,129 @@
+# bench/bench_rules.py
+"""
+rule engine แบบ NumPy (app.domain.rules) เทียบกับเวอร์ชันเดิม (slice หน้าต่างทีละ index)
+  1) ตรวจว่า hit (index, code) ของ WE-1..4 เท่ากับของเดิมทุกตัว และ N-3/N-4/N-7/N-8 ตรงกับ brute force
+  2) จับเวลา evaluate() บน series ยาว (ค่าเริ่มต้น 1M จุด)
+
+    python -m bench.bench_rules --n 1000000 --check 20000 [--legacy]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import List, Sequence, Tuple
+
+from app.domain import rules
+
+
+# ---- reference: implementation เดิมก่อน vectorize (O(n·w)) ----
+def _side(v: float, cl: float) -> int:
+    if v > cl: return 1
+    if v < cl: return -1
+    return 0
+
+def _ref_we(values: Sequence[float], cl: float, std: float) -> List[Tuple[int, str]]:
+    out = []
+    if std > 0:
+        out += [(i, "WE-1") for i, v in enumerate(values) if v > cl + 3*std or v < cl - 3*std]
+        for i in range(2, len(values)):
+            over2 = [v for v in values[i-2:i+1] if (v > cl + 2*std or v < cl - 2*std)]
+            if len(over2) >= 2 and len({_side(v, cl) for v in over2}) <= 1:
+                out.append((i, "WE-2"))
+        for i in range(4, len(values)):
+            over1 = [v for v in values[i-4:i+1] if (v > cl + std or v < cl - std)]
+            if len(over1) >= 4 and len({_side(v, cl) for v in over1}) == 1:
+                out.append((i, "WE-3"))
+    for i in range(7, len(values)):
+        s = [_side(v, cl) for v in values[i-7:i+1]]
+        if (all(x >= 0 for x in s) or all(x <= 0 for x in s)) and any(x != 0 for x in s):
+            out.append((i, "WE-4"))
+    return out
+
+def _ref_nelson(values: Sequence[float], cl: float, std: float) -> List[Tuple[int, str]]:
+    out = []
+    for i in range(5, len(values)):
+        w = values[i-5:i+1]
+        if all(b > a for a, b in zip(w, w[1:])) or all(b < a for a, b in zip(w, w[1:])):
+            out.append((i, "N-3"))
+    for i in range(13, len(values)):
+        w = values[i-13:i+1]
+        d = [b - a for a, b in zip(w, w[1:])]
+        if all(x * y < 0 for x, y in zip(d, d[1:])):
+            out.append((i, "N-4"))
+    if std > 0:
+        for i in range(14, len(values)):
+            if all(abs(v - cl) < std for v in values[i-14:i+1]):
+                out.append((i, "N-7"))
+        for i in range(7, len(values)):
+            w = values[i-7:i+1]
+            if all(abs(v - cl) > std for v in w) and any(v > cl for v in w) and any(v < cl for v in w):
+                out.append((i, "N-8"))
+    return out
+
+
+def synth(n: int, seed: int = 11, every: int = 6) -> List[float]:
+    """
+    series ปกติ + ช่วง shift/trend/สลับ/แกว่งแคบ (ช่วงละ 500 จุด) เพื่อให้ทุกกติกามี hit
+    every: รอบของ phase — ค่ามาก = ส่วนใหญ่ in-control (ใกล้ข้อมูลจริง), 6 = มี anomaly ทุกช่วง
+    """
+    rnd = random.Random(seed)
+    out, level = [], 0.0
+    for i in range(n):
+        phase = (i // 500) % every
+        if phase == 1:
+            level = 1.5                       # shift → WE-2/3/4
+        elif phase == 3:
+            out.append(0.01 * (i % 500) + rnd.gauss(0, 0.001)); continue   # trend → N-3
+        elif phase == 4:
+            out.append((1.8 if i % 2 else -1.8) + rnd.gauss(0, 0.05)); continue  # สลับ → N-4/N-8
+        elif phase == 5:
+            out.append(rnd.gauss(0, 0.2)); continue                         # แกว่งแคบ → N-7
+        else:
+            level = 0.0
+        out.append(level + rnd.gauss(0, 1.0))
+    return out
+
+
+def check(values: List[float], cl: float, std: float) -> int:
+    got = [(h.index, h.code) for h in rules.evaluate(values, cl, std, rules=rules.ALL_RULES)]
+    want = _ref_we(values, cl, std) + _ref_nelson(values, cl, std)
+    assert sorted(got) == sorted(want), "hit mismatch"
+    # WE ต้องได้ลำดับเดียวกับของเดิม (เรียงตาม index, ในแต่ละ index ตามลำดับกติกา)
+    we = [(h.index, h.code) for h in rules.evaluate(values, cl, std, rules=rules.WE_RULES)]
+    assert we == sorted(_ref_we(values, cl, std), key=lambda x: x[0]), "WE order mismatch"
+    return len(got)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=1_000_000)
+    ap.add_argument("--check", type=int, default=20_000, help="จำนวนจุดที่ใช้ตรวจกับ reference")
+    ap.add_argument("--every", type=int, default=40, help="รอบ phase ของ series ยาว (40 → anomaly ~10%%)")
+    ap.add_argument("--legacy", action="store_true", help="จับเวลา implementation เดิมบน --n ด้วย (ช้า)")
+    args = ap.parse_args()
+
+    small = synth(args.check)
+    hits = check(small, 0.0, 1.0)
+    print(f"equivalent: {hits} hits over {args.check:,} points")
+
+    values = synth(args.n, every=args.every)
+    t = time.perf_counter()
+    hits = rules.evaluate(values, 0.0, 1.0, rules=rules.ALL_RULES)
+    dt = time.perf_counter() - t
+    by_code = {}
+    for h in hits:
+        by_code[h.code] = by_code.get(h.code, 0) + 1
+    print(f"numpy   {args.n:,} points: {dt:.3f}s ({args.n / dt:,.0f} pts/s)  hits={by_code}")
+
+    ref = values if args.legacy else small
+    t = time.perf_counter()
+    _ref_we(ref, 0.0, 1.0)
+    dt_ref = time.perf_counter() - t
+    n_ref = len(ref)
+    print(f"legacy  {n_ref:,} points: {dt_ref:.3f}s ({n_ref / dt_ref:,.0f} pts/s, WE-1..4 เท่านั้น)")
+
+
+if __name__ == "__main__":
+    main()
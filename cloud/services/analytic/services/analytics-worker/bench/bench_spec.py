@@ -0,0 +1,149 @@
+# bench/bench_spec.py
+"""
+SpecResolver (interval index ใน memory) เทียบกับ lookup ทีละแถว
+
+  1) offline: lookups/s ของ SpecResolver.get บน spec สังเคราะห์ (หลายช่วงเวลาต่อ series)
+     + ตรวจผลเท่ากับการไล่หาแบบตรง ๆ (linear scan ของช่วงที่ครอบเวลา)
+  2) --db: เทียบกับ SELECT ... WHERE period @> :t ต่อ lookup (แบบ spec_lookup ที่ผู้ใช้เขียนเอง)
+     ใส่ spec ของ tenant "bench-spec" ใน transaction แล้ว rollback (ต้องรัน 071, 083 แล้ว; DB_* env เดียวกับ worker)
+
+    python -m bench.bench_spec --series 2000
+    python -m bench.bench_spec --series 2000 --db
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+from sqlalchemy import text
+
+from app.services.spec_resolver import SpecResolver
+from app.utils.time import dt_to_ms
+
+T0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+TENANT = "bench-spec"
+
+
+def synth_specs(series: int, per_series: int, seed: int = 3) -> List[tuple]:
+    """แต่ละ series มี per_series ช่วงต่อกัน (ช่วงสุดท้ายเปิดปลาย) — รูปแบบแถวเดียวกับ SpecResolver.load"""
+    rnd = random.Random(seed)
+    rows = []
+    for s in range(series):
+        t = T0
+        for j in range(per_series):
+            nxt = t + timedelta(days=rnd.randint(5, 40))
+            cl = rnd.uniform(10, 50)
+            rows.append((TENANT, "f1", f"mc-{s:04d}", None, "temp", t, None if j == per_series - 1 else nxt,
+                         cl, cl + 3, cl - 3, cl + 5, cl - 5))
+            t = nxt
+    return rows
+
+
+def synth_queries(series: int, n: int, seed: int = 4) -> List[Tuple[tuple, int]]:
+    rnd = random.Random(seed)
+    t0 = dt_to_ms(T0 - timedelta(days=10))
+    return [((TENANT, "f1", f"mc-{rnd.randrange(series):04d}", "s-1", "temp"),
+             t0 + rnd.randrange(400 * 86_400_000)) for _ in range(n)]
+
+
+def _linear(rows: List[tuple], key: tuple, t: int):
+    for r in rows:
+        if (r[0], r[1], r[2], r[4]) == (key[0], key[1], key[2], key[4]):
+            lo = dt_to_ms(r[5]) if r[5] is not None else float("-inf")
+            hi = dt_to_ms(r[6]) if r[6] is not None else float("inf")
+            if lo <= t < hi:
+                return r[7]
+    return None
+
+
+class _Rows:
+    def __init__(self, rows): self.rows = rows
+    def execute(self, *_a, **_k): return self
+    def all(self): return self.rows
+    def close(self): pass
+
+
+def bench_offline(rows: List[tuple], queries: List[Tuple[tuple, int]]) -> None:
+    res = SpecResolver(lambda: _Rows(rows), ttl_s=3600)
+    t = time.perf_counter()
+    res.load()
+    load = time.perf_counter() - t
+
+    by_series = {}
+    for r in rows:
+        by_series.setdefault(r[2], []).append(r)
+    bad = 0
+    for key, ts in queries[:2000]:
+        lim = res.get(key, ts)
+        if (lim.cl if lim else None) != _linear(by_series.get(key[2], []), key, ts):
+            bad += 1
+
+    best = float("inf")
+    for _ in range(3):
+        t = time.perf_counter()
+        for key, ts in queries:
+            res.get(key, ts)
+        best = min(best, time.perf_counter() - t)
+    print(f"load {len(rows):,} intervals in {load * 1e3:.1f} ms; check vs linear scan: "
+          f"{'OK' if not bad else f'{bad} MISMATCH'}")
+    print(f"  SpecResolver.get   {len(queries) / best:12,.0f} lookups/s   "
+          f"(hit {res.hits:,} / miss {res.misses:,})")
+
+
+def bench_db(rows: List[tuple], queries: List[Tuple[tuple, int]]) -> None:
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        for r in rows:
+            db.execute(text("""
+              INSERT INTO analytics.analytics_spec_limits
+                (tenant_id, factory_id, machine_id, sensor_id, metric, period, cl, ucl, lcl, usl, lsl)
+              VALUES (:t, :f, :m, :s, :metric, tstzrange(:lo, :hi, '[)'), :cl, :ucl, :lcl, :usl, :lsl)
+            """), dict(zip(("t", "f", "m", "s", "metric", "lo", "hi", "cl", "ucl", "lcl", "usl", "lsl"), r)))
+        q = text("""
+          SELECT cl, ucl, lcl, usl, lsl FROM analytics.analytics_spec_limits
+          WHERE tenant_id = :t AND factory_id = :f AND machine_id = :m AND metric = :metric AND period @> :ts
+        """)
+        sample = queries[:2000]
+        t = time.perf_counter()
+        for key, ts in sample:
+            db.execute(q, {"t": key[0], "f": key[1], "m": key[2], "metric": key[4],
+                           "ts": T0 + timedelta(milliseconds=ts - dt_to_ms(T0))}).first()
+        per_row = time.perf_counter() - t
+
+        t = time.perf_counter()
+        res = SpecResolver(lambda: db, ttl_s=3600)
+        res.load(db)
+        for key, ts in sample:
+            res.get(key, ts)
+        cached = time.perf_counter() - t
+        print(f"db ({len(sample):,} lookups)")
+        print(f"  SELECT ต่อ lookup        {len(sample) / per_row:12,.0f} lookups/s")
+        print(f"  bulk load + resolver      {len(sample) / cached:12,.0f} lookups/s  (x{per_row / cached:.0f})")
+    finally:
+        db.rollback()
+        db.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--series", type=int, default=2000)
+    ap.add_argument("--per-series", type=int, default=8, help="จำนวนช่วง spec ต่อ series")
+    ap.add_argument("--n", type=int, default=200_000, help="จำนวน lookup")
+    ap.add_argument("--db", action="store_true", help="เทียบกับ SELECT ต่อ lookup บน DB จริง (rollback)")
+    args = ap.parse_args()
+
+    rows = synth_specs(args.series, args.per_series)
+    queries = synth_queries(args.series, args.n)
+    bench_offline(rows, queries)
+    if args.db:
+        bench_db(rows, queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# bench/bench_time.py
+"""
+แกนเวลาแบบ int epoch ms เทียบกับเส้นทาง datetime เดิม (parse_ts + floor_to_bucket ราย record × window)
+  1) ตรวจว่า parse_ts_ms / bucket แบบ integer ให้ค่าเดียวกับ datetime ทุกตัว
+     (string หลายรูปแบบ, datetime จาก msgspec, offset ที่ไม่ใช่ UTC)
+  2) จับเวลาต่อ record: parse, parse + bucket ทุก window, map + aggregate ของ sensor, event rollup
+
+    python -m bench.bench_time --n 50000
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from app.config import Config
+from app.pipelines.map.sensor import handle_sensor_batch, handle_sensor_reading
+from app.services.aggregator import _reduce, aggregate_batch
+from app.utils.time import dt_to_ms, floor_ms, floor_to_bucket, ms_to_dt, parse_ts, parse_ts_ms
+from app.workers.stream_worker import _event_rollups
+from bench.bench_batch_map import synth
+
+
+# ---- reference: เส้นทางเดิมก่อนเปลี่ยนเป็น epoch ms ----
+def _legacy_aggregate(objs: List[dict], windows: List[int]):
+    buckets = defaultdict(list)
+    for o in objs:
+        _, m = handle_sensor_reading(o)
+        key = (m["tenant_id"], m["factory_id"], m["machine_id"], m.get("sensor_id"), m["metric"])
+        for w in windows:
+            buckets[(key, w, dt_to_ms(floor_to_bucket(m["time"], w)))].append(m["value"])
+    return list(_reduce(buckets))
+
+def _legacy_event_rollups(events: List[dict], windows: List[int]) -> int:
+    grouped = 0
+    for w in windows:
+        g = {}
+        for e in events:
+            bucket = floor_to_bucket(e["time"], w).astimezone(timezone.utc)
+            key = (e["tenant_id"], e["domain"], e["entity_type"], e["entity_id"], e["event_type"], w, bucket)
+            g.setdefault(key, []).append(e.get("value"))
+        grouped += len(g)
+    return grouped
+
+
+def _samples(n: int, seed: int = 3) -> List[object]:
+    rnd = random.Random(seed)
+    t0 = datetime(2025, 8, 20, tzinfo=timezone.utc)
+    out: List[object] = []
+    for i in range(n):
+        t = t0 + timedelta(seconds=rnd.uniform(-86400 * 30, 86400 * 30), microseconds=rnd.randrange(10**6))
+        k = i % 6
+        if k == 0:
+            out.append(t.strftime("%Y-%m-%dT%H:%M:%SZ"))
+        elif k == 1:
+            out.append(t.strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
+        elif k == 2:
+            out.append(t.strftime("%Y-%m-%dT%H:%M:%S.") + f"{t.microsecond // 1000:03d}Z")
+        elif k == 3:
+            out.append(t.astimezone(timezone(timedelta(hours=7))).isoformat())
+        elif k == 4:
+            out.append(t.isoformat())
+        else:
+            out.append(t)  # datetime ที่ msgspec parse มาแล้ว
+    return out
+
+
+def check(n: int) -> None:
+    for v in _samples(n):
+        dt = parse_ts(v)
+        ms = parse_ts_ms(v)
+        assert ms == dt_to_ms(dt), f"parse mismatch: {v!r}"
+        assert ms_to_dt(ms) == dt.replace(microsecond=dt.microsecond // 1000 * 1000), f"round-trip: {v!r}"
+        for w in Config.WINDOWS:
+            assert floor_ms(ms, w) == dt_to_ms(floor_to_bucket(dt, w)), f"bucket mismatch: {v!r} w={w}"
+
+
+def _per_record(fn, arg, n: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - t)
+    return best / n * 1e6  # µs/record
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=50_000)
+    ap.add_argument("--check", type=int, default=20_000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    windows = Config.WINDOWS
+
+    check(args.check)
+    print(f"equivalent: {args.check:,} timestamps × windows {windows}")
+
+    objs = [o for o in synth("sensors.device.readings", args.n) if "tenant_id" in o]  # ตัด record เสียออก
+    strs = [o["time"] for o in objs]
+    events = [{"time": parse_ts(s), "tenant_id": "t1", "domain": "ops", "entity_type": "batch",
+               "entity_id": f"B-{i % 50}", "event_type": "tick", "value": float(i % 7)}
+              for i, s in enumerate(strs)]
+
+    ref = sorted((r["bucket_start"], r["window_s"], r["sensor_id"], r["count_n"])
+                 for r in _legacy_aggregate(objs, windows))
+    got = sorted((r["bucket_start"], r["window_s"], r["sensor_id"], r["count_n"])
+                 for r in aggregate_batch(handle_sensor_batch(objs).measurements, windows))
+    assert ref == got, "aggregate rows differ"
+    assert _legacy_event_rollups(events, windows) == len(_event_rollups(events, windows)), "rollups differ"
+
+    cases = [
+        ("parse", lambda xs: [parse_ts(s) for s in xs],
+                  lambda xs: [parse_ts_ms(s) for s in xs], strs),
+        (f"parse + bucket ×{len(windows)}",
+                  lambda xs: [floor_to_bucket(parse_ts(s), w) for s in xs for w in windows],
+                  lambda xs: [t - t % (w * 1000) for t in map(parse_ts_ms, xs) for w in windows], strs),
+        ("sensor map + aggregate",
+                  lambda os: _legacy_aggregate(os, windows),
+                  lambda os: list(aggregate_batch(handle_sensor_batch(os).measurements, windows)), objs),
+        ("event rollup",
+                  lambda es: _legacy_event_rollups(es, windows),
+                  lambda es: _event_rollups(es, windows), events),
+    ]
+    print(f"{'µs/record':<28}{'datetime':>10}{'epoch ms':>10}{'reduction':>11}")
+    for name, old, new, arg in cases:
+        a = _per_record(old, arg, args.n, args.repeat)
+        b = _per_record(new, arg, args.n, args.repeat)
+        print(f"{name:<28}{a:>10.3f}{b:>10.3f}{(1 - b / a) * 100:>10.1f}%")
+
+
+if __name__ == "__main__":
+    main()
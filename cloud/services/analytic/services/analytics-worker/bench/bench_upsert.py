@@ -0,0 +1,122 @@
+# bench/bench_upsert.py
+"""
+เทียบ rows/sec ระหว่าง upsert ทีละแถวผ่าน Session, bulk multi-VALUES (WRITE_ADAPTER=session)
+และ psycopg3 pipeline mode + prepared statement (WRITE_ADAPTER=pipeline)
+ต้องมี Postgres/TimescaleDB ที่รัน cloud/db/071,072,076 แล้ว (ใช้ DB_* env เดียวกับ worker)
+ทุกรอบทำใน transaction แล้ว rollback — ไม่ทิ้งข้อมูลไว้ใน DB
+
+    python -m bench.bench_upsert --rows 5000
+    python -m bench.bench_upsert --rows 5000 --bad 3   # + แถวผิด 3 แถว: pipeline รายงาน error ราย statement
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.adapters.pg_pipeline import PipelineRepo
+from app.adapters.repository import AnalyticsRepo
+from app.database import SessionLocal
+
+
+def _agg_rows(n: int, series: int = 200):
+    t0 = datetime(2025, 8, 20, tzinfo=timezone.utc)
+    rows = []
+    for i in range(n):
+        s = i % series
+        v = random.gauss(25.0, 2.0)
+        rows.append({
+            "bucket_start": t0 + timedelta(seconds=60 * (i // series)),
+            "window_s": 60,
+            "tenant_id": "bench", "factory_id": "f1", "machine_id": f"mc-{s:04d}",
+            "sensor_id": f"s-{s:04d}", "metric": "temp",
+            "count_n": 10, "sum_val": v * 10, "avg_val": v,
+            "min_val": v - 1, "max_val": v + 1, "stddev_val": 0.5, "p95_val": v + 0.8,
+        })
+    return rows
+
+
+def _rollup_rows(n: int, series: int = 200):
+    t0 = datetime(2025, 8, 20, tzinfo=timezone.utc)
+    return [{
+        "bucket_start": t0 + timedelta(seconds=60 * (i // series)), "window_s": 60,
+        "tenant_id": "bench", "domain": "device", "entity_type": "machine",
+        "entity_id": f"mc-{i % series:04d}", "event_type": "status",
+        "count_n": 3, "sum_val": 2.0, "avg_val": 2.0 / 3, "min_val": 0.0, "max_val": 1.0,
+    } for i in range(n)]
+
+
+def _event_rows(n: int, series: int = 200):
+    t0 = datetime(2025, 8, 20, tzinfo=timezone.utc)
+    return [{
+        "time": t0 + timedelta(milliseconds=250 * i), "tenant_id": "bench", "domain": "device",
+        "entity_type": "machine", "entity_id": f"mc-{i % series:04d}", "event_type": "status",
+        "value": float(i % 3), "unit": None, "severity": None, "payload": {"i": i},
+    } for i in range(n)]
+
+
+def _anomaly_rows(n: int, series: int = 200):
+    t0 = datetime(2025, 8, 20, tzinfo=timezone.utc)
+    return [{
+        "time": t0 + timedelta(milliseconds=250 * i), "tenant_id": "bench", "factory_id": "f1",
+        "machine_id": f"mc-{i % series:04d}", "sensor_id": f"s-{i % series:04d}", "metric": "temp",
+        "rule_code": "WE-1", "severity": 3, "value": 31.0, "cl": 25.0, "ucl": 30.0, "lcl": 20.0,
+        "zscore": 3.6, "details": {"reason": "bench"},
+    } for i in range(n)]
+
+
+def _timed(label: str, fn, rows, repo_cls=AnalyticsRepo) -> float:
+    db = SessionLocal()
+    try:
+        repo = repo_cls(db)
+        t = time.perf_counter()
+        fn(repo, rows)
+        db.flush()
+        dt = time.perf_counter() - t
+    finally:
+        db.rollback()
+        db.close()
+    rate = len(rows) / dt if dt > 0 else float("inf")
+    print(f"{label:<32} {len(rows):>8} rows  {dt:8.3f}s  {rate:12,.0f} rows/s")
+    for e in getattr(repo, "errors", [])[:5]:
+        print(f"    {e.table}{e.key}: {e.error.splitlines()[0]}")
+    return rate
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=5000)
+    ap.add_argument("--bad", type=int, default=0, help="ใส่แถว tenant_id = NULL กี่แถว (รอบ pipeline)")
+    args = ap.parse_args()
+
+    aggs = _agg_rows(args.rows)
+    rollups = _rollup_rows(args.rows)
+    events = _event_rows(args.rows)
+    anomalies = _anomaly_rows(args.rows)
+
+    a1 = _timed("analytics_agg: per-row", lambda r, rows: [r.upsert_agg(x) for x in rows], aggs)
+    a2 = _timed("analytics_agg: bulk", lambda r, rows: r.upsert_agg_many(rows), aggs)
+    a3 = _timed("analytics_agg: pipeline", lambda r, rows: r.upsert_agg_many(rows), aggs, PipelineRepo)
+    e1 = _timed("event_rollup: per-row", lambda r, rows: [r.upsert_event_rollup(x) for x in rows], rollups)
+    e2 = _timed("event_rollup: bulk", lambda r, rows: r.upsert_event_rollup_many(rows), rollups)
+    e3 = _timed("event_rollup: pipeline", lambda r, rows: r.upsert_event_rollup_many(rows), rollups, PipelineRepo)
+    v1 = _timed("analytics_event: per-row", lambda r, rows: [r.insert_event(x) for x in rows], events)
+    v2 = _timed("analytics_event: bulk", lambda r, rows: r.insert_events_many(rows), events)
+    v3 = _timed("analytics_event: pipeline", lambda r, rows: r.insert_events_many(rows), events, PipelineRepo)
+    n2 = _timed("analytics_anomaly: bulk", lambda r, rows: r.insert_anomalies_many(rows), anomalies)
+    n3 = _timed("analytics_anomaly: pipeline", lambda r, rows: r.insert_anomalies_many(rows), anomalies, PipelineRepo)
+    print(f"speedup vs per-row: agg bulk x{a2 / a1:.1f} pipeline x{a3 / a1:.1f}, "
+          f"rollup bulk x{e2 / e1:.1f} pipeline x{e3 / e1:.1f}, event bulk x{v2 / v1:.1f} pipeline x{v3 / v1:.1f}")
+    print(f"pipeline vs bulk: agg x{a3 / a2:.2f}, rollup x{e3 / e2:.2f}, event x{v3 / v2:.2f}, anomaly x{n3 / n2:.2f}")
+
+    if args.bad:
+        bad = [dict(r) for r in aggs]
+        for i in range(args.bad):
+            bad[(i * 7919) % len(bad)]["tenant_id"] = None
+        _timed(f"analytics_agg: pipeline +{args.bad} bad", lambda r, rows: r.upsert_agg_many(rows), bad, PipelineRepo)
+
+
+if __name__ == "__main__":
+    main()
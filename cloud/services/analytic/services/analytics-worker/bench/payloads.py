@@ -0,0 +1,256 @@
+# bench/payloads.py
+"""
+payload สังเคราะห์ต่อ topic (รูปแบบหลัง decode = dict เดียวกับที่ handler ได้จาก json/orjson)
+รูปร่างตาม docstring ของ mapper ใน app/pipelines/map/* และใกล้ traffic จริง:
+
+- cardinality เบ้: series ถูกสุ่มแบบ Zipf (ไม่กี่ series ร้อนมาก, ที่เหลือนาน ๆ มาที) — dict/bucket ใน aggregator
+  โตตามจำนวน series จริง ไม่ใช่ uniform
+- เวลาไม่เรียง: jitter ไม่กี่วินาทีทุกข้อความ + ~2% มาช้า 1–15 นาที (ข้ามขอบ bucket)
+  รูปแบบเวลาปนกัน: 'Z' + ms, ไม่มีเศษวินาที, offset +07:00
+- record เสีย ~0.2% (ขาด field บังคับ) → handler ต้องข้าม/นับ error
+
+    from bench.payloads import GENERATORS
+    objs = GENERATORS["sensors.device.readings"](10_000, seed=1)
+"""
+
+from __future__ import annotations
+
+import random
+from bisect import bisect
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Callable, Dict, List, Sequence
+
+T0 = datetime(2025, 8, 20, tzinfo=timezone.utc)
+_ICT = timezone(timedelta(hours=7))
+
+Generator = Callable[..., List[dict]]
+
+
+class Zipf:
+    """สุ่ม index 0..n-1 ด้วยน้ำหนัก 1/(i+1)^s (bisect บน cumulative weight)"""
+
+    def __init__(self, n: int, s: float = 1.1):
+        self.cum = list(accumulate(1.0 / (i + 1) ** s for i in range(n)))
+
+    def __call__(self, rnd: random.Random) -> int:
+        return bisect(self.cum, rnd.random() * self.cum[-1])
+
+
+class Clock:
+    """เวลาเดินหน้าทีละ step_s + jitter, บางข้อความมาช้า (out-of-order)"""
+
+    def __init__(self, rnd: random.Random, step_s: float, late_p: float = 0.02):
+        self.rnd = rnd
+        self.step_s = step_s
+        self.late_p = late_p
+        self.i = 0
+
+    def __call__(self) -> str:
+        rnd = self.rnd
+        s = self.i * self.step_s + rnd.uniform(-3.0, 1.0)
+        if rnd.random() < self.late_p:
+            s -= rnd.uniform(60, 900)
+        self.i += 1
+        t = T0 + timedelta(seconds=s)
+        r = rnd.random()
+        if r < 0.8:
+            return t.strftime("%Y-%m-%dT%H:%M:%S.") + f"{t.microsecond // 1000:03d}Z"
+        if r < 0.9:
+            return t.strftime("%Y-%m-%dT%H:%M:%SZ")
+        return t.astimezone(_ICT).isoformat()
+
+
+def _corrupt(rnd: random.Random, o: dict, required: Sequence[str], p: float = 0.002) -> dict:
+    if rnd.random() < p:
+        o.pop(rnd.choice(required), None)
+    return o
+
+
+_SENSOR_METRICS = (("temp", 25.0, 2.0), ("humidity", 70.0, 6.0), ("nh3", 12.0, 4.0),
+                   ("co2", 1800.0, 250.0), ("pressure", 101.3, 0.4), ("light", 320.0, 80.0))
+
+
+def sensor_readings(n: int, seed: int = 1, machines: int = 50, sensors_per_machine: int = 8) -> List[dict]:
+    rnd = random.Random(seed)
+    pick = Zipf(machines * sensors_per_machine)
+    clock = Clock(rnd, step_s=0.02)
+    out = []
+    for _ in range(n):
+        s = pick(rnd)
+        metric, mu, sd = _SENSOR_METRICS[s % len(_SENSOR_METRICS)]
+        v = round(rnd.gauss(mu, sd), 2)
+        o = {"time": clock(), "tenant_id": "t1", "factory_id": f"f{s % 3 + 1}",
+             "machine_id": f"mc-{s // sensors_per_machine:02d}", "sensor_id": f"s-{s:03d}",
+             "metric": metric, "value": str(v) if rnd.random() < 0.05 else v}
+        if rnd.random() < 0.3:
+            o["payload"] = {"fw": "1.4.2", "rssi": rnd.randint(-90, -40)}
+        out.append(_corrupt(rnd, o, ("tenant_id", "machine_id", "metric", "value")))
+    return out
+
+
+def device_health(n: int, seed: int = 2, machines: int = 120) -> List[dict]:
+    """3 รูปแบบ: status (→ event), health_score (→ measurement), heartbeat เปล่า (→ event)"""
+    rnd = random.Random(seed)
+    pick = Zipf(machines)
+    clock = Clock(rnd, step_s=1.0)
+    out = []
+    for _ in range(n):
+        m = pick(rnd)
+        o = {"time": clock(), "tenant_id": "t1", "factory_id": f"f{m % 3 + 1}", "machine_id": f"mc-{m:03d}"}
+        r = rnd.random()
+        if r < 0.3:
+            o["status"] = "online" if rnd.random() < 0.95 else "offline"
+            o["level"] = rnd.choice(("ok", "ok", "ok", "warn", "error", "critical"))
+        elif r < 0.8:
+            o["health_score"] = round(rnd.betavariate(9, 1), 3)
+            o["cpu_pct"] = round(rnd.uniform(5, 95), 1)
+        if rnd.random() < 0.7:
+            o["battery_pct"] = rnd.randint(5, 100)
+        if rnd.random() < 0.2:
+            o["payload"] = {"uptime_s": rnd.randint(0, 10**7)}
+        out.append(_corrupt(rnd, o, ("tenant_id", "factory_id", "machine_id")))
+    return out
+
+
+def sweep_readings(n: int, seed: int = 3, machines: int = 40) -> List[dict]:
+    rnd = random.Random(seed)
+    pick = Zipf(machines)
+    clock = Clock(rnd, step_s=5.0)
+    out = []
+    for _ in range(n):
+        m = pick(rnd)
+        k = min(120, int(rnd.paretovariate(1.5) * 3))  # ส่วนใหญ่สั้น, บางชุดยาวมาก
+        readings = [{"value": round(rnd.gauss(23, 0.6), 2)} for _ in range(k)]
+        if readings and rnd.random() < 0.05:
+            readings[rnd.randrange(k)]["value"] = None
+        o = {"time": clock(), "tenant_id": "t1", "factory_id": "f1", "machine_id": f"mc-{m:02d}",
+             "readings": readings}
+        if rnd.random() < 0.8:
+            o["metric"] = rnd.choice(("temp", "temp", "humidity"))
+        if rnd.random() < 0.3:
+            o["payload"] = {"probe": f"p-{rnd.randrange(4)}"}
+        out.append(_corrupt(rnd, o, ("time", "tenant_id")))
+    return out
+
+
+_ANALYTES = (("Moisture", 12.0, 1.0, "%"), ("Crude Protein", 18.0, 1.5, "%"), ("Ash", 6.0, 0.5, "%"),
+             ("Crude Fat", 4.0, 0.6, "%"), ("Fiber", 3.5, 0.4, "%"), ("Aflatoxin B1", 5.0, 3.0, "ppb"))
+
+
+def lab_results(n: int, seed: int = 4, samples: int = 3000) -> List[dict]:
+    rnd = random.Random(seed)
+    pick_sample = Zipf(samples, s=0.8)
+    pick_analyte = Zipf(len(_ANALYTES), s=0.7)
+    clock = Clock(rnd, step_s=30.0, late_p=0.1)  # ผล lab มักถูกคีย์ย้อนหลัง
+    out = []
+    for _ in range(n):
+        s = pick_sample(rnd)
+        name, mu, sd, unit = _ANALYTES[pick_analyte(rnd)]
+        o = {"time": clock(), "tenant_id": "t1", "factory_id": "f1", "sample_id": f"S-{8000 + s}",
+             "analyte": name, "value": round(abs(rnd.gauss(mu, sd)), 2), "unit": unit, "lot": f"L-{1000 + s // 40}"}
+        if rnd.random() < 0.15:
+            o["lab_id"] = "lab-ext"
+        else:
+            o["station_id"] = f"lab-0{1 + s % 2}"
+        out.append(_corrupt(rnd, o, ("tenant_id", "factory_id", "value")))
+    return out
+
+
+def weather_readings(n: int, seed: int = 5, stations: int = 20) -> List[dict]:
+    rnd = random.Random(seed)
+    pick = Zipf(stations)
+    clock = Clock(rnd, step_s=10.0)
+    out = []
+    for _ in range(n):
+        s = pick(rnd)
+        o = {"time": clock(), "tenant_id": "t1", "factory_id": f"farm-{'abc'[s % 3]}", "station_id": f"wx-{s:03d}",
+             "payload": {"src": rnd.choice(("openweather", "davis", "local"))}}
+        r = rnd.random()
+        if r < 0.6:
+            o.update(temp_c=round(rnd.gauss(30, 3), 1), humidity=round(rnd.uniform(50, 95), 1),
+                     rain_mm=round(max(0.0, rnd.gauss(0, 2)), 1), wind_kph=round(rnd.uniform(0, 25), 1))
+        elif r < 0.8:
+            o["humidity"] = round(rnd.uniform(50, 95), 1)
+        elif r < 0.95:
+            o["rain_mm"] = round(max(0.0, rnd.gauss(0, 2)), 1)
+        # ที่เหลือไม่มีค่าตัวเลข → event weather_report
+        out.append(_corrupt(rnd, o, ("tenant_id", "factory_id")))
+    return out
+
+
+_OPS = (("batch", ("batch_started", "batch_closed")), ("shift", ("shift_started",)),
+        ("workorder", ("workorder_opened",)), ("line", ("alarm_triggered",)), ("house", ("alarm_triggered",)))
+
+
+def ops_events(n: int, seed: int = 6, entities: int = 300) -> List[dict]:
+    rnd = random.Random(seed)
+    pick = Zipf(entities)
+    clock = Clock(rnd, step_s=20.0)
+    out = []
+    for _ in range(n):
+        e = pick(rnd)
+        etype, events = _OPS[e % len(_OPS)]
+        o = {"time": clock(), "tenant_id": "t1", "entity_type": etype, "entity_id": f"{etype[0].upper()}-{e:04d}",
+             "event_type": rnd.choice(events), "value": None}
+        if etype == "batch":
+            o["payload"] = {"species": rnd.choice(("broiler", "layer", "swine")), "target_fcr": 1.5}
+        elif rnd.random() < 0.3:
+            o["value"], o["unit"] = rnd.randint(1, 50), "count"
+        out.append(_corrupt(rnd, o, ("time", "tenant_id")))
+    return out
+
+
+_COMMODITIES = (("corn", 256.0, "USD/MT"), ("soymeal", 410.0, "USD/MT"), ("diesel", 0.95, "USD/L"),
+                ("wheat", 230.0, "USD/MT"), ("fishmeal", 1600.0, "USD/MT"))
+
+
+def econ_events(n: int, seed: int = 7) -> List[dict]:
+    rnd = random.Random(seed)
+    pick = Zipf(len(_COMMODITIES), s=1.3)
+    clock = Clock(rnd, step_s=60.0)
+    out = []
+    for _ in range(n):
+        name, px, unit = _COMMODITIES[pick(rnd)]
+        o = {"time": clock(), "tenant_id": "t1", "price": round(px * rnd.uniform(0.97, 1.03), 2),
+             "source": rnd.choice(("bloomberg", "cbot", "local"))}
+        if rnd.random() < 0.1:
+            o["symbol"], o["unit"] = name.upper(), unit
+        else:
+            o["commodity"], o["currency"] = name, unit
+        if rnd.random() < 0.01:
+            o["price"] = None
+        out.append(_corrupt(rnd, o, ("time", "tenant_id")))
+    return out
+
+
+def feed_events(n: int, seed: int = 8, silos: int = 60) -> List[dict]:
+    """2 รูปแบบตาม handle_feed_event: delivery_received (event) / ระดับ silo (measurement)"""
+    rnd = random.Random(seed)
+    pick = Zipf(silos)
+    clock = Clock(rnd, step_s=15.0)
+    out = []
+    for _ in range(n):
+        s = pick(rnd)
+        o = {"time": clock(), "tenant_id": "t1", "factory_id": "f1", "silo_id": f"silo-{s:02d}",
+             "house_id": f"h-{s // 4:02d}"}
+        if rnd.random() < 0.1:
+            o.update(event_type="delivery_received", kg=rnd.randint(2000, 12000),
+                     lot=f"F-{rnd.randrange(500)}", supplier=rnd.choice(("cp", "betagro", "local")))
+        else:
+            o["level_pct"] = round(rnd.uniform(3, 100), 1)
+        out.append(_corrupt(rnd, o, ("tenant_id", "silo_id")))
+    return out
+
+
+# topic → generator (ครอบทุก topic ที่มี mapper ใน app/pipelines/map/*)
+GENERATORS: Dict[str, Generator] = {
+    "sensors.device.readings": sensor_readings,
+    "device.health": device_health,
+    "sensors.sweep.readings": sweep_readings,
+    "lab.results": lab_results,
+    "weather.readings": weather_readings,
+    "ops.events": ops_events,
+    "econ.events": econ_events,
+    "feed.events": feed_events,
+}
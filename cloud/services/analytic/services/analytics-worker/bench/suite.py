@@ -0,0 +1,251 @@
+# bench/suite.py
+"""
+micro-benchmark ชุดรวมของ hot path (ไม่ต้องมี Kafka/DB) + baseline JSON + ตรวจ regression
+
+case:
+  map.<topic>           handler ราย record (try/except ต่อ record แบบ worker) ของทุก topic ที่มี mapper
+  map.<topic>.batch     batch handler ที่ worker ใช้จริง (native หรือ adapt จาก handler ราย record)
+  agg.*                 aggregate / aggregate_batch / aggregate_np_batch / aggregate_cascade_batch (Config.WINDOWS)
+  rules.evaluate        WE-1..4 + N-3/4/7/8 บน series ยาว (anomaly ~10%)
+  time.*                floor_to_bucket / floor_ms / parse_ts_ms
+payload มาจาก bench.payloads (Zipf series, เวลาไม่เรียง, รูปแบบตาม docstring ของ mapper)
+
+ต่อ case รายงาน ops/s (ดีที่สุดจาก --repeat รอบ) และ memory ที่ allocate ระหว่างเรียก 1 ครั้ง
+(peak ของ tracemalloc รอบแยก ไม่ปนกับการจับเวลา) → B/op
+
+    python -m bench.suite run --save bench/baseline.json
+    python -m bench.suite run --baseline bench/baseline.json            # รันแล้วเทียบทันที
+    python -m bench.suite compare bench/baseline.json new.json --threshold 0.1
+compare คืน exit code 1 ถ้า ops/s ลดเกิน --threshold หรือ B/op เพิ่มเกิน --mem-threshold
+(baseline ผูกกับเครื่อง/เวอร์ชัน Python — เทียบเฉพาะไฟล์ที่รันบนเครื่องเดียวกัน)
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.config import Config
+from app.domain import rules
+from app.pipelines import init_registry, registry
+from app.pipelines.batch import MeasurementBatch, adapt
+from app.pipelines.map.econ import handle_econ_event
+from app.pipelines.map.feed import handle_feed_event
+from app.pipelines.map.ops import handle_ops_event
+from app.services.aggregator import aggregate, aggregate_batch, aggregate_cascade_batch
+from app.utils.time import floor_ms, floor_to_bucket, parse_ts, parse_ts_ms
+from bench.bench_rules import synth as synth_series
+from bench.payloads import GENERATORS
+
+# mapper ใน app/pipelines/map/* ที่ยังไม่ถูก register ใน init_registry() → วัดจาก module ตรง ๆ
+UNREGISTERED = {
+    "ops.events": (handle_ops_event, None),
+    "econ.events": (handle_econ_event, None),
+    "feed.events": (handle_feed_event, None),
+}
+
+
+@dataclass
+class Case:
+    name: str
+    fn: Callable[[], object]
+    ops: int
+
+
+def _map_records(handler, objs: List[dict]) -> Tuple[list, int]:
+    out, errors = [], 0
+    for o in objs:
+        try:
+            out.append(handler(o))
+        except Exception:
+            errors += 1
+    return out, errors
+
+
+def _mappers() -> Dict[str, tuple]:
+    """topic → (handler ราย record, batch handler) ตามที่ worker ใช้จริง (ทุก domain)"""
+    init_registry()
+    topics = registry.registered()
+    missing = sorted(set(topics) - set(GENERATORS))
+    if missing:
+        raise SystemExit(f"no payload generator for registered topic(s): {', '.join(missing)} (bench/payloads.py)")
+    prev = os.environ.get("DOMAINS_ENABLED")
+    os.environ["DOMAINS_ENABLED"] = ",".join(sorted(set(topics.values())))
+    try:
+        d = registry.reload()
+        out = {t: (d.handlers[t], d.batch[t]) for t in topics}
+    finally:
+        if prev is None:
+            os.environ.pop("DOMAINS_ENABLED", None)
+        else:
+            os.environ["DOMAINS_ENABLED"] = prev
+        registry.reload()
+    for t, (rec, bat) in UNREGISTERED.items():
+        out.setdefault(t, (rec, bat or adapt(rec)))
+    return out
+
+
+def build_cases(n: int, series_n: int) -> List[Case]:
+    cases: List[Case] = []
+    windows = list(Config.WINDOWS)
+
+    mappers = _mappers()
+    for topic, (rec, bat) in sorted(mappers.items()):
+        objs = GENERATORS[topic](n)
+        cases.append(Case(f"map.{topic}", lambda rec=rec, objs=objs: _map_records(rec, objs), n))
+        cases.append(Case(f"map.{topic}.batch", lambda bat=bat, objs=objs: bat(objs), n))
+
+    # aggregate: measurement จาก sensor topic (Zipf series, เวลาไม่เรียง)
+    objs = GENERATORS["sensors.device.readings"](n)
+    mapped, _ = _map_records(mappers["sensors.device.readings"][0], objs)
+    ms = [m for kind, m in mapped if kind == "measurement"]
+    batch = MeasurementBatch()
+    for m in ms:
+        batch.append(m)
+    cases.append(Case("agg.aggregate", lambda: list(aggregate(ms, windows)), len(ms)))
+    cases.append(Case("agg.aggregate_batch", lambda: list(aggregate_batch(batch, windows)), len(batch)))
+    cases.append(Case("agg.aggregate_cascade_batch", lambda: list(aggregate_cascade_batch(batch, windows)), len(batch)))
+    try:
+        from app.services.aggregator_np import aggregate_np_batch
+        cases.append(Case("agg.aggregate_np_batch", lambda: list(aggregate_np_batch(batch, windows)), len(batch)))
+    except ImportError:
+        print("[suite] numpy not available → skip agg.aggregate_np_batch")
+
+    values = synth_series(series_n, every=40)
+    cases.append(Case("rules.evaluate", lambda: rules.evaluate(values, 0.0, 1.0, rules=rules.ALL_RULES), series_n))
+
+    stamps = [o["time"] for o in objs if "time" in o]
+    dts = [parse_ts(s) for s in stamps]
+    ints = [parse_ts_ms(s) for s in stamps]
+    per = len(stamps) * len(windows)
+    cases.append(Case("time.floor_to_bucket", lambda: [floor_to_bucket(t, w) for t in dts for w in windows], per))
+    cases.append(Case("time.floor_ms", lambda: [floor_ms(t, w) for t in ints for w in windows], per))
+    cases.append(Case("time.parse_ts_ms", lambda: [parse_ts_ms(s) for s in stamps], len(stamps)))
+    return cases
+
+
+def measure(case: Case, repeat: int) -> dict:
+    case.fn()  # warm up (cache ภายใน handler, import lazy)
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        case.fn()
+        best = min(best, time.perf_counter() - t)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        res = case.fn()
+        peak = tracemalloc.get_traced_memory()[1] - base
+        del res
+    finally:
+        tracemalloc.stop()
+    return {"ops": case.ops, "ops_s": case.ops / best, "peak_b_per_op": peak / max(1, case.ops),
+            "peak_kib": peak / 1024}
+
+
+def run(n: int, series_n: int, repeat: int, only: Optional[List[str]] = None) -> dict:
+    results = {}
+    print(f"{'case':<40}{'ops':>9}{'ops/s':>14}{'B/op':>10}{'peak KiB':>11}")
+    for case in build_cases(n, series_n):
+        if only and not any(s in case.name for s in only):
+            continue
+        r = results[case.name] = measure(case, repeat)
+        print(f"{case.name:<40}{r['ops']:>9,}{r['ops_s']:>14,.0f}{r['peak_b_per_op']:>10,.0f}{r['peak_kib']:>11,.0f}")
+    try:
+        import numpy
+        np_version = numpy.__version__
+    except ImportError:
+        np_version = None
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "machine": platform.node(), "numpy": np_version,
+            "n": n, "series_n": series_n, "repeat": repeat, "windows": list(Config.WINDOWS),
+        },
+        "cases": results,
+    }
+
+
+def compare(old: dict, new: dict, threshold: float, mem_threshold: float) -> List[str]:
+    """คืนรายชื่อ case ที่ถดถอย (พิมพ์ตารางเทียบด้วย)"""
+    om, nm = old.get("meta", {}), new.get("meta", {})
+    for k in ("python", "machine", "n", "windows"):
+        if om.get(k) != nm.get(k):
+            print(f"[suite] warning: {k} differs ({om.get(k)} → {nm.get(k)}) — ผลเทียบอาจไม่ตรงกัน")
+    bad = []
+    oc, nc = old["cases"], new["cases"]
+    print(f"{'case':<40}{'ops/s old':>14}{'ops/s new':>14}{'Δ':>8}{'B/op old':>10}{'B/op new':>10}{'Δ':>8}")
+    for name in sorted(set(oc) | set(nc)):
+        if name not in oc or name not in nc:
+            print(f"{name:<40}  {'(new case)' if name in nc else '(removed)'}")
+            continue
+        o, c = oc[name], nc[name]
+        speed = c["ops_s"] / o["ops_s"] - 1.0
+        mem = (c["peak_b_per_op"] / o["peak_b_per_op"] - 1.0) if o["peak_b_per_op"] > 0 else 0.0
+        flags = []
+        if speed < -threshold:
+            flags.append("SLOWER")
+        if mem > mem_threshold:
+            flags.append("MORE-MEM")
+        if flags:
+            bad.append(name)
+        print(f"{name:<40}{o['ops_s']:>14,.0f}{c['ops_s']:>14,.0f}{speed:>+8.1%}"
+              f"{o['peak_b_per_op']:>10,.0f}{c['peak_b_per_op']:>10,.0f}{mem:>+8.1%}  {' '.join(flags)}")
+    print(f"{len(bad)} regression(s) (threshold ops/s -{threshold:.0%}, B/op +{mem_threshold:.0%})")
+    return bad
+
+
+def _load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    r = sub.add_parser("run", help="รัน suite (และบันทึก/เทียบ baseline)")
+    r.add_argument("--n", type=int, default=20_000, help="จำนวน payload ต่อ topic")
+    r.add_argument("--series", type=int, default=200_000, help="ความยาว series ของ rules.evaluate")
+    r.add_argument("--repeat", type=int, default=5)
+    r.add_argument("--only", nargs="*", help="เฉพาะ case ที่ชื่อมีคำเหล่านี้")
+    r.add_argument("--save", help="เขียนผลเป็น JSON (baseline)")
+    r.add_argument("--baseline", help="เทียบกับ baseline นี้หลังรัน (exit 1 ถ้าถดถอย)")
+
+    c = sub.add_parser("compare", help="เทียบ JSON สองไฟล์ (exit 1 ถ้าถดถอย)")
+    c.add_argument("old")
+    c.add_argument("new")
+
+    for p in (r, c):
+        p.add_argument("--threshold", type=float, default=0.10, help="ops/s ลดได้ไม่เกินสัดส่วนนี้")
+        p.add_argument("--mem-threshold", type=float, default=0.25, help="B/op เพิ่มได้ไม่เกินสัดส่วนนี้")
+    args = ap.parse_args()
+
+    if args.cmd == "compare":
+        sys.exit(1 if compare(_load(args.old), _load(args.new), args.threshold, args.mem_threshold) else 0)
+
+    res = run(args.n, args.series, args.repeat, args.only)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2, sort_keys=True)
+        print(f"saved {len(res['cases'])} case(s) → {args.save}")
+    if args.baseline:
+        print()
+        sys.exit(1 if compare(_load(args.baseline), res, args.threshold, args.mem_threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# tests/test_agg_buffer.py
+"""AggBuffer: merge ข้าม batch, เงื่อนไข flush, restore หลังเขียนไม่สำเร็จ และ offset ที่ commit ได้"""
+
+from datetime import datetime, timedelta, timezone
+
+from app.services.agg_buffer import AggBuffer
+from app.utils.stats import merge_agg_row
+
+T0 = datetime(2025, 8, 20, tzinfo=timezone.utc)
+TP = ("sensors.device.readings", 0)
+
+
+def _row(machine="mc-01", n=1, v=1.0, bucket=T0, window=60):
+    return {"tenant_id": "t1", "factory_id": "f1", "machine_id": machine, "sensor_id": "s-1", "metric": "temp",
+            "window_s": window, "bucket_start": bucket, "count_n": n, "sum_val": v * n, "avg_val": v,
+            "min_val": v, "max_val": v, "m2_val": 0.0, "stddev_val": 0.0, "p95_val": v, "sketch": None}
+
+
+class Clock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def test_merge_and_pop_closed_bucket():
+    buf = AggBuffer(max_age_s=60, grace_s=5, clock=Clock())
+    buf.add([_row(v=1.0)], {TP: (10, 19)}, watermark=T0 + timedelta(seconds=30))
+    buf.add([_row(v=3.0)], {TP: (20, 29)}, watermark=T0 + timedelta(seconds=50))
+    assert len(buf) == 1
+    assert buf.pop_due() == []  # bucket ยังไม่ปิด
+    assert buf.committable() == {TP: 10}
+
+    buf.add([], {TP: (30, 30)}, watermark=T0 + timedelta(seconds=65))  # 60 + grace 5
+    (e,) = buf.pop_due()
+    assert e.row["count_n"] == 2 and e.row["sum_val"] == 4.0
+    assert e.offsets == {TP: 10}
+    assert buf.committable() == {TP: 31}
+
+
+def test_max_age_and_max_keys():
+    clock = Clock()
+    buf = AggBuffer(max_keys=2, max_age_s=10, clock=clock)
+    buf.add([_row("a")], {TP: (0, 0)})
+    clock.t = 5
+    buf.add([_row("b")], {TP: (1, 1)})
+    clock.t = 11
+    assert [e.row["machine_id"] for e in buf.pop_due()] == ["a"]
+    buf.add([_row("c"), _row("d")], {TP: (2, 2)})
+    assert len(buf.pop_due()) == 3  # เกิน max_keys → flush ทั้งหมด
+    assert buf.pop_due(force=True) == []
+
+
+def test_restore_keeps_offsets_and_merges_with_new_data():
+    clock = Clock()
+    buf = AggBuffer(clock=clock)
+    buf.add([_row(v=1.0)], {TP: (100, 109)})
+    due = buf.pop_due(force=True)
+    assert buf.committable() == {TP: 110}
+
+    # ระหว่างเขียนพลาด มีข้อมูลใหม่ของ key เดิมเข้ามา
+    clock.t = 3
+    buf.add([_row(v=5.0)], {TP: (110, 119)})
+    buf.restore(due)
+    assert buf.committable() == {TP: 100}
+    (e,) = buf.pop_due(force=True)
+    assert e.born == 0.0
+    assert e.row == merge_agg_row(_row(v=1.0), _row(v=5.0))
+
+
+def test_forget_revoked_partition():
+    buf = AggBuffer()
+    other = ("sensors.device.readings", 1)
+    buf.add([_row()], {TP: (0, 4), other: (7, 9)})
+    buf.pop_due(force=True)
+    buf.forget([other])
+    assert buf.committable() == {TP: 5}
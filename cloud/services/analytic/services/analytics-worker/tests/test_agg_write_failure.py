@@ -0,0 +1,288 @@
+# tests/test_agg_write_failure.py
+"""
+path ที่มี AggBuffer: เขียน analytics_agg ไม่สำเร็จ → entry ต้องกลับเข้า buffer และต้องไม่ commit offset
+- run_worker ไม่ตาย: รอแล้วเขียนซ้ำ batch เดิม (ไม่ decode/รวมเข้า buffer ซ้ำ)
+- events/anomalies ของ batch commit แยก transaction → ไม่หายไปกับ rollback ของ agg
+- StagedPipeline ของ WORKER_PIPELINE=1: stage write คืน entry เข้า buffer และเขียนซ้ำเหมือนกัน (pipeline ไม่ตาย)
+"""
+
+import json
+import threading
+from contextlib import contextmanager, nullcontext
+
+import pytest
+
+from app.pipelines import init_registry
+from app.pipelines.registry import reload as reload_registry
+from app.adapters.pg_pipeline import StatementError
+from app.instrumentation.metrics import dead_letter_rows
+from app.services.agg_buffer import AggBuffer
+from app.workers import pipeline as pl
+from app.workers import stream_worker as sw
+from app.workers.replay import ReplayMessage
+
+TOPIC = "sensors.device.readings"
+
+
+def _msgs(n: int = 20, offset: int = 100):
+    out = []
+    for i in range(n):
+        o = {"time": f"2025-08-20T00:00:{i:02d}Z", "tenant_id": "t1", "factory_id": "f1",
+             "machine_id": "mc-01", "sensor_id": "s-001", "metric": "temp", "value": 20.0 + i}
+        out.append(ReplayMessage(TOPIC, json.dumps(o).encode(), partition=0, offset=offset + i))
+    return out
+
+
+class _DB:
+    """transaction ปลอม: ของที่ repo เขียนจะ "ลง DB" เมื่อ session_scope จบโดยไม่มี error เท่านั้น"""
+
+    def __init__(self):
+        self.pending = []
+
+    def begin_nested(self):
+        return nullcontext()
+
+
+COMMITTED = []
+
+
+@contextmanager
+def _session():
+    db = _DB()
+    yield db
+    COMMITTED.extend(db.pending)
+
+
+class RaisingRepo:
+    agg_failures = None  # None = พังทุกครั้ง, n = พัง n ครั้งแรก
+    on_fail = None
+    calls = 0
+
+    def __init__(self, db=None):
+        self.db = db if db is not None else _DB()
+
+    def insert_events_many(self, rows):
+        self.db.pending += [("event", r) for r in rows]
+        return len(rows)
+
+    def upsert_event_rollup_many(self, rows):
+        return len(rows)
+
+    def insert_anomalies_many(self, rows):
+        self.db.pending += [("anomaly", r) for r in rows]
+        return len(rows)
+
+    def upsert_agg_many(self, rows):
+        rows = list(rows)
+        cls = type(self)
+        cls.calls += 1
+        if cls.agg_failures is None or cls.calls <= cls.agg_failures:
+            if cls.on_fail:
+                cls.on_fail(cls.calls)
+            return self._fail(rows)
+        self.db.pending += [("agg", r) for r in rows]
+        return len(rows)
+
+    def _fail(self, rows):
+        raise RuntimeError("db down")
+
+
+class PartialRepo(RaisingRepo):
+    """เหมือน PipelineRepo: แถวที่ผิดไปอยู่ใน errors แล้วคืนปกติ (sqlstate ชั่วคราว เช่น deadlock)"""
+    sqlstate = "40P01"
+
+    def __init__(self, db=None):
+        super().__init__(db)
+        self.errors = []
+
+    def _fail(self, rows):
+        bad = max(rows, key=lambda r: r["window_s"])
+        self.errors.append(StatementError("analytics_agg", AggBuffer.key(bad), "failed", self.sqlstate))
+        self.db.pending += [("agg", r) for r in rows if r is not bad]
+        return len(rows) - 1
+
+
+class PoisonRepo(PartialRepo):
+    """แถว window 3600 ผิด constraint ถาวร (sqlstate class 23) ทุกครั้งที่เขียน"""
+    sqlstate = "23514"
+
+    def upsert_agg_many(self, rows):
+        rows = list(rows)
+        type(self).calls += 1
+        if any(r["window_s"] == 3600 for r in rows):
+            return self._fail(rows)
+        self.db.pending += [("agg", r) for r in rows]
+        return len(rows)
+
+
+class FakeConsumer:
+    def __init__(self, batches, stop: threading.Event, until=lambda c: True):
+        self.batches = list(batches)
+        self.stop = stop
+        self.until = until  # หมด batch แล้วหยุดเมื่อ until(self) เป็นจริง
+        self.commits = []
+
+    def subscribe(self, topics, **callbacks):
+        pass
+
+    def consume(self, num_messages=500, timeout=1.0):
+        if self.batches:
+            return self.batches.pop(0)
+        if self.until(self):
+            self.stop.set()
+        return []
+
+    def commit(self, *args, **kwargs):
+        self.commits.append(kwargs)
+
+    def assignment(self):
+        return []
+
+    def pause(self, partitions):
+        pass
+
+    def resume(self, partitions):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDetector:
+    def process(self, measurements):
+        return [{"rule_code": "WE-1", "n": len(measurements)}]
+
+    def evict_idle(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def _registry(monkeypatch):
+    init_registry()
+    reload_registry()
+    COMMITTED.clear()
+    for cls in (RaisingRepo, PartialRepo, PoisonRepo):
+        monkeypatch.setattr(cls, "calls", 0)
+
+
+def _run_worker(monkeypatch, repo_cls, failures=None):
+    buffer = AggBuffer(max_keys=0)  # ทุก entry ถึงเวลา flush ทันที
+    stop = threading.Event()
+    c = FakeConsumer([_msgs()], stop)
+    monkeypatch.setattr(repo_cls, "agg_failures", failures)
+    if failures is None:
+        # DB ไม่กลับมา: หยุด worker หลังเขียนซ้ำไป 3 รอบ
+        monkeypatch.setattr(repo_cls, "on_fail", lambda n: n >= 3 and stop.set())
+    monkeypatch.setattr(sw.signal, "signal", lambda *a: None)
+    monkeypatch.setattr(sw, "_stop", stop)
+    monkeypatch.setattr(sw, "_retry_delay", lambda failures: 0)
+    monkeypatch.setattr(sw, "build_consumer", lambda: c)
+    monkeypatch.setattr(sw, "_build_buffer", lambda: buffer)
+    monkeypatch.setattr(sw, "_build_detector", FakeDetector)
+    monkeypatch.setattr(sw, "session_scope", _session)
+    monkeypatch.setattr(sw, "make_repo", repo_cls)
+    monkeypatch.setattr(sw.Config, "WORKER_PIPELINE", False)
+    sw.run_worker()  # ต้องไม่ raise
+    return buffer, c
+
+
+def _committed(kind):
+    return [r for k, r in COMMITTED if k == kind]
+
+
+@pytest.mark.parametrize("repo_cls", [RaisingRepo, PartialRepo])
+def test_run_worker_keeps_entries_and_offsets(monkeypatch, repo_cls):
+    buffer, c = _run_worker(monkeypatch, repo_cls)
+    assert repo_cls.calls >= 3  # เขียนซ้ำ ไม่ได้ตายตั้งแต่ครั้งแรก
+    assert len(buffer) > 0
+    assert c.commits == []
+    assert buffer.committable() == {(TOPIC, 0): 100}
+    # anomaly ของ batch ลง DB แล้ว (transaction แยกจาก agg) และไม่ถูกเขียนซ้ำตอน retry
+    assert len(_committed("anomaly")) == 1
+    assert _committed("agg") == []
+
+
+@pytest.mark.parametrize("repo_cls", [RaisingRepo, PartialRepo])
+def test_run_worker_retries_transient_failure(monkeypatch, repo_cls):
+    buffer, c = _run_worker(monkeypatch, repo_cls, failures=2)
+    assert len(buffer) == 0
+    assert c.commits
+    assert {(tp.topic, tp.partition, tp.offset) for k in c.commits for tp in k["offsets"]} == {(TOPIC, 0, 120)}
+    assert len(_committed("anomaly")) == 1
+    # rows ของ batch เข้า buffer ครั้งเดียว → count รวมเท่ากับจำนวนข้อความ (ไม่นับซ้ำจากการ retry)
+    assert sum(r["count_n"] for r in _committed("agg") if r["window_s"] == 60) == 20
+
+
+def test_poison_row_is_dead_lettered(monkeypatch):
+    monkeypatch.setattr(sw.Config, "AGG_DEAD_LETTER_ATTEMPTS", 3)
+    dead = dead_letter_rows.labels(table="analytics_agg")
+    before = dead._value.get()
+    buffer, c = _run_worker(monkeypatch, PoisonRepo, failures=0)  # ไม่หยุด worker เอง: ต้องผ่านไปได้ด้วย dead-letter
+    assert PoisonRepo.calls == 4  # พัง 3 ครั้ง → ทิ้งแถวนั้น แล้วเขียนที่เหลือสำเร็จในรอบเดียวกัน
+    assert dead._value.get() - before == 1
+    assert not any(r["window_s"] == 3600 for r in _committed("agg"))
+    assert len(buffer) == 0
+    assert {(tp.topic, tp.partition, tp.offset) for k in c.commits for tp in k["offsets"]} == {(TOPIC, 0, 120)}
+    assert sum(r["count_n"] for r in _committed("agg") if r["window_s"] == 60) == 20
+
+
+@pytest.mark.parametrize("repo_cls", [RaisingRepo, PartialRepo])
+def test_pipeline_write_restores_entries(monkeypatch, repo_cls):
+    monkeypatch.setattr(sw, "session_scope", _session)
+    monkeypatch.setattr(sw, "make_repo", repo_cls)
+    buffer = AggBuffer(max_keys=0)
+    pipe = pl.StagedPipeline(consumer=None, buffer=buffer)
+    msgs = _msgs()
+    b = pipe._agg(pipe._map(pl._Batch(msgs=msgs, offsets=sw._offsets_of(msgs))))
+    assert b.rows
+
+    with pytest.raises(Exception):
+        pipe._write(b)
+    assert len(buffer) > 0
+    assert buffer.committable() == {(TOPIC, 0): 100}
+
+    with pytest.raises(Exception):
+        pipe._flush(pl._Flush(force=True))
+    assert len(buffer) > 0
+    assert buffer.committable() == {(TOPIC, 0): 100}
+
+
+def _run_pipeline(monkeypatch, repo_cls, failures=None):
+    buffer = AggBuffer(max_keys=0)
+    stop = threading.Event()
+    # DB ไม่กลับมา → หยุดจาก on_fail; เขียนได้ → หยุดหลัง commit แรก
+    c = FakeConsumer([_msgs()], stop, until=lambda c: failures is not None and bool(c.commits))
+    monkeypatch.setattr(repo_cls, "agg_failures", failures)
+    if failures is None:
+        monkeypatch.setattr(repo_cls, "on_fail", lambda n: n >= 3 and stop.set())
+    monkeypatch.setattr(sw, "session_scope", _session)
+    monkeypatch.setattr(sw, "make_repo", repo_cls)
+    monkeypatch.setattr(pl, "_retry_delay", lambda failures: 0)
+    pipe = pl.StagedPipeline(consumer=c, buffer=buffer, detector=FakeDetector())
+    pipe.run(stop)  # ต้องไม่ raise
+    return buffer, c
+
+
+@pytest.mark.parametrize("repo_cls", [RaisingRepo, PartialRepo])
+def test_pipeline_retries_transient_failure(monkeypatch, repo_cls):
+    buffer, c = _run_pipeline(monkeypatch, repo_cls, failures=2)
+    assert repo_cls.calls == 3
+    assert len(buffer) == 0
+    assert {(tp.topic, tp.partition, tp.offset) for k in c.commits for tp in k["offsets"]} == {(TOPIC, 0, 120)}
+    assert len(_committed("anomaly")) == 1
+    assert sum(r["count_n"] for r in _committed("agg") if r["window_s"] == 60) == 20
+
+
+@pytest.mark.parametrize("repo_cls", [RaisingRepo, PartialRepo])
+def test_pipeline_stops_while_db_down(monkeypatch, repo_cls):
+    buffer, c = _run_pipeline(monkeypatch, repo_cls)
+    assert repo_cls.calls >= 3
+    assert c.commits == []
+    assert buffer.committable() == {(TOPIC, 0): 100}
+    assert _committed("agg") == []
+
+
+def test_write_aggs_without_buffer_does_not_raise():
+    # path ที่ไม่มี buffer ยังกลืน error ต่อ batch เหมือนเดิม
+    sw._write_aggs(RaisingRepo(), [{"k": 1}], series=None)
+    sw._write_aggs(PartialRepo(), [{"k": 1}], series=None)
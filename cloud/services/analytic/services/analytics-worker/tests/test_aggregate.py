@@ -0,0 +1,97 @@
+# tests/test_aggregate.py
+"""
+engine ของ AGG_ENGINE (python / numpy / cascade, ทั้งแบบ dict และ MeasurementBatch) ต้องให้แถวเท่ากัน
+(ยกเว้น p95 ของ window หยาบใน cascade ที่มาจาก sketch → ต่างได้ไม่เกิน alpha)
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.pipelines.batch import MeasurementBatch
+from app.services.aggregator import aggregate, aggregate_batch, aggregate_cascade, aggregate_cascade_batch
+from bench.bench_aggregate import synth_measurements
+
+np_engine = pytest.importorskip("app.services.aggregator_np")
+
+WINDOWS = [60, 300, 3600]
+FIELDS = ("count_n", "sum_val", "avg_val", "min_val", "max_val", "stddev_val", "p95_val")
+
+
+def _index(rows):
+    return {(r["tenant_id"], r["factory_id"], r["machine_id"], r["sensor_id"], r["metric"],
+             r["window_s"], r["bucket_start"]): r for r in rows}
+
+
+@pytest.fixture(scope="module")
+def batch():
+    b = MeasurementBatch()
+    for m in synth_measurements(20_000, series=300):
+        b.append(m)
+    return b
+
+
+@pytest.fixture(scope="module")
+def reference(batch):
+    return _index(aggregate(batch.rows(), WINDOWS))
+
+
+ENGINES = {
+    "aggregate_batch": lambda b: aggregate_batch(b, WINDOWS),
+    "aggregate_np": lambda b: np_engine.aggregate_np(b.rows(), WINDOWS),
+    "aggregate_np_batch": lambda b: np_engine.aggregate_np_batch(b, WINDOWS),
+    "aggregate_cascade": lambda b: aggregate_cascade(b.rows(), WINDOWS),
+    "aggregate_cascade_batch": lambda b: aggregate_cascade_batch(b, WINDOWS),
+}
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_engines_match_python(engine, batch, reference):
+    got = _index(ENGINES[engine](batch))
+    assert got.keys() == reference.keys()
+    for k, ra in reference.items():
+        rb = got[k]
+        for f in FIELDS:
+            tol = 1e-9
+            if f == "p95_val" and "cascade" in engine and ra["window_s"] != min(WINDOWS):
+                tol = ra["sketch"].alpha  # window หยาบของ cascade: p95 จาก sketch ที่ merge แล้ว
+            assert math.isclose(ra[f], rb[f], rel_tol=tol, abs_tol=1e-9), (k, f, ra[f], rb[f])
+        assert math.isclose(ra["m2_val"], rb["m2_val"], rel_tol=1e-6, abs_tol=1e-6), (k, "m2_val")
+        assert ra["sketch"].count == rb["sketch"].count == ra["count_n"], (k, "sketch")
+
+
+def test_single_bucket_values():
+    t0 = datetime(2025, 8, 20, tzinfo=timezone.utc)
+    ms = [{"tenant_id": "t1", "factory_id": "f1", "machine_id": "mc-01", "sensor_id": "s-1", "metric": "temp",
+           "value": float(v), "time": t0 + timedelta(seconds=i)} for i, v in enumerate([4, 1, 3, 2, 5])]
+    rows = _index(aggregate(ms, [60]))
+    (row,) = rows.values()
+    assert row["bucket_start"] == t0
+    assert (row["count_n"], row["sum_val"], row["min_val"], row["max_val"]) == (5, 15.0, 1.0, 5.0)
+    assert row["avg_val"] == 3.0
+    assert math.isclose(row["m2_val"], 10.0)
+
+
+@pytest.mark.parametrize("engine", ["python"] + sorted(ENGINES))
+def test_p95_uses_sketch_rank(engine, batch, reference):
+    # p95 ของ batch แรกต้องนิยาม rank เดียวกับ sketch (q*(n-1)) → upsert ครั้งถัดไปที่อ่านจาก sketch ไม่กระโดด
+    rows = reference if engine == "python" else _index(ENGINES[engine](batch))
+    for k, r in rows.items():
+        est = r["sketch"].quantile(0.95)
+        assert abs(est - r["p95_val"]) <= r["sketch"].alpha * abs(r["p95_val"]) + 1e-9, (k, est, r["p95_val"])
+
+
+def test_cascade_coarse_p95_from_sketch(batch):
+    for r in aggregate_cascade_batch(batch, WINDOWS):
+        if r["window_s"] != min(WINDOWS):
+            assert r["p95_val"] == r["sketch"].quantile(0.95)
+
+
+def test_p95_rank_small_bucket():
+    t0 = datetime(2025, 8, 20, tzinfo=timezone.utc)
+    ms = [{"tenant_id": "t1", "factory_id": "f1", "machine_id": "mc-01", "sensor_id": "s-1", "metric": "temp",
+           "value": float(v), "time": t0 + timedelta(seconds=i)} for i, v in enumerate(range(1, 22))]
+    for rows in (aggregate(ms, [60]), np_engine.aggregate_np(ms, [60])):
+        (row,) = list(rows)
+        assert row["p95_val"] == 20.0  # sorted[int(0.95*20)] — ไม่ใช่ sorted[int(0.95*21)-1] = 19.0
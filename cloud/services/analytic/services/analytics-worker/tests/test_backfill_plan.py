@@ -0,0 +1,40 @@
+# tests/test_backfill_plan.py
+"""plan_chunks: chunk ต่อกันพอดี [start, end) และขอบภายในลงตัว step กับทุก window"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.workers.backfill import plan_chunks
+
+UTC = timezone.utc
+
+
+@pytest.mark.parametrize("start,end,step_s,windows", [
+    (datetime(2025, 7, 1, tzinfo=UTC), datetime(2025, 7, 8, tzinfo=UTC), 86400, [60, 300, 3600]),
+    (datetime(2025, 7, 1, 3, 17, 42, tzinfo=UTC), datetime(2025, 7, 3, 11, 5, tzinfo=UTC), 86400, [60, 300, 3600]),
+    (datetime(2025, 7, 1, 0, 1, tzinfo=UTC), datetime(2025, 7, 1, 9, tzinfo=UTC), 3600, [60, 300, 5400]),
+])
+def test_chunks_cover_range_on_aligned_edges(start, end, step_s, windows):
+    chunks = plan_chunks(start, end, step_s, windows)
+    assert chunks[0][0] == start and chunks[-1][1] == end
+    for (a, b), (c, _) in zip(chunks, chunks[1:]):
+        assert b == c
+    for lo, hi in chunks:
+        assert lo < hi
+    for _, edge in chunks[:-1]:
+        secs = int(edge.timestamp())
+        assert secs % step_s == 0
+        assert all(secs % w == 0 for w in windows)
+
+
+def test_step_is_lcm_of_windows():
+    start = datetime(2025, 7, 1, tzinfo=UTC)
+    chunks = plan_chunks(start, start + timedelta(hours=6), 3600, [60, 5400])
+    # lcm(3600, 5400) = 10800 → 2 chunk
+    assert [(hi - lo).total_seconds() for lo, hi in chunks] == [10800, 10800]
+
+
+def test_empty_range():
+    t = datetime(2025, 7, 1, tzinfo=UTC)
+    assert plan_chunks(t, t, 86400, [60]) == []
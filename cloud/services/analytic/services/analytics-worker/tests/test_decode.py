@@ -0,0 +1,59 @@
+# tests/test_decode.py
+"""DECODER=auto (msgspec schema ต่อ topic) ต้องให้ผลของ mapper เท่ากับ json.loads — รวม key ที่ schema ไม่รู้จัก"""
+
+import json
+from datetime import datetime
+
+import pytest
+
+from app.pipelines.decode import MSGSPEC_AVAILABLE, decoder_for
+from app.pipelines.map.device_health import handle_device_health
+from app.pipelines.map.econ import handle_econ_event
+from app.pipelines.map.lab import handle_lab_record
+from app.pipelines.map.ops import handle_ops_event
+from app.pipelines.map.sensor import handle_sensor_reading
+from app.pipelines.map.sweep import handle_sweep_reading
+from app.pipelines.map.weather import handle_weather_record
+from bench.payloads import GENERATORS
+
+pytestmark = pytest.mark.skipif(not MSGSPEC_AVAILABLE, reason="msgspec not installed")
+
+HANDLERS = {
+    "sensors.device.readings": handle_sensor_reading,
+    "device.health": handle_device_health,
+    "sensors.sweep.readings": handle_sweep_reading,
+    "lab.results": handle_lab_record,
+    "weather.readings": handle_weather_record,
+    "ops.events": handle_ops_event,
+    "econ.events": handle_econ_event,
+}
+
+
+def _map(handler, obj):
+    try:
+        return handler(obj)
+    except Exception as e:
+        return type(e)
+
+
+def _raw(o: dict) -> bytes:
+    return json.dumps(o, default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v)).encode()
+
+
+@pytest.mark.parametrize("topic", sorted(HANDLERS))
+@pytest.mark.parametrize("extra", [{}, {"x_extra": "keep-me", "operator": "kw", "method": "AOAC", "market": "CBOT"}])
+def test_typed_decode_matches_stdlib(topic, extra):
+    handler = HANDLERS[topic]
+    typed = decoder_for(topic, "auto")
+    for o in GENERATORS[topic](300):
+        raw = _raw({**o, **extra})
+        assert _map(handler, typed(raw)) == _map(handler, json.loads(raw)), raw
+
+
+@pytest.mark.parametrize("topic,key", [("lab.results", "operator"), ("lab.results", "method"),
+                                       ("econ.events", "market"), ("lab.results", "x_extra")])
+def test_forwarded_keys_survive(topic, key):
+    o = {**GENERATORS[topic](1, seed=11)[0], "value": 1.5, "price": 2.5, key: "v"}
+    o.pop("payload", None)
+    _, mapped = HANDLERS[topic](decoder_for(topic, "auto")(_raw(o)))
+    assert mapped["payload"][key] == "v"
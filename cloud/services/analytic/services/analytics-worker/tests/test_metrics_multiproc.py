@@ -0,0 +1,60 @@
+# tests/test_metrics_multiproc.py
+"""WORKER_PROCESSES>1: /v1/metrics ของ parent ต้องรวม metric ที่ child process เขียน (prometheus multiprocess mode)"""
+
+import os
+import subprocess
+import sys
+import textwrap
+
+SCRIPT = textwrap.dedent("""
+    import multiprocessing as mp
+
+    from app.instrumentation import metrics as m
+
+    def child(topic, lag):
+        from app.instrumentation import metrics as cm
+        cm.ingested.labels(topic=topic).inc(10)
+        cm.lag.labels(topic=topic, partition="0").set(lag)
+        cm.batch_size.set(lag)
+
+    if __name__ == "__main__":
+        assert m.MULTIPROC_DIR
+        ctx = mp.get_context("spawn")
+        procs = [ctx.Process(target=child, args=(t, n)) for t, n in (("a", 5), ("b", 7))]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+            assert p.exitcode == 0
+        body = m.metrics_response()[0].decode()
+        for p in procs[:1]:
+            m.mark_process_dead(p.pid)
+        after = m.metrics_response()[0].decode()
+        print(body)
+        print("=====")
+        print(after)
+""")
+
+
+def _run(tmp_path):
+    script = tmp_path / "multiproc_metrics.py"  # spawn ต้อง import __main__ จากไฟล์ได้
+    script.write_text(SCRIPT)
+    env = {**os.environ, "WORKER_PROCESSES": "2"}
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, str(script)], cwd=root, env={**env, "PYTHONPATH": root},
+                         capture_output=True, text=True, timeout=120)
+    assert out.returncode == 0, out.stderr
+    return out.stdout.split("=====")
+
+
+def test_parent_collects_child_metrics(tmp_path):
+    body, after = _run(tmp_path)
+    assert 'aw_ingested_msgs_total{topic="a"} 10.0' in body
+    assert 'aw_ingested_msgs_total{topic="b"} 10.0' in body
+    assert 'aw_consumer_lag{partition="0",topic="a"} 5.0' in body
+    assert 'aw_consumer_lag{partition="0",topic="b"} 7.0' in body
+    # child ที่ตายแล้ว: counter ยังนับ แต่ gauge แบบ live* หายไป
+    assert 'aw_ingested_msgs_total{topic="a"} 10.0' in after
+    assert 'aw_consumer_lag{partition="0",topic="a"}' not in after
+    assert 'aw_consumer_lag{partition="0",topic="b"} 7.0' in after
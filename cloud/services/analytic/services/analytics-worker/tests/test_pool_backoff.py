@@ -0,0 +1,60 @@
+# tests/test_pool_backoff.py
+"""WorkerPool: backoff ของ restart โตเฉพาะตอน child ตายติดกัน — อยู่ได้นานกว่า max_backoff_s แล้วตาย → เริ่มนับใหม่"""
+
+from app.workers.pool import WorkerPool
+
+
+class FakeProc:
+    pid = 0
+    exitcode = 1
+
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+
+def _pool(monkeypatch, clock):
+    pool = WorkerPool(1, max_backoff_s=30.0)
+    procs = []
+
+    def spawn(ch):
+        ch.proc = FakeProc()
+        ch.started = clock[0]
+        procs.append(ch.proc)
+
+    monkeypatch.setattr(pool, "_spawn", spawn)
+    monkeypatch.setattr("app.workers.pool.mark_process_dead", lambda pid: None)
+    spawn(pool._children[0])
+    return pool, procs
+
+
+def _die_and_restart(pool, procs, clock, uptime):
+    clock[0] += uptime
+    procs[-1].alive = False
+    pool._tick(clock[0])
+    ch = pool._children[0]
+    delay = ch.next_start - clock[0]
+    clock[0] = ch.next_start
+    pool._tick(clock[0])
+    return delay
+
+
+def test_backoff_grows_while_crash_looping(monkeypatch):
+    clock = [1000.0]
+    pool, procs = _pool(monkeypatch, clock)
+    delays = [_die_and_restart(pool, procs, clock, uptime=1.0) for _ in range(6)]
+    assert delays == [2, 4, 8, 16, 30, 30]
+    assert pool._children[0].restarts == 6
+
+
+def test_backoff_resets_after_stable_run(monkeypatch):
+    clock = [1000.0]
+    pool, procs = _pool(monkeypatch, clock)
+    for _ in range(6):
+        _die_and_restart(pool, procs, clock, uptime=1.0)
+    # อยู่นานกว่า max_backoff_s แล้วค่อยตาย → restart เร็วเหมือนครั้งแรก
+    assert _die_and_restart(pool, procs, clock, uptime=3600.0) == 2
+    assert _die_and_restart(pool, procs, clock, uptime=1.0) == 4
+    assert pool._children[0].restarts == 8
@@ -0,0 +1,43 @@
+# tests/test_rules.py
+"""rules.evaluate (NumPy, cumsum ของ mask) ต้องได้ hit เท่ากับ implementation เดิมที่ slice หน้าต่างทีละ index"""
+
+import pytest
+
+from app.domain import rules
+from bench.bench_rules import _ref_nelson, _ref_we, synth
+
+
+@pytest.fixture(scope="module")
+def values():
+    return synth(6_000)
+
+
+@pytest.mark.parametrize("cl,std", [(0.0, 1.0), (0.3, 0.7), (0.0, 0.0)])
+def test_evaluate_matches_reference(values, cl, std):
+    got = [(h.index, h.code) for h in rules.evaluate(values, cl, std, rules=rules.ALL_RULES)]
+    want = _ref_we(values, cl, std) + _ref_nelson(values, cl, std)
+    assert sorted(got) == sorted(want)
+
+
+def test_we_order_matches_reference(values):
+    # WE: เรียงตาม index และในแต่ละ index ตามลำดับกติกาเหมือนของเดิม
+    we = [(h.index, h.code) for h in rules.evaluate(values, 0.0, 1.0, rules=rules.WE_RULES)]
+    assert we == sorted(_ref_we(values, 0.0, 1.0), key=lambda x: x[0])
+
+
+def test_every_rule_fires(values):
+    codes = {h.code for h in rules.evaluate(values, 0.0, 1.0, rules=rules.ALL_RULES)}
+    assert codes >= {"WE-1", "WE-2", "WE-3", "WE-4", "N-3", "N-4", "N-7", "N-8"}
+
+
+def test_default_is_we_only(values):
+    # anomaly_detector เรียก evaluate() แบบไม่ระบุ rules → ผลต้องเท่าเดิม (WE-1..4 เท่านั้น)
+    got = [(h.index, h.code) for h in rules.evaluate(values, 0.0, 1.0)]
+    assert got == sorted(_ref_we(values, 0.0, 1.0), key=lambda x: x[0])
+
+
+@pytest.mark.parametrize("n", [0, 1, 7, 15])
+def test_short_series(n):
+    vals = [float(i % 3) for i in range(n)]
+    got = [(h.index, h.code) for h in rules.evaluate(vals, 1.0, 0.5, rules=rules.ALL_RULES)]
+    assert sorted(got) == sorted(_ref_we(vals, 1.0, 0.5) + _ref_nelson(vals, 1.0, 0.5))